@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Job log following tests (LogFollower), on a job log in a local docroot.
+#
+# The client Ws calls are directly performed by the server WebServices
+# module, without XML-RPC.
+#
+# Requires the core and common directories in the PYTHONPATH.
+##
+
+import testerman
+
+import ConfigManager
+import EventManager
+import FileSystemManager
+import JobManager
+import TestermanClient
+import WebServices
+
+import os
+import shutil
+import StringIO
+import tempfile
+import threading
+import unittest
+
+
+TempDir = None
+
+class NotificationManager:
+	def dispatchNotification(self, notification):
+		pass
+
+def setUpModule():
+	global TempDir
+	TempDir = tempfile.mkdtemp()
+	os.makedirs(os.path.join(TempDir, 'docroot', 'archives'))
+	os.makedirs(os.path.join(TempDir, 'var'))
+	cm = ConfigManager.instance()
+	cm.register("testerman.document_root", os.path.join(TempDir, 'docroot'))
+	cm.register("testerman.var_root", os.path.join(TempDir, 'var'))
+	cm.register("testerman.fs.cache.max_entries", 0)
+	cm.register("testerman.ws.max_chunk_size", 1024*1024)
+	cm.register("ts.name", "test")
+	cm.set_transient("ts.server_root", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+	FileSystemManager.initialize()
+	EventManager.TheManager = NotificationManager()
+	testerman.log = lambda txt: None
+
+def tearDownModule():
+	shutil.rmtree(TempDir)
+
+def docrootFilename(path):
+	return os.path.join(TempDir, 'docroot', path[1:])
+
+def appendFile(path, content):
+	f = open(docrootFilename(path), 'ab')
+	f.write(content)
+	f.close()
+
+
+LOG_FILENAME = '/archives/job.log'
+
+class LogFollowerTestSequence(unittest.TestCase):
+	def setUp(self):
+		for path in [ LOG_FILENAME, '/archives/tc1.log', '/archives/tc2.log' ]:
+			if os.path.exists(docrootFilename(path)):
+				os.remove(docrootFilename(path))
+		self.job = JobManager.Job('test')
+		self.job._logFilename = LOG_FILENAME
+		self.job.setState(JobManager.Job.STATE_RUNNING)
+		JobManager.instance().registerJob(self.job)
+		self.client = TestermanClient.Client(name = "test", userAgent = "test", serverUrl = "http://localhost:8080")
+		self.client._Client__proxy = WebServices
+
+	def follow(self, offset = 0, wait = False, expandLogs = False, chunkSize = 0):
+		"""
+		@rtype: tuple (bool, string, integer)
+		@returns: the follow() result, the written log, and the offset to resume from
+		"""
+		output = StringIO.StringIO()
+		follower = testerman.LogFollower(self.client, output, expandLogs, chunkSize)
+		ret = follower.follow(self.job.getId(), offset, wait)
+		return (ret, output.getvalue(), follower.getOffset())
+
+	def test_jobNotFound(self):
+		output = StringIO.StringIO()
+		self.assertEqual(testerman.LogFollower(self.client, output).follow(0), None)
+
+	def test_offsetFollowing(self):
+		appendFile(LOG_FILENAME, '<a />\n<b')
+		(ret, log, offset) = self.follow()
+		self.assertEqual((ret, log, offset), (False, testerman.LogFollower.XmlHeader + '<a />\n', 6))
+		# Resumed from the returned offset
+		appendFile(LOG_FILENAME, ' />\n<c />\n')
+		(ret, log, offset) = self.follow(offset)
+		self.assertEqual((ret, log, offset), (False, '<b />\n<c />\n', 18))
+		(ret, log, offset) = self.follow(offset)
+		self.assertEqual((ret, log, offset), (False, '', 18))
+
+	def test_complete(self):
+		appendFile(LOG_FILENAME, '<a />\n')
+		self.job.setState(JobManager.Job.STATE_COMPLETE)
+		# Read by small chunks: complete once the whole log is written only
+		(ret, log, offset) = self.follow(chunkSize = 4)
+		self.assertEqual(ret, True)
+		self.assertEqual(log, testerman.LogFollower.XmlHeader + '<a />\n' + testerman.LogFollower.XmlFooter)
+		(ret, log, offset) = self.follow(offset)
+		self.assertEqual((ret, log), (True, testerman.LogFollower.XmlFooter))
+
+	def test_waitForCompletion(self):
+		appendFile(LOG_FILENAME, '<a />\n')
+		def complete():
+			appendFile(LOG_FILENAME, '<b />\n')
+			self.job.setState(JobManager.Job.STATE_COMPLETE)
+		timer = threading.Timer(0.2, complete)
+		timer.start()
+		try:
+			(ret, log, offset) = self.follow(wait = True)
+		finally:
+			timer.cancel()
+		self.assertEqual(ret, True)
+		self.assertEqual(log, testerman.LogFollower.XmlHeader + '<a />\n<b />\n' + testerman.LogFollower.XmlFooter)
+
+	def test_includeExpansion(self):
+		appendFile('/archives/tc1.log', '<tc1 />\n<include url="testerman://server/archives/tc2.log" />\n<tc1-end />\n')
+		appendFile('/archives/tc2.log', '<tc2 />\n<tc2-end />')
+		appendFile(LOG_FILENAME, '<a />\n<include url="testerman://server/archives/tc1.log" />\n<include url="testerman://server/archives/missing.log" />\n<b')
+		# Included files are fetched by small chunks, too, and nested includes expanded
+		(ret, log, offset) = self.follow(expandLogs = True, chunkSize = 5)
+		self.assertEqual(ret, False)
+		self.assertEqual(log, testerman.LogFollower.XmlHeader + '<a />\n<tc1 />\n<tc2 />\n<tc2-end />\n<tc1-end />\n')
+		self.job.setState(JobManager.Job.STATE_COMPLETE)
+		(ret, log, offset) = self.follow(offset, expandLogs = True)
+		self.assertEqual((ret, log), (True, '<b' + testerman.LogFollower.XmlFooter))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -28,14 +28,16 @@ import optparse
 import os
 import sys
 import re
+import socket
 import threading
 import time
 import logging
 import urlparse
+import xmlrpclib
 
 
 
-VERSION = "1.4.0"
+VERSION = "1.5.0"
 
 # Returned in case of a job submission-related execution error
 RETCODE_EXECUTION_ERROR = 70
@@ -150,47 +152,162 @@ def loadSessionParameters(filename = None, parameters = ''):
 
 
 ###############################################################################
-# Log Expander
+# Log Follower
 ###############################################################################
 
-class LogExpander:
+class LogFollower:
 	"""
-	A Raw log saver that follows include directives
-	to expand the logs inline.
+	Follows a job log by offset, and writes it to an output stream
+	as soon as it is available, chunk by chunk, so that the log is never
+	held in memory, regardless of its size.
 	
-	Based on *string* parsing, not XML parsing, 
-	and assumes that <include> elements are on a single line.
+	Optionally expands include directives inline, fetching the
+	included files chunk by chunk, too.
+	Based on string parsing, not XML parsing, and assumes that
+	<include> elements are on a single line.
+	
+	Connection errors are retried from the last offset reached,
+	up to retryTimeout seconds without any successful request.
 	"""
-	def __init__(self, client):
-		self._client = client
+	XmlHeader = '<?xml version="1.0" encoding="utf-8" ?>\n<ats>\n'
+	XmlFooter = '</ats>'
 
-	def expand(self, rawLogs):
-		return '\n'.join(self._expand(rawLogs))
+	# Polling backoff when no new log data is available, in s
+	MinPollingInterval = 0.5
+	MaxPollingInterval = 5.0
 	
-	def _expand(self, rawLogs):
-		ret = []
+	def __init__(self, client, output, expandLogs = False, chunkSize = 0, retryTimeout = 300.0):
+		self._client = client
+		self._output = output
+		self._expandLogs = expandLogs
+		self._chunkSize = chunkSize
+		self._retryTimeout = retryTimeout
+		# The offset reached in the followed log
+		self._offset = 0
+		# The incomplete last line of the followed log, not written yet
+		self._pending = ''
+
+	def getOffset(self):
+		"""
+		@rtype: integer
+		@returns: the offset of the log data not written yet
+		"""
+		return self._offset - len(self._pending)
 
-		for line in rawLogs.split('\n'):
-			if not line.startswith('<include '):
-				ret.append(line)
+	def follow(self, jobId, offset = 0, wait = True):
+		"""
+		Writes the job log from offset to the output.
+		
+		If offset is 0, the log is prefixed with the XML prologue and root element
+		opening tag, as returned by getJobLog(). The root element is closed
+		once the job is complete only, so that an incomplete log
+		can be resumed from the returned offset.
+		
+		@type  wait: bool
+		@param wait: if True, follows the log until the job is complete.
+		Otherwise, only writes the currently available log.
+		
+		@rtype: bool, or None
+		@returns: None if the job was not found, True if the job is complete
+		and its whole log was written, False otherwise.
+		The offset to resume following the log from is available with getOffset().
+		"""
+		self._offset = offset
+		self._pending = ''
+		if offset == 0:
+			self._output.write(self.XmlHeader)
+
+		interval = self.MinPollingInterval
+		while True:
+			chunk = self._call(self._client.getJobLogChunk, jobId, self._offset, self._chunkSize)
+			if chunk is None:
+				return None
+			(data, self._offset, complete) = chunk
+			if data:
+				self._pending = self._writeChunk(self._pending, data)
+				self._output.flush()
+				interval = self.MinPollingInterval
+			if complete:
+				self._writeLines(self._pending)
+				self._pending = ''
+				self._output.write(self.XmlFooter)
+				self._output.flush()
+				return True
+			if not data:
+				if not wait:
+					return False
+				time.sleep(interval)
+				interval = min(interval * 2, self.MaxPollingInterval)
+
+	def _call(self, method, *args):
+		"""
+		Calls a client method, retrying it in case of connection errors.
+		"""
+		start = time.time()
+		interval = self.MinPollingInterval
+		while True:
+			try:
+				return method(*args)
+			except xmlrpclib.Fault:
+				raise
+			except (socket.error, xmlrpclib.ProtocolError, IOError) as e:
+				if time.time() - start > self._retryTimeout:
+					raise
+				log("Unable to reach the server (%s), retrying in %ss..." % (str(e), interval))
+				time.sleep(interval)
+				interval = min(interval * 2, self.MaxPollingInterval)
+
+	def _writeChunk(self, pending, data):
+		"""
+		Writes the complete lines of pending + data.
+		
+		Since the server returns log chunks ending with a complete line,
+		only a line larger than a chunk may be split.
+		
+		@rtype: string
+		@returns: the remaining incomplete line, if expanding includes
+		"""
+		if not self._expandLogs:
+			self._output.write(data)
+			return ''
+		data = pending + data
+		end = data.rfind('\n') + 1
+		self._writeLines(data[:end])
+		return data[end:]
+
+	def _writeLines(self, data):
+		"""
+		Writes log lines, expanding include directives if needed.
+		"""
+		if not self._expandLogs or not '<include ' in data:
+			self._output.write(data)
+			return
+		for line in data.splitlines(True):
+			if line.startswith('<include '):
+				self._expand(line)
 			else:
-				m = re.match(r'\<include (?P<prefix>.*)url="(?P<url>.*?)" (?P<suffix>.*)', line)
-				if m:
-					url = m.group('url')
-					includedLogs = self.fetchUrl(url)
-					if includedLogs is not None:
-						ret += self._expand(includedLogs)
-					else:
-						# Warning
-						log("Unable to fetch url '%s'..." % url)
-		return ret
+				self._output.write(line)
 
-	def fetchUrl(self, url):
-		log("Fetching included url '%s'..." % url)
-		# extract path from url
+	def _expand(self, line):
+		m = re.match(r'\<include (?P<prefix>.*)url="(?P<url>.*?)" (?P<suffix>.*)', line)
+		if not m:
+			return
+		url = m.group('url')
 		path = os.path.normpath(urlparse.urlparse(url).path)
 		log("Fetching included path '%s'..." % path)
-		return self._client.getFile(path)
+		offset = 0
+		pending = ''
+		while True:
+			chunk = self._call(self._client.getFileChunk, path, offset, self._chunkSize)
+			if chunk is None:
+				log("Unable to fetch url '%s'..." % url)
+				break
+			(data, offset, eof) = chunk
+			pending = self._writeChunk(pending, data)
+			if eof:
+				break
+		if pending:
+			self._writeLines(pending + '\n')
 
 ###############################################################################
 # Executable Source URI
@@ -420,13 +537,11 @@ class TestermanCliClient:
 		# Import the file
 		self.log("Uploading %s to %s..." % (sourceFilename, tmpPackagePath))
 		try:
-			f = open(sourceFilename, 'r')
-			contents = f.read()
-			f.close()
-			
-			ret = self.__client.importPackageFile(contents, tmpPackagePath)
-			if not ret:
-				raise Exception("Unable to upload package (no error provided)")
+			f = open(sourceFilename, 'rb')
+			try:
+				self.__client.importPackageFromFile(f, tmpPackagePath)
+			finally:
+				f.close()
 			self.log("%s correctly uploaded to %s" % (sourceFilename, tmpPackagePath))
 		except Exception as e:
 			self.log("Sorry, unable to import package: %s" % str(e))
@@ -569,24 +684,32 @@ class TestermanCliClient:
 		ret = self.__client.updateAgent(agentName, branch, version)
 		print (str(ret))
 
-	def getLog(self, jobId, expandLogs):
+	def followLog(self, jobId, output, expandLogs, offset = 0, wait = True):
 		"""
-		Returns the current log for a job;
+		Writes the log for a job to output, chunk by chunk, from offset;
 		expands include elements if expandLogs is set to True.
+		
+		If wait is set to True, follows the log until the job is complete.
+		
+		Returns True if the job is complete and its whole log was written,
+		False if the log is not complete yet, or None in case of an error.
+		In both latter cases, the offset to resume following the log
+		from is logged.
 		"""
+		follower = LogFollower(self.__client, output, expandLogs)
 		try:
-			ret = self.__client.getJobLog(jobId)
-			if not ret:
-				raise Exception("No log available (job not started or delete logs)")
+			ret = follower.follow(jobId, offset, wait)
+			if ret is None:
+				raise Exception("Job not found")
+		except KeyboardInterrupt:
+			self.log("Log following interrupted, resume it with --log-offset %s" % follower.getOffset())
+			raise
 		except Exception as e:
-			self.log("Unable to get current log for job ID %s: %s\n" % (jobId, str(e)))
+			self.log("Unable to get log for job ID %s (resume it with --log-offset %s): %s" % (jobId, follower.getOffset(), str(e)))
 			return None
-		
-		if expandLogs:
-			logExpander = LogExpander(self.__client)
-			return logExpander.expand(ret)
-		else:
-			return ret
+		if not ret:
+			self.log("Job not complete yet, resume its log with --log-offset %s" % follower.getOffset())
+		return ret
 
 	def listDependencies(self, path, recursive = True):
 		"""
@@ -608,19 +731,22 @@ class TestermanCliClient:
 		
 		print ("Extracting %s to %s..." % (path, filename))
 		try:
-			contents = self.__client.exportPackage("/repository/%s" % path)
-			if contents is None:
-				raise Exception("Package %s not found" % path)
 			f = open(filename, 'wb')
-			f.write(contents)
-			f.close()
+			try:
+				found = self.__client.exportPackageToFile("/repository/%s" % path, f)
+			finally:
+				f.close()
+			if not found:
+				os.remove(filename)
+				raise Exception("Package %s not found" % path)
 			print ("%s created." % filename)
 		except Exception as e:
 			self.log("Sorry, unable to extract package: %s" % str(e))
 
 	def importPackage(self, path, filename):
 		"""
-		Import the package filename to path
+		Import the package filename to path.
+		If path already exists, only the changed files are updated.
 		"""
 		if not filename:
 			print ("Sorry, missing input filename")
@@ -628,14 +754,12 @@ class TestermanCliClient:
 		
 		print ("Importing %s to %s..." % (filename, path))
 		try:
-			f = open(filename, 'r')
-			contents = f.read()
-			f.close()
-			
-			ret = self.__client.importPackageFile(contents, "/repository/%s" % path)
-			if not ret:
-				raise Exception("Unable to import package (no error provided)")
-			print ("%s correctly imported as %s" % (filename, path))
+			f = open(filename, 'rb')
+			try:
+				written = self.__client.importPackageFromFile(f, "/repository/%s" % path)
+			finally:
+				f.close()
+			print ("%s correctly imported as %s (%d files written)" % (filename, path, written))
 		except Exception as e:
 			self.log("Sorry, unable to import package: %s" % str(e))
 
@@ -663,7 +787,7 @@ def main():
 	
 	# Runners
 	group = optparse.OptionGroup(parser, "Job Runners")
-	group.add_option("--run", dest = "runUri", metavar = "URI", help = "run a ats/campaign/package, either local or from the repository, then monitor it and wait for its completion.\nThe URI format is: local:<path> or repository:<path>. The filename extension (.ats, .campaign, .tpk) indicates the job type.\nIf --output-filename is provided, dump the logs once the job is complete.", default = None)
+	group.add_option("--run", dest = "runUri", metavar = "URI", help = "run a ats/campaign/package, either local or from the repository, then monitor it and wait for its completion.\nThe URI format is: local:<path> or repository:<path>. The filename extension (.ats, .campaign, .tpk) indicates the job type.\nIf --output-filename is provided, write the logs to it while the job is running.", default = None)
 	# Deprecated runners
 	group.add_option("--run-local-ats", dest = "atsFilename", metavar = "FILENAME", help = "[DEPRECATED - use --run instead]\nrun FILENAME as an ATS, monitor it and wait for its completion", default = None)
 	group.add_option("--run-ats", dest = "atsPath", metavar = "PATH", help = "[DEPRECATED - use --run instead]\nrun an ATS whose path in the repository is PATH, monitor it and wait for its completion", default = None)
@@ -686,8 +810,10 @@ def main():
 
 	# Log management
 	group = optparse.OptionGroup(parser, "Log Management")
-	group.add_option("--get-log", dest = "logJobId", metavar = "ID", help = "get the current logs for job ID", default = None)
+	group.add_option("--get-log", dest = "logJobId", metavar = "ID", help = "get the current logs for job ID, to --output-filename if provided", default = None)
 	group.add_option("--expand-logs", dest = "expandLogs", action = "store_true", help = "expand include elements in retrieved log files", default = False)
+	group.add_option("--follow", dest = "followLog", action = "store_true", help = "when getting logs, wait for the job completion and write the logs as they are generated (default: %default)", default = False)
+	group.add_option("--log-offset", dest = "logOffset", metavar = "OFFSET", type = "long", help = "when getting logs, start from OFFSET, as logged when the log retrieval was interrupted, appending to --output-filename if provided (default: %default)", default = 0)
 	parser.add_option_group(group)
 
 	# Probe management
@@ -708,7 +834,7 @@ def main():
 	# Package management
 	group = optparse.OptionGroup(parser, "Package Management")
 	group.add_option("--extract-package", dest = "extractPackage", metavar = "PATH", help = "extract the package whose repository path is PATH to a tpk file indicated with --output-filename", default = None)
-	group.add_option("--import-package-to", dest = "importPackage", metavar = "PATH", help = "import the package provided by --input-filename to the repository path PATH", default = None)
+	group.add_option("--import-package-to", dest = "importPackage", metavar = "PATH", help = "import the package provided by --input-filename to the repository path PATH. If PATH already exists, only the changed files are updated.", default = None)
 	parser.add_option_group(group)
 
 	# Misc
@@ -774,23 +900,28 @@ def main():
 			# Now, if we are in synchronous execution, let's wait
 			if options.waitForJobCompletion and not options.scheduledDate:
 				try:
+					# Optionally, write the log to a file while waiting.
+					if options.outputFilename:
+						try:
+							f = open(options.outputFilename, 'wb')
+							try:
+								complete = client.followLog(jobId, f, options.expandLogs)
+							finally:
+								f.close()
+							if not complete:
+								raise Exception("incomplete log")
+							client.log("Execution logs available in '%s'" % options.outputFilename)
+						except KeyboardInterrupt:
+							raise
+						except Exception as e:
+							client.log("Unable to dump execution logs to '%s': %s" % (options.outputFilename, str(e)))
+							client.stopXc()
+							return RETCODE_EXECUTION_ERROR
+					# Returns immediately if the job is already complete
 					result = client.monitorUntilCompletion(jobId)
 				except KeyboardInterrupt:
 					client.stopXc()
 					return RETCODE_EXECUTION_ERROR
-				
-				# Optionally, get the log and dump it to a file.
-				if result is not None and options.outputFilename:
-					try:
-						log = client.getLog(jobId, options.expandLogs)
-						f = open(options.outputFilename, 'w')
-						f.write(log)
-						f.close()
-						client.log("Execution logs available in '%s'" % options.outputFilename)
-					except Exception as e:
-						client.log("Unable to dump execution logs to '%s': %s" % (options.outputFilename, str(e)))
-						client.stopXc()
-						return RETCODE_EXECUTION_ERROR
 					
 			client.stopXc()
 			# If result == 40, no log available.
@@ -799,12 +930,24 @@ def main():
 
 		# Log options
 		elif options.logJobId:
-			log = client.getLog(int(options.logJobId), options.expandLogs)
-			if log:
-				print (log)
-				return 0
+			if options.outputFilename:
+				# Resumed logs are appended
+				if options.logOffset:
+					output = open(options.outputFilename, 'ab')
+				else:
+					output = open(options.outputFilename, 'wb')
 			else:
+				output = sys.stdout
+			try:
+				complete = client.followLog(int(options.logJobId), output, options.expandLogs, options.logOffset, options.followLog)
+			except KeyboardInterrupt:
+				return 1
+			finally:
+				if options.outputFilename:
+					output.close()
+			if complete is None or (options.followLog and not complete):
 				return 1
+			return 0
 		
 		# Tools options
 		elif options.listDependencies:
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2009 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Minimal Linux inotify binding, based on ctypes,
+# used by the watcher.* probes and the file system backends.
+##
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+
+# Events (see inotify(7))
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+# Additional flags set by the kernel
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+# Flags for inotify_add_watch
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0x80000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+TheLibc = None
+
+def _getLibc():
+	global TheLibc
+	if TheLibc is None:
+		TheLibc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+	return TheLibc
+
+def isAvailable():
+	"""
+	@rtype: bool
+	@returns: True if inotify can be used on this platform.
+	"""
+	if not sys.platform.startswith('linux'):
+		return False
+	try:
+		libc = _getLibc()
+		return hasattr(libc, 'inotify_init') and hasattr(libc, 'inotify_add_watch')
+	except Exception:
+		return False
+
+
+class Inotify:
+	"""
+	An inotify instance: add watches, then wait for its fileno() to be
+	readable and read its events.
+	"""
+	def __init__(self):
+		libc = _getLibc()
+		try:
+			fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		except AttributeError:
+			# glibc < 2.9
+			import fcntl
+			fd = libc.inotify_init()
+			if fd >= 0:
+				fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+		if fd < 0:
+			e = ctypes.get_errno()
+			raise OSError(e, os.strerror(e))
+		self._fd = fd
+		self._libc = libc
+
+	def fileno(self):
+		return self._fd
+
+	def addWatch(self, path, mask):
+		"""
+		@rtype: integer
+		@returns: the watch descriptor
+		"""
+		if isinstance(path, unicode):
+			path = path.encode('utf-8')
+		wd = self._libc.inotify_add_watch(self._fd, path, mask)
+		if wd < 0:
+			e = ctypes.get_errno()
+			raise OSError(e, "%s: %s" % (path, os.strerror(e)))
+		return wd
+
+	def removeWatch(self, wd):
+		self._libc.inotify_rm_watch(self._fd, wd)
+
+	def readEvents(self):
+		"""
+		Reads the pending events, without blocking.
+
+		@rtype: list of (wd, mask, cookie, name)
+		"""
+		try:
+			data = os.read(self._fd, 256 * 1024)
+		except OSError as e:
+			if e.errno in (errno.EAGAIN, errno.EINTR):
+				return []
+			raise
+		ret = []
+		offset = 0
+		while offset + EVENT_HEADER.size <= len(data):
+			wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+			offset += EVENT_HEADER.size
+			name = data[offset:offset+length].rstrip('\0')
+			offset += length
+			ret.append((wd, mask, cookie, name))
+		return ret
+
+	def close(self):
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
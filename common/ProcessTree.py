@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Process tree tools: get a whole process tree (as a flat list of pids),
+# and kill it, optionally with its process group or its cgroup.
+#
+# Used by the TE (PA), the server, and the probes starting processes.
+##
+
+import errno
+import os
+import signal
+import struct
+import sys
+import time
+
+
+################################################################################
+# Process tree discovery
+################################################################################
+
+# Set on first use: True if /proc/<pid>/task/<tid>/children is available
+# (Linux 3.5+ with CONFIG_PROC_CHILDREN)
+HasProcChildren = None
+
+def _hasProcChildren():
+	global HasProcChildren
+	if HasProcChildren is None:
+		HasProcChildren = os.path.exists('/proc/%d/task/%d/children' % (os.getpid(), os.getpid()))
+	return HasProcChildren
+
+def _getChildren_linux(pid):
+	"""
+	@rtype: list of int
+	@returns: the direct children of a process, from its
+	/proc/<pid>/task/*/children files.
+	"""
+	ret = []
+	try:
+		tids = os.listdir('/proc/%d/task' % pid)
+	except OSError:
+		# Already terminated
+		return ret
+	for tid in tids:
+		try:
+			f = open('/proc/%d/task/%s/children' % (pid, tid))
+			try:
+				ret += [ int(x) for x in f.read().split() ]
+			finally:
+				f.close()
+		except (IOError, OSError):
+			pass
+	return ret
+
+def _getParentIndex_linux():
+	"""
+	A single pass on /proc/*/stat.
+
+	@rtype: dict[int] = list of int
+	@returns: the children pids indexed by their parent pid
+	"""
+	index = {}
+	for entry in os.listdir('/proc'):
+		if not entry.isdigit():
+			continue
+		try:
+			f = open('/proc/%s/stat' % entry)
+			try:
+				data = f.read()
+			finally:
+				f.close()
+			# pid (comm) state ppid ..., comm may contain spaces and parenthesis
+			ppid = int(data[data.rfind(')') + 2:].split(' ', 2)[1])
+		except (IOError, OSError, ValueError, IndexError):
+			continue
+		index.setdefault(ppid, []).append(int(entry))
+	return index
+
+def _getParentIndex_solaris():
+	"""
+	A single pass on /proc/*/status, according to /usr/include/sys/procfs.h
+
+	typedef struct pstatus {
+        int     pr_flags;       /* flags (see below) */
+        int     pr_nlwp;        /* number of active lwps in the process */
+        pid_t   pr_pid;         /* process id */
+        pid_t   pr_ppid;        /* parent process id */
+	...
+	}
+	"""
+	index = {}
+	header = struct.calcsize('IIII')
+	for entry in os.listdir('/proc'):
+		if not entry.isdigit():
+			continue
+		try:
+			f = open('/proc/%s/status' % entry)
+			try:
+				buf = f.read(header)
+			finally:
+				f.close()
+			(_, _, pid_, ppid_) = struct.unpack('IIII', buf)
+		except Exception:
+			continue
+		index.setdefault(ppid_, []).append(pid_)
+	return index
+
+def getChildrenPids(pid, includeParent = True):
+	"""
+	Retrieves all the children pids for a given pid,
+	including the pid itself as the first element of the returned list of PIDs
+	(unless includeParent is False).
+
+	Only reads the children of the tree processes when the kernel exposes
+	them (Linux 3.5+), otherwise reads the status of all processes once.
+	Only supports Linux and Solaris: on other platforms, no children are returned.
+
+	@type  pid: int
+	@param pid: the parent pid whose we should retrieve children
+	@type  includeParent: bool
+	@param includeParent: if True, the first pid is pid itself
+
+	@rtype: list of int
+	@returns: first the pid itself, then its children's pids,
+	parents before their children
+	"""
+	if sys.platform.startswith('linux') and _hasProcChildren():
+		getChildren = _getChildren_linux
+	else:
+		if sys.platform.startswith('linux'):
+			index = _getParentIndex_linux()
+		elif sys.platform in [ 'sunos5' ]:
+			index = _getParentIndex_solaris()
+		else:
+			index = {}
+		getChildren = lambda p: index.get(p, [])
+
+	ret = [ pid ]
+	seen = set(ret)
+	i = 0
+	while i < len(ret):
+		for child in getChildren(ret[i]):
+			if not child in seen:
+				seen.add(child)
+				ret.append(child)
+		i += 1
+	if not includeParent:
+		ret = ret[1:]
+	return ret
+
+
+################################################################################
+# cgroups
+################################################################################
+
+def joinCgroup(path, pid = None):
+	"""
+	Moves a process (by default, the current one) into a cgroup.
+	Its future children will be created in the same cgroup.
+
+	@type  path: string
+	@param path: the cgroup directory, for instance /sys/fs/cgroup/testerman/te-1
+	"""
+	f = open(os.path.join(path, 'cgroup.procs'), 'w')
+	try:
+		f.write('%d\n' % (pid or os.getpid()))
+	finally:
+		f.close()
+
+def getCgroupPids(path):
+	"""
+	@rtype: list of int
+	@returns: the processes in a cgroup
+	"""
+	try:
+		f = open(os.path.join(path, 'cgroup.procs'))
+		try:
+			return [ int(x) for x in f.read().split() ]
+		finally:
+			f.close()
+	except (IOError, OSError):
+		return []
+
+def killCgroup(path, sig = signal.SIGKILL):
+	"""
+	Sends a signal to all the processes of a cgroup,
+	including the ones forked while we signal them.
+
+	@rtype: list of int
+	@returns: the signalled pids
+	"""
+	killFile = os.path.join(path, 'cgroup.kill')
+	if sig == signal.SIGKILL and os.path.exists(killFile):
+		# cgroup v2, Linux 5.14+: atomic
+		pids = getCgroupPids(path)
+		f = open(killFile, 'w')
+		try:
+			f.write('1\n')
+		finally:
+			f.close()
+		return pids
+
+	ret = []
+	for attempt in range(10):
+		pids = [ x for x in getCgroupPids(path) if not x in ret ]
+		if not pids:
+			break
+		for pid in pids:
+			try:
+				os.kill(pid, sig)
+			except OSError:
+				pass
+		ret += pids
+	return ret
+
+def removeCgroup(path, timeout = 1.0):
+	"""
+	Removes an (empty, or being emptied) cgroup.
+	Waits up to timeout for its killed processes to terminate.
+	"""
+	end = time.time() + timeout
+	while True:
+		try:
+			os.rmdir(path)
+			return True
+		except OSError as e:
+			if e.errno == errno.ENOENT:
+				return True
+			if e.errno != errno.EBUSY or time.time() > end:
+				return False
+		time.sleep(0.01)
+
+
+################################################################################
+# Process tree killing
+################################################################################
+
+def killProcessTree(pid, sig = None, includeParent = True, processGroup = False, cgroup = None):
+	"""
+	Sends a signal to a process and all its descendants.
+
+	On Windows, only the process itself is signalled (SIGTERM only),
+	i.e. nothing is signalled if includeParent is False.
+
+	@type  sig: int
+	@param sig: the signal to send, SIGKILL by default (SIGTERM on Windows)
+	@type  processGroup: bool
+	@param processGroup: if True, pid is a process group leader: the signal is
+	also sent to its group, including the processes that may have been forked
+	while the tree was being discovered
+	@type  cgroup: string
+	@param cgroup: if set, the processes in this cgroup are signalled too
+
+	@rtype: list of int
+	@returns: the signalled pids (not including the ones from the process group)
+	"""
+	if sys.platform in [ 'win32', 'win64' ]:
+		if not includeParent:
+			return []
+		os.kill(pid, signal.SIGTERM)
+		return [ pid ]
+
+	if sig is None:
+		sig = signal.SIGKILL
+	pids = getChildrenPids(pid, includeParent)
+	if processGroup:
+		try:
+			os.killpg(pid, sig)
+		except OSError:
+			pass
+	for p in pids:
+		try:
+			os.kill(p, sig)
+		except OSError:
+			pass
+	if cgroup:
+		pids += [ x for x in killCgroup(cgroup, sig) if not x in pids ]
+	return pids
@@ -24,8 +24,10 @@ import TestermanMessages as Messages
 import TestermanNodes as Nodes
 
 import base64
+import hashlib
 import re
 import tarfile
+import tempfile
 import threading
 import time
 import xmlrpclib
@@ -103,6 +105,14 @@ class DummyLogger:
 ##
 # Convenience functions
 ##
+def _toXmlRpcNumber(value):
+	"""
+	XML-RPC integers are limited to 32 bits.
+	"""
+	if not (-2**31 <= value < 2**31):
+		return float(value)
+	return int(value)
+
 def compareVersions(versionA, versionB):
 	"""
 	Version scheme rules for Testerman components:
@@ -407,6 +417,38 @@ class Client(Nodes.ConnectingNode):
 			self.getLogger().debug("log decompressed")
 		return res
 
+	def getJobLogChunk(self, jobId, offset, maxSize = 0):
+		"""
+		Returns a part of the current log for a job whose ID is jobId,
+		from offset, or None if the job was not found.
+		
+		Unlike getJobLog(), the log is not wrapped into a XML prologue and root
+		element: concatenating the successive chunks gives the raw log file content.
+		
+		This client-side implementation always requests the chunk as
+		a compressed data (gziped + base64 encoding).
+		
+		@type  jobId: integer
+		@param jobId: the job ID
+		@type  offset: integer
+		@param offset: the position in the log to read from, i.e. 0 or the offset
+		returned with the previous chunk
+		@type  maxSize: integer
+		@param maxSize: the maximum chunk size, in bytes (0: the server maximum)
+		
+		@throws Exception in case of an error.
+		
+		@rtype: tuple (string (not unicode), integer, bool), or None
+		@returns: the log chunk (utf-8, ending with a complete line),
+		the offset to read the next chunk from, and True if the job is complete
+		and its whole log has been read. None if the job was not found.
+		"""
+		self.getLogger().debug("getJobLogChunk from %s..." % offset)
+		res = self.__proxy.getJobLogChunk(jobId, _toXmlRpcNumber(offset), maxSize, True)
+		if res is None:
+			return None
+		return (zlib.decompress(base64.decodestring(res['data'])), long(res['offset']), res['complete'])
+
 	def getJobDetails(self, jobId):
 		"""
 		Gets a specific job's details.
@@ -715,6 +757,31 @@ class Client(Nodes.ConnectingNode):
 			raise e
 		return content
 
+	def getFileChunk(self, filename, offset, maxSize = 0):
+		"""
+		Gets a part of a file, from offset.
+		This implementation always request the chunk as compressed data
+		(gzip + base64 encoding).
+		
+		@type  filename: string
+		@param filename: complete path within the docroot of the filename to retrieve
+		@type  offset: integer
+		@param offset: the position in the file to read from
+		@type  maxSize: integer
+		@param maxSize: the maximum chunk size, in bytes (0: the server maximum)
+		
+		@throws Exception in case of a (technical) error.
+		
+		@rtype: tuple ((buffer) string, integer, bool), or None
+		@returns: the chunk, the offset to read the next chunk from,
+		and True if the end of the file was reached. None if the file was not found.
+		"""
+		self.getLogger().debug("Getting file %s from %s..." % (filename, offset))
+		res = self.__proxy.getFileChunk(filename, _toXmlRpcNumber(offset), maxSize, True)
+		if res is None:
+			return None
+		return (zlib.decompress(base64.decodestring(res['data'])), long(res['offset']), res['eof'])
+
 	def getFileInfo(self, filename):
 		"""
 		@type  filename: string
@@ -1176,6 +1243,154 @@ class Client(Nodes.ConnectingNode):
 			raise e
 		return res
 
+	def getPackageManifest(self, path):
+		"""
+		Lists the files of a package, with their content digests.
+		
+		@type  path: string
+		@param path: docroot path to the package root
+		
+		@throws Exception in case of a (technical) error.
+		
+		@rtype: list of dict{'name': string, 'type': 'dir' or 'file', 'size': integer, 'digest': string}, or None
+		@returns: the package files and folders, relative to the package root, or None if the package was not found.
+		"""
+		return self.__proxy.getPackageManifest(path)
+
+	def exportPackageToFile(self, path, f, chunkSize = 0):
+		"""
+		Extracts a package file from a package, writing it to a file object.
+		
+		Unlike exportPackage(), the package files are retrieved one by one, by chunks,
+		so that the package file is never loaded in memory.
+		
+		@type  path: string
+		@param path: complete path within the docroot of the package to retrieve
+		@type  f: file object
+		@param f: the file object to write the package file (.tpk) to
+		@type  chunkSize: integer
+		@param chunkSize: the maximum size of the retrieved file chunks, in bytes (0: the server maximum)
+		
+		@throws Exception in case of a (technical) error.
+		
+		@rtype: bool
+		@returns: True if the package file was written, False if the package was not found.
+		"""
+		start = time.time()
+		self.getLogger().debug("Exporting package %s..." % path)
+		manifest = self.getPackageManifest(path)
+		if manifest is None:
+			return False
+
+		tfile = tarfile.open("tpk", "w:gz", f)
+		for entry in manifest:
+			tarinfo = tarfile.TarInfo(entry['name'])
+			tarinfo.mtime = time.time()
+			if entry['type'] == 'dir':
+				tarinfo.type = tarfile.DIRTYPE
+				tarinfo.mode = 0o755
+				tfile.addfile(tarinfo)
+				continue
+
+			tarinfo.type = tarfile.AREGTYPE
+			tarinfo.mode = 0o644
+			tmp = tempfile.TemporaryFile()
+			try:
+				sha = hashlib.sha1()
+				offset = 0
+				eof = False
+				while not eof:
+					chunk = self.getFileChunk("%s/%s" % (path, entry['name']), offset, chunkSize)
+					if chunk is None:
+						raise Exception("Unable to get package file %s" % entry['name'])
+					(data, offset, eof) = chunk
+					sha.update(data)
+					tmp.write(data)
+				if sha.hexdigest() != entry['digest']:
+					raise Exception("Package file %s modified while being exported" % entry['name'])
+				tarinfo.size = offset
+				tmp.seek(0)
+				tfile.addfile(tarinfo, tmp)
+			finally:
+				tmp.close()
+		tfile.close()
+		self.getLogger().debug("Package file extracted, %d entries in %fs" % (len(manifest), time.time() - start))
+		return True
+
+	def importPackageFromFile(self, f, path, chunkSize = 1024*1024):
+		"""
+		Imports a package file, read from a file object, to a package folder in the doc root.
+		
+		Unlike importPackageFile(), only the files whose content changed are
+		transferred (by chunks) and written, so that the destination path
+		may exist: the package is then updated.
+		Files that are not in the package file are not removed from the destination package.
+		
+		@type  f: file object
+		@param f: the file object to read the package file (.tpk) from
+		@type  path: string
+		@param path: docroot path to the package root
+		@type  chunkSize: integer
+		@param chunkSize: the size of the transferred file chunks, in bytes
+		
+		@throws Exception on error
+		
+		@rtype: integer
+		@returns: the number of written files.
+		"""
+		start = time.time()
+		self.getLogger().debug("Importing package file to %s..." % path)
+		# The package file is decompressed once: the file contents are
+		# spooled while computing their digests, to be transferred from there.
+		tfile = tarfile.open("tpk", "r|gz", f)
+		spool = tempfile.TemporaryFile()
+		manifest = []
+		# (offset in the spool, size), indexed by digest
+		spooledFiles = {}
+		try:
+			for c in tfile:
+				if c.isdir():
+					manifest.append({ 'name': c.name, 'type': 'dir' })
+				elif c.isfile():
+					sha = hashlib.sha1()
+					spoolOffset = spool.tell()
+					content = tfile.extractfile(c)
+					while True:
+						data = content.read(chunkSize)
+						if not data:
+							break
+						sha.update(data)
+						spool.write(data)
+					digest = sha.hexdigest()
+					manifest.append({ 'name': c.name, 'type': 'file', 'size': _toXmlRpcNumber(c.size), 'digest': digest })
+					if digest in spooledFiles:
+						# Same content as a previous file
+						spool.seek(spoolOffset)
+						spool.truncate()
+					else:
+						spooledFiles[digest] = (spoolOffset, c.size)
+			tfile.close()
+
+			transfers = self.__proxy.getPackageTransfers(path, manifest)
+			self.getLogger().debug("%d files to transfer out of %d entries" % (len(transfers), len(manifest)))
+			for transfer in transfers:
+				(spoolOffset, size) = spooledFiles[transfer['digest']]
+				offset = long(transfer['offset'])
+				spool.seek(spoolOffset + offset)
+				while offset < size:
+					data = spool.read(min(chunkSize, size - offset))
+					if not data:
+						raise Exception("Unable to read %s from the package file" % transfer['name'])
+					offset = long(self.__proxy.importPackageFileChunk(transfer['digest'], _toXmlRpcNumber(offset), base64.encodestring(zlib.compress(data)), True))
+			res = self.__proxy.importPackageManifest(path, manifest)
+			self.getLogger().debug("Package file imported, %d files written in %fs" % (res, time.time() - start))
+		except xmlrpclib.Fault as e:
+			self.getLogger().error("!! importPackageFromFile: Fault: " + str(e.faultString))
+			raise e
+		finally:
+			spool.close()
+		return res
+
 	def schedulePackage(self, path, username, session = {}, at = 0.0, script = None, profileName = None):
 		"""
 		TODO: documentation (once the API is stable)
@@ -1275,16 +1490,22 @@ class Client(Nodes.ConnectingNode):
 	# Server Management
 	##
 	
-	def getCounter(self, path):
-		res = self.__proxy.getCounter(path)
+	def getCounter(self, path, component = "ts"):
+		res = self.__proxy.getCounter(path, component)
 		return res
 	
-	def getCounters(self, paths):
-		res = self.__proxy.getCounters(paths)
+	def getCounters(self, paths, component = "ts"):
+		res = self.__proxy.getCounters(paths, component)
 		return res
 	
-	def getAllCounters(self):
-		res = self.__proxy.getAllCounters()
+	def getAllCounters(self, component = "ts"):
+		res = self.__proxy.getAllCounters(component)
+		return res
+
+	def resetCounter(self, path):
+		self.getLogger().debug("resetCounter(%s)..." % path)
+		res = self.__proxy.resetCounter(path)
+		self.getLogger().debug("resetCounter(): " + str(res))
 		return res
 
 	def resetAllCounters(self):
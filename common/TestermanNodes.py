@@ -56,6 +56,12 @@
 
 import TestermanMessages as Messages
 
+# Only available on the server side
+try:
+	import CounterManager
+except ImportError:
+	CounterManager = None
+
 import threading
 import select
 import socket
@@ -1300,6 +1306,8 @@ class BaseNode(object):
 			del self.__outgoingTransactions[transactionId]
 			self.__mutex.release()
 			self.__trace("%d === response received on time on synchronous request (took %fs)" % (transactionId, time.time() - ts))
+			if CounterManager:
+				CounterManager.instance().record("nodes.requests.%s" % request.getMethod().lower(), (time.time() - ts) * 1000.0)
 			return response
 		else:
 			# Purge the transaction
@@ -1307,6 +1315,8 @@ class BaseNode(object):
 			del self.__outgoingTransactions[transactionId]
 			self.__mutex.release()
 			self.__trace("%d === timeout on synchronous request, purging" % transactionId)
+			if CounterManager:
+				CounterManager.instance().inc("nodes.timeouts.%s" % request.getMethod().lower())
 			return None
 
 	def isStarted(self):
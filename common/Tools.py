@@ -18,9 +18,9 @@
 #
 ##
 
-import glob
+import ProcessTree
+
 import os
-import re
 import resource
 import time
 import traceback
@@ -125,71 +125,6 @@ def formatTable(headers = [], rows = [], order = None, notAvailableLabel = "(n/a
 # Tools: get a whole process tree (as a flat list of pids)
 ################################################################################
 
-def parseStatusFile_linux(filename):
-	pid_ = None
-	ppid_ = None
-	try:
-		f = open(filename)
-		lines = f.readlines()
-		f.close()
-		for line in lines:
-			if not pid_:
-				m = re.match(r'Pid:\s+(.*)', line)
-				if m:
-					pid_ = int(m.group(1))
-			elif not ppid_:
-				m = re.match(r'PPid:\s+(.*)', line)
-				if m:
-					ppid_ = int(m.group(1))
-			elif ppid_ and pid_:
-				break
-	except Exception as e:
-		pass
-	return (pid_, ppid_)
-
-def parseStatusFile_solaris(filename):
-	"""
-	according to /usr/include/sys/procfs.h
-	
-	typedef struct pstatus {
-        int     pr_flags;       /* flags (see below) */
-        int     pr_nlwp;        /* number of active lwps in the process */
-        pid_t   pr_pid;         /* process id */
-        pid_t   pr_ppid;        /* parent process id */
-	...
-	}
-	"""
-	pid_ = None
-	ppid_ = None
-	try:
-		f = open(filename)
-		buf = f.read()
-		f.close()
-		
-		(_, _, pid_, ppid_) = struct.unpack('IIII', buf[:struct.calcsize('IIII')])
-	except:
-		pass
-	return (pid_, ppid_)
-
-def parseStatusFile(filename):
-	"""
-	Parse a /proc/<pid>/status file,
-	according to the current OS.
-	
-	@rtype: tuple of int 
-	@returns: pid, ppid (any of those may be None if not parsed)
-	
-	Supported:
-	- Linux 2.6.x
-	- Solaris
-	"""
-	if sys.platform in [ 'linux', 'linux2' ]:
-		return parseStatusFile_linux(filename)
-	elif sys.platform in [ 'sunos5' ]:
-		return parseStatusFile_solaris(filename)
-	else:
-		return (None, None)
-
 def getChildrenPids(pid):
 	"""
 	Retrieves all the children pids for a given pid, 
@@ -197,8 +132,8 @@ def getChildrenPids(pid):
 
 	Returns them as a list.
 	
-	WARNING: only Linux and Solaris-compatible for now,
-	as it relies on /proc/<pid>/status pseudo file.
+	WARNING: only Linux and Solaris-compatible for now.
+	See ProcessTree.getChildrenPids().
 	
 	@type  pid: int
 	@param pid: the parent pid whose we should retrieve children
@@ -206,29 +141,7 @@ def getChildrenPids(pid):
 	@rtype: list of int
 	@returns: first the pid itself, then its children's pids
 	"""
-	pids = [] # a list of current (pid, ppid)
-	# Let's scan /proc/...
-	# No other way to do it ?
-	statusFilenames = glob.glob("/proc/[0-9]*/status")
-	for filename in statusFilenames:
-		try:
-			pid_, ppid_ = parseStatusFile(filename)
-			if pid_ and ppid_:
-				pids.append( (pid_, ppid_) )
-		except:
-			pass
-	
-	# Now let's construct the tree for the looked up pid
-	ret = [ pid ]
-	ppids = [ pid ]
-	while ppids:
-		currentPpid = ppids.pop()
-		for (pid_, ppid_) in pids:
-			if ppid_ == currentPpid:
-				if pid_ not in ppids: ppids.append(pid_)
-				if pid_ not in ret: ret.append(pid_)
-	
-	return ret
+	return ProcessTree.getChildrenPids(pid)
 
 
 ################################################################################
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# ProcessTree tests.
+##
+
+import ProcessTree
+
+import os
+import signal
+import subprocess
+import sys
+import time
+import unittest
+
+
+class KillProcessTreeTestSequence(unittest.TestCase):
+	def setUp(self):
+		self._platform = sys.platform
+		self._kill = os.kill
+		self.killed = []
+		os.kill = lambda pid, sig: self.killed.append((pid, sig))
+
+	def tearDown(self):
+		sys.platform = self._platform
+		os.kill = self._kill
+
+	def test_windowsIncludeParent(self):
+		sys.platform = 'win32'
+		self.assertEqual(ProcessTree.killProcessTree(1234), [ 1234 ])
+		self.assertEqual(self.killed, [ (1234, signal.SIGTERM) ])
+
+	def test_windowsExcludeParent(self):
+		sys.platform = 'win32'
+		self.assertEqual(ProcessTree.killProcessTree(1234, includeParent = False), [])
+		self.assertEqual(self.killed, [])
+
+
+class ChildrenPidsTestSequence(unittest.TestCase):
+	def test_children(self):
+		if not sys.platform.startswith('linux'):
+			return
+		p = subprocess.Popen([ 'sh', '-c', 'sleep 10 & sleep 10; wait' ])
+		try:
+			# Wait for the shell to fork its children
+			for i in range(100):
+				pids = ProcessTree.getChildrenPids(p.pid)
+				if len(pids) == 3:
+					break
+				time.sleep(0.01)
+			self.assertEqual(pids[0], p.pid)
+			self.assertEqual(len(pids), 3)
+			self.assertEqual(ProcessTree.getChildrenPids(p.pid, includeParent = False), pids[1:])
+		finally:
+			ProcessTree.killProcessTree(p.pid)
+			p.wait()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -308,6 +308,8 @@ class CodecManager(object):
 	def __init__(self):
 		#: dict[codec/aliasname] = (codec class, params)
 		self._codecs = {}
+		#: dict[codec/aliasname] = module name, for codecs not imported yet
+		self._codecModules = {}
 		self._logCallback = None
 	
 	def log(self, txt):
@@ -322,6 +324,35 @@ class CodecManager(object):
 			self._codecs[name] = (class_, {})
 			self.log("Codec class %s registered as codec %s" % (class_.__name__, name))
 	
+	def registerCodecModule(self, name, moduleName):
+		"""
+		Declares that codec name is provided by module moduleName,
+		which is only imported the first time the codec is needed.
+		"""
+		if not self._codecs.has_key(name) and not self._codecModules.has_key(name):
+			self._codecModules[name] = moduleName
+
+	def _loadCodecModule(self, name):
+		"""
+		Imports the module declared for codec name, if any.
+		
+		Import errors (typically a missing optional dependency)
+		are reported as a CodecNotFoundException.
+		
+		@rtype: bool
+		@returns: True if the codec is now registered, False otherwise.
+		"""
+		moduleName = self._codecModules.get(name)
+		if moduleName is None:
+			return False
+		try:
+			__import__(moduleName)
+		except Exception as e:
+			self.log("Unable to import module %s for codec %s: %s" % (moduleName, name, str(e)))
+			raise CodecNotFoundException("Codec '%s' is not available: unable to import %s: %s" % (name, moduleName, str(e)))
+		self._codecModules.pop(name, None)
+		return self._codecs.has_key(name)
+	
 	def alias(self, name, codec, **kwargs):
 		"""
 		Configure a codec and alias it.
@@ -329,7 +360,7 @@ class CodecManager(object):
 		that we can create different specialized configurations based on
 		the same alias.
 		"""
-		if not self._codecs.has_key(codec):
+		if not self._codecs.has_key(codec) and not self._loadCodecModule(codec):
 			raise Exception("Unable to alias codec %s to %s: codec %s is not registered" % (codec, name, codec))
 		(codecClass, properties) = self._codecs[codec]
 		mergedProperties = {}
@@ -343,7 +374,7 @@ class CodecManager(object):
 		"""
 		Creates and returns configured codec instance.
 		"""
-		if not self._codecs.has_key(name):
+		if not self._codecs.has_key(name) and not self._loadCodecModule(name):
 			return None
 		else:
 			codecClass, properties = self._codecs[name]
@@ -408,6 +439,18 @@ def alias(name, codec, **kwargs):
 def registerCodecClass(name, class_):
 	return instance().registerCodecClass(name, class_)
 
+def registerCodecModule(name, moduleName):
+	"""
+	Declares a codec (or codec alias) whose module will be
+	imported on first use only.
+
+	@type  name: string
+	@param name: the codec name
+	@type  moduleName: string
+	@param moduleName: the name of the module that registers this codec when imported
+	"""
+	return instance().registerCodecModule(name, moduleName)
+
 def encode(name, template, **properties):
 	"""
 	@type  name: string
@@ -36,10 +36,23 @@
 #
 # addCounter(path) enables to explicitly create a counter.
 #
+# Gauges are counters whose value is set() instead of inc()'d/dec()'d.
+#
+# Histograms (addHistogram(path), record(path, value)) are leaf counters
+# recording a distribution of values, typically latencies in ms, in bounded
+# memory. They provide the _count (default), _min, _max, _mean and _pNN
+# (percentile, _p50, _p99, _p999 for 99.9, ...) properties.
+# Summing such properties over non-leaf counters is meaningless: get them
+# from the histogram leaves.
+#
+# Once created, leaf counters are updated without taking the
+# manager-wide lock, so that they can be used on hot paths.
+#
 ##
 
-import time
+import collections
 import threading
+import time
 
 class CounterProperty:
 	"""
@@ -61,6 +74,9 @@ class CounterProperty:
 	def dec(self, v):
 		self.value -= v
 	
+	def set(self, v):
+		self.value = v
+	
 	def reset(self):
 		self.value = 0
 
@@ -81,28 +97,96 @@ class MaxCounterProperty(CounterProperty):
 	def dec(self, v = 1):
 		self.__current -= v
 
+	def set(self, v):
+		self.__current = v
+		if self.__current > self.value:
+			self.value = self.__current
+	
+	def reset(self):
+		self.value = 0
+		self.__current = 0
+
 class AverageCounterProperty(CounterProperty):
 	"""
-	Manage an average over time for the associated counter.
+	Manage an average over time for the associated counter,
+	i.e. the mean value of the counter weighted by the duration
+	spent at each value since the last reset.
 	"""
 	def __init__(self):
-		CounterProperty.__init__(self, 'max')
-		self.__count = 0
-		self.__lasttime = None
-		self.__current = 0
+		CounterProperty.__init__(self, 'average')
+		self.reset()
 	
-	def inc(self, v = 1):
+	def __update(self):
 		t = time.time()
-		
+		self.__integral += self.__current * (t - self.__lasttime)
 		self.__lasttime = t
+	
+	def inc(self, v = 1):
+		self.__update()
 		self.__current += v
+
+	def dec(self, v = 1):
+		self.__update()
+		self.__current -= v
+
+	def set(self, v):
+		self.__update()
+		self.__current = v
+	
+	def reset(self):
+		self.value = 0
+		self.__start = self.__lasttime = time.time()
+		self.__integral = 0.0
+		self.__current = 0
 	
 	def get(self):
 		"""
 		Reimplemented to take the duration spent at current value into account
 		"""
-		return 0
+		t = time.time()
+		elapsed = t - self.__start
+		if elapsed <= 0:
+			return self.__current
+		return (self.__integral + self.__current * (t - self.__lasttime)) / elapsed
+
+class RateCounterProperty(CounterProperty):
+	"""
+	Manage an increment rate (per second) for the associated counter,
+	computed over a sliding window of the last window seconds.
+	"""
+	def __init__(self, window = 10):
+		CounterProperty.__init__(self, 'rate')
+		self.__window = window
+		self.reset()
 	
+	def inc(self, v = 1):
+		second = int(time.time())
+		if self.__slots and self.__slots[-1][0] == second:
+			self.__slots[-1][1] += v
+		else:
+			self.__slots.append([second, v])
+			while self.__slots[0][0] <= second - self.__window:
+				self.__slots.popleft()
+
+	def dec(self, v = 1):
+		pass
+	
+	def set(self, v):
+		pass
+	
+	def reset(self):
+		self.value = 0
+		self.__slots = collections.deque()
+	
+	def get(self):
+		# Only consider complete seconds
+		now = int(time.time())
+		total = 0
+		for (second, v) in list(self.__slots):
+			if now - self.__window <= second < now:
+				total += v
+		return float(total) / self.__window
+
 
 
 class Counter:
@@ -119,22 +203,41 @@ class Counter:
 	def __init__(self, name):
 		self.name = name
 		self.properties = {}
+		self._mutex = threading.Lock()
 		self.addProperty(CounterProperty("default"))
 	
 	def addProperty(self, p):
+		self._mutex.acquire()
 		self.properties['_' + p.name] = p
+		self._mutex.release()
+		return self
+
+	def getPropertyNames(self):
+		return [ x[1:] for x in self.properties.keys() ]
 
 	def reset(self):
-		for k, v in self.properties.items():
+		self._mutex.acquire()
+		for v in self.properties.values():
 			v.reset()
+		self._mutex.release()
 	
 	def inc(self, val = 1):
-		for k, v in self.properties.items():
+		self._mutex.acquire()
+		for v in self.properties.values():
 			v.inc(val)
+		self._mutex.release()
 
 	def dec(self, val = 1):	
-		for k, v in self.properties.items():
+		self._mutex.acquire()
+		for v in self.properties.values():
 			v.dec(val)
+		self._mutex.release()
+
+	def set(self, val):
+		self._mutex.acquire()
+		for v in self.properties.values():
+			v.set(val)
+		self._mutex.release()
 
 	def get(self, propertyName = "default"):
 		p = "_" + propertyName
@@ -143,17 +246,132 @@ class Counter:
 		else:
 			return 0
 
+class Histogram:
+	"""
+	An HDR-like histogram, recording non-negative values (typically
+	latencies in ms) with a bounded relative error in a bounded number of
+	logarithmic buckets: recording is O(1), and memory does not depend
+	on the number of recorded values.
+	
+	Values are recorded with a resolution of unit, and a relative
+	precision of 1/2^(precisionBits - 1) (less than 1% with the defaults).
+	
+	It behaves as a Counter in a counter tree: inc(v) records v.
+	get() returns the number of recorded values, get('min'), get('max'),
+	get('mean'), get('p50'), get('p99'), get('p999') the other statistics.
+	"""
+	PROPERTIES = [ 'count', 'min', 'max', 'mean', 'p50', 'p90', 'p99', 'p999' ]
+	
+	def __init__(self, name, unit = 0.001, precisionBits = 8):
+		self.name = name
+		self._unit = unit
+		self._precisionBits = precisionBits
+		self._subBucketCount = 1 << precisionBits
+		self._mutex = threading.Lock()
+		self.reset()
+
+	def _getBucketKey(self, n):
+		if n < self._subBucketCount:
+			return n
+		shift = n.bit_length() - self._precisionBits
+		return (shift << self._precisionBits) + (n >> shift)
+
+	def _getBucketValue(self, key):
+		"""
+		Returns the value in the middle of the bucket.
+		"""
+		shift = key >> self._precisionBits
+		if not shift:
+			return key * self._unit
+		mantissa = key & (self._subBucketCount - 1)
+		return ((mantissa << shift) + (1 << (shift - 1))) * self._unit
+
+	def addProperty(self, p):
+		# Histograms have fixed properties
+		return self
+
+	def getPropertyNames(self):
+		return self.PROPERTIES[:]
+
+	def record(self, value):
+		if value < 0:
+			value = 0
+		key = self._getBucketKey(int(value / self._unit))
+		self._mutex.acquire()
+		self._buckets[key] = self._buckets.get(key, 0) + 1
+		self._count += 1
+		self._sum += value
+		if self._min is None or value < self._min:
+			self._min = value
+		if self._max is None or value > self._max:
+			self._max = value
+		self._mutex.release()
+
+	inc = record
+
+	def dec(self, val = 1):
+		pass
+
+	def set(self, val):
+		self.record(val)
+
+	def reset(self):
+		self._mutex.acquire()
+		self._buckets = {}
+		self._count = 0
+		self._sum = 0.0
+		self._min = None
+		self._max = None
+		self._mutex.release()
+
+	def getPercentile(self, percentile):
+		self._mutex.acquire()
+		try:
+			if not self._count:
+				return 0
+			rank = percentile / 100.0 * self._count
+			seen = 0
+			for key in sorted(self._buckets.keys()):
+				seen += self._buckets[key]
+				if seen >= rank:
+					# The bucket value is approximated: keep it within the known bounds
+					return min(max(self._getBucketValue(key), self._min), self._max)
+			return self._max
+		finally:
+			self._mutex.release()
+
+	def get(self, propertyName = "default"):
+		if propertyName in [ 'default', 'count' ]:
+			return self._count
+		elif propertyName == 'min':
+			return self._min or 0
+		elif propertyName == 'max':
+			return self._max or 0
+		elif propertyName == 'mean':
+			if not self._count:
+				return 0
+			return self._sum / self._count
+		elif propertyName.startswith('p') and propertyName[1:].isdigit():
+			# p50 = 50th percentile, p999 = 99.9th percentile
+			digits = propertyName[1:]
+			if len(digits) > 2:
+				digits = digits[:2] + '.' + digits[2:]
+			return self.getPercentile(float(digits))
+		return 0
+
 class CounterNode:
 	"""
 	Boxing class for a counter within a counter tree, with possible childrens.
 	"""
-	def __init__(self, name):
+	def __init__(self, name, counter = None):
 		"""
 		name is a local name within the counter tree.
 		"""
 		# This is not optimised: the counter is actually used only if leaf.
 		# If we have children, is ignored.
-		self.counter = Counter(name)
+		if counter is None:
+			counter = Counter(name)
+		self.counter = counter
 		# Optional child counters, indexed by their local name.
 		self.children = {}
 
@@ -188,6 +406,9 @@ class CounterManager:
 		# Root counters.
 		self.root = CounterNode("root")
 		self.mutex = threading.RLock()
+		# Explicit paths to counters, to update them without walking the tree.
+		# Only updated under the mutex, read without it.
+		self._counters = {}
 
 	def __getCounters(self, path):
 		"""
@@ -240,26 +461,52 @@ class CounterManager:
 		
 		NB: incrementing or decrementing a non-leaf node is useless, since when we'll get a value, only children values will be used.
 		"""
-		self.mutex.acquire()
-		node = self.__getNodeByPath(path)
-		if not node:
-			counter = self.addCounter(path)
-		else:
-			counter = node.counter
-
-		counter.inc(val)
-		self.mutex.release()
+		counter = self._getCounter(path)
+		if counter:
+			counter.inc(val)
 
 	def dec(self, path, val = 1):
-		self.mutex.acquire()
-		node = self.__getNodeByPath(path)
-		if not node:
-			counter = self.addCounter(path)
-		else:
-			counter = node.counter
+		counter = self._getCounter(path)
+		if counter:
+			counter.dec(val)
+	
+	def set(self, path, val):
+		"""
+		Sets a gauge value.
+		path is a wildcard-less and property-less string (otherwise do nothing)
+		If the gauge does not exist, create it on the fly.
+		"""
+		counter = self._getCounter(path)
+		if counter:
+			counter.set(val)
 
-		counter.dec(val)
-		self.mutex.release()
+	def record(self, path, val):
+		"""
+		Records a value into a histogram.
+		If the histogram does not exist, create it on the fly.
+		"""
+		counter = self._counters.get(path)
+		if counter is None:
+			counter = self.addHistogram(path)
+		if counter:
+			counter.inc(val)
+
+	def _getCounter(self, path):
+		"""
+		Returns the counter at path, creating it if needed.
+		Does not lock the manager if the counter already exists.
+		"""
+		counter = self._counters.get(path)
+		if counter is None:
+			self.mutex.acquire()
+			node = self.__getNodeByPath(path)
+			if not node:
+				counter = self._add(path)
+			else:
+				counter = node.counter
+				self._counters[path] = counter
+			self.mutex.release()
+		return counter
 	
 	def addCounter(self, path, oid = None):
 		"""
@@ -285,26 +532,44 @@ class CounterManager:
 			Snmp.registerGauge("%s.%s" % (SNMP_BASE_OID, oid), lambda: counter.get())
 		return counter		
 
-	def _add(self, path):
+	def addHistogram(self, path, unit = 0.001):
+		"""
+		Add a new histogram in the tree, and return it.
+		Values are recorded with unit as resolution.
+		"""
+		return self._add(path, lambda name: Histogram(name, unit = unit))
+
+	def _add(self, path, counterFactory = None):
 		"""
 		Add a new counter in the tree, and return it.
 		"""
 		if "*" in path or "_" in path:
 			return None
 		
-		counters = self.__getCounters(path)
-		if not (counters == []):
-			return counters[0] # already exists, return it.
-		
-		currentNode = self.root
-		for name in path.split("."):
-			if currentNode.children.has_key(name):
-				currentNode = currentNode.children[name]
+		self.mutex.acquire()
+		try:
+			counters = self.__getCounters(path)
+			if not (counters == []):
+				return counters[0] # already exists, return it.
+			
+			currentNode = self.root
+			names = path.split(".")
+			for name in names[:-1]:
+				if currentNode.children.has_key(name):
+					currentNode = currentNode.children[name]
+				else:
+					currentNode.children[name] = CounterNode(name)
+					currentNode = currentNode.children[name]
+			name = names[-1]
+			if counterFactory:
+				currentNode.children[name] = CounterNode(name, counterFactory(name))
 			else:
 				currentNode.children[name] = CounterNode(name)
-				currentNode = currentNode.children[name]
-
-		return currentNode.counter		
+			counter = currentNode.children[name].counter
+			self._counters[path] = counter
+			return counter
+		finally:
+			self.mutex.release()
 
 
 	def get(self, path):
@@ -370,6 +635,39 @@ class CounterManager:
 		self.mutex.release()
 		return ret
 
+	def getAllLeafPropertyValues(self):
+		"""
+		Return a dict of { path: value } for all leaf counters,
+		including their properties as path._property entries.
+		"""
+		self.mutex.acquire()
+		counters = []
+		nodes = [ (None, self.root) ]
+		while nodes:
+			basename, node = nodes.pop()
+			for (name, child) in node.children.items():
+				if basename:
+					path = basename + '.' + name
+				else:
+					path = name
+				if child.children:
+					nodes.append((path, child))
+				else:
+					counters.append((path, child.counter))
+		self.mutex.release()
+		ret = {}
+		for (path, counter) in counters:
+			ret[path] = counter.get()
+			for propertyName in counter.getPropertyNames():
+				if propertyName != 'default':
+					ret['%s._%s' % (path, propertyName)] = counter.get(propertyName)
+		return ret
+
+	def resetAll(self):
+		self.mutex.acquire()
+		self.root.reset()
+		self.mutex.release()
+
 
 TheCounterManager = None
 
@@ -26,10 +26,13 @@ import ConfigManager
 import CounterManager
 import TestermanMessages as Messages
 import TestermanNodes as Nodes
+import TestermanTCI
 import Versions
 
 import logging
+import Queue
 import threading
+import time
 
 cm = ConfigManager.instance()
 
@@ -104,6 +107,61 @@ class IlServer(Nodes.ListeningNode):
 
 	
 
+class LogWriter(threading.Thread):
+	"""
+	Processes the log notifications in their reception order,
+	out of the Il thread: converts binary log events to XML, writes
+	them to their log files and dispatches them to the Xc subscribers.
+	"""
+	def __init__(self, manager):
+		threading.Thread.__init__(self)
+		self.setDaemon(True)
+		self._manager = manager
+		# (notification, reception time, flushed event)
+		self._queue = Queue.Queue()
+
+	def getLogger(self):
+		return logging.getLogger('TS.TL')
+
+	def enqueue(self, notification):
+		self._queue.put((notification, time.time(), None))
+
+	def flush(self, timeout):
+		"""
+		Waits for the notifications enqueued so far to be processed.
+
+		@type  timeout: float
+		@param timeout: the maximum time to wait, in s
+
+		@rtype: bool
+		@returns: True if they were processed, False if the timeout expired.
+		"""
+		flushed = threading.Event()
+		self._queue.put((None, None, flushed))
+		flushed.wait(timeout)
+		return flushed.isSet()
+
+	def stop(self):
+		"""
+		Stops once the notifications enqueued so far are processed.
+		"""
+		self._queue.put((None, None, None))
+		self.join()
+
+	def run(self):
+		while True:
+			(notification, startTime, flushed) = self._queue.get()
+			if flushed:
+				flushed.set()
+			elif notification is not None:
+				try:
+					self._manager.writeLogNotification(notification, startTime)
+				except Exception as e:
+					self.getLogger().error("Unable to process log notification for %s: %s" % (notification.getUri(), str(e)))
+			else:
+				break
+
+
 ################################################################################
 # TL dispatcher
 # Keep tracks of currently registered Xc clients and forward them
@@ -119,10 +177,12 @@ class Manager:
 		self._mutex = threading.RLock()
 		self._xcServer = XcServer(self, xcAddress)
 		self._ilServer = IlServer(self, ilAddress)
+		self._logWriter = LogWriter(self)
 	
 		# The subscription mapping is a list of Xc channels objects per uri (jobid:<id>, system:jobs, ...).
 		self._subscriptions = {}
 		self._xcClients = []
+		CounterManager.instance().addCounter("server.ts.il.events").addProperty(CounterManager.RateCounterProperty())
 		
 	def _lock(self):
 		self._mutex.acquire()
@@ -139,6 +199,7 @@ class Manager:
 	def start(self):
 		self.getLogger().info("Starting...")
 		self._xcServer.start()
+		self._logWriter.start()
 		self._ilServer.start()
 		self.getLogger().info("Started")
 	
@@ -148,6 +209,7 @@ class Manager:
 		self._xcServer.finalize()
 		self._ilServer.stop()
 		self._ilServer.finalize()
+		self._logWriter.stop()
 		self.getLogger().info("Stopped")
 	
 	def subscribe(self, channel, uri):
@@ -231,22 +293,75 @@ class Manager:
 		return logging.getLogger('TS.TL')
 
 	def handleIlNotification(self, notification):
+		"""
+		Log notifications are processed by the log writer,
+		so that the Il thread only receives them.
+		"""
+		CounterManager.instance().inc("server.ts.il.events")
 		method = notification.getMethod()
 		if method == "LOG":
-			# Add server-side/TL control here
-			filename = notification.getHeader('Log-Filename')
-			if filename:
-				try:
-					f = open(filename, 'a')
-					f.write('%s\n' % notification.getBody())
-					f.close()
-				except Exception as e:
-					self.getLogger().error("Unable to write log for %s: %s" % (notification.getUri(), str(e)))		
+			self._logWriter.enqueue(notification)
 		else:
 			self.getLogger().warning("Received unsupported notification method: " + method)
+			# Dispath
+			self.dispatchNotification(notification)
+
+	def flushLogNotifications(self, timeout = 30.0):
+		"""
+		Waits for the log notifications received so far
+		to be written and dispatched.
+
+		@type  timeout: float
+		@param timeout: the maximum time to wait, in s
+
+		@rtype: bool
+		@returns: True if they were, False if the timeout expired.
+		"""
+		return self._logWriter.flush(timeout)
+
+	def writeLogNotification(self, notification, startTime):
+		"""
+		Called by the log writer.
+
+		@type  startTime: float
+		@param startTime: the notification reception time
+		"""
+		# Add server-side/TL control here
+		filename = notification.getHeader('Log-Filename')
+		if notification.getContentType() == TestermanTCI.LogEventContentType:
+			# Binary event: only converted to XML if someone needs it
+			self._lock()
+			subscribed = self._subscriptions.has_key(str(notification.getUri()))
+			self._unlock()
+			if not filename and not subscribed:
+				CounterManager.instance().record("server.ts.il.latency", (time.time() - startTime) * 1000.0)
+				return
+			try:
+				self._convertLogEvent(notification)
+			except Exception as e:
+				self.getLogger().error("Unable to convert log event for %s: %s" % (notification.getUri(), str(e)))
+				return
+		if filename:
+			try:
+				f = open(filename, 'a')
+				f.write('%s\n' % notification.getBody())
+				f.close()
+			except Exception as e:
+				self.getLogger().error("Unable to write log for %s: %s" % (notification.getUri(), str(e)))		
 
 		# Dispath
 		self.dispatchNotification(notification)
+		CounterManager.instance().record("server.ts.il.latency", (time.time() - startTime) * 1000.0)
+
+	def _convertLogEvent(self, notification):
+		"""
+		Replaces a binary log event by its XML representation,
+		as expected in log files and by Xc clients.
+		"""
+		xml = TestermanTCI.logEventToXml(TestermanTCI.decodeLogEvent(notification.getApplicationBody()))
+		notification.setHeader("Content-Type", "application/xml")
+		notification.setHeader("Content-Encoding", "utf-8")
+		notification.setBody(xml.encode('utf-8'))
 
 
 ################################################################################
@@ -18,6 +18,115 @@
 #
 ##
 
+import Inotify
+
+import logging
+import os
+import select
+import threading
+
+
+def getLogger():
+	return logging.getLogger('TS.FSB')
+
+
+class TreeWatcher(threading.Thread):
+	"""
+	Watches a local directory tree with inotify (Linux only),
+	reporting the changed files and directories to a callback.
+
+	Helper for backends implementing watch() with local files.
+	"""
+	WATCH_MASK = Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO | Inotify.IN_MODIFY | Inotify.IN_CLOSE_WRITE | Inotify.IN_ATTRIB | Inotify.IN_ONLYDIR
+
+	def __init__(self, basepath, callback, excluded = []):
+		"""
+		@type  callback: function(path, recursive)
+		@param callback: called with the path of a changed entry,
+		relative to basepath, '' for basepath itself.
+		recursive is True if the whole subtree may have changed.
+		@type  excluded: list of strings
+		@param excluded: names of the directories not to watch
+		"""
+		threading.Thread.__init__(self)
+		self.setDaemon(True)
+		self._basepath = os.path.realpath(basepath)
+		self._callback = callback
+		self._excluded = excluded
+		self._inotify = None
+		#: watched dir, relative to basepath, indexed by watch descriptor
+		self._watches = {}
+
+	def start(self):
+		"""
+		@rtype: bool
+		@returns: True if the tree is watched, False if it cannot be (not on Linux,
+		too many directories to watch, ...)
+		"""
+		if not Inotify.isAvailable():
+			return False
+		try:
+			self._inotify = Inotify.Inotify()
+			self._addWatches('')
+		except Exception as e:
+			getLogger().warning("Unable to watch %s for changes: %s" % (self._basepath, str(e)))
+			if self._inotify:
+				self._inotify.close()
+			return False
+		getLogger().info("Watching %s for changes (%d directories)" % (self._basepath, len(self._watches)))
+		threading.Thread.start(self)
+		return True
+
+	def _addWatches(self, path):
+		for (dirpath, dirnames, filenames) in os.walk(os.path.join(self._basepath, path)):
+			dirnames[:] = [ d for d in dirnames if not d in self._excluded ]
+			wd = self._inotify.addWatch(dirpath, self.WATCH_MASK)
+			relpath = os.path.relpath(dirpath, self._basepath)
+			if relpath == '.':
+				relpath = ''
+			self._watches[wd] = relpath
+
+	def _removeWatches(self, path):
+		for (wd, relpath) in self._watches.items():
+			if relpath == path or relpath.startswith(path + '/'):
+				self._inotify.removeWatch(wd)
+				del self._watches[wd]
+
+	def run(self):
+		while True:
+			try:
+				select.select([ self._inotify ], [], [])
+				changes = {}
+				for (wd, mask, cookie, name) in self._inotify.readEvents():
+					if mask & Inotify.IN_Q_OVERFLOW:
+						getLogger().warning("Too many changes in %s, some of them were lost" % self._basepath)
+						changes[''] = True
+						continue
+					if mask & Inotify.IN_IGNORED:
+						self._watches.pop(wd, None)
+						continue
+					directory = self._watches.get(wd)
+					if directory is None or not name or name in self._excluded:
+						continue
+					path = directory and '%s/%s' % (directory, name) or name
+					recursive = False
+					if mask & Inotify.IN_ISDIR:
+						if mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+							self._removeWatches(path)
+							recursive = True
+						elif mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+							try:
+								self._addWatches(path)
+							except OSError as e:
+								getLogger().warning("Unable to watch %s/%s for changes: %s" % (self._basepath, path, str(e)))
+							recursive = True
+					changes[path] = changes.get(path, False) or recursive
+				for (path, recursive) in changes.items():
+					self._callback(path, recursive)
+			except Exception as e:
+				getLogger().warning("Error while watching %s for changes: %s" % (self._basepath, str(e)))
+
+
 class Attributes:
 	def __init__(self):
 		# File size, in bytes
@@ -111,6 +220,29 @@ class FileSystemBackend:
 		"""
 		return None
 
+	def readChunk(self, filename, offset, size):
+		"""
+		Returns a part of the (current) content of a file.
+		
+		The default implementation reads the whole file:
+		backends that can read a part of a file should reimplement it.
+		
+		@type  filename: string
+		@param filename: the complete path to the file relative to the FSB mountpoint
+		@type  offset: integer
+		@param offset: the position of the first byte to read
+		@type  size: integer
+		@param size: the maximum number of bytes to read
+		
+		@rtype: string/buffer
+		@return: up to size bytes from offset (an empty string at the end of the file),
+		         or None if not found.
+		"""
+		content = self.read(filename)
+		if content is None:
+			return None
+		return content[offset:offset+size]
+
 	def write(self, filename, content, baseRevision = None, reason = None, username = None):
 		"""
 		Writes content to a file, creating it if needed.
@@ -364,6 +496,24 @@ class FileSystemBackend:
 		"""
 		return False
 
+	def watch(self, callback):
+		"""
+		Requests the backend to report the changes made to its files and directories,
+		including the ones not made through the backend (by another application).
+		The FileSystemManager only caches metadata for the backends reporting their
+		changes.
+
+		@type  callback: function(path, recursive)
+		@param callback: to call with the path of a changed file or directory,
+		relative to the mountpoint ('' for the mountpoint itself), with
+		recursive set to True if the whole path subtree may have changed.
+		Profiles are reported with their virtual path (<script>/profiles/<profile>).
+
+		@rtype: bool
+		@returns: True if the backend reports the changes, False otherwise.
+		"""
+		return False
+
 	def chown(self, path, user, group):
 		"""
 		Change the owner/group of a file to user/group.
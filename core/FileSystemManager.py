@@ -23,15 +23,22 @@
 # virtual file system traversal
 ###
 
+import ConfigManager
+import CounterManager
 import EventManager
 import FileSystemBackendManager
 import FileSystemBackend
 import TestermanMessages as Messages
 import Versions
 
+import collections
 import logging
 import os
 import os.path
+import posixpath
+import threading
+
+cm = ConfigManager.instance()
 
 
 # Application-type for returned objects in dir lists (sort of mime-types)
@@ -99,6 +106,104 @@ class VirtualPath:
 	def isVirtual(self):
 		return (self._vtype is not None)
 
+################################################################################
+# Metadata cache
+################################################################################
+
+class MetadataCache:
+	"""
+	A bounded LRU cache of directory listings (including the profiles
+	virtual folders) and file attributes, indexed by docroot path.
+
+	Values are only cached if no invalidation occured while
+	they were computed (see getGeneration()).
+	"""
+	MISS = object()
+
+	def __init__(self, maxEntries):
+		self._mutex = threading.RLock()
+		self._maxEntries = maxEntries
+		#: cached values, indexed by (kind, path), in LRU order
+		self._entries = collections.OrderedDict()
+		#: incremented on each invalidation
+		self._generation = 0
+		CounterManager.instance().addCounter("server.ts.fs.cache.hits")
+		CounterManager.instance().addCounter("server.ts.fs.cache.misses")
+
+	def _lock(self):
+		self._mutex.acquire()
+
+	def _unlock(self):
+		self._mutex.release()
+
+	def getGeneration(self):
+		return self._generation
+
+	def get(self, kind, path):
+		"""
+		@rtype: object
+		@returns: the cached value, or MetadataCache.MISS
+		"""
+		key = (kind, path)
+		self._lock()
+		value = self._entries.pop(key, self.MISS)
+		if value is not self.MISS:
+			self._entries[key] = value
+		self._unlock()
+		if value is self.MISS:
+			CounterManager.instance().inc("server.ts.fs.cache.misses")
+		else:
+			CounterManager.instance().inc("server.ts.fs.cache.hits")
+		return value
+
+	def put(self, kind, path, value, generation):
+		"""
+		@type  generation: integer
+		@param generation: the cache generation when the value
+		started to be computed
+		"""
+		self._lock()
+		if generation == self._generation:
+			self._entries[(kind, path)] = value
+			while len(self._entries) > self._maxEntries:
+				self._entries.popitem(last = False)
+		self._unlock()
+
+	def invalidate(self, path):
+		"""
+		Invalidates the cached values that depend on a file or a directory,
+		when it is created, modified or deleted.
+		"""
+		parent = posixpath.dirname(path)
+		keys = [ ('dir', path), ('attributes', path), ('dir', path + '/profiles'), ('dir', parent) ]
+		if posixpath.basename(path) == 'package.xml':
+			# the application type of the parent dir may have changed
+			keys.append(('dir', posixpath.dirname(parent)))
+		self._lock()
+		self._generation += 1
+		for key in keys:
+			self._entries.pop(key, None)
+		self._unlock()
+
+	def invalidateTree(self, path):
+		"""
+		Invalidates the cached values that depend on a directory and
+		on all its contents.
+		"""
+		prefix = path.rstrip('/') + '/'
+		self._lock()
+		self._generation += 1
+		for key in self._entries.keys():
+			if key[1] == path or key[1].startswith(prefix):
+				del self._entries[key]
+		self._entries.pop(('dir', posixpath.dirname(path)), None)
+		self._unlock()
+
+
+def normalizePath(path):
+	return posixpath.normpath('/' + path)
+
+
 ################################################################################
 # The manager
 ################################################################################
@@ -123,7 +228,61 @@ class FileSystemManager:
 	- write
 	- rmdir
 	- unlink
+
+	Directory listings and file attributes are cached for the backends
+	that report their changes (see FileSystemBackend.watch()).
 	"""
+	def __init__(self):
+		self._cache = None
+		maxEntries = cm.get("testerman.fs.cache.max_entries")
+		if maxEntries:
+			self._cache = MetadataCache(maxEntries)
+		#: the backends whose metadata can be cached
+		self._watchedBackends = []
+
+	def watchBackends(self):
+		"""
+		Starts watching the mounted backends for changes,
+		enabling the metadata cache for them.
+		"""
+		if not self._cache:
+			return
+		for (mountpoint, backend) in FileSystemBackendManager.Mountpoints.items():
+			def onChange(path, recursive, mountpoint = mountpoint):
+				path = normalizePath(mountpoint + path)
+				if recursive:
+					self._cache.invalidateTree(path)
+				else:
+					self._cache.invalidate(path)
+			try:
+				if backend.watch(onChange):
+					self._watchedBackends.append(backend)
+				else:
+					getLogger().info("Backend %s mounted on %s does not report changes, not caching its metadata" % (str(backend), mountpoint))
+			except Exception as e:
+				getLogger().warning("Unable to watch backend %s mounted on %s: %s" % (str(backend), mountpoint, str(e)))
+
+	def _getCached(self, kind, path, backend):
+		"""
+		@rtype: tuple (value, generation)
+		@returns: the cached value or MetadataCache.MISS, and the
+		cache generation to put the computed value with, if missed.
+		"""
+		if not backend in self._watchedBackends:
+			return (MetadataCache.MISS, None)
+		generation = self._cache.getGeneration()
+		return (self._cache.get(kind, normalizePath(path)), generation)
+
+	def _putCached(self, kind, path, value, generation):
+		if generation is not None:
+			self._cache.put(kind, normalizePath(path), value, generation)
+
+	def _invalidate(self, path, recursive = False):
+		if self._cache:
+			if recursive:
+				self._cache.invalidateTree(normalizePath(path))
+			else:
+				self._cache.invalidate(normalizePath(path))
 
 	def logged(fn, *args, **kw):
 		"""
@@ -272,6 +431,24 @@ class FileSystemManager:
 		else:			
 			return backend.read(adjusted, revision = None)
 
+	def readChunk(self, filename, offset, size):
+		"""
+		Returns a part of the current content of a file,
+		without reading the whole file when the backend supports it.
+		vpath is supported.
+		"""
+		vpath = VirtualPath(filename)
+		if vpath.isVirtual():
+			content = self.read(filename)
+			if content is None:
+				return None
+			return content[offset:offset+size]
+
+		(adjusted, backend) = FileSystemBackendManager.getBackend(filename)
+		if not backend:
+			raise Exception('No backend available to manipulate %s' % filename)
+		return backend.readChunk(adjusted, offset, size)
+
 	def write(self, filename, content, reason = None, notify = True, username = None):
 		"""
 		Automatically creates the missing directories up to the file, if needed.
@@ -308,6 +485,8 @@ class FileSystemManager:
 		except Exception as e:
 			getLogger().error("Unable to write %s: %s" % (filename, str(e)))
 			return False
+		finally:
+			self._invalidate(filename)
 
 		if notify:
 			if newfile:
@@ -333,6 +512,8 @@ class FileSystemManager:
 		except Exception as e:
 			getLogger().error("Unable to profile %s for %s: %s" % (profilename, filename, str(e)))
 			return False
+		finally:
+			self._invalidate(resourcepath)
 
 		if notify:
 			if newfile:
@@ -358,6 +539,7 @@ class FileSystemManager:
 			ret = backend.unlinkprofile(adjusted, vpath.getVirtualValue(), username = username)
 		else:
 			ret = backend.unlink(adjusted, reason, username = username)
+		self._invalidate(filename)
 
 		if ret and notify:
 			self._notifyFileDeleted(filename)
@@ -394,13 +576,18 @@ class FileSystemManager:
 			else:
 				return None
 			
+		(res, generation) = self._getCached('dir', path, backend)
+		if res is not MetadataCache.MISS:
+			return res and [ dict(x) for x in res ]
+
 		# Standard dir contents
-		elif vpath.isProfileRelated():
+		if vpath.isProfileRelated():
 			dircontents = backend.getprofiles(adjusted)
 		else:			
 			dircontents = backend.getdir(adjusted)
 
 		if dircontents is None:
+			self._putCached('dir', path, None, generation)
 			return None
 		
 		# Now converts the backend-level object type to application-level type
@@ -410,6 +597,7 @@ class FileSystemManager:
 			applicationType = self.getApplicationType(name, path, entry['type'])
 			if applicationType:			
 				res.append({'name': name, 'type': applicationType})
+		self._putCached('dir', path, [ dict(x) for x in res ], generation)
 		return res
 
 	@logged
@@ -440,6 +628,7 @@ class FileSystemManager:
 					continue
 				else:
 					res = backend.mkdir(adjusted)
+					self._invalidate(p)
 					if not res:
 						return False
 					if notify:
@@ -478,6 +667,7 @@ class FileSystemManager:
 		else:
 			getLogger().info("Deleting directory '%s' recursively, adjusted to '%s' for backend '%s'" % (path, adjusted, backend))
 			ret = self._rmdir(adjusted, backend, notify = True)
+		self._invalidate(path, recursive = True)
 		if ret and notify:
 			self._notifyDirDeleted(path)
 		return ret
@@ -518,10 +708,16 @@ class FileSystemManager:
 		if not backend:
 			raise Exception('No backend available to manipulate %s' % baseObject)
 		
+		(ret, generation) = self._getCached('attributes', filename, backend)
+		if ret is not MetadataCache.MISS:
+			return ret
+
 		if vpath.isProfileRelated():
-			return backend.profileattributes(adjusted, vpath.getVirtualValue())
+			ret = backend.profileattributes(adjusted, vpath.getVirtualValue())
 		else:			
-			return backend.attributes(adjusted, revision = None)
+			ret = backend.attributes(adjusted, revision = None)
+		self._putCached('attributes', filename, ret, generation)
+		return ret
 
 	def revisions(self, filename):
 		(adjusted, backend) = FileSystemBackendManager.getBackend(filename)
@@ -732,6 +928,8 @@ class FileSystemManager:
 				ret = backend.renamedir(adjusted, newName)
 			else:
 				ret = backend.rename(adjusted, newName)
+			self._invalidate(source, recursive = True)
+			self._invalidate(destination, recursive = True)
 			if ret:
 				self._notifyFileRenamed(source, newName)
 			return ret
@@ -753,6 +951,7 @@ def initialize():
 	FileSystemBackendManager.scanFileSystemBackends()
 	# Mount everything according to the configuration file, if any
 	FileSystemBackendManager.mountAll()
+	TheFileSystemManager.watchBackends()
 
 def finalize():
 	pass
@@ -0,0 +1 @@
+../common/Inotify.py
\ No newline at end of file
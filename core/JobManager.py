@@ -26,6 +26,7 @@
 ##
 
 import ConfigManager
+import CounterManager
 import DependencyResolver
 import EventManager
 import FileSystemManager
@@ -39,6 +40,7 @@ import compiler
 import cPickle as pickle
 import copy_reg
 import fcntl
+import json
 import logging
 import os
 import os.path
@@ -46,6 +48,8 @@ import parser
 import re
 import shutil
 import signal
+import socket
+import subprocess
 import sys
 import tempfile
 import threading
@@ -570,6 +574,56 @@ class Job(object):
 		"""		
 		return None
 
+	def getLogChunk(self, offset, maxSize):
+		"""
+		Returns a part of the current job's log file, so that
+		clients can follow it by offset, without reading it again
+		and without the XML prologue and root element added by getLog().
+		
+		The chunk ends with a complete line, unless a single line is larger
+		than maxSize.
+		
+		@type  offset: integer
+		@param offset: the position in the log file to read from
+		@type  maxSize: integer
+		@param maxSize: the maximum chunk size, in bytes
+		
+		@rtype: tuple (string (utf-8), integer, bool)
+		@returns: the chunk, the offset to read the next chunk from,
+		          and True if the job is complete and the whole log has been read
+		"""
+		if not self._logFilename:
+			return ('', offset, self.isFinished())
+
+		# Checked before reading: the log of a finished job does not grow anymore
+		finished = self.isFinished()
+		# Logs are locally generated, so no need to access them through the FileSystemManager.
+		absoluteLogFilename = os.path.normpath("%s%s" % (cm.get("testerman.document_root"), self._logFilename))
+		try:
+			f = open(absoluteLogFilename, 'rb')
+		except IOError:
+			if finished:
+				# The log was deleted.
+				raise
+			# The log file may have not been created yet.
+			return ('', offset, False)
+		try:
+			f.seek(offset)
+			data = f.read(maxSize)
+		finally:
+			f.close()
+
+		eof = len(data) < maxSize
+		if eof and finished:
+			return (data, offset + len(data), True)
+		# The last line may be being written
+		end = data.rfind('\n') + 1
+		if end > 0:
+			data = data[:end]
+		elif eof:
+			data = ''
+		return (data, offset + len(data), False)
+
 	def postRun(self):
 		"""
 		Called when the job is complete, regardless of its status.
@@ -585,6 +639,204 @@ class Job(object):
 		"""
 		pass
 
+################################################################################
+# TE fork server
+################################################################################
+
+# The TE fork server script, run with the TE interpreter
+TE_FORK_SERVER_NAME = "TEForkServer.py"
+
+class ForkedTe:
+	"""
+	A TE forked by the TE fork server.
+	Since it is not our child, its termination is notified by the fork server.
+	"""
+	def __init__(self, connection, pid):
+		self._connection = connection
+		self._file = connection.makefile('r')
+		self.pid = pid
+	
+	def wait(self):
+		"""
+		Waits for the TE to complete.
+		
+		@rtype: int
+		@returns: the TE exit status, encoded as os.waitpid() does.
+		"""
+		self._connection.settimeout(None)
+		try:
+			while True:
+				line = self._file.readline()
+				if not line:
+					break
+				message = json.loads(line)
+				if message.has_key('status'):
+					return message['status']
+		finally:
+			self._file.close()
+			self._connection.close()
+
+		# Lost contact with the fork server: we can only watch the process until it disappears
+		getLogger().warning("Lost contact with the TE fork server while waiting for TE (pid %s)" % self.pid)
+		while True:
+			try:
+				os.kill(self.pid, 0)
+			except OSError:
+				break
+			time.sleep(1.0)
+		return signal.SIGKILL
+
+class TeForkServer:
+	"""
+	Controls the TE fork server process.
+	
+	The fork server is started with the TE interpreter and environment,
+	preloads the TE core modules and plugins, and forks the TEs from this
+	warm interpreter.
+	The TE core modules are preloaded from the server root, i.e. from the
+	files that are copied into the TE eggs as their core dependencies.
+	It is (re)started on demand, when not running yet, when the TE interpreter,
+	environment or core dependencies changed, or when it reports that a
+	preloaded module changed.
+	"""
+	def __init__(self):
+		self._mutex = threading.RLock()
+		self._process = None
+		self._socketDirectory = None
+		self._socketFilename = None
+		# The (interpreter, environment, preloading) the current fork server was started with
+		self._key = None
+	
+	def _lock(self):
+		self._mutex.acquire()
+	
+	def _unlock(self):
+		self._mutex.release()
+	
+	def _start(self, executable, env, coreDependencies, key):
+		# The core dependencies are preloaded first, as the egg would provide them
+		modules = [ x[:-3] for x in coreDependencies if x.endswith('.py') ]
+		modules += [ x.strip() for x in cm.get("testerman.te.forkserver.preload").split(',') if x.strip() and not x.strip() in modules ]
+		adapterModuleName = cm.get("testerman.te.python.ttcn3module")
+		if adapterModuleName and not adapterModuleName in modules:
+			modules.append(adapterModuleName)
+		pluginPaths = cm.get("testerman.te.probe_paths") + cm.get("testerman.te.codec_paths")
+		self._socketDirectory = tempfile.mkdtemp()
+		self._socketFilename = "%s/te.sock" % self._socketDirectory
+		args = [ executable, "%s/%s" % (cm.get_transient('ts.server_root'), TE_FORK_SERVER_NAME),
+			'--socket', self._socketFilename,
+			'--core-path', cm.get_transient('ts.server_root'),
+			'--preload', ','.join(modules),
+			'--plugin-paths', ','.join(pluginPaths) ]
+		if cm.get("testerman.te.forkserver.preload_plugins"):
+			args.append('--preload-plugins')
+		getLogger().info("Starting TE fork server: %s" % ' '.join(args))
+		# Our stdin is kept by the fork server: it exits when we close it
+		self._process = subprocess.Popen(args, executable = executable, env = env, stdin = subprocess.PIPE, close_fds = True)
+		self._key = key
+		
+	def _stop(self):
+		if self._process:
+			getLogger().info("Stopping TE fork server (pid %s)..." % self._process.pid)
+			try:
+				self._process.stdin.close()
+				self._process.wait()
+			except Exception as e:
+				getLogger().warning("Unable to stop the TE fork server gracefully: %s" % str(e))
+			self._process = None
+		if self._socketDirectory:
+			shutil.rmtree(self._socketDirectory, ignore_errors = True)
+			self._socketDirectory = None
+		self._key = None
+
+	def _connect(self):
+		"""
+		Connects to the fork server, waiting for it to be listening.
+		"""
+		timeout = time.time() + cm.get("testerman.te.forkserver.start_timeout")
+		while True:
+			if self._process.poll() is not None:
+				raise Exception("TE fork server exited with status %s" % self._process.returncode)
+			s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				s.connect(self._socketFilename)
+				return s
+			except socket.error as e:
+				s.close()
+				if time.time() > timeout:
+					raise Exception("TE fork server not available: %s" % str(e))
+			time.sleep(0.05)
+
+	def spawn(self, executable, args, env, cwd, coreDependencies = []):
+		"""
+		Forks a TE from the fork server.
+		
+		@type  executable: string
+		@param executable: the TE interpreter
+		@type  args: list of strings
+		@param args: the interpreter arguments, i.e. the TE egg filename followed by its options
+		@type  env: dict[string] of strings
+		@param env: the TE environment
+		@type  cwd: string
+		@param cwd: the TE working directory
+		@type  coreDependencies: list of strings
+		@param coreDependencies: the core dependencies embedded into the TE egg,
+		as filenames relative to the server root
+		
+		@throws Exception if the TE could not be forked
+		
+		@rtype: ForkedTe
+		@returns: the forked TE
+		"""
+		key = (executable, sorted(env.items()), list(coreDependencies), cm.get("testerman.te.forkserver.preload"), cm.get("testerman.te.forkserver.preload_plugins"))
+		self._lock()
+		try:
+			for attempt in range(2):
+				if self._key != key or self._process is None or self._process.poll() is not None:
+					self._stop()
+					self._start(executable, env, coreDependencies, key)
+				s = self._connect()
+				try:
+					# Leave the fork server enough time to complete its preloading, if just started
+					s.settimeout(cm.get("testerman.te.forkserver.start_timeout"))
+					s.sendall(json.dumps({ 'args': args, 'cwd': cwd }) + '\n')
+					line = s.makefile('r').readline()
+					if not line:
+						raise Exception("connection closed by the TE fork server")
+					reply = json.loads(line)
+				except:
+					s.close()
+					raise
+				if reply.has_key('pid'):
+					return ForkedTe(s, reply['pid'])
+				s.close()
+				if reply.get('error') != 'stale':
+					raise Exception(reply.get('error'))
+				getLogger().info("TE fork server preloaded modules changed, restarting it...")
+				self._stop()
+			raise Exception("unable to get an up-to-date TE fork server")
+		finally:
+			self._unlock()
+
+	def stop(self):
+		self._lock()
+		try:
+			self._stop()
+		finally:
+			self._unlock()
+
+TheTeForkServer = TeForkServer()
+
+def getTeForkServer():
+	"""
+	@rtype: TeForkServer, or None
+	@returns: the TE fork server, or None if disabled.
+	"""
+	if not cm.get("testerman.te.forkserver.enabled"):
+		return None
+	return TheTeForkServer
+
+
 ################################################################################
 # Job subclass: ATS
 ################################################################################
@@ -637,6 +889,8 @@ class AtsJob(Job):
 		self._tePackageDirectory = None
 		
 		self._selectedGroups = None
+		# Core dependencies embedded into the TE egg
+		self._coreDependencies = []
 		
 		# For detailed info
 		self._teInputSession = None
@@ -923,6 +1177,7 @@ self._baseDirectory, self._tePackageDirectory, self._teCommandLine, self._teFile
 		# Now copy the core dependencies
 		# These dependencies depend on the selected language api / adapter module
 		coreDependencies = adapterDependencies
+		self._coreDependencies = coreDependencies
 		
 		for coreDep in coreDependencies:
 			# Let's copy the dependencies
@@ -1138,21 +1393,41 @@ Platform: UNKNOWN
 
 		# Fork and run it
 		try:
-			pid = os.fork()
-			if pid:
-				# Wait for the child to finish
-				self._tePid = pid
-				self.setState(self.STATE_RUNNING)
-				# actual retcode (< 256), killing signal, if any
-				getLogger().info("%s: Waiting for TE to complete (pid %s)..." % (str(self), pid))
-				res = os.waitpid(pid, 0)
-				(retcode, sig) = divmod(res[1], 256)
-				self._tePid = None
+			startTime = time.time()
+			forkedTe = None
+			forkServer = getTeForkServer()
+			if forkServer:
+				try:
+					forkedTe = forkServer.spawn(executable, args[1:], env, tePackageDirectory, self._coreDependencies)
+				except Exception as e:
+					getLogger().warning("%s: unable to use the TE fork server, executing the TE: %s" % (str(self), str(e)))
+			if forkedTe:
+				pid = forkedTe.pid
+				waitTe = forkedTe.wait
 			else:
-				# forked child: exec with the TE once moved to the correct dir
-				os.chdir(tePackageDirectory)
-				os.execve(executable, args, env)
-				# Done with the child.
+				pid = os.fork()
+				if not pid:
+					# forked child: exec with the TE once moved to the correct dir
+					os.chdir(tePackageDirectory)
+					os.execve(executable, args, env)
+					# Done with the child.
+				waitTe = lambda: os.waitpid(pid, 0)[1]
+
+			counters = CounterManager.instance()
+			counters.record("server.ts.jobs.ats.fork.latency", (time.time() - startTime) * 1000.0)
+			counters.inc("server.ts.jobs.ats.running")
+			# Wait for the child to finish
+			self._tePid = pid
+			self.setState(self.STATE_RUNNING)
+			# actual retcode (< 256), killing signal, if any
+			getLogger().info("%s: Waiting for TE to complete (pid %s)..." % (str(self), pid))
+			try:
+				status = waitTe()
+			finally:
+				counters.dec("server.ts.jobs.ats.running")
+				counters.record("server.ts.jobs.ats.duration", (time.time() - startTime) * 1000.0)
+			(retcode, sig) = divmod(status, 256)
+			self._tePid = None
 		except Exception as e:
 			getLogger().error("%s: unable to execute TE: %s" % (str(self), str(e)))
 			self._tePid = None
@@ -1167,6 +1442,9 @@ Platform: UNKNOWN
 
 		# Normal continuation, once the child has returned.
 		getLogger().info("%s: TE completed" % str(self))
+		# The log events received so far are written before the job is seen as completed
+		if not EventManager.instance().flushLogNotifications():
+			getLogger().warning("%s: log events still pending on completion" % str(self))
 		if sig > 0:
 			getLogger().info("%s: TE terminated with signal %d" % (str(self), sig))
 			# In case of a kill, make sure we never return a "OK" retcode
@@ -1748,6 +2026,8 @@ class Scheduler(threading.Thread):
 		for job in jobs:
 			if job.getScheduledStartTime() < time.time():
 				getLogger().info("Scheduler: starting new job: %s" % str(job))
+				# Delay between the expected start time and the actual dispatch
+				CounterManager.instance().record("server.ts.jobs.dispatch.latency", (time.time() - job.getScheduledStartTime()) * 1000.0)
 				# Prepare a new thread, execute the job
 				job.preRun()
 				jobThread = threading.Thread(target = lambda: job.run(job.getScheduledSession()))
@@ -1769,6 +2049,8 @@ class JobManager:
 		self._mutex = threading.RLock()
 		self._jobQueue = []
 		self._scheduler = Scheduler(self)
+		CounterManager.instance().addCounter("server.ts.jobs.submitted").addProperty(CounterManager.RateCounterProperty())
+		CounterManager.instance().addGauge("server.ts.jobs.ats.running").addProperty(CounterManager.MaxCounterProperty())
 	
 	def start(self):
 		self._scheduler.start()
@@ -1857,6 +2139,7 @@ class JobManager:
 		@returns: the submitted job Id
 		"""
 		self.registerJob(job)
+		CounterManager.instance().inc("server.ts.jobs.submitted")
 		# Initialize the job (i.e. prepare it)
 		# Raises exceptions in case of an error
 		try:
@@ -1970,6 +2253,13 @@ class JobManager:
 		else:
 			return None
 
+	def getJobLogChunk(self, id_, offset, maxSize):
+		job = self.getJob(id_)
+		if job:
+			return job.getLogChunk(offset, maxSize)
+		else:
+			return None
+
 	def rescheduleJob(self, id_, at):
 		job = self.getJob(id_)
 		if job:
@@ -2028,4 +2318,5 @@ def finalize():
 		instance().persist()
 	except Exception as e:
 		getLogger().error("Unable to stop the job manager gracefully: %s" % str(e))
+	TheTeForkServer.stop()
 
@@ -18,18 +18,39 @@
 #
 # - package creation in a file system,
 # - package extraction, importation, etc.
+# - content-addressed package importation: only the files whose
+#   content digest changed are transferred (in chunks) and written.
 #
 ##
 
+import ConfigManager
 import FileSystemManager
 
 import logging
 import os
+import re
 import cStringIO as StringIO
 import tarfile
+import tempfile
 import time
 import xml.dom.minidom
 
+try:
+	import hashlib
+	shaclass = hashlib.sha1
+except:
+	import sha
+	shaclass = sha.sha 
+
+
+cm = ConfigManager.instance()
+
+# Files are hashed by parts of this size, in bytes
+DIGEST_CHUNK_SIZE = 1024*1024
+
+# Uncomplete staged files are removed after this delay, in s
+STAGING_MAX_AGE = 24*3600
+
 
 DEFAULT_PACKAGE_DESCRIPTION = """<?xml version="1.0" encoding="utf-8"?>
 <package>
@@ -250,6 +271,327 @@ def importPackageFile(content, path):
 	return True	
 
 
+################################################################################
+# Content-addressed importation
+################################################################################
+
+def _getFileDigest(filename):
+	"""
+	Computes the digest of a docroot file, reading it by parts.
+	
+	@rtype: tuple (integer, string), or None
+	@returns: the file size and its sha1 hex digest, or None if the file does not exist.
+	"""
+	if not FileSystemManager.instance().isfile(filename):
+		return None
+	sha = shaclass()
+	size = 0
+	while True:
+		data = FileSystemManager.instance().readChunk(filename, size, DIGEST_CHUNK_SIZE)
+		if data is None:
+			return None
+		sha.update(data)
+		size += len(data)
+		if len(data) < DIGEST_CHUNK_SIZE:
+			break
+	return (size, sha.hexdigest())
+
+def getPackageManifest(path):
+	"""
+	Lists the files of a package, with their content digests.
+	
+	@type  path: string
+	@param path: the docroot path to the package's root folder
+	
+	@rtype: list of dict{'name': string, 'type': 'dir' or 'file', 'size': integer, 'digest': string}, or None
+	@returns: None if the package was not found, or its files and folders
+	relative to the package root folder (as they would be named in a package file).
+	size and digest (sha1, hex) are provided for files only.
+	"""
+	def _listFolder(relbasepath, docrootbasepath):
+		for entry in FileSystemManager.instance().getdir(docrootbasepath):
+			name, apptype = entry['name'], entry['type']
+			relname = "%s%s" % (relbasepath, name)
+			docrootname = "%s%s" % (docrootbasepath, name)
+			if apptype == FileSystemManager.APPTYPE_DIR:
+				ret.append({ 'name': relname, 'type': 'dir' })
+				_listFolder("%s/" % relname, "%s/" % docrootname)
+			else:
+				digest = _getFileDigest(docrootname)
+				if digest is not None:
+					ret.append({ 'name': relname, 'type': 'file', 'size': digest[0], 'digest': digest[1] })
+
+	if not FileSystemManager.instance().isdir(path):
+		return None
+
+	ret = []
+	if not path.endswith('/'):
+		path = "%s/" % path
+	_listFolder('', path)
+	return ret
+
+def checkPackageManifest(manifest):
+	"""
+	Checks that a package manifest, as returned by getPackageManifest(),
+	describes a correct package, like checkPackageFile() does for a package file.
+	"""
+	names = [ (e['name'], e['type']) for e in manifest ]
+	if not ('package.xml', 'file') in names:
+		raise Exception("Missing package description file (package.xml)")
+	if not ('src', 'dir') in names:
+		raise Exception("Missing source folder (src)")
+	if not ('profiles', 'dir') in names:
+		raise Exception("Missing profiles folder (profiles)")
+	for e in manifest:
+		if e['type'] == 'file' and not re.match(r'^[0-9a-f]{40}$', e['digest']):
+			raise Exception("Invalid digest for %s" % e['name'])
+	return True
+
+def _isImportable(name):
+	"""
+	Only the package's standard files are imported, and never
+	outside the package folder.
+	"""
+	if name.startswith('/') or '..' in name.split('/'):
+		return False
+	return name.startswith('src/') or name.startswith('profiles/') or name in [ 'package.xml', 'src', 'profiles' ]
+
+def _getStagingFilename(digest):
+	"""
+	Staged files are named after their digest, so that
+	a file can be staged once for several imports.
+	"""
+	if not re.match(r'^[0-9a-f]{40}$', digest):
+		raise Exception("Invalid digest (%s)" % digest)
+	varRoot = cm.get("testerman.var_root")
+	if varRoot:
+		stagingDir = os.path.join(varRoot, "package-staging")
+	else:
+		stagingDir = os.path.join(tempfile.gettempdir(), "testerman-package-staging")
+	if not os.path.isdir(stagingDir):
+		os.makedirs(stagingDir)
+	return os.path.join(stagingDir, digest)
+
+def _getStagedSize(digest):
+	try:
+		return os.path.getsize(_getStagingFilename(digest))
+	except OSError:
+		return 0
+
+def _cleanupStaging():
+	stagingDir = os.path.dirname(_getStagingFilename('0' * 40))
+	now = time.time()
+	for entry in os.listdir(stagingDir):
+		filename = os.path.join(stagingDir, entry)
+		try:
+			if os.path.getmtime(filename) < now - STAGING_MAX_AGE:
+				getLogger().info("Removing expired staged file %s" % entry)
+				os.remove(filename)
+		except OSError:
+			pass
+
+def getPackageTransfers(path, manifest):
+	"""
+	Compares a package manifest with the package in path, if any,
+	and returns the files that need to be staged with stagePackageFileChunk()
+	before importing the manifest with importPackageManifest().
+	
+	Files whose content did not change are not returned. Files that are
+	partially staged are returned with the offset to resume their staging from.
+	
+	@type  manifest: list of dict, as returned by getPackageManifest()
+	@param manifest: the files of the package to import
+	
+	@rtype: list of dict{'name': string, 'digest': string, 'offset': integer}
+	@returns: the files to stage, one per digest
+	"""
+	checkPackageManifest(manifest)
+	ret = []
+	digests = set()
+	for e in manifest:
+		if e['type'] != 'file' or not _isImportable(e['name']) or e['digest'] in digests:
+			continue
+		if _getFileDigest("%s/%s" % (path, e['name'])) == (long(e['size']), e['digest']):
+			continue
+		digests.add(e['digest'])
+		offset = _getStagedSize(e['digest'])
+		if offset == long(e['size']):
+			try:
+				_checkStagedFile(e['digest'], offset)
+				# Already staged (or empty)
+				continue
+			except Exception:
+				# Removed, to stage again
+				offset = 0
+		if offset > long(e['size']):
+			offset = 0
+		ret.append({ 'name': e['name'], 'digest': e['digest'], 'offset': offset })
+	getLogger().info("%d files to transfer to import %d entries to %s" % (len(ret), len(manifest), path))
+	return ret
+
+def stagePackageFileChunk(digest, offset, content):
+	"""
+	Stages a part of a file to import with importPackageManifest().
+	
+	@type  digest: string
+	@param digest: the sha1 hex digest of the whole file
+	@type  offset: integer
+	@param offset: the position of this part in the file. 0 restarts the staging.
+	@type  content: buffer string
+	@param content: the part of the file
+	
+	@rtype: integer
+	@returns: the offset of the next part
+	"""
+	filename = _getStagingFilename(digest)
+	if offset == 0:
+		_cleanupStaging()
+		f = open(filename, 'wb')
+	else:
+		stagedSize = _getStagedSize(digest)
+		if stagedSize != offset:
+			raise Exception("Invalid offset for %s: %s bytes staged" % (digest, stagedSize))
+		f = open(filename, 'ab')
+	try:
+		f.write(content)
+	finally:
+		f.close()
+	return offset + len(content)
+
+def _removeInvalidStagedFile(digest):
+	getLogger().info("Removing invalid staged file %s" % digest)
+	try:
+		os.remove(_getStagingFilename(digest))
+	except OSError:
+		pass
+	raise Exception("Invalid staged file %s" % digest)
+
+def _checkStagedFile(digest, size):
+	"""
+	Checks that a file is completely staged, reading it by parts.
+	An invalid staged file is removed, so that it can be staged again.
+	Empty files are never staged.
+	"""
+	if size == 0:
+		return
+	try:
+		f = open(_getStagingFilename(digest), 'rb')
+	except IOError:
+		raise Exception("File %s not staged" % digest)
+	sha = shaclass()
+	stagedSize = 0
+	try:
+		while True:
+			data = f.read(DIGEST_CHUNK_SIZE)
+			if not data:
+				break
+			sha.update(data)
+			stagedSize += len(data)
+	finally:
+		f.close()
+	if stagedSize != size or sha.hexdigest() != digest:
+		_removeInvalidStagedFile(digest)
+
+def _readStagedFile(digest, size):
+	"""
+	Returns the content of a staged file, after checking it.
+	Empty files are never staged.
+	"""
+	if size == 0:
+		return ''
+	try:
+		f = open(_getStagingFilename(digest), 'rb')
+		try:
+			content = f.read()
+		finally:
+			f.close()
+	except IOError:
+		raise Exception("File %s not staged" % digest)
+	if len(content) != size or shaclass(content).hexdigest() != digest:
+		_removeInvalidStagedFile(digest)
+	return content
+
+def importPackageManifest(path, manifest):
+	"""
+	Imports a package to a docroot folder according to its manifest:
+	the files whose content changed are written from the staged files,
+	the others are left untouched.
+	Files that are not in the manifest are not removed.
+	
+	Each changed file is loaded in memory once, to be written to the docroot.
+	All the staged files are checked before writing anything: an invalid one
+	is removed, so that getPackageTransfers() requires it again.
+	
+	Unlike importPackageFile(), the destination path may already exist,
+	so that a package can be updated.
+	
+	@rtype: integer
+	@returns: the number of written files
+	"""
+	try:
+		checkPackageManifest(manifest)
+	except Exception as e:
+		getLogger().info("Invalid package manifest: %s" % e)
+		raise Exception("Invalid package manifest: %s" % e)
+
+	if FileSystemManager.instance().isfile(path):
+		getLogger().info("Cannot import package to %s: not a path to package" % path)
+		raise Exception("Invalid destination package path: is a file")
+
+	entries = []
+	for e in manifest:
+		if _isImportable(e['name']):
+			entries.append(e)
+		else:
+			getLogger().info("Discarding importation of %s" % e['name'])
+
+	# The files whose content changed, checked before writing anything
+	changedFiles = set()
+	for entry in entries:
+		if entry['type'] == 'file' and _getFileDigest("%s/%s" % (path, entry['name'])) != (long(entry['size']), entry['digest']):
+			try:
+				_checkStagedFile(entry['digest'], long(entry['size']))
+			except Exception as e:
+				getLogger().info("Cannot import package to %s: %s" % (path, e))
+				raise
+			changedFiles.add(entry['name'])
+
+	created = not FileSystemManager.instance().isdir(path)
+
+	written = 0
+	digests = set()
+	try:
+		# Minimal package tree
+		FileSystemManager.instance().mkdir("%s/profiles" % path, False)
+		FileSystemManager.instance().mkdir("%s/src" % path, False)
+
+		for e in entries:
+			dst = "%s/%s" % (path, e['name'])
+			if e['type'] == 'dir':
+				FileSystemManager.instance().mkdir(dst, not created)
+				continue
+			if not e['name'] in changedFiles:
+				continue
+			getLogger().info("Importing %s to %s..." % (e['name'], dst))
+			content = _readStagedFile(e['digest'], long(e['size']))
+			# When creating the package, it is notified once complete.
+			FileSystemManager.instance().write(dst, content, notify = not created)
+			digests.add(e['digest'])
+			written += 1
+	finally:
+		if created:
+			FileSystemManager.instance()._notifyDirCreated(path)
+
+	for digest in digests:
+		try:
+			os.remove(_getStagingFilename(digest))
+		except OSError:
+			pass
+
+	getLogger().info("Package imported to %s, %d files written" % (path, written))
+	return written
+
+
 
 if __name__ == '__main__':
 	import sys
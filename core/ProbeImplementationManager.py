@@ -279,10 +279,42 @@ def getLogger():
 
 # Contains the Class (python obj) of the probe implementation, indexed by its probeType (probeId)
 ProbeImplementationClasses = {}
+# Contains the name of the module providing a probe implementation not imported yet, indexed by its probeType
+ProbeImplementationModules = {}
 
 def getProbeImplementationClasses():
 	return ProbeImplementationClasses
 
+def registerProbeImplementationModule(type_, moduleName):
+	"""
+	Declares that probe type type_ is implemented in module moduleName,
+	which is only imported the first time such a probe is needed.
+	"""
+	if not ProbeImplementationClasses.has_key(type_) and not ProbeImplementationModules.has_key(type_):
+		ProbeImplementationModules[type_] = moduleName
+
+def getProbeImplementationClass(type_):
+	"""
+	Returns the probe implementation class for a probe type,
+	importing its module first if needed.
+	
+	@throws ProbeException if the module providing the implementation
+	cannot be imported (for instance a missing optional dependency).
+	
+	@rtype: class, or None
+	@returns: the probe implementation class, or None if the type is unknown.
+	"""
+	if not ProbeImplementationClasses.has_key(type_):
+		moduleName = ProbeImplementationModules.get(type_)
+		if moduleName is None:
+			return None
+		try:
+			__import__(moduleName)
+		except Exception as e:
+			raise ProbeException("Probe type %s is not available: unable to import %s: %s" % (type_, moduleName, str(e)))
+		ProbeImplementationModules.pop(type_, None)
+	return ProbeImplementationClasses.get(type_)
+
 def registerProbeImplementationClass(type_, class_):
 	if ProbeImplementationClasses.has_key(type_):
 		getLogger().warning("Not registering class for probe type %s: already registered" % type_)
@@ -169,6 +169,18 @@ class ProbeManager:
 		agentUri = "agent:%s" % (agentName)
 		return self._proxy.updateAgent(agentUri)
 
+	def getCounters(self, paths = None):
+		"""
+		Returns TACS counter values.
+		
+		@type  paths: list of strings, or None
+		@param paths: the counter paths to retrieve, or None to get all leaf counters and their properties
+		
+		@rtype: dict[string] of numbers
+		@returns: the counter values, indexed by their paths
+		"""
+		return self._proxy.getCounters(paths)
+
 
 TheProbeManager = None
 
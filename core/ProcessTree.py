@@ -0,0 +1 @@
+../common/ProcessTree.py
\ No newline at end of file
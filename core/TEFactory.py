@@ -37,6 +37,7 @@ import StringIO
 import modulefinder
 import imp
 import re
+import threading
 
 
 cm = ConfigManager.instance()
@@ -104,6 +105,139 @@ def smartReindent(code, indentCharacter = '\t', reindentCount = 1):
 
 	return ''.join(ret)
 
+################################################################################
+# TE plugin manifest
+################################################################################
+
+# Registration calls are statically extracted from the plugin sources,
+# so that the server never imports probe or codec modules (and their
+# optional dependencies) itself.
+_CodecRegistrationRe = re.compile(r'''\b(?:registerCodecClass|CodecManager\.alias)\s*\(\s*['"]([^'"]+)['"]''')
+_ProbeRegistrationRe = re.compile(r'''\bregisterProbeImplementationClass\s*\(\s*['"]([^'"]+)['"]''')
+
+# dict[filename] = (mtime, size, (codec names, probe types))
+_PluginFileCache = {}
+_PluginFileCacheMutex = threading.RLock()
+
+def _scanPluginFile(filename):
+	"""
+	Returns the codec names and probe types registered by a plugin source file,
+	reusing the previous analysis if the file did not change.
+	
+	@rtype: tuple (list of strings, list of strings)
+	@returns: (codec names, probe types)
+	"""
+	st = os.stat(filename)
+	_PluginFileCacheMutex.acquire()
+	try:
+		cached = _PluginFileCache.get(filename)
+		if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+			return cached[2]
+	finally:
+		_PluginFileCacheMutex.release()
+
+	codecs = []
+	probes = []
+	f = open(filename, 'r')
+	try:
+		for line in f:
+			if line.lstrip().startswith('#'):
+				continue
+			codecs += _CodecRegistrationRe.findall(line)
+			probes += _ProbeRegistrationRe.findall(line)
+	finally:
+		f.close()
+	registrations = (codecs, probes)
+
+	_PluginFileCacheMutex.acquire()
+	_PluginFileCache[filename] = (st.st_mtime, st.st_size, registrations)
+	_PluginFileCacheMutex.release()
+	return registrations
+
+def _scanPluginModule(path):
+	"""
+	Analyzes a plugin module, i.e. a single python file or a package
+	(in which case all its python files are analyzed).
+	"""
+	if not os.path.isdir(path):
+		return _scanPluginFile(path)
+	codecs = []
+	probes = []
+	for dirpath, dirnames, filenames in os.walk(path):
+		dirnames.sort()
+		for filename in sorted(filenames):
+			if filename.endswith('.py'):
+				(c, p) = _scanPluginFile(os.path.join(dirpath, filename))
+				codecs += c
+				probes += p
+	return (codecs, probes)
+
+def buildPluginManifest(probePaths, codecPaths):
+	"""
+	Builds the plugin manifest embedded into the TEs, enabling them to import
+	probe and codec modules on first use only, instead of importing all of them
+	on startup.
+	
+	The modules are discovered the same way the TE would scan its plugin paths.
+	Modules for which no registration could be found statically (helpers,
+	dynamic registrations, ...) are flagged to be imported on TE startup.
+	Unit test modules (test_*.py) are ignored.
+	
+	@type  probePaths: list of strings
+	@param probePaths: the probe plugin paths
+	@type  codecPaths: list of strings
+	@param codecPaths: the codec plugin paths
+	
+	@rtype: dict
+	@returns: a dict containing:
+	  'probes': dict[probe type] = module name,
+	  'codecs': dict[codec name or alias] = module name,
+	  'eager': list of module names to import on startup
+	"""
+	manifest = { 'probes': {}, 'codecs': {}, 'eager': [] }
+	for path in (probePaths or []) + (codecPaths or []):
+		try:
+			entries = sorted(os.listdir(path))
+		except Exception as e:
+			getLogger().warning("Unable to scan plugin path %s: %s" % (path, str(e)))
+			continue
+		for m in entries:
+			filename = path + '/' + m
+			if m.startswith('.') or m.startswith('__init__') or m.startswith('test_') or not (os.path.isdir(filename) or m.endswith('.py')):
+				continue
+			if m.endswith('.py'):
+				m = m[:-3]
+			try:
+				(codecs, probes) = _scanPluginModule(filename)
+			except Exception as e:
+				getLogger().warning("Unable to analyze plugin %s: %s" % (filename, str(e)))
+				codecs, probes = [], []
+			if not codecs and not probes:
+				if not m in manifest['eager']:
+					manifest['eager'].append(m)
+				continue
+			# Same precedence as the registrations: the first one wins
+			for name in codecs:
+				manifest['codecs'].setdefault(name, m)
+			for type_ in probes:
+				manifest['probes'].setdefault(type_, m)
+	return manifest
+
+def getPluginManifest():
+	"""
+	Returns the plugin manifest for the currently configured plugin paths.
+	Only the plugin files that changed since the previous call are analyzed again.
+	"""
+	return buildPluginManifest(cm.get("testerman.te.probe_paths"), cm.get("testerman.te.codec_paths"))
+
+def initialize():
+	"""
+	Generates the initial plugin manifest on server start.
+	"""
+	manifest = getPluginManifest()
+	getLogger().info("Plugin manifest: %d probe types, %d codecs, %d modules loaded on TE startup" % (len(manifest['probes']), len(manifest['codecs']), len(manifest['eager'])))
+
+
 def createTestExecutable(name, ats, atsDirInTePackage):
 	"""
 	Creates a complete, command-line parameterized TE from a source ATS.
@@ -124,9 +258,11 @@ def createTestExecutable(name, ats, atsDirInTePackage):
 	ilPort = cm.get("interface.il.port")
 	ilIp = cm.get("interface.il.ip")
 	maxLogPayloadSize = cm.get("testerman.te.log.max_payload_size")
+	logEncoding = cm.get("testerman.te.log.encoding")
 	
 	codecPaths = cm.get("testerman.te.codec_paths")
 	probePaths = cm.get("testerman.te.probe_paths")
+	pluginManifest = buildPluginManifest(probePaths, codecPaths)
 	
 	metadata = getMetadata(ats)
 	
@@ -168,7 +304,9 @@ def createTestExecutable(name, ats, atsDirInTePackage):
 		il_ip = ilIp, il_port = ilPort, 
 		tacs_ip = tacsIp, tacs_port = tacsPort,
     max_log_payload_size = maxLogPayloadSize, 
+		log_encoding = logEncoding,
 		probe_paths = probePaths, codec_paths = codecPaths,
+		plugin_manifest = pluginManifest,
 		adapter_module_name = adapterModuleName, 
 		metadata = metadata.toDict(),
 		source_ats = smartReindent(ats),
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# TE fork server.
+#
+# Started by the Testerman Server with the TE interpreter and environment,
+# this process imports the TE core runtime (from the server root, i.e. the
+# files that are copied into the TE eggs) and the probe/codec plugins once,
+# then forks a process for each TE to run. The forked TE executes its egg
+# in this warm, copy-on-write interpreter instead of starting and
+# initializing a new one.
+#
+# This script only depends on the standard library, and is run by the
+# TE interpreter, not by the server.
+#
+# Protocol, over a local stream socket, one JSON object per line:
+# - the server sends { "args": [ egg, option, ... ], "cwd": path }
+# - the fork server replies { "pid": pid } once the TE is forked,
+#   then { "status": status } when it terminates (os.waitpid() encoding),
+#   or { "error": description } if the TE could not be forked.
+#   The "stale" error means that a preloaded module has changed on disk:
+#   the fork server exits and should be restarted.
+#
+# The fork server exits when its standard input is closed,
+# i.e. when the server stops or dies.
+##
+
+import errno
+import fcntl
+import imp
+import json
+import optparse
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import zipimport
+
+
+def log(txt):
+	sys.stderr.write("TEForkServer[%s]: %s\n" % (os.getpid(), txt))
+	sys.stderr.flush()
+
+def getModuleSourceFilename(module):
+	filename = getattr(module, '__file__', None)
+	if not filename:
+		return None
+	if filename.endswith('.pyc') or filename.endswith('.pyo'):
+		filename = filename[:-1]
+	return filename
+
+class ForkServer:
+	def __init__(self, socketFilename):
+		self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self._socket.bind(socketFilename)
+		self._socket.listen(16)
+		# Self-pipe, written on SIGCHLD to wake up the select loop
+		self._wakeupPipe = os.pipe()
+		fcntl.fcntl(self._wakeupPipe[1], fcntl.F_SETFL, os.O_NONBLOCK)
+		# dict[connection] = buffered input
+		self._connections = {}
+		# dict[pid] = connection to notify on termination
+		self._children = {}
+		# list of (filename, mtime) for the preloaded modules
+		self._preloadedFiles = []
+
+	def preload(self, modules, pluginPaths, preloadPlugins, corePath = None):
+		before = set(sys.modules.keys())
+		# Only used while preloading: the TEs import the other modules from their egg
+		if corePath:
+			sys.path.insert(0, corePath)
+		for path in pluginPaths:
+			if not path in sys.path:
+				sys.path.append(path)
+		for m in modules:
+			try:
+				__import__(m)
+			except Exception as e:
+				log("unable to preload module %s: %s" % (m, str(e)))
+		if preloadPlugins:
+			for path in pluginPaths:
+				try:
+					entries = os.listdir(path)
+				except Exception as e:
+					log("unable to scan plugin path %s: %s" % (path, str(e)))
+					continue
+				for m in entries:
+					if m.startswith('.') or m.startswith('__init__') or m.startswith('test_') or not (os.path.isdir(path + '/' + m) or m.endswith('.py')):
+						continue
+					if m.endswith('.py'):
+						m = m[:-3]
+					try:
+						__import__(m)
+					except Exception as e:
+						# Missing optional dependencies: the TE will report them on use
+						log("not preloading plugin %s: %s" % (m, str(e)))
+		if corePath:
+			sys.path.remove(corePath)
+
+		for name in set(sys.modules.keys()) - before:
+			filename = getModuleSourceFilename(sys.modules[name])
+			if filename:
+				try:
+					self._preloadedFiles.append((filename, os.stat(filename).st_mtime))
+				except OSError:
+					pass
+		log("%d modules preloaded" % len(self._preloadedFiles))
+
+	def _isStale(self):
+		for filename, mtime in self._preloadedFiles:
+			try:
+				if os.stat(filename).st_mtime != mtime:
+					return True
+			except OSError:
+				return True
+		return False
+
+	def _onSigChld(self, sig, frame):
+		try:
+			os.write(self._wakeupPipe[1], 'x')
+		except OSError:
+			pass
+
+	def _send(self, connection, message):
+		try:
+			connection.sendall(json.dumps(message) + '\n')
+		except Exception as e:
+			log("unable to notify the server: %s" % str(e))
+
+	def _reapChildren(self):
+		while True:
+			try:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+			except OSError as e:
+				if e.errno == errno.EINTR:
+					continue
+				return
+			if not pid:
+				return
+			connection = self._children.pop(pid, None)
+			if connection:
+				self._send(connection, { 'status': status })
+
+	def _closeConnection(self, connection):
+		del self._connections[connection]
+		for pid, c in self._children.items():
+			if c is connection:
+				# The TE keeps running, but nobody waits for it anymore
+				del self._children[pid]
+		connection.close()
+
+	def _fork(self, connection, request):
+		"""
+		@rtype: dict, or None
+		@returns: the request in the forked child, None in the fork server.
+		"""
+		sys.stdout.flush()
+		sys.stderr.flush()
+		try:
+			pid = os.fork()
+		except OSError as e:
+			self._send(connection, { 'error': 'unable to fork: %s' % str(e) })
+			return None
+
+		if pid:
+			self._children[pid] = connection
+			self._send(connection, { 'pid': pid })
+			return None
+
+		# Forked TE: get rid of the fork server context
+		signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+		signal.signal(signal.SIGINT, signal.default_int_handler)
+		signal.signal(signal.SIGTERM, signal.SIG_DFL)
+		self._socket.close()
+		for c in self._connections.keys():
+			c.close()
+		os.close(self._wakeupPipe[0])
+		os.close(self._wakeupPipe[1])
+		# The fork server stdin is its control pipe
+		devnull = os.open(os.devnull, os.O_RDONLY)
+		os.dup2(devnull, 0)
+		os.close(devnull)
+		# Do not share the random state with the other TEs
+		random.seed()
+		return request
+
+	def serve(self):
+		"""
+		Main loop.
+
+		@rtype: dict, or None
+		@returns: None when the fork server should exit,
+		or the request to execute when returning in a forked TE.
+		"""
+		signal.signal(signal.SIGCHLD, self._onSigChld)
+		while True:
+			rlist = [ 0, self._socket, self._wakeupPipe[0] ] + self._connections.keys()
+			try:
+				r, w, e = select.select(rlist, [], [])
+			except select.error as e:
+				if e.args[0] == errno.EINTR:
+					continue
+				raise
+
+			for s in r:
+				if s == 0:
+					if not os.read(0, 1024):
+						return None
+
+				elif s is self._socket:
+					connection, address = self._socket.accept()
+					self._connections[connection] = ''
+
+				elif s == self._wakeupPipe[0]:
+					os.read(self._wakeupPipe[0], 1024)
+					self._reapChildren()
+
+				elif s in self._connections:
+					try:
+						data = s.recv(4096)
+					except socket.error:
+						data = None
+					if not data:
+						self._closeConnection(s)
+						continue
+					buf = self._connections[s] + data
+					while '\n' in buf:
+						line, buf = buf.split('\n', 1)
+						try:
+							request = json.loads(line)
+						except Exception as e:
+							self._send(s, { 'error': 'invalid request: %s' % str(e) })
+							continue
+						if self._isStale():
+							self._send(s, { 'error': 'stale' })
+							return None
+						if self._fork(s, request) is not None:
+							return request
+					self._connections[s] = buf
+
+def runTe(request):
+	"""
+	Executes the TE egg as the __main__ module, just like
+	python <egg> <options> would, in the current (forked) process.
+	"""
+	args = [ str(x) for x in request['args'] ]
+	egg = args[0]
+	os.chdir(request['cwd'])
+	sys.argv = args
+	sys.path.insert(0, egg)
+	importer = zipimport.zipimporter(egg)
+	code = importer.get_code('__main__')
+	main = imp.new_module('__main__')
+	main.__file__ = os.path.join(egg, '__main__.py')
+	main.__loader__ = importer
+	main.__builtins__ = __builtins__
+	# Keep the fork server module alive (and its globals valid) once replaced
+	sys.modules['TEForkServer'] = sys.modules['__main__']
+	sys.modules['__main__'] = main
+	exec code in main.__dict__
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--socket", dest = "socketFilename", metavar = "FILE", help = "listen for TE requests on the local socket FILE")
+	parser.add_option("--core-path", dest = "corePath", metavar = "PATH", help = "the path to the TE core modules to preload", default = None)
+	parser.add_option("--preload", dest = "modules", metavar = "MODULE[,MODULE]", help = "TE core modules to preload", default = "")
+	parser.add_option("--plugin-paths", dest = "pluginPaths", metavar = "PATH[,PATH]", help = "probe and codec plugins paths", default = "")
+	parser.add_option("--preload-plugins", dest = "preloadPlugins", action = "store_true", help = "preload the plugins found in the plugin paths", default = False)
+	(options, args) = parser.parse_args()
+
+	# Do not let the server directory (added as the script directory) shadow the TE modules
+	if sys.path and os.path.abspath(sys.path[0] or '.') == os.path.dirname(os.path.abspath(__file__)):
+		del sys.path[0]
+	# Terminal interrupts are for the server, which will close our stdin
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	server = ForkServer(options.socketFilename)
+	server.preload(filter(None, options.modules.split(',')), filter(None, options.pluginPaths.split(',')), options.preloadPlugins, options.corePath)
+	return server.serve()
+
+
+if __name__ == '__main__':
+	request = main()
+	if request is not None:
+		runTe(request)
@@ -362,8 +362,23 @@ class IaClient(Nodes.ConnectingNode):
 			return None
 
 	def getCounter(self, path):
-		return 0
-	#...
+		counters = self.getCounters([ path ])
+		if counters:
+			return counters.get(path)
+		return None
+
+	def getCounters(self, paths = None):
+		"""
+		Gets counter values from the TACS.
+		If paths is None, gets all leaf counters with their properties.
+		"""
+		request = Messages.Request("GET-COUNTERS", "system:tacs", "Ia", "1.0")
+		request.setApplicationBody(paths)
+		response = self.executeRequest(0, request)
+		if response and response.getStatusCode() == 200:
+			return response.getApplicationBody()
+		else:
+			return None
 
 
 class DisabledIaClient:
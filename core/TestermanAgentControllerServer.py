@@ -314,6 +314,7 @@ class IaServer(Nodes.ListeningNode):
 	 R GET-AGENTS
 	 R GET-PROBE
 	 R GET-VARIABLES
+	 R GET-COUNTERS
 
 	TE -> Probe via TACS:
 	 R TRI-SEND
@@ -345,6 +346,7 @@ class IaServer(Nodes.ListeningNode):
 	
 	def onRequest(self, channel, transactionId, request):
 		self.getLogger().debug("New request received:\n%s" % str(request))
+		startTime = time.time()
 		try:
 			method = request.getMethod()
 
@@ -391,6 +393,16 @@ class IaServer(Nodes.ListeningNode):
 				resp = Messages.Response(200, "OK")
 				resp.setApplicationBody(variables)
 				self.sendResponse(channel, transactionId, resp)
+			elif method == "GET-COUNTERS":
+				paths = request.getApplicationBody()
+				cm = CounterManager.instance()
+				if paths is None:
+					counters = cm.getAllLeafPropertyValues()
+				else:
+					counters = dict([ (path, cm.get(path)) for path in paths ])
+				resp = Messages.Response(200, "OK")
+				resp.setApplicationBody(counters)
+				self.sendResponse(channel, transactionId, resp)
 			elif method == "GET-PROBE":
 				probeUri = request.getHeader('Probe-Uri')
 				info = self._controller.getProbeInfo(probeUri)
@@ -448,6 +460,9 @@ class IaServer(Nodes.ListeningNode):
 			resp = Messages.Response(501, "Internal server error")
 			resp.setBody(str(e) + "\n" + Nodes.getBacktrace())
 			self.sendResponse(channel, transactionId, resp)
+
+		# Routing time, including the probe/agent round trip for forwarded requests
+		CounterManager.instance().record("server.tacs.ia.requests.%s" % request.getMethod().lower(), (time.time() - startTime) * 1000.0)
 	
 	def onNotification(self, channel, notification):
 		self.getLogger().debug("New notification received:\n%s" % str(notification))
@@ -512,6 +527,9 @@ class Controller(object):
 		# The subscription mapping is a list of Ia channels per uri (probe:<id>, system:probes, ...).
 		self._subscriptions = {}
 		self._iaClients = []
+
+		CounterManager.instance().addCounter("server.tacs.probes.enqueued").addProperty(CounterManager.RateCounterProperty())
+		CounterManager.instance().addCounter("server.tacs.probes.logs").addProperty(CounterManager.RateCounterProperty())
 	
 	def getLogger(self):
 		return logging.getLogger('TACS.Controller')
@@ -997,12 +1015,14 @@ class Controller(object):
 		"""
 		Forward from Xa to Ia (to probe's subscribers)
 		"""
+		CounterManager.instance().inc("server.tacs.probes.enqueued")
 		self._dispatchNotification(notification)
 	
 	def onLog(self, channel, notification):
 		"""
 		Forward to subscribers for the probe
 		"""
+		CounterManager.instance().inc("server.tacs.probes.logs")
 		self._dispatchNotification(notification)
 
 
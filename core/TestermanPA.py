@@ -23,14 +23,13 @@
 ##
 
 
+import ProcessTree
 import TestermanTCI
 import TestermanTTCN3 as Testerman
 
 import threading
 import signal
 import os
-import re
-import glob
 import time
 
 
@@ -136,56 +135,11 @@ def triReadTimer(timerId):
 
 def getChildrenPids(pid, includeParent = False):
 	"""
-	Convenience function: retrieves all the children pids for a pid, including the pid itself.
+	Convenience function: retrieves all the children pids for a pid, including the pid itself
+	if includeParent is set.
 	Returns them at a list.
 	"""
-
-	pids = [] # a list of current (pid, ppid)
-	# Let's scan /proc/...
-	# No other way to do it ?
-	statusFilenames = glob.glob("/proc/[0-9]*/status")
-	for filename in statusFilenames:
-		try:
-			pid_ = None
-			ppid_ = None
-			f = open(filename)
-			lines = f.readlines()
-			f.close()
-			for line in lines:
-				if not pid_:
-					m = re.match(r'Pid:\s+(.*)', line)
-					if m:
-						pid_ = int(m.group(1))
-				elif not ppid_:
-					m = re.match(r'PPid:\s+(.*)', line)
-					if m:
-						ppid_ = int(m.group(1))
-				elif ppid_ and pid_:
-					break
-			if pid_ and ppid_:
-				pids.append( (pid_, ppid_) )
-		except:
-			pass
-	
-#	print ("DEBUG: list of current process ids: " + str(pids))
-	
-	# Now let's construct the tree for the looked up pid
-	if includeParent:
-		ret = [ pid ]
-	else:
-		ret = []
-
-	ppids = [ pid ]
-	
-	while ppids:
-		currentPpid = ppids.pop()
-		for (pid_, ppid_) in pids:
-			if ppid_ == currentPpid:
-				if pid_ not in ppids: ppids.append(pid_)
-				if pid_ not in ret: ret.append(pid_)
-	
-#	print ("DEBUG: global list of children: " + str(ret))
-	return ret
+	return ProcessTree.getChildrenPids(pid, includeParent)
 
 def killChildren():
 	"""
@@ -193,12 +147,8 @@ def killChildren():
 	Useful to make sure, at the end of a TE, that no subprocesses remain
 	(may be created by some local probes).
 	"""
-	for pid in getChildrenPids(os.getpid(), includeParent = False):
-		try:
-			print ("DEBUG: %d killing %d..." % (os.getpid(), pid))
-			os.kill(pid, signal.SIGKILL)
-		except:
-			pass
+	for pid in ProcessTree.killProcessTree(os.getpid(), signal.SIGKILL, includeParent = False):
+		print ("DEBUG: %d killed %d" % (os.getpid(), pid))
 	
 
 ################################################################################
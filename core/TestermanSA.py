@@ -665,9 +665,9 @@ def createProbe(uri, type_, transient = False):
 	else:
 		# We're looking for a local probe only.
 		# Search for an implementation in local plugin space
-		if ProbeImplementationManager.getProbeImplementationClasses().has_key(type_):
-			probeImplementation = ProbeImplementationManager.getProbeImplementationClasses()[type_]()
-			adapter = LocalProbeAdapter(probeImplementation)
+		probeImplementationClass = ProbeImplementationManager.getProbeImplementationClass(type_)
+		if probeImplementationClass:
+			adapter = LocalProbeAdapter(probeImplementationClass())
 
 	if adapter:
 		# May raise an exception if the attachment is not feasible (Stubs and remote probes)
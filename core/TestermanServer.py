@@ -24,6 +24,7 @@ import EventManager
 import FileSystemManager
 import JobManager
 import ProbeManager
+import TEFactory
 import Tools
 import Versions
 import WebServices
@@ -319,6 +320,8 @@ def main():
 	cm.register("testerman.webclient.document_root", "%s/webclient" % testerman_home, xform = expandPath, dynamic = False)
 	cm.register("testerman.administrator.name", "administrator", dynamic = True)
 	cm.register("testerman.administrator.email", "testerman-admin@localhost", dynamic = True)
+	cm.register("testerman.fs.cache.max_entries", 10000) # directory listings and file attributes cached by the file system manager (0 to disable)
+	cm.register("testerman.ws.max_chunk_size", 1024*1024, dynamic = True) # max size of the file and log chunks returned to the clients following them, in bytes
 	# testerman.te.*: test executable-related variables
 	cm.register("testerman.te.codec_paths", "%s/plugins/codecs" % testerman_home, xform = splitPaths)
 	cm.register("testerman.te.probe_paths", "%s/plugins/probes" % testerman_home, xform = splitPaths)
@@ -326,6 +329,11 @@ def main():
 	cm.register("testerman.te.python.ttcn3module", "TestermanTTCN3", dynamic = True) # TTCN3 adaptation lib (enable the easy use of previous versions to keep script compatibility)
 	cm.register("testerman.te.python.additional_pythonpath", "", dynamic = True) # Additional search paths for system-wide modules (non-userland/in repository)
 	cm.register("testerman.te.log.max_payload_size", 64*1024, dynamic = True) # the maximum dumpable payload in log (as a single value). Bigger payloads are truncated to this size, in bytes.
+	cm.register("testerman.te.log.encoding", "binary", dynamic = True) # encoding of the log events sent by the TEs: 'binary' (converted to XML by the server) or 'xml'
+	cm.register("testerman.te.forkserver.enabled", True, dynamic = True) # fork TEs from a warm interpreter instead of executing a new one
+	cm.register("testerman.te.forkserver.preload", "TestermanTCI,TestermanSA,TestermanPA,CodecManager,ProbeImplementationManager", dynamic = True) # TE core modules preloaded by the fork server, in addition to testerman.te.python.ttcn3module
+	cm.register("testerman.te.forkserver.preload_plugins", True, dynamic = True) # also preload the probe and codec plugins
+	cm.register("testerman.te.forkserver.start_timeout", 30.0, dynamic = True) # max time to wait for the fork server to be ready, in s
 	cm.register("ts.webui.theme", "default", dynamic = True)
 	cm.register("wcs.webui.theme", "default", dynamic = True)
 
@@ -494,6 +502,7 @@ def main():
 	try:
 		serverThread = XmlRpcServerThread() # Ws server
 		FileSystemManager.initialize()
+		TEFactory.initialize() # TE plugin manifest
 		EventManager.initialize() # Xc server, Ih server [TSE:CH], Il server [TSE:TL]
 		ProbeManager.initialize() # Ia client
 		JobManager.initialize() # Job scheduler
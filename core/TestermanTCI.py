@@ -49,6 +49,7 @@ import TestermanNodes as Nodes
 
 import base64
 import cgi
+import struct
 import sys
 import time
 import threading
@@ -61,6 +62,12 @@ import StringIO
 # through initialize()
 TheIlClient = None
 MaxLogPayloadSize = 65535
+# Log events encoding on the TE to server (Il) path: 'xml', or 'binary'
+LogEncoding = 'xml'
+
+# Binary log events: Content-Type, and format version
+LogEventContentType = "application/x-testerman-log-event"
+LogEventFormatVersion = 2
 
 
 ################################################################################
@@ -83,11 +90,12 @@ def getBacktrace():
 ################################################################################
 
 class IlClient(Nodes.ConnectingNode):
-	def __init__(self, jobId, serverAddress, localAddress = ('', 0), logFilename = None):
+	def __init__(self, jobId, serverAddress, localAddress = ('', 0), logFilename = None, encoding = 'xml'):
 		Nodes.ConnectingNode.__init__(self, "TE job:%s" % str(jobId), "TestermanTCI/IlClient")
 		
 		self.logFilename = logFilename
 		self.jobId = jobId
+		self.encoding = encoding
 		
 		self.localAddress = localAddress
 		self.initialize(serverAddress, self.localAddress)
@@ -96,20 +104,35 @@ class IlClient(Nodes.ConnectingNode):
 		"""
 		Creates a notification and send it to the EventManager/TL, through the Il interface.
 		"""
+		self._sendLogNotification(logClass, xml.encode('utf-8'), "application/xml", "utf-8")
+
+	def sendLogEvent(self, logClass, event):
+		"""
+		Sends a log event, encoded according to the client encoding.
+		The server converts binary events to XML.
+		"""
+		if self.encoding == 'binary':
+			# Base64: the Il transport does not support \x00 in messages
+			self._sendLogNotification(logClass, base64.encodestring(encodeLogEvent(event)), LogEventContentType, "base64")
+		else:
+			self.sendLogNotification(logClass, logEventToXml(event))
+
+	def _sendLogNotification(self, logClass, body, contentType, contentEncoding = None):
 		try:	
 			notification = Messages.Notification("LOG", "job:%s" % self.jobId, "Il", "1.0")
 			if self.logFilename:
 				notification.setHeader("Log-Filename", self.logFilename)
 			notification.setHeader("Log-Class", logClass)
 			notification.setHeader("Log-Timestamp", time.time())
-			notification.setHeader("Content-Encoding", "utf-8")
-			notification.setHeader("Content-Type", "application/xml")
-			notification.setBody(xml.encode('utf-8'))
+			if contentEncoding:
+				notification.setHeader("Content-Encoding", contentEncoding)
+			notification.setHeader("Content-Type", contentType)
+			notification.setBody(body)
 
 			self.sendNotification(0, notification)
 		except Exception:
 			# Logging fallback to stderr
-			print ("WARNING: unable to send LOG notification: " + getBacktrace(), file=sys.stdout)
+			sys.stderr.write("WARNING: unable to send LOG notification: %s\n" % getBacktrace())
 
 ##################################################################################
 # A fake Il Client that write logs locally instead of sending log notifications
@@ -140,18 +163,27 @@ class LocalIlClient:
 				pass
 		self.mutex.release()
 
-def initialize(logFilename, ilServerAddress = None, jobId = None, maxPayloadSize = 65535):
+	def sendLogEvent(self, logClass, event):
+		self.sendLogNotification(logClass, logEventToXml(event))
+
+def initialize(logFilename, ilServerAddress = None, jobId = None, maxPayloadSize = 65535, logEncoding = 'xml'):
 	"""
 	Sets module variables, starts connecting the IlClient to the TL subsystem
 	or initializes the logger for local logging only
+	
+	@type  logEncoding: string
+	@param logEncoding: 'xml' or 'binary', the encoding of the log events sent to the TL subsystem.
+	Local logs are always written in XML.
 	"""
 	global TheIlClient
 	global MaxLogPayloadSize
+	global LogEncoding
 
 	MaxLogPayloadSize = maxPayloadSize
+	LogEncoding = logEncoding
 
 	if ilServerAddress and jobId:
-		TheIlClient = IlClient(jobId, serverAddress = ilServerAddress, logFilename = logFilename)
+		TheIlClient = IlClient(jobId, serverAddress = ilServerAddress, logFilename = logFilename, encoding = logEncoding)
 		TheIlClient.start()
 	else:
 		TheIlClient = LocalIlClient(logFilename)
@@ -211,69 +243,69 @@ def toXml(element, attributes, value = ''):
 	return u'<%s %s>%s</%s>' % (element, u" ".join(map(lambda e: u'%s="%s"' % (e[0], str(e[1])), attributes.items())), value, element)
 
 def logAtsStarted(id_):
-	tliLog('core', toXml('ats-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }))
+	tliLogEvent('core', 'ats-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_ })
 
 def logAtsStopped(id_, result, message = ''):
-	tliLog('core', toXml('ats-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'result': str(result) }, cgi.escape(message)))
+	tliLogEvent('core', 'ats-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'result': str(result) }, ('t', message))
 
 def logUser(message, tc = None):
 	if tc is None:
-		tliLog('user', toXml('user', { 'class': 'user', 'timestamp': time.time() }, cgi.escape(message)))
+		tliLogEvent('user', 'user', { 'class': 'user', 'timestamp': time.time() }, ('t', message))
 	else:
-		tliLog('user', toXml('user', { 'class': 'user', 'timestamp': time.time(), 'tc': tc }, cgi.escape(message)))
+		tliLogEvent('user', 'user', { 'class': 'user', 'timestamp': time.time(), 'tc': tc }, ('t', message))
 
 def logInternal(message):
-	tliLog('internal', toXml('internal', { 'class': 'internal', 'timestamp': time.time() }, cgi.escape(message)))
+	tliLogEvent('internal', 'internal', { 'class': 'internal', 'timestamp': time.time() }, ('t', message))
 	
 def logMessageSent(fromTc, fromPort, toTc, toPort, message, address = None):
 	if not address:
 		address = ''
 	try:
-		tliLog('event', toXml('message-sent', { 'class': 'event', 'timestamp': time.time(), 'from-tc': fromTc, 'from-port': fromPort, 'to-tc': toTc, 'to-port': toPort }, '%s%s' % (testermanToXml(message, 'message'), testermanToXml(address, 'address'))))
+		tliLogEvent('event', 'message-sent', { 'class': 'event', 'timestamp': time.time(), 'from-tc': fromTc, 'from-port': fromPort, 'to-tc': toTc, 'to-port': toPort }, ('v', [ ('message', message), ('address', address) ]))
 	except Exception as e:
 		ret = getBacktrace()
 		logUser(unicode(e) + u'\n' + unicode(ret))
 
 def logTestcaseCreated(id_, role):
-	tliLog('core', toXml('testcase-created', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'role': role }))
+	tliLogEvent('core', 'testcase-created', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'role': role })
 
 def logTestcaseStarted(id_, title):
-	tliLog('core', toXml('testcase-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }, cgi.escape(title)))
+	tliLogEvent('core', 'testcase-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }, ('t', title))
 
 def logTestcaseStopped(id_, verdict, description):
-	tliLog('core', toXml('testcase-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'verdict': verdict }, u"<![CDATA[%s]]>" % description))
+	tliLogEvent('core', 'testcase-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'verdict': verdict }, ('c', description))
 
 def logTimerStarted(id_, tc, duration):
-	tliLog('event', toXml('timer-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'duration': str(duration), 'tc': tc }))
+	tliLogEvent('event', 'timer-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'duration': str(duration), 'tc': tc })
 
 def logTimerStopped(id_, tc, runningTime):
-	tliLog('event', toXml('timer-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'running-time': str(runningTime), 'tc': tc }))
+	tliLogEvent('event', 'timer-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'running-time': str(runningTime), 'tc': tc })
 
 def logTimerExpiry(id_, tc):
-	tliLog('event', toXml('timer-expiry', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'tc': tc }))
+	tliLogEvent('event', 'timer-expiry', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'tc': tc })
 
 def logTestComponentCreated(id_):
-	tliLog('event', toXml('tc-created', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }))
+	tliLogEvent('event', 'tc-created', { 'class': 'event', 'timestamp': time.time(), 'id': id_ })
 
 def logTestComponentStarted(id_, behaviour):
-	tliLog('event', toXml('tc-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'behaviour': behaviour }))
+	tliLogEvent('event', 'tc-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'behaviour': behaviour })
 
 def logTestComponentStopped(id_, verdict, message = ''):
-	tliLog('event', toXml('tc-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'verdict': verdict }, cgi.escape(message)))
+	tliLogEvent('event', 'tc-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'verdict': verdict }, ('t', message))
 
 def logTestComponentKilled(id_, message = ''):
-	tliLog('event', toXml('tc-killed', { 'class': 'event', 'timestamp': time.time(), 'id': id_, }, cgi.escape(message)))
+	tliLogEvent('event', 'tc-killed', { 'class': 'event', 'timestamp': time.time(), 'id': id_, }, ('t', message))
 
 def logVerdictUpdated(tc, verdict):
-	tliLog('event', toXml('verdict-updated', { 'class': 'event', 'timestamp': time.time(), 'tc': tc, 'verdict': verdict }))
+	tliLogEvent('event', 'verdict-updated', { 'class': 'event', 'timestamp': time.time(), 'tc': tc, 'verdict': verdict })
 
 def logTemplateMatch(tc, port, message, template, encodedMessage = None):
 	try:
 		# Should we call a tliMatch/tliMisMatch ?
 		if encodedMessage:
-			tliLog('match', toXml('template-match', { 'class': 'event', 'timestamp': time.time(), 'tc': tc, 'port': port }, '%s%s%s' % (testermanToXml(message, 'message'), testermanToXml(template, 'template'), testermanToXml(encodedMessage, 'encoded-message'))))
+			tliLogEvent('match', 'template-match', { 'class': 'event', 'timestamp': time.time(), 'tc': tc, 'port': port }, ('v', [ ('message', message), ('template', template), ('encoded-message', encodedMessage) ]))
 		else:
-			tliLog('match', toXml('template-match', { 'class': 'event', 'timestamp': time.time(), 'tc': tc, 'port': port }, '%s%s' % (testermanToXml(message, 'message'), testermanToXml(template, 'template'))))
+			tliLogEvent('match', 'template-match', { 'class': 'event', 'timestamp': time.time(), 'tc': tc, 'port': port }, ('v', [ ('message', message), ('template', template) ]))
 	except Exception as e:
 		ret = getBacktrace()
 		logUser(unicode(e) + u'\n' + unicode(ret))
@@ -285,44 +317,289 @@ def logTemplateMismatch(tc, port, message, template, encodedMessage = None, mism
 	try:
 		# Should we call a tliMatch/tliMisMatch ?
 		if encodedMessage:
-			tliLog('mismatch', toXml('template-mismatch', attributes, '%s%s%s' % (testermanToXml(message, 'message'), testermanToXml(template, 'template'), testermanToXml(encodedMessage, 'encoded-message'))))
+			tliLogEvent('mismatch', 'template-mismatch', attributes, ('v', [ ('message', message), ('template', template), ('encoded-message', encodedMessage) ]))
 		else:
-			tliLog('mismatch', toXml('template-mismatch', attributes, '%s%s' % (testermanToXml(message, 'message'), testermanToXml(template, 'template'))))
+			tliLogEvent('mismatch', 'template-mismatch', attributes, ('v', [ ('message', message), ('template', template) ]))
 	except Exception as e:
 		ret = getBacktrace()
 		logUser(unicode(e) + u'\n' + unicode(ret))
 
 def logTimeoutBranchSelected(id_):
 	# in a alt, we selected a timer.TIMEOUT where the timer's id is id_
-	tliLog('match', toXml('timeout-branch', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }))
+	tliLogEvent('match', 'timeout-branch', { 'class': 'event', 'timestamp': time.time(), 'id': id_ })
 
 def logDoneBranchSelected(id_):
 	# in a alt, we selected a tc.DONE where the tc's id is id_
-	tliLog('match', toXml('done-branch', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }))
+	tliLogEvent('match', 'done-branch', { 'class': 'event', 'timestamp': time.time(), 'id': id_ })
 
 def logKilledBranchSelected(id_):
 	# in a alt, we selected a tc.KILLED where the tc's id is id_
-	tliLog('match', toXml('killed-branch', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }))
+	tliLogEvent('match', 'killed-branch', { 'class': 'event', 'timestamp': time.time(), 'id': id_ })
 
 def logSystemSent(tsiPort, label, payload, sutAddress = None):
 	if sutAddress is None: sutAddress = ''
-	tliLog('system', toXml('system-sent', { 'class': 'system', 'timestamp': time.time(), 'tsi-port': tsiPort }, '%s%s%s' % (testermanToXml(label, 'label'), testermanToXml(payload, 'payload'), testermanToXml(sutAddress, 'sut-address'))))
+	tliLogEvent('system', 'system-sent', { 'class': 'system', 'timestamp': time.time(), 'tsi-port': tsiPort }, ('v', [ ('label', label), ('payload', payload), ('sut-address', sutAddress) ]))
 
 def logSystemReceived(tsiPort, label, payload, sutAddress = None):
 	if sutAddress is None: sutAddress = ''
-	tliLog('system', toXml('system-received', { 'class': 'system', 'timestamp': time.time(), 'tsi-port': tsiPort }, '%s%s%s' % (testermanToXml(label, 'label'), testermanToXml(payload, 'payload'), testermanToXml(sutAddress, 'sut-address'))))
+	tliLogEvent('system', 'system-received', { 'class': 'system', 'timestamp': time.time(), 'tsi-port': tsiPort }, ('v', [ ('label', label), ('payload', payload), ('sut-address', sutAddress) ]))
 
 def logActionRequested(message, timeout, tc):
-	tliLog('action', toXml('action-requested', { 'class': 'action', 'timestamp': time.time(), 'timeout': timeout, 'tc': tc }, '%s' % (testermanToXml(message, 'message'))))
+	tliLogEvent('action', 'action-requested', { 'class': 'action', 'timestamp': time.time(), 'timeout': timeout, 'tc': tc }, ('v', [ ('message', message) ]))
 
 def logActionCleared(reason, tc):
-	tliLog('action', toXml('action-cleared', { 'class': 'action', 'timestamp': time.time(), 'tc': tc, 'reason': reason }))
+	tliLogEvent('action', 'action-cleared', { 'class': 'action', 'timestamp': time.time(), 'tc': tc, 'reason': reason })
 
 def tliLog(level, xml):
 	if not level in getExcludedLogLevels():
 		# Fire a log event
 		TheIlClient.sendLogNotification(level, xml)
+
+def tliLogEvent(level, element, attributes, body = None):
+	"""
+	Fires a log event, unless its level is excluded.
+	The event is only serialized (to XML or binary) if not excluded.
+	
+	@type  body: tuple, or None
+	@param body: the event element content:
+	('t', text) for an escaped text,
+	('c', text) for a CDATA section,
+	('v', [ (element, value), ... ]) for a list of Testerman structures.
+	"""
+	if not level in getExcludedLogLevels():
+		TheIlClient.sendLogEvent(level, (element, attributes, body))
+
+def logEventToXml(event):
+	"""
+	@type  event: tuple (element, attributes, body)
+	@param event: a log event, as passed to tliLogEvent
 	
+	@rtype: unicode
+	@returns: the event XML representation
+	"""
+	(element, attributes, body) = event
+	if body is None:
+		value = ''
+	elif body[0] == 't':
+		value = cgi.escape(body[1])
+	elif body[0] == 'c':
+		value = u"<![CDATA[%s]]>" % body[1]
+	else:
+		value = u''.join([ testermanToXml(v, name) for (name, v) in body[1] ])
+	return toXml(element, attributes, value)
+
+	
+################################################################################
+# Binary log event format
+################################################################################
+
+"""
+A binary log event is the serialization of the tuple
+(LogEventFormatVersion, element, attributes, body), as a tree of tagged
+values. Each value starts with a one-character tag:
+
+|| tag  || value   || followed by ||
+|| N    || None    || - ||
+|| T, F || boolean || - ||
+|| i    || int, long || a signed 64-bit integer ||
+|| l    || long    || its length, then its decimal representation ||
+|| d    || float   || an IEEE 754 double ||
+|| s    || str     || its length, then its raw bytes ||
+|| u    || unicode || its length, then its utf-8 bytes ||
+|| (    || tuple   || its item count, then its items ||
+|| [    || list    || its item count, then its items ||
+|| {    || dict    || its entry count, then its keys and values ||
+
+Lengths and counts are unsigned 32-bit integers. All numbers are big endian.
+String payloads are raw (not escaped, not base64-encoded).
+
+Values of other types are converted as the XML serializer would
+(toMessage(), then unicode() or str()). Dict keys are encoded as
+simple values only.
+
+Events are received from the TEs: the decoder only creates these simple
+types and containers, and rejects truncated or inconsistent data, and
+containers nested deeper than MaxLogEventDepth.
+"""
+
+MaxLogEventDepth = 256
+
+_SimpleTypes = (type(None), bool, int, long, float, str, unicode)
+
+def encodeLogEvent(event):
+	"""
+	@rtype: string (buffer)
+	@returns: the binary representation of a log event
+	"""
+	parts = []
+	_encodeValue((LogEventFormatVersion, ) + event, parts)
+	return ''.join(parts)
+
+def decodeLogEvent(data):
+	"""
+	@type  data: string (buffer)
+	@param data: the binary representation of a log event, as returned by encodeLogEvent
+	
+	@throws Exception: in case of an invalid binary representation
+	
+	@rtype: tuple (element, attributes, body)
+	@returns: the log event
+	"""
+	(event, offset) = _decodeValue(data, 0, 0)
+	if offset != len(data):
+		raise Exception("Invalid log event: unexpected data after the event")
+	if not (type(event) is tuple and len(event) == 4):
+		raise Exception("Invalid log event: not an event")
+	if event[0] != LogEventFormatVersion:
+		raise Exception("Unsupported log event format version (%s)" % event[0])
+	if not (type(event[1]) in (str, unicode) and type(event[2]) is dict):
+		raise Exception("Invalid log event: not an event")
+	return event[1:]
+
+_TaggedLength = struct.Struct('>cI')
+_TaggedInteger = struct.Struct('>cq')
+_TaggedFloat = struct.Struct('>cd')
+_Length = struct.Struct('>I')
+_Integer = struct.Struct('>q')
+_Float = struct.Struct('>d')
+
+def _encodeValue(obj, parts):
+	t = type(obj)
+	if t is str:
+		parts.append(_TaggedLength.pack('s', len(obj)))
+		parts.append(obj)
+	elif t is unicode:
+		obj = obj.encode('utf-8')
+		parts.append(_TaggedLength.pack('u', len(obj)))
+		parts.append(obj)
+	elif t is dict:
+		parts.append(_TaggedLength.pack('{', len(obj)))
+		for (k, v) in obj.iteritems():
+			if not type(k) in _SimpleTypes:
+				k = _toSimpleValue(k)
+			_encodeValue(k, parts)
+			_encodeValue(v, parts)
+	elif t is list or t is tuple:
+		parts.append(_TaggedLength.pack(t is list and '[' or '(', len(obj)))
+		for v in obj:
+			_encodeValue(v, parts)
+	elif obj is None:
+		parts.append('N')
+	elif t is bool:
+		parts.append(obj and 'T' or 'F')
+	elif t is int or t is long:
+		if -0x8000000000000000 <= obj <= 0x7fffffffffffffff:
+			parts.append(_TaggedInteger.pack('i', obj))
+		else:
+			obj = str(obj)
+			parts.append(_TaggedLength.pack('l', len(obj)))
+			parts.append(obj)
+	elif t is float:
+		parts.append(_TaggedFloat.pack('d', obj))
+	else:
+		_encodeValue(_toEncodableValue(obj), parts)
+
+def _toEncodableValue(obj):
+	"""
+	@rtype: one of the types supported by _encodeValue
+	@returns: obj converted as the XML serializer would
+	"""
+	# Tries to apply the 'to message' transformation (useful for template proxies)
+	try:
+		obj = obj.toMessage()
+	except:
+		pass
+
+	if type(obj) in _SimpleTypes or type(obj) in (list, tuple, dict):
+		return obj
+	if isinstance(obj, list):
+		return list(obj)
+	if isinstance(obj, tuple):
+		if not len(obj) == 2:
+			# Invalid "choice" representation
+			return ()
+		return tuple(obj)
+	if isinstance(obj, dict):
+		# Not dict(obj), which ignores the dict subclass methods
+		return dict(obj.items())
+	return _toSimpleValue(obj)
+
+def _toSimpleValue(obj):
+	if isinstance(obj, str):
+		return str(obj)
+	try:
+		return unicode(obj)
+	except UnicodeDecodeError:
+		return str(obj)
+
+def _decodeLength(data, offset):
+	if offset + 4 > len(data):
+		raise Exception("Invalid log event: truncated data")
+	return (_Length.unpack_from(data, offset)[0], offset + 4)
+
+def _decodeValue(data, offset, depth):
+	"""
+	@rtype: tuple (value, offset)
+	@returns: the value encoded at offset in data, and the offset of the next one
+	"""
+	if offset >= len(data):
+		raise Exception("Invalid log event: truncated data")
+	tag = data[offset]
+	offset += 1
+	if tag in 'sul':
+		(length, offset) = _decodeLength(data, offset)
+		end = offset + length
+		if end > len(data):
+			raise Exception("Invalid log event: truncated data")
+		value = data[offset:end]
+		if tag == 'u':
+			try:
+				value = value.decode('utf-8')
+			except UnicodeDecodeError:
+				raise Exception("Invalid log event: invalid unicode string")
+		elif tag == 'l':
+			if not value.lstrip('-').isdigit():
+				raise Exception("Invalid log event: invalid long integer")
+			value = long(value)
+		return (value, end)
+	elif tag in '([{':
+		if depth >= MaxLogEventDepth:
+			raise Exception("Invalid log event: too deeply nested values")
+		(count, offset) = _decodeLength(data, offset)
+		# Each value is encoded on at least one byte
+		if count > len(data) - offset:
+			raise Exception("Invalid log event: truncated data")
+		if tag == '{':
+			value = {}
+			for i in xrange(count):
+				(k, offset) = _decodeValue(data, offset, depth + 1)
+				if not type(k) in _SimpleTypes:
+					raise Exception("Invalid log event: invalid dict key")
+				(value[k], offset) = _decodeValue(data, offset, depth + 1)
+		else:
+			value = []
+			for i in xrange(count):
+				(v, offset) = _decodeValue(data, offset, depth + 1)
+				value.append(v)
+			if tag == '(':
+				value = tuple(value)
+		return (value, offset)
+	elif tag == 'N':
+		return (None, offset)
+	elif tag == 'T':
+		return (True, offset)
+	elif tag == 'F':
+		return (False, offset)
+	elif tag == 'i':
+		if offset + 8 > len(data):
+			raise Exception("Invalid log event: truncated data")
+		return (_Integer.unpack_from(data, offset)[0], offset + 8)
+	elif tag == 'd':
+		if offset + 8 > len(data):
+			raise Exception("Invalid log event: truncated data")
+		return (_Float.unpack_from(data, offset)[0], offset + 8)
+	raise Exception("Invalid log event: unknown value tag (%s)" % repr(tag))
+
 ################################################################################
 # Main Testerman log format: XML serializer
 ################################################################################
@@ -31,8 +31,13 @@ from TestermanTCI import *
 import TestermanTCI
 
 import binascii
+import cPickle as pickle
 import random
 import re
+import signal
+import socket
+import struct
+import sys
 import threading
 import time
 import os
@@ -45,7 +50,9 @@ import select
 # - added control:stop_testcase_on_failure(stop = True)
 # 1.3: 
 # - added set_(*args)
-API_VERSION = "1.3"
+# 1.4:
+# - added TestCase.create(process = True), process-based PTCs
+API_VERSION = "1.4"
 
 ################################################################################
 # Some general functions
@@ -502,7 +509,7 @@ class TestComponent:
 	_ANY_DONE_EVENT = { 'event': 'any.c.done' }
 	_ANY_KILLED_EVENT = { 'event': 'any.c.killed' }
 	
-	def __init__(self, name = None, alive = False):
+	def __init__(self, name = None, alive = False, process = False):
 		"""
 		Creates a new Test Component (TC), that is theorically
 		suitable for MTC or PTC.
@@ -511,6 +518,9 @@ class TestComponent:
 		@param name: the name of the component.
 		@type  alive: bool
 		@param alive: TTCN-3 alive parameter.
+		@type  process: bool
+		@param process: if True, the PTC behaviours are executed in a dedicated
+		process instead of a thread of the TE process.
 		"""
 		self._name = name
 		if not self._name:
@@ -533,6 +543,10 @@ class TestComponent:
 		self._alive = alive
 		# PTC local verdict (not used for MTC for now...)
 		self._verdict = VERDICT_NONE
+		# Process-based PTC: behaviours run in a forked process,
+		# reachable through this _PtcProcessLink while running.
+		self._process = process
+		self._link = None
 		
 		# Special internal events used by stop() and kill()
 		self._STOP_COMMAND = { 'event': 'stop_ptc', 'ptc': self }
@@ -704,6 +718,10 @@ class TestComponent:
 		
 		If forward_verdict is set, updates the test case (mtc) verdict.
 		"""
+		if _ProcessPtc is self:
+			# Executed in the PTC process: the TE process manages the state transitions
+			_getParentLink().send('stopped', message, forward_verdict, self._getverdict())
+			return
 		logTestComponentStopped(id_ = str(self), verdict = self._verdict, message = message)
 		if forward_verdict:
 			self._updateTestCaseVerdict()
@@ -745,6 +763,9 @@ class TestComponent:
 		"""
 		Sets to killed state, emits killed signal, etc - if needed
 		"""
+		if _ProcessPtc is self:
+			_getParentLink().send('killed')
+			return
 		if self._getState() != self.STATE_KILLED:
 			logTestComponentKilled(id_ = str(self), message = "killed")
 			self._setState(self.STATE_KILLED)
@@ -823,7 +844,8 @@ class TestComponent:
 		Implementation note:
 		normally we should go through the Component Handler to execute the behaviour
 		on a possibly distributed PTC. 
-		For now, this is just a (local) thread.
+		For now, this is just a (local) thread, or a forked process for
+		process-based PTCs.
 		
 		@type  behaviour: a Behaviour object
 		@param behaviour: the behaviour to bind to the PTC
@@ -832,6 +854,9 @@ class TestComponent:
 			# ignore start() on MTC
 			return
 
+		if _getParentLink():
+			raise TestermanTtcn3Exception("Invalid operation: you cannot start a PTC from a process-based PTC.")
+
 		if not self.alive():
 			raise TestermanTtcn3Exception("Invalid operation: you cannot start a behaviour on a PTC which is not alive anymore.")
 
@@ -849,8 +874,11 @@ class TestComponent:
 		# Attach the PTC to this behaviour
 		behaviour._setPtc(self)
 		
-		behaviourThread = threading.Thread(target = self._start, args = (behaviour, ), kwargs = kwargs)
-		behaviourThread.start()
+		if self._process:
+			_startPtcProcess(self, behaviour, kwargs)
+		else:
+			behaviourThread = threading.Thread(target = self._start, args = (behaviour, ), kwargs = kwargs)
+			behaviourThread.start()
 
 	def stop(self):
 		"""
@@ -863,11 +891,17 @@ class TestComponent:
 		"""
 		if self._mtc:
 			raise TestermanStopException()
+		elif _getParentLink() and not _ProcessPtc is self:
+			# From a process-based PTC: the TE process knows the actual PTC state
+			_getParentLink().send('command', str(self), 'stop')
 		else:
 			if self._getState() == self.STATE_RUNNING:
 				logInternal("Stopping %s..." % str(self))
-				# Let's post a system event to manage inter-thread communications
-				_postSystemEvent(self._STOP_COMMAND, self)
+				if self._link:
+					self._link.send('command', 'stop')
+				else:
+					# Let's post a system event to manage inter-thread communications
+					_postSystemEvent(self._STOP_COMMAND, self)
 
 	def kill(self):
 		"""
@@ -880,10 +914,15 @@ class TestComponent:
 		"""
 		if self._mtc:
 			self._testcase.stop()
+		elif _getParentLink() and not _ProcessPtc is self:
+			_getParentLink().send('command', str(self), 'kill')
 		else:
 			if self._getState() == self.STATE_RUNNING:
-				# Post our internal event to communicate with the PTC thread.
-				_postSystemEvent(self._KILL_COMMAND, self)
+				if self._link:
+					self._link.send('command', 'kill')
+				else:
+					# Post our internal event to communicate with the PTC thread.
+					_postSystemEvent(self._KILL_COMMAND, self)
 
 	def done(self):
 		"""
@@ -979,6 +1018,11 @@ class Port:
 	
 	def _enqueue(self, message, from_):
 #		logInternal("%s enqueuing message (started=%s)" % (str(self), str(self._started)))
+		link = _getTestComponentLink(self._tc)
+		if link:
+			# The port queue lives in another process
+			link.forwardMessage(self, message, from_)
+			return
 		self._lock()
 		if self._started:
 			self._messageQueue.append((message, from_))
@@ -1238,6 +1282,7 @@ class TestCase:
 			ptc.stop()
 		for ptc in self._ptcs:
 			ptc.done()
+		_waitPtcProcesses()
 		
 		self._mtc._finalize()
 			
@@ -1269,20 +1314,28 @@ class TestCase:
 		"""
 		self._description = description
 	
-	def create(self, name = None, alive = False):
+	def create(self, name = None, alive = False, process = False):
 		"""
 		Creates and returns a (P)TC.
 		The resulting TC will be associated to the testcase.
 		
+		Process-based PTCs execute their behaviours in a forked process,
+		so that CPU-bound behaviours are not serialized with the other
+		components. Their port messages, system events and logs are
+		proxied by the TE process. Messages sent to/from such a PTC
+		must be picklable.
+		
 		@type  name: string
 		@param name: the name of the PTC. If None, the name is automaticall generated as tc_%d.
 		@type  alive: bool
 		@param alive: TTCN-3 TC alive parameter.
+		@type  process: bool
+		@param process: run the PTC behaviours in a dedicated process.
 		
 		@rtypes: TestComponent
 		@returns: a new TestComponent.
 		"""
-		tc = TestComponent(name, alive)
+		tc = TestComponent(name, alive, process)
 		tc._testcase = self
 		self._ptcs.append(tc)
 		# Remove state events that are no longuer relevant - "ALL_DONE_EVENT" is still, however.
@@ -1487,6 +1540,9 @@ class TestSystemInterfacePort:
 		
 		The returned status is ignored for now.
 		"""
+		if _getParentLink():
+			# From a process-based PTC: the TRI is in the TE process
+			return _getParentLink().request('send', self._name, message, sutAddress)
 		return TestermanSA.triSend(None, self._name, sutAddress, message)
 
 
@@ -1608,15 +1664,31 @@ def connect(portA, portB):
 		if port._tc == portA._tc:
 			raise TestermanTtcn3Exception("Cannot connect %s and %s: %s is already connected to %s" % (str(portA), str(portB), str(portB), str(port)))
 
+	if _getParentLink():
+		# The TE process holds the reference topology
+		_getParentLink().request('connect', str(portA._tc), portA._name, str(portB._tc), portB._name)
+
 	# OK, we can connect
-	portA._connectedPorts.append(portB)
-	portB._connectedPorts.append(portA)
+	_linkPorts(portA, portB)
+	_notifyPtcProcesses([portA, portB], 'connect', str(portA._tc), portA._name, str(portB._tc), portB._name)
 
 def disconnect(portA, portB):
 	"""
 	Disconnects portA and portB.
 	Does nothing if they are not connected.
 	"""
+	if _getParentLink():
+		_getParentLink().request('disconnect', str(portA._tc), portA._name, str(portB._tc), portB._name)
+	_unlinkPorts(portA, portB)
+	_notifyPtcProcesses([portA, portB], 'disconnect', str(portA._tc), portA._name, str(portB._tc), portB._name)
+
+def _linkPorts(portA, portB):
+	if not portB in portA._connectedPorts:
+		portA._connectedPorts.append(portB)
+	if not portA in portB._connectedPorts:
+		portB._connectedPorts.append(portA)
+
+def _unlinkPorts(portA, portB):
 	if portA in portB._connectedPorts:
 		portB._connectedPorts.remove(portA)
 	if portB in portA._connectedPorts:
@@ -1646,6 +1718,12 @@ def port_map(port, tsiPort):
 	if port._isMapped():
 		raise TestermanTtcn3Exception("Cannot map %s to %s: %s is already mapped" % (str(port), str(tsiPort), str(port)))
 
+	if _getParentLink():
+		# The TRI is in the TE process. Only the local association is needed here.
+		_getParentLink().request('map', str(port._tc), port._name, tsiPort._name)
+		_associateTsiPort(port, tsiPort)
+		return
+
 	# Should we use a status or directly an exception ?...
 	status = TestermanSA.triMap(port, tsiPort._name)
 	if status == TestermanSA.TR_Error:
@@ -1659,6 +1737,7 @@ def port_map(port, tsiPort):
 	# "Local" mapping
 	port._mappedTsiPort = tsiPort
 	tsiPort._mappedPorts.append(port)
+	_notifyPtcProcesses([port], 'map', port._name, tsiPort._name)
 
 def port_unmap(port, tsiPort):
 	"""
@@ -1672,6 +1751,11 @@ def port_unmap(port, tsiPort):
 	@type  tsiPort: TestSystemInterfacePort
 	@param tsiPort: the tsi port to unmap from the tsiPort
 	"""
+	if _getParentLink():
+		_getParentLink().request('unmap', str(port._tc), port._name, tsiPort._name)
+		_dissociateTsiPort(port, tsiPort)
+		return
+
 	# TRI call
 	TestermanSA.triUnmap(port, tsiPort._name)
 	# System-wide de-association
@@ -1688,6 +1772,7 @@ def port_unmap(port, tsiPort):
 			# OK, the tsiPort is not used anymore. We can remove it.
 			del _TsiPorts[tsiPort._name]
 	_TsiPortsLock.release()
+	_notifyPtcProcesses([port], 'unmap', port._name, tsiPort._name)
 
 ################################################################################
 # Some built-in functions (both TTCN-3 and for convenience)
@@ -1871,7 +1956,9 @@ def alt(alternatives):
 	# port has something new in it.
 	watchedPortsFds = []
 	
-	systemQueueWatched = False
+	# System queue event keys watched by this alt, and the associated notifier
+	systemQueueKeys = []
+	systemQueuePipe = None
 		
 	for alternative in alternatives:
 		# Optional guard. Its presence is detected if the first element of the clause is callable.
@@ -1885,16 +1972,20 @@ def alt(alternatives):
 			condition = alternative[0]
 			actions = alternative[1:]
 		
- 		if not portAlternatives.has_key(condition.port) and condition.port._started:
+		if not portAlternatives.has_key(condition.port) and condition.port._started:
 			portAlternatives[condition.port] = []
-			if condition.port is _getSystemQueue():
-				# Register ourselves as a listener on the system port
-				condition.port._registerListener()
-				systemQueueWatched = True
-			watchedPortsFds.append(condition.port.getNotifierFd())
+			if not condition.port is _getSystemQueue():
+				watchedPortsFds.append(condition.port.getNotifierFd())
 		portAlternatives[condition.port].append((guard, condition, actions))
+		if condition.port is _getSystemQueue():
+			systemQueueKeys.append(_getSystemEventKey(condition.template))
+
+	if systemQueueKeys:
+		# Register ourselves as a listener for the events we are waiting for
+		systemQueuePipe = _getSystemQueue()._registerListener(systemQueueKeys)
+		watchedPortsFds.append(systemQueuePipe[0])
 	
-	logInternal("alt: tc %s is watching the following fds: %s - watching the system queue: %s" % (getLocalContext().getTc(), watchedPortsFds, systemQueueWatched))
+	logInternal("alt: tc %s is watching the following fds: %s - watching %d system queue events" % (getLocalContext().getTc(), watchedPortsFds, len(systemQueueKeys)))
 
 	# Step 2.
 	matchedInfo = None # tuple (guard, template, asValue, actions, message, decodedMessage)
@@ -1911,56 +2002,14 @@ def alt(alternatives):
 				# Instead, they are kept in the queue for other consumers (other TCs, or in a next alt()
 				# in the current TC).
 				if port is _getSystemQueue():
-					port._lock()
-					try:
-						# Make sure that we don't loop forever here because we did not remove our notification
-						# from the notification pipe.
-						port._acknowledgeNotification()
-						for (message, from_) in port._messageQueue:
-							# We ignore the 'from' in systemQueue
-							for (guard, condition, actions) in alternatives:
-								# Guard is ignored for internal messages (we shouldn't have one, anyway)
-	
-								# Special message matches (NB: we're suppose to have only dict messages in the system queue)
-								if isinstance(message, dict) and condition.template['event'].startswith('any.'):
-									# "Wildcard"-based match: we do not expect this exact event in the queue.
-									# Instead, we match any 'ressembling' event.
-									if condition.template['event'] == 'any.c.done':
-										# We match is we have any 'done' in our queue
-										if message.get('event') == 'done':
-											match = True
-									elif condition.template['event'] == 'any.c.killed':
-										# We match is we have any 'killed' in our queue
-										if message.get('event') == 'killed':
-											match = True
-	
-									if match:
-										matchedInfo = (guard, condition, actions, message, None) # None: decodedMessage
-										# In this case, we do NOT consume the message: left for
-										# other ptc.KILLED, or other any component killed, ...
-										break
-
-								# Standard system message matches - consumed if matched
-								else:
-									# Ignore the decoded message: must be the same as encoded for internal events.
-									(match, _, _) = templateMatch(message, condition.template)
-									if match:
-										matchedInfo = (guard, condition, actions, message, None) # None: decodedMessage
-										# Consume the message
-										port._remove(message, from_)
-										# Exit the port alternative loop, with matchedInfo
-										break
-	
-							if matchedInfo:
-								# Exit the loop on messages directly.
-								break
-					except Exception as e:
-						port._unlock()
-						logInternal("Exception while analyzing system events: %s" % str(e))
-						raise
-					port._unlock()
-					if matchedInfo:
-						(guard, condition, actions, message, _) = matchedInfo
+					# Make sure that we don't loop forever here because we did not remove our notification
+					# from the notification pipe.
+					port._acknowledgeNotification(systemQueuePipe)
+					# We ignore the 'from' in systemQueue
+					matched = port._match(alternatives)
+					if matched:
+						(guard, condition, actions, message) = matched
+						matchedInfo = (guard, condition, actions, message, None) # None: decodedMessage
 						# OK, we have some actions to trigger (outside the critical section)
 						# According to the event type we matched, log it (or not)
 						# system queue events are always formatted as a dict { 'event': string } and 'ptc' or 'timer' dependending on the event.
@@ -2090,12 +2139,11 @@ def alt(alternatives):
 	#			if r: logInternal("activity detected on port(s) %s" % r)
 	except Exception as e:
 		logInternal("exception in alt(): %s (%s)" % (str(e), repr(e)))
-		if systemQueueWatched:
-			_getSystemQueue()._unregisterListener()
 		raise e
-
-	if systemQueueWatched:
-		_getSystemQueue()._unregisterListener()
+	finally:
+		# Also reached when leaving the alt() on a RETURN action
+		if systemQueuePipe:
+			_getSystemQueue()._unregisterListener(systemQueueKeys, systemQueuePipe)
 
 # Control "Keywords" for alt().
 # May be used as is directly, in a lambda, or returned from an altstep or a function called
@@ -2121,6 +2169,32 @@ def RETURN():
 # etc) to implement, provision and read this message queue as well.
 # System messages are handled in alt(), as if it were any other TTCN-3 message.
 
+# System events are indexed by (event type, source), where the source is the
+# timer or the PTC the event relates to (None for all-component events).
+# This key is also used to register the alt()s waiting for such an event,
+# so that posting an event only wakes up the TCs that wait for it.
+
+# Wildcard source, used by any-component branch conditions
+_AnySource = object()
+
+# Wildcard system events, and the event type they match
+_SystemEventWildcards = {
+	'any.c.done': 'done',
+	'any.c.killed': 'killed',
+}
+
+def _getSystemEventKey(event):
+	"""
+	Returns the index key for a system event or a system branch condition template.
+	
+	@rtype: tuple (string, object)
+	@returns: (event type, source)
+	"""
+	eventType = event['event']
+	if eventType in _SystemEventWildcards:
+		return (_SystemEventWildcards[eventType], _AnySource)
+	return (eventType, event.get('timer', event.get('ptc', None)))
+
 class SystemQueue(Port):
 	"""
 	This is basically a standard port, but with
@@ -2128,45 +2202,79 @@ class SystemQueue(Port):
 	system messages are handled in alt(), in particular with regards
 	to new message notifications.
 	
-	each alt() that are watching the system queue should register
-	a dedicated notifier (calling getNotifierFd(), the queue assign
-	a new notifier automatically per TLS),
-	and whenever a new message arrives in the system queue, all
-	registered notifiers are notified.
+	Events are indexed by (event type, source) keys.
+	
+	Each alt() watching the system queue registers its TC notifier
+	(a pipe per TLS) for the event keys it waits for,
+	and whenever a new event is posted, only the notifiers
+	registered for its key are notified.
 	"""
 	def __init__(self):
 		Port.__init__(self, tc = None, name = '__system_queue__')
-		self._pipes = []
+		# dict[(event type, source)] = list of (sequence number, message, from_), in posting order
+		self._events = {}
+		# dict[event type] = list of (event type, source) keys currently in self._events
+		self._eventKeys = {}
+		# Posting sequence number, to match the earliest event first
+		self._sequence = 0
+		# dict[(event type, source or _AnySource)] = list of notification pipes
+		self._listeners = {}
+
+	def start(self):
+		self._lock()
+		self._events = {}
+		self._eventKeys = {}
+		self._unlock()
+		Port.start(self)
+
+	def clear(self):
+		self._lock()
+		self._events = {}
+		self._eventKeys = {}
+		self._unlock()
+		logInternal("%s cleared" % str(self))
 
-	def _registerListener(self):
+	def _registerListener(self, keys):
+		"""
+		Registers the current TC notifier for events matching keys.
+		
+		@type  keys: list of (event type, source) tuples
+		@param keys: the event keys to be notified for
+		
+		@rtype: tuple (int, int)
+		@returns: the notification pipe (r, w) to watch
+		"""
 		pipe = getLocalContext().getSystemQueueNotifier()
 		self._lock()
-		if not pipe in self._pipes:
-			self._pipes.append(pipe)
+		for key in keys:
+			self._listeners.setdefault(key, []).append(pipe)
 		self._unlock()
-		logInternal("system queue: tc %s registered as a listener (fd %s)" % (getLocalContext().getTc(), pipe[0]))
+		logInternal("system queue: tc %s registered as a listener for %d events (fd %s)" % (getLocalContext().getTc(), len(keys), pipe[0]))
 		return pipe
 	
-	def getNotifierFd(self):
-		pipe = getLocalContext().getSystemQueueNotifier()
-		return pipe[0]
-	
-	def _unregisterListener(self):
-		pipe = getLocalContext().getSystemQueueNotifier()
+	def _unregisterListener(self, keys, pipe):
+		"""
+		Unregisters a notifier previously registered with _registerListener(keys).
+		Other registrations of the same notifier (nested alt()) are left untouched.
+		"""
 		self._lock()
-		try:
-			self._pipes.remove(pipe)
-		except:
-			pass
+		for key in keys:
+			pipes = self._listeners.get(key)
+			if pipes and pipe in pipes:
+				pipes.remove(pipe)
+				if not pipes:
+					del self._listeners[key]
 		self._unlock()
 		getLocalContext().cleanSystemQueueNotifier()
 		logInternal("system queue: tc %s unregistered as a listener (fd %s)" % (getLocalContext().getTc(), pipe[0]))
 	
-	def _notifyListeners(self):
+	def _notifyListeners(self, key):
 		"""
-		Notify current system queue listeners (writing something in their notification pipes).
+		Notify the listeners waiting for an event matching key
+		(writing something in their notification pipes).
 		"""
-		for p in self._pipes:
+		pipes = self._listeners.get(key, []) + self._listeners.get((key[0], _AnySource), [])
+		for p in pipes:
 			try:
 				os.write(p[1], 'r')
 				logInternal("system queue: notifying a new message for reader on %s" % (p[0]))
@@ -2176,23 +2284,28 @@ class SystemQueue(Port):
 
 	def _enqueue(self, message, from_):
 		"""
-		The system queue implementation for enqueue is to enqueue the message,
-		then send a notification through the notifier pipe only if
+		The system queue implementation for enqueue is to index the message,
+		then send a notification through the notifier pipes of the
+		listeners waiting for it only.
 		"""
 		logInternal("system queue: enqueuing message from %s" % (str(from_)))
+		key = _getSystemEventKey(message)
 		self._lock()
-		self._messageQueue.append((message, from_))
-		self._notifyListeners()
+		self._sequence += 1
+		if not self._events.has_key(key):
+			self._events[key] = []
+			self._eventKeys.setdefault(key[0], []).append(key)
+		self._events[key].append((self._sequence, message, from_))
+		self._notifyListeners(key)
 		self._unlock()
 
-	def _acknowledgeNotification(self):
+	def _acknowledgeNotification(self, pipe):
 		"""
 		To be called by a listener when it acknowledges that
 		it is aware that new messages where received in the system queue.
 		Technically, this purges its notification pipe to avoid an overflow
 		in the long run.
 		"""
-		pipe = getLocalContext().getSystemQueueNotifier()
 		try:
 			f = pipe[0]
 			r, w, e = select.select([f], [], [], 0)
@@ -2201,6 +2314,63 @@ class SystemQueue(Port):
 				logInternal("system queue: tc %s acknowledged new message notification on fd %s" % (getLocalContext().getTc(), f))
 		except:
 			pass
+
+	def _getFirstEvent(self, key):
+		"""
+		Returns the earliest event matching key, or None.
+		
+		@rtype: tuple (sequence number, message, from_), or None
+		"""
+		if key[1] is _AnySource:
+			first = None
+			for k in self._eventKeys.get(key[0], []):
+				event = self._events[k][0]
+				if first is None or event[0] < first[0]:
+					first = event
+			return first
+		events = self._events.get(key)
+		if events:
+			return events[0]
+		return None
+
+	def _removeEvent(self, key, event):
+		events = self._events[key]
+		events.remove(event)
+		if not events:
+			del self._events[key]
+			self._eventKeys[key[0]].remove(key)
+			if not self._eventKeys[key[0]]:
+				del self._eventKeys[key[0]]
+
+	def _match(self, alternatives):
+		"""
+		Looks for the earliest event matching one of the alternatives,
+		consuming it unless it was matched by a wildcard condition
+		(left for other ptc.DONE, any component done, ...).
+		
+		@type  alternatives: list of (guard, condition, actions)
+		@param alternatives: the alt() alternatives on the system queue.
+		Guards are ignored for internal messages.
+		
+		@rtype: tuple (guard, condition, actions, message), or None
+		@returns: the matched alternative and event, if any
+		"""
+		self._lock()
+		try:
+			matched = None
+			for (guard, condition, actions) in alternatives:
+				key = _getSystemEventKey(condition.template)
+				event = self._getFirstEvent(key)
+				if event and (matched is None or event[0] < matched[1][0]):
+					matched = (key, event, guard, condition, actions)
+			if not matched:
+				return None
+			(key, event, guard, condition, actions) = matched
+			if key[1] is not _AnySource:
+				self._removeEvent(key, event)
+			return (guard, condition, actions, event[1])
+		finally:
+			self._unlock()
 	
 	def _remove(self, message, from_):
 		"""
@@ -2212,12 +2382,12 @@ class SystemQueue(Port):
 		as it is more a collection of states (that could be read by next alt())
 		instead of actual triggers.
 		"""
+		key = _getSystemEventKey(message)
 		self._lock()
-		try:
-			self._messageQueue.remove((message, from_))
-		except ValueError:
-			# Not in queue
-			pass
+		for event in self._events.get(key, []):
+			if event[1] == message and event[2] == from_:
+				self._removeEvent(key, event)
+				break
 		self._unlock()
 	
 
@@ -2238,6 +2408,7 @@ def _postSystemEvent(event, from_):
 	Posts an event into the system bus.
 	"""
 	_getSystemQueue()._enqueue(event, from_)
+	_forwardSystemEvent('event', event)
 
 def _removeSystemEvent(event, from_):
 	"""
@@ -2246,6 +2417,480 @@ def _removeSystemEvent(event, from_):
 	(timer.TIMEOUT, ptc.DONE, ...) due to object restart.
 	"""
 	_getSystemQueue()._remove(event, from_)
+	_forwardSystemEvent('remove', event)
+
+################################################################################
+# Process-based PTCs
+################################################################################
+
+# A process-based PTC executes its behaviour in a process forked from the TE
+# when started. The TE process keeps the reference copy of the TC and
+# its ports, and a _PtcProcessLink to the PTC process (a socketpair):
+# - messages enqueued to the PTC ports, in the TE process, are forwarded
+#   to the PTC process, and messages sent by the PTC to ports owned by
+#   other TCs are forwarded to the TE process,
+# - mapped ports sends, map/unmap/connect/disconnect are performed
+#   in the TE process, and TRI incoming messages are forwarded as
+#   any other enqueued message,
+# - done/killed events are forwarded to the PTC processes,
+#   stop/kill commands to the PTC process,
+# - logs are forwarded to the TE process,
+# - the state transitions on stop/kill are performed by the TE process,
+#   based on the final PTC verdict, so that done/killed/verdict
+#   handling is the same as for thread-based PTCs.
+# Timers are local to the PTC process.
+
+# Within a PTC process: the TC executed by this process, and the link to the TE process
+_ProcessPtc = None
+_ParentLink = None
+
+# Within the TE process: the links to the running PTC processes
+_PtcProcessLinks = []
+_PtcProcessLinksLock = threading.RLock()
+
+# The system events forwarded to PTC processes
+_ForwardedSystemEvents = [ 'done', 'killed', 'all.c.done', 'all.c.killed' ]
+
+class _PtcProcessLink:
+	"""
+	A message link between the TE process and a PTC process.
+	Messages are tuples, pickled and prefixed with their length.
+	
+	Messages are dispatched by a reader thread to onMessage(link, message).
+	request() is a synchronous version of send(), whose result
+	is sent back by the peer with a 'response' message.
+	"""
+	def __init__(self, sock, onMessage, onClose = None):
+		self._socket = sock
+		self._onMessage = onMessage
+		self._onClose = onClose
+		self._sendMutex = threading.RLock()
+		self._responses = {}
+		self._responseCondition = threading.Condition(threading.RLock())
+		self._closed = False
+		self._thread = None
+		# Set on the TE process side
+		self.tc = None
+		self.pid = None
+	
+	def start(self):
+		self._thread = threading.Thread(target = self._read)
+		self._thread.setDaemon(True)
+		self._thread.start()
+	
+	def join(self):
+		self._thread.join()
+	
+	def close(self):
+		try:
+			self._socket.shutdown(socket.SHUT_RDWR)
+		except Exception:
+			pass
+		self._socket.close()
+	
+	def send(self, *message):
+		"""
+		Sends a message to the peer.
+		
+		@rtype: bool
+		@returns: True if sent, False if the peer is gone.
+		"""
+		data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+		self._sendMutex.acquire()
+		try:
+			try:
+				self._socket.sendall(struct.pack('!I', len(data)) + data)
+				return True
+			except socket.error as e:
+				logInternal("PTC process link: unable to send %s: %s" % (message[0], e))
+				return False
+		finally:
+			self._sendMutex.release()
+	
+	def request(self, operation, *args):
+		"""
+		Sends a request to the peer, waits for its response.
+		Re-raises the peer exception, if any, as a TestermanTtcn3Exception.
+		"""
+		requestId = _getNewId()
+		if not self.send('request', requestId, operation, args):
+			raise TestermanTtcn3Exception("Unable to %s: the TE process link is closed" % operation)
+		self._responseCondition.acquire()
+		try:
+			while not requestId in self._responses and not self._closed:
+				self._responseCondition.wait()
+			if not requestId in self._responses:
+				raise TestermanTtcn3Exception("Unable to %s: the TE process link is closed" % operation)
+			(result, error) = self._responses.pop(requestId)
+		finally:
+			self._responseCondition.release()
+		if error:
+			raise TestermanTtcn3Exception(error)
+		return result
+	
+	def forwardMessage(self, port, message, from_):
+		"""
+		Forwards a message enqueued to a port owned by the peer process.
+		
+		from_ is a TC, or a SUT address (for ports mapped to the test system).
+		"""
+		if isinstance(from_, TestComponent):
+			from_ = ('tc', str(from_))
+		else:
+			from_ = ('sut', from_)
+		self.send('enqueue', str(port._tc), port._name, message, from_)
+
+	def _recv(self, size):
+		data = ''
+		while len(data) < size:
+			chunk = self._socket.recv(size - len(data))
+			if not chunk:
+				return None
+			data += chunk
+		return data
+
+	def _read(self):
+		while True:
+			try:
+				header = self._recv(4)
+				if header is None:
+					break
+				data = self._recv(struct.unpack('!I', header)[0])
+				if data is None:
+					break
+			except socket.error:
+				break
+			message = pickle.loads(data)
+			if message[0] == 'response':
+				self._responseCondition.acquire()
+				self._responses[message[1]] = (message[2], message[3])
+				self._responseCondition.notifyAll()
+				self._responseCondition.release()
+			elif message[0] == 'request':
+				try:
+					result = self._onMessage(self, message[2:])
+					self.send('response', message[1], result, None)
+				except Exception as e:
+					self.send('response', message[1], None, str(e))
+			else:
+				try:
+					self._onMessage(self, message)
+				except Exception:
+					logInternal("PTC process link: unable to handle %s:\n%s" % (message[0], getBacktrace()))
+
+		self._responseCondition.acquire()
+		self._closed = True
+		self._responseCondition.notifyAll()
+		self._responseCondition.release()
+		if self._onClose:
+			self._onClose(self)
+
+class _PtcProcessIlClient:
+	"""
+	Replaces the Il client in a PTC process: logs are forwarded to the
+	TE process Il client.
+	"""
+	def __init__(self, link):
+		self._link = link
+	
+	def sendLogNotification(self, logClass, xml):
+		self._link.send('log', logClass, xml)
+
+	def sendLogEvent(self, logClass, event):
+		# Binary encoded: the event values may not be picklable
+		self._link.send('log-event', logClass, TestermanTCI.encodeLogEvent(event))
+
+	def stop(self):
+		pass
+	
+	def finalize(self):
+		pass
+
+def _getParentLink():
+	"""
+	Returns the link to the TE process when executed in a PTC process, or None.
+	"""
+	return _ParentLink
+
+def _getTestComponentLink(tc):
+	"""
+	Returns the link to use to reach the port queues of tc, if they
+	are not in the current process, or None.
+	"""
+	if _ParentLink:
+		if tc is _ProcessPtc:
+			return None
+		return _ParentLink
+	return getattr(tc, '_link', None)
+
+def _getTestComponentByName(testcase, name):
+	"""
+	Resolves a TC name, in the current process.
+	
+	@rtype: TestComponent, or None
+	"""
+	if testcase._mtc and str(testcase._mtc) == name:
+		return testcase._mtc
+	for ptc in testcase._ptcs:
+		if str(ptc) == name:
+			return ptc
+	return None
+
+def _resolveSender(testcase, from_):
+	(kind, value) = from_
+	if kind == 'tc':
+		return _getTestComponentByName(testcase, value)
+	return value
+
+def _associateTsiPort(port, tsiPort):
+	port._lock()
+	port._mappedTsiPort = tsiPort
+	if not port in tsiPort._mappedPorts:
+		tsiPort._mappedPorts.append(port)
+	port._unlock()
+
+def _dissociateTsiPort(port, tsiPort):
+	port._lock()
+	port._mappedTsiPort = None
+	if port in tsiPort._mappedPorts: 
+		tsiPort._mappedPorts.remove(port)
+	port._unlock()
+
+def _notifyPtcProcesses(ports, *message):
+	"""
+	Notifies the processes of the process-based PTCs owning ports
+	of a topology change (TE process only).
+	"""
+	if _ParentLink:
+		return
+	for link in set([ port._tc._link for port in ports if getattr(port._tc, '_link', None) ]):
+		link.send(*message)
+
+def _forwardSystemEvent(operation, event):
+	"""
+	Forwards a done/killed event posting or removal to the running
+	PTC processes (TE process only).
+	"""
+	if _ParentLink or not event['event'] in _ForwardedSystemEvents:
+		return
+	ptc = event.get('ptc', None)
+	if ptc is not None:
+		ptc = str(ptc)
+	_PtcProcessLinksLock.acquire()
+	links = _PtcProcessLinks[:]
+	_PtcProcessLinksLock.release()
+	for link in links:
+		link.send(operation, event['event'], ptc)
+
+def _getSystemEvent(testcase, eventType, ptcName):
+	"""
+	Returns the local system event corresponding to a forwarded one.
+	"""
+	if ptcName is None:
+		if eventType == 'all.c.done':
+			return TestComponent._ALL_DONE_EVENT
+		return TestComponent._ALL_KILLED_EVENT
+	ptc = _getTestComponentByName(testcase, ptcName)
+	if not ptc:
+		return None
+	if eventType == 'done':
+		return ptc._DONE_EVENT
+	return ptc._KILLED_EVENT
+
+def _startPtcProcess(tc, behaviour, kwargs):
+	"""
+	Forks a new process to execute behaviour on tc (TE process side).
+	"""
+	(parentSocket, childSocket) = socket.socketpair()
+	sys.stdout.flush()
+	sys.stderr.flush()
+	pid = os.fork()
+	if not pid:
+		parentSocket.close()
+		try:
+			_runPtcProcess(tc, childSocket, behaviour, kwargs)
+		finally:
+			os._exit(0)
+
+	childSocket.close()
+	link = _PtcProcessLink(parentSocket, _onPtcProcessMessage, _onPtcProcessClosed)
+	link.tc = tc
+	link.pid = pid
+	tc._link = link
+	_PtcProcessLinksLock.acquire()
+	_PtcProcessLinks.append(link)
+	_PtcProcessLinksLock.release()
+	logInternal("%s started in process %s" % (str(tc), pid))
+	link.start()
+
+def _onPtcProcessMessage(link, message):
+	"""
+	Handles a message from a PTC process (TE process side).
+	"""
+	testcase = link.tc._testcase
+	operation = message[0]
+	if operation == 'log':
+		TestermanTCI.TheIlClient.sendLogNotification(message[1], message[2])
+	elif operation == 'log-event':
+		TestermanTCI.TheIlClient.sendLogEvent(message[1], TestermanTCI.decodeLogEvent(message[2]))
+	elif operation == 'enqueue':
+		(tcName, portName, msg, from_) = message[1:]
+		tc = _getTestComponentByName(testcase, tcName)
+		if tc:
+			tc[portName]._enqueue(msg, _resolveSender(testcase, from_))
+	elif operation == 'send':
+		(tsiPortName, msg, sutAddress) = message[1:]
+		return testcase._system[tsiPortName].send(msg, sutAddress)
+	elif operation == 'command':
+		(tcName, command) = message[1:]
+		tc = _getTestComponentByName(testcase, tcName)
+		if tc and command == 'stop':
+			tc.stop()
+		elif tc and command == 'kill':
+			tc.kill()
+	elif operation == 'stopped':
+		(msg, forwardVerdict, verdict) = message[1:]
+		link.tc._lock()
+		link.tc._verdict = verdict
+		link.tc._unlock()
+		link.tc._doStop(msg, forwardVerdict)
+	elif operation == 'killed':
+		link.tc._doKill()
+	elif operation in [ 'connect', 'disconnect' ]:
+		(tcA, portA, tcB, portB) = message[1:]
+		portA = _getTestComponentByName(testcase, tcA)[portA]
+		portB = _getTestComponentByName(testcase, tcB)[portB]
+		if operation == 'connect':
+			connect(portA, portB)
+		else:
+			disconnect(portA, portB)
+	elif operation in [ 'map', 'unmap' ]:
+		(tcName, portName, tsiPortName) = message[1:]
+		port = _getTestComponentByName(testcase, tcName)[portName]
+		if operation == 'map':
+			port_map(port, testcase._system[tsiPortName])
+		else:
+			port_unmap(port, testcase._system[tsiPortName])
+
+def _onPtcProcessClosed(link):
+	"""
+	Called when a PTC process has closed its link, i.e. has terminated.
+	"""
+	tc = link.tc
+	link.close()
+	try:
+		(pid, status) = os.waitpid(link.pid, 0)
+	except OSError:
+		status = 0
+	if tc._link is link:
+		tc._link = None
+	if tc._getState() == tc.STATE_RUNNING:
+		# The process did not report its termination
+		tc._setverdict(VERDICT_ERROR)
+		tc._doStop("PTC %s process terminated unexpectedly (status %s)" % (str(tc), status))
+		tc._doKill()
+	else:
+		logInternal("%s process %s terminated" % (str(tc), link.pid))
+	_PtcProcessLinksLock.acquire()
+	if link in _PtcProcessLinks:
+		_PtcProcessLinks.remove(link)
+	_PtcProcessLinksLock.release()
+
+def _waitPtcProcesses():
+	"""
+	Waits for the termination of the PTC processes whose
+	termination is being handled (TE process only).
+	"""
+	_PtcProcessLinksLock.acquire()
+	links = _PtcProcessLinks[:]
+	_PtcProcessLinksLock.release()
+	for link in links:
+		link.join()
+
+def _onParentMessage(link, message):
+	"""
+	Handles a message from the TE process (PTC process side).
+	"""
+	tc = _ProcessPtc
+	testcase = tc._testcase
+	operation = message[0]
+	if operation == 'enqueue':
+		(tcName, portName, msg, from_) = message[1:]
+		tc[portName]._enqueue(msg, _resolveSender(testcase, from_))
+	elif operation == 'command':
+		if message[1] == 'stop':
+			_postSystemEvent(tc._STOP_COMMAND, tc)
+		else:
+			_postSystemEvent(tc._KILL_COMMAND, tc)
+	elif operation in [ 'event', 'remove' ]:
+		event = _getSystemEvent(testcase, message[1], message[2])
+		if event is None:
+			return
+		if operation == 'event':
+			_postSystemEvent(event, event.get('ptc', None))
+		else:
+			_removeSystemEvent(event, event.get('ptc', None))
+	elif operation in [ 'connect', 'disconnect' ]:
+		(tcA, portA, tcB, portB) = message[1:]
+		tcA = _getTestComponentByName(testcase, tcA)
+		tcB = _getTestComponentByName(testcase, tcB)
+		if tcA and tcB:
+			if operation == 'connect':
+				_linkPorts(tcA[portA], tcB[portB])
+			else:
+				_unlinkPorts(tcA[portA], tcB[portB])
+	elif operation == 'map':
+		_associateTsiPort(tc[message[1]], testcase._system[message[2]])
+	elif operation == 'unmap':
+		_dissociateTsiPort(tc[message[1]], testcase._system[message[2]])
+
+def _runPtcProcess(tc, sock, behaviour, kwargs):
+	"""
+	Executes behaviour on tc in the forked PTC process.
+	"""
+	global _ProcessPtc, _ParentLink
+	global _ContextMapMutex, _TimersLock, _TsiPortsLock, _GeneratorBaseIdMutex, _PtcProcessLinksLock
+
+	# The TE process terminates the PTCs
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	random.seed()
+
+	# The locks may have been held by other threads when forking
+	_GeneratorBaseIdMutex = threading.RLock()
+	_ContextMapMutex = threading.RLock()
+	_ContextMap.clear()
+	_TimersLock = threading.RLock()
+	_Timers.clear()
+	_TsiPortsLock = threading.RLock()
+	_TsiPorts.clear()
+	TestermanPA.initialize()
+	TestermanPA.CurrentTimers.clear()
+	systemQueue = _getSystemQueue()
+	systemQueue._mutex = threading.RLock()
+	systemQueue._listeners = {}
+	tc._mutex = threading.RLock()
+	for port in tc._ports.values():
+		port._mutex = threading.RLock()
+
+	_PtcProcessLinksLock = threading.RLock()
+	_PtcProcessLinksLock.acquire()
+	for link in _PtcProcessLinks:
+		link._socket.close()
+	del _PtcProcessLinks[:]
+	_PtcProcessLinksLock.release()
+	
+	_ProcessPtc = tc
+	_ParentLink = _PtcProcessLink(sock, _onParentMessage)
+	TestermanTCI.TheIlClient = _PtcProcessIlClient(_ParentLink)
+	_ParentLink.start()
+
+	try:
+		tc._start(behaviour, **kwargs)
+	finally:
+		_stopAllTimers()
+		sys.stdout.flush()
+		sys.stderr.flush()
+		_ParentLink.close()
 
 ################################################################################
 # Test Adapter Configuration management - System Bindings management
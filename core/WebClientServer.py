@@ -51,6 +51,8 @@ import re
 import libxml2
 import JSON
 import SocketServer
+import collections
+import itertools
 
 
 
@@ -64,6 +66,8 @@ JSON_CONTENT_TYPE = "text/plain" # or application/json
 
 # "ajax-like" method async timeout
 TIMEOUT_GET_JOB_STATUS = 10.0
+# "ajax-like" runtime log polling: max wait for new events
+TIMEOUT_GET_RUNTIME_LOG = 10.0
 
 # Rights
 RIGHT_CUSTOMIZE_RUN_PARAMETERS = "customize-run-parameters"
@@ -170,16 +174,89 @@ class XcApplication(WebServer.WebSocketApplication):
 			return
 
 
+################################################################################
+# Request Handler to push runtime logs through HTML5 WebSockets
+################################################################################
+
+class RuntimeLogApplication(WebServer.WebSocketApplication):
+	"""
+	Pushes the log events of a job to a WebSocket client
+	as soon as they are received from the server.
+	
+	Connect to /websocket/runtimelog/<jobId>.
+	
+	Sent messages are JSON objects:
+	{ "type": "log", "events": [ { "eventId": int, "data": xml string }, ... ] }
+	{ "type": "resync", "dropped": int }: the client was too slow to consume
+	  its events, or connected after the oldest buffered ones were discarded,
+	  and some of them were dropped.
+	
+	Events are buffered in a bounded, per-client buffer managed by the
+	(shared) JobMonitorManager.
+	"""
+	def __init__(self, testermanClient, jobMonitorManager, **kwargs):
+		WebServer.WebSocketApplication.__init__(self, **kwargs)
+		self._client = testermanClient
+		self._jobMonitorManager = jobMonitorManager
+		self._clientBuffer = None
+		self._senderThread = None
+
+	def _getClient(self):
+		return self._client
+
+	def __str__(self):
+		return "WebSocket/RuntimeLog application [%s]" % str(self._getClientAddress())
+
+	def _sendEvents(self):
+		"""
+		Sender thread main loop: forwards events from our client buffer
+		to the WebSocket client.
+		"""
+		clientBuffer = self._clientBuffer
+		try:
+			while not clientBuffer.isClosed():
+				events, dropped = clientBuffer.pop(1.0)
+				if dropped:
+					getLogger().info("%s: slow client, %s events dropped" % (self, dropped))
+					self.wsSend(JSON.dumps(dict(type = "resync", dropped = dropped)))
+				if events:
+					self.wsSend(JSON.dumps(dict(type = "log", events = [ dict(eventId = x[0], data = x[1]) for x in events ])))
+		except Exception as e:
+			getLogger().info("%s: unable to push events: %s" % (self, str(e)))
+			self.wsClose()
+
+	##
+	# Reimplementations from WebSocketApplication
+	##
+	
+	def onWsOpen(self):
+		jobId = self.request.getPath()[1:].split('?', 1)[0]
+		jobInfo = self._getClient().getJobInfo(int(jobId))
+		if not jobInfo:
+			raise Exception("job %s does not exist" % jobId)
+		getLogger().info("%s: monitoring job %s" % (self, jobId))
+		self._jobMonitorManager.monitor(jobInfo)
+		self._clientBuffer = self._jobMonitorManager.registerClient(jobId)
+		self._senderThread = threading.Thread(target = self._sendEvents)
+		self._senderThread.setDaemon(True)
+		self._senderThread.start()
+
+	def onWsClose(self):
+		getLogger().info("%s: disconnected" % self)
+		if self._clientBuffer:
+			self._jobMonitorManager.unregisterClient(self._clientBuffer)
+
+
 ################################################################################
 # Request Handler to provide WebClient services
 ################################################################################
 
 class WebClientApplication(WebServer.WebApplication):
-	def __init__(self, testermanClient, **kwargs):
+	def __init__(self, testermanClient, jobMonitorManager, **kwargs):
 		WebServer.WebApplication.__init__(self, **kwargs)
 		self._client = testermanClient
 		self._repositoryHome = None
-		self._jobMonitorManager = JobMonitorManager(testermanClient)
+		self._jobMonitorManager = jobMonitorManager
 
 	def authenticate(self, username, password):
 		self._repositoryHome = None
@@ -609,12 +686,17 @@ class WebClientApplication(WebServer.WebApplication):
 		
 		Otherwise returns a null object.
 		"""
-		elements = self._jobMonitorManager.getEvents(jobId)
-		
-		if not elements:
-			time.sleep(1) # force a wait to avoid a requery. Normally we should wait until a new event arrives instead.
+		try:
+			lastLogEventId = int(lastLogEventId or 0)
+		except ValueError:
+			lastLogEventId = 0
+		# Long polling: returns as soon as a new event is available
+		elements, dropped = self._jobMonitorManager.getEvents(jobId, lastLogEventId, TIMEOUT_GET_RUNTIME_LOG)
+
+		if dropped:
+			getLogger().info("Runtime log poller for job %s missed %s events" % (jobId, dropped))
 		
-		logElements = [ dict(eventId = lastLogEventId + x[0], data = x[1]) for x in elements ]
+		logElements = [ dict(eventId = x[0], data = x[1]) for x in elements ]
 		
 		self._sendContent(JSON.dumps(logElements), contentType = JSON_CONTENT_TYPE)
 	
@@ -626,43 +708,186 @@ class JobMonitorManager:
 	"""
 	This component is responsible for monitoring jobs that
 	are watched by at least one web client,
-	and buffering log events to serve them to the web clients
-	via ajax polling.
+	and buffering log events to serve them to the web clients,
+	either via ajax long polling (getEvents) or pushed over
+	WebSocket links (see RuntimeLogApplication).
+	
+	A single instance is shared by all web applications:
+	all its bookkeeping is protected by a lock, and
+	every buffer it manages is bounded.
 	"""
 	
 	class EventQueue:
 		"""
 		The queue that contains buffered events for a particular
 		job.
+		
+		This is a ring buffer: only the last maxSize events are kept.
+		Each event gets an absolute, monotonic event ID so that
+		pollers can detect they missed some events (resync).
 		"""
-		def __init__(self, jobInfo):
+		def __init__(self, jobInfo, maxSize):
 			self._id = jobInfo['id']
 			self._lastUpdate = time.time()
-			self._lastEventId = -1
-			self._queue = []
+			# The ID of the next event to enqueue
+			self._nextEventId = 0
+			self._queue = collections.deque(maxlen = maxSize)
 			self._running = True
+			# Notified on new events and on stop, for long pollers
+			self._condition = threading.Condition()
 		
 		def setStopped(self):
+			self._condition.acquire()
 			self._running = False
 			self._lastUpdate = time.time()
+			self._condition.notifyAll()
+			self._condition.release()
 		
 		def enqueue(self, event):
-			self._queue.append(event)
-			self._lastEventId += 1
+			"""
+			Returns the event ID assigned to this event.
+			"""
+			self._condition.acquire()
+			eventId = self._nextEventId
+			self._queue.append((eventId, event))
+			self._nextEventId += 1
 			self._lastUpdate = time.time()
+			self._condition.notifyAll()
+			self._condition.release()
+			return eventId
 		
 		def isStopped(self):
 			return not self._running
 		
 		def getLastUpdate(self):
 			return self._lastUpdate
+		
+		def getEvents(self, startingFromId, maxEvents, timeout = 0.0):
+			"""
+			Returns up to maxEvents events whose ID is >= startingFromId,
+			waiting up to timeout seconds for at least one of them to be available.
+			
+			@rtype: tuple (list of (int, string), int)
+			@returns: the (eventId, event) list, and the number of
+			events that were dropped from the ring before they could be
+			retrieved (0 if none).
+			"""
+			self._condition.acquire()
+			try:
+				if timeout and self._running and startingFromId >= self._nextEventId:
+					self._condition.wait(timeout)
+				dropped = 0
+				if self._queue:
+					oldestId = self._queue[0][0]
+					if startingFromId < oldestId:
+						dropped = oldestId - startingFromId
+						startingFromId = oldestId
+					skip = startingFromId - oldestId
+					events = list(itertools.islice(self._queue, skip, skip + maxEvents))
+				else:
+					events = []
+				return (events, dropped)
+			finally:
+				self._condition.release()
+
+		def getLastEvents(self, maxEvents):
+			"""
+			Returns the last (up to) maxEvents events.
+			
+			@rtype: tuple (list of (int, string), int)
+			@returns: the (eventId, event) list, and the number of
+			events enqueued before them that are not returned.
+			"""
+			self._condition.acquire()
+			try:
+				events = list(self._queue)[-maxEvents:]
+				if events:
+					return (events, events[0][0])
+				return (events, self._nextEventId)
+			finally:
+				self._condition.release()
+
+	class ClientBuffer:
+		"""
+		A per-client bounded buffer, filled by the manager when new events
+		are received for the job the client subscribed to, and
+		consumed by the client sender.
+		
+		When the client is too slow to consume its buffer, the
+		oldest events are dropped and the client is notified it should
+		resync on its next read.
+		"""
+		def __init__(self, jobId, maxSize):
+			self._jobId = jobId
+			self._queue = collections.deque(maxlen = maxSize)
+			self._dropped = 0
+			self._closed = False
+			self._condition = threading.Condition()
+		
+		def getJobId(self):
+			return self._jobId
+		
+		def push(self, eventId, event):
+			self._condition.acquire()
+			if len(self._queue) == self._queue.maxlen:
+				self._dropped += 1
+			self._queue.append((eventId, event))
+			self._condition.notify()
+			self._condition.release()
+		
+		def setDropped(self, dropped):
+			"""
+			Reports events the client missed before the buffered ones,
+			so that it resyncs on its next read.
+			"""
+			self._condition.acquire()
+			self._dropped += dropped
+			self._condition.release()
+		
+		def close(self):
+			self._condition.acquire()
+			self._closed = True
+			self._condition.notify()
+			self._condition.release()
+		
+		def isClosed(self):
+			return self._closed
+		
+		def pop(self, timeout = None):
+			"""
+			Waits for events to be available, then returns them all.
+			
+			@rtype: tuple (list of (int, string), int)
+			@returns: the buffered (eventId, event) list, and the number
+			of events dropped since the last pop().
+			"""
+			self._condition.acquire()
+			try:
+				if not self._queue and not self._closed:
+					self._condition.wait(timeout)
+				events = list(self._queue)
+				self._queue.clear()
+				dropped = self._dropped
+				self._dropped = 0
+				return (events, dropped)
+			finally:
+				self._condition.release()
 
 	def __init__(self, testermanClient):
-		# TODO: add locks everywhere
-		self._queues = {}			
+		self._mutex = threading.RLock()
+		# Job uri: EventQueue
+		self._queues = {}
+		# Job uri: list of ClientBuffers
+		self._clients = {}
 		
 		self._client = testermanClient
 	
+	def _lock(self):
+		self._mutex.acquire()
+	
+	def _unlock(self):
+		self._mutex.release()
+	
 	def _getClient(self):
 		return self._client
 
@@ -705,50 +930,123 @@ class JobMonitorManager:
 	
 			
 	def monitor(self, jobInfo):
+		"""
+		Starts buffering log events for this job, if not already done.
+		"""
 		jobId = jobInfo['id']
 		state = jobInfo['state']
 		uri = "job:%s" % jobId
 		if state in ['waiting', 'running', 'cancelling']:
-			if not jobId in self._queues:
+			subscribe = False
+			self._lock()
+			if not uri in self._queues:
+				self._queues[uri] = self.EventQueue(jobInfo, cm.get("wcs.runtime_log.job_buffer_size"))
+				subscribe = True
+			self._unlock()
+			if subscribe:
 				self._getClient().subscribe(uri, self.onNotification)
-				self._queues[uri] = self.EventQueue(jobInfo)
 		else:
 			# Nothing to do, already stopped
 			pass
 	
+	def registerClient(self, jobId):
+		"""
+		Registers a new client interested in live log events for a job.
+		
+		The most recent events buffered for this job are immediately made
+		available in the returned ClientBuffer, reporting the older ones
+		as dropped.
+		
+		@rtype: JobMonitorManager.ClientBuffer
+		"""
+		uri = "job:%s" % jobId
+		clientBuffer = self.ClientBuffer(jobId, cm.get("wcs.runtime_log.client_buffer_size"))
+		self._lock()
+		try:
+			self._clients.setdefault(uri, []).append(clientBuffer)
+			queue = self._queues.get(uri)
+			if queue:
+				# Replay the most recent events we have, and make the client
+				# resync if it cannot get the job log from its beginning
+				events, dropped = queue.getLastEvents(clientBuffer._queue.maxlen)
+				for (eventId, event) in events:
+					clientBuffer.push(eventId, event)
+				if dropped:
+					clientBuffer.setDropped(dropped)
+		finally:
+			self._unlock()
+		return clientBuffer
+	
+	def unregisterClient(self, clientBuffer):
+		uri = "job:%s" % clientBuffer.getJobId()
+		self._lock()
+		try:
+			clients = self._clients.get(uri, [])
+			if clientBuffer in clients:
+				clients.remove(clientBuffer)
+			if not clients and uri in self._clients:
+				del self._clients[uri]
+		finally:
+			self._unlock()
+		clientBuffer.close()
+	
 	def onNotification(self, notification):
 		uri = notification.getUri()
 		if notification.getMethod() == "LOG":
-			if uri in self._queues:
-				self._queues.enqueue(notification.getBody())
+			event = notification.getBody()
+			self._lock()
+			try:
+				queue = self._queues.get(uri)
+				if queue:
+					eventId = queue.enqueue(event)
+					for clientBuffer in self._clients.get(uri, []):
+						clientBuffer.push(eventId, event)
+			finally:
+				self._unlock()
 		elif notification.getMethod() == "JOB-EVENT":
-			if uri in self._queues:
-				state = notification.getApplicationBody()['state']
-				if not state in ['waiting', 'running', 'cancelling']:
+			state = notification.getApplicationBody()['state']
+			if not state in ['waiting', 'running', 'cancelling']:
+				self._lock()
+				queue = self._queues.get(uri)
+				self._unlock()
+				if queue:
 					self._getClient().unsubscribe(uri, self.onNotification)
-					self._queues[uri].setStopped()
+					queue.setStopped()
 	
 	def garbageCollection(self):
 		"""
 		To be called regularly.
 		"""
 		timeout = 60
-		toPurge = []
-		for uri, queue in self._queues.items():
-			if queue.isStopped() and queue.getLastUpdate() < (time.time() - timeout):
-				# Let's purge the queue entrie
-				toPurge.append(uri)
-		
-		for uri in toPurge:
-			del self._queues[uri]
+		self._lock()
+		try:
+			toPurge = []
+			for uri, queue in self._queues.items():
+				if queue.isStopped() and queue.getLastUpdate() < (time.time() - timeout) and not self._clients.get(uri):
+					# Let's purge the queue entrie
+					toPurge.append(uri)
+			
+			for uri in toPurge:
+				del self._queues[uri]
+		finally:
+			self._unlock()
 	
-	def getEvents(self, jobId, startingFromId = 0):
+	def getEvents(self, jobId, startingFromId = 0, timeout = 0.0):
+		"""
+		Returns the events buffered for a job starting from event ID startingFromId,
+		waiting up to timeout seconds for new events if none is available yet.
+
+		@rtype: tuple (list of (int, string), int)
+		@returns: the (eventId, event) list, and the number of missed (dropped) events
+		"""
 		MAX_EVENTS = 100
 		uri = "job:%s" % jobId
-		if uri in self._queues:
-			q = self._queues[uri]
-			return zip(xrange(MAX_EVENTS), q._queue[startingFromId:])
-		return []
+		self._lock()
+		queue = self._queues.get(uri)
+		self._unlock()
+		if queue:
+			return queue.getEvents(startingFromId, MAX_EVENTS, timeout)
+		return ([], 0)
 
 ############################################################
 # The HTTP Server
@@ -782,15 +1080,22 @@ class HttpServerThread(threading.Thread):
 		serverUrl = "http://%s:%s" % (cm.get("ts.ip"), cm.get("ts.port"))
 		client = TestermanClient.Client(name = "Testerman WebClient", userAgent = "WebClient/%s" % VERSION, serverUrl = serverUrl)
 		self._client = client
+		# Shared by all applications instances, i.e. all requests
+		self._jobMonitorManager = JobMonitorManager(client)
 		RequestHandler.registerApplication('/', WebClientApplication, 
 			documentRoot = cm.get("testerman.webclient.document_root"), 
 			testermanClient = client,
+			jobMonitorManager = self._jobMonitorManager,
 			debug = cm.get("wcs.debug"),
 			authenticationRealm = 'Testerman WebClient',
 			theme = cm.get("wcs.webui.theme"))
 		RequestHandler.registerApplication('/websocket', XcApplication, 
 			testermanServerUrl = serverUrl,
 			debug = cm.get("wcs.debug"))
+		RequestHandler.registerApplication('/websocket/runtimelog', RuntimeLogApplication, 
+			testermanClient = client,
+			jobMonitorManager = self._jobMonitorManager,
+			debug = cm.get("wcs.debug"))
 
 		self._server = HttpServer(address, RequestHandler)
 
@@ -798,9 +1103,13 @@ class HttpServerThread(threading.Thread):
 		self._client.startXc()
 		getLogger().info("Testerman Client Xc interface started")
 		getLogger().info("HTTP server started")
+		lastGarbageCollection = time.time()
 		try:
 			while not self._stopEvent.isSet(): 
 				self._server.handle_request_with_timeout(0.01)
+				if time.time() - lastGarbageCollection > 10.0:
+					self._jobMonitorManager.garbageCollection()
+					lastGarbageCollection = time.time()
 		except Exception as e:
 			getLogger().error("Exception in HTTP server thread: " + str(e))
 		getLogger().info("HTTP server stopped")
@@ -845,6 +1154,8 @@ def main():
 	cm.register("testerman.administrator.name", "administrator", dynamic = True)
 	cm.register("testerman.administrator.email", "testerman-admin@localhost", dynamic = True)
 	cm.register("wcs.webui.theme", "default", dynamic = True)
+	cm.register("wcs.runtime_log.job_buffer_size", 10000)
+	cm.register("wcs.runtime_log.client_buffer_size", 1000)
 
 
 	parser = optparse.OptionParser(version = getVersion())
@@ -39,9 +39,20 @@ import struct
 import time
 import threading
 import select
+import collections
+import email.utils
 
 DEFAULT_PAGE = "/index.vm"
 
+# Static files smaller than this are kept in memory (bytes)
+STATIC_CACHE_MAX_FILE_SIZE = 256 * 1024
+# Total size of the static files memory cache (bytes)
+STATIC_CACHE_MAX_SIZE = 16 * 1024 * 1024
+# Larger files are streamed by chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+# Precompile cached airspeed templates into render functions
+TEMPLATE_PRECOMPILATION = True
+
 
 cm = ConfigManager.instance()
 
@@ -85,6 +96,143 @@ class AuthenticationError(Exception):
 	pass
 
 
+################################################################################
+# Static files cache
+################################################################################
+
+class StaticFileCache:
+	"""
+	A thread-safe LRU cache for small static files contents,
+	validated against the file mtime and size on each access.
+	"""
+	def __init__(self, maxFileSize = STATIC_CACHE_MAX_FILE_SIZE, maxSize = STATIC_CACHE_MAX_SIZE):
+		self._maxFileSize = maxFileSize
+		self._maxSize = maxSize
+		self._size = 0
+		# path: (mtime, size, contents), least recently used first
+		self._entries = collections.OrderedDict()
+		self._mutex = threading.RLock()
+		self._hits = 0
+		self._misses = 0
+	
+	def _lock(self):
+		self._mutex.acquire()
+	
+	def _unlock(self):
+		self._mutex.release()
+
+	def isCacheable(self, size):
+		return size <= self._maxFileSize
+
+	def get(self, path, mtime, size):
+		"""
+		Returns the contents of the file, from the cache if
+		it is still valid, or reading it (and caching it) otherwise.
+		
+		@throws IOError if the file cannot be read.
+		"""
+		self._lock()
+		try:
+			entry = self._entries.pop(path, None)
+			if entry and entry[0] == mtime and entry[1] == size:
+				self._hits += 1
+				# Mark as the most recently used
+				self._entries[path] = entry
+				return entry[2]
+			elif entry:
+				self._size -= entry[1]
+			self._misses += 1
+		finally:
+			self._unlock()
+
+		f = open(path, 'rb')
+		try:
+			contents = f.read()
+		finally:
+			f.close()
+		
+		if len(contents) != size or not self.isCacheable(size):
+			# Modified while we were reading it, or too large.
+			return contents
+		
+		self._lock()
+		try:
+			if path not in self._entries:
+				self._entries[path] = (mtime, size, contents)
+				self._size += size
+			while self._size > self._maxSize and self._entries:
+				_, (_, evictedSize, _) = self._entries.popitem(last = False)
+				self._size -= evictedSize
+		finally:
+			self._unlock()
+		return contents
+	
+	def getStatistics(self):
+		self._lock()
+		ret = dict(hits = self._hits, misses = self._misses, entries = len(self._entries), size = self._size)
+		self._unlock()
+		return ret
+
+
+# Shared by all the web applications
+_staticFileCache = StaticFileCache()
+
+def getStaticFileCache():
+	return _staticFileCache
+
+
+class TemplateCache:
+	"""
+	A thread-safe cache of parsed (and optionally precompiled)
+	airspeed templates, invalidated when the template file
+	mtime or size changes.
+	"""
+	def __init__(self, precompile = TEMPLATE_PRECOMPILATION):
+		self._precompile = precompile
+		# path: (mtime, size, airspeed.Template)
+		self._templates = {}
+		self._mutex = threading.RLock()
+	
+	def _lock(self):
+		self._mutex.acquire()
+	
+	def _unlock(self):
+		self._mutex.release()
+	
+	def get(self, path):
+		"""
+		Returns the airspeed.Template for this file.
+		
+		@throws OSError, IOError if the file cannot be read.
+		"""
+		st = os.stat(path)
+		self._lock()
+		entry = self._templates.get(path)
+		self._unlock()
+		if entry and entry[0] == st.st_mtime and entry[1] == st.st_size:
+			return entry[2]
+		
+		f = open(path)
+		contents = f.read()
+		f.close()
+		template = airspeed.Template(contents)
+		# Parse it now, out of the lock, so that syntax errors are raised here
+		if self._precompile:
+			template.compile()
+		else:
+			template.ensure_compiled()
+
+		self._lock()
+		self._templates[path] = (st.st_mtime, st.st_size, template)
+		self._unlock()
+		return template
+
+_templateCache = TemplateCache()
+
+def getTemplateCache():
+	return _templateCache
+
+
 
 ################################################################################
 # Main request handler: Application Dispatcher
@@ -159,6 +307,22 @@ class WebRequest:
 	def endHeaders(self):
 		return self.__handler.end_headers()
 	
+	def sendFile(self, f, offset, count):
+		"""
+		Sends count bytes from the file object f, starting at offset,
+		directly to the client, by chunks, in bounded memory.
+		"""
+		# Make sure the headers are sent before the body
+		self.__handler.wfile.flush()
+		f.seek(offset)
+		while count > 0:
+			data = f.read(min(count, STREAM_CHUNK_SIZE))
+			if not data:
+				break
+			self.__handler.wfile.write(data)
+			count -= len(data)
+		self.__handler.wfile.flush()
+	
 	# Things to cleanup/refactor, used to prototype a websocket server
 	def _getHandler(self):
 		return self.__handler
@@ -393,36 +557,171 @@ class WebApplication:
 		"""
 		Serves the file without additional verifications.
 		If asFilename is set, sends the file as attachment.
+		
+		Untransformed files support conditional GETs (ETag/Last-Modified)
+		and single byte ranges. Small files are served from a memory cache,
+		large ones are streamed from the disk.
 		"""
 		# Check if the file exists
 		try:
-			f = open(path)
-			contents = f.read()
-			f.close()
+			st = os.stat(path)
 		except:
 			self.request.sendError(404)
-		else:
+			return
+
+		contentType = self._getContentType(path)
+		if not contentType:
+			# Unsupported media type
+			self.request.sendError(415)
+			return
+
+		if xform:
+			# Dynamic contents: no caching, no partial contents
+			try:
+				f = open(path)
+				contents = f.read()
+				f.close()
+			except:
+				self.request.sendError(404)
+				return
 			try:
-				if xform:
-					contents = xform(contents)
+				contents = xform(contents)
 			except:
 				# Internal transformation error
 				self.request.sendError(500)
+				return
+			self.request.sendResponse(200)
+			self.request.sendHeader('Content-Type', contentType)
+			if asFilename:
+				self.request.sendHeader('Content-Disposition', 'attachment; filename="%s"' % asFilename)
+			self.request.sendHeader('Content-Length', len(contents))
+			self.request.endHeaders()
+			self.request.write(contents)
+			self.request.flush()
+			return
+
+		size = st.st_size
+		mtime = int(st.st_mtime)
+		etag = '"%x-%x-%x"' % (st.st_ino, mtime, size)
+		lastModified = email.utils.formatdate(mtime, usegmt = True)
+		headers = self.request.getHeaders()
+
+		# Conditional GET
+		if self._isNotModified(headers, etag, mtime):
+			self.request.sendResponse(304)
+			self.request.sendHeader('ETag', etag)
+			self.request.sendHeader('Last-Modified', lastModified)
+			self.request.endHeaders()
+			self.request.flush()
+			return
+
+		# Partial content
+		byteRange = None
+		ifRange = headers.get('If-Range')
+		if headers.get('Range') and (not ifRange or ifRange == etag):
+			byteRange = self._parseRange(headers.get('Range'), size)
+			if byteRange is False:
+				self.request.sendResponse(416)
+				self.request.sendHeader('Content-Range', 'bytes */%s' % size)
+				self.request.sendHeader('Content-Length', 0)
+				self.request.endHeaders()
+				self.request.flush()
+				return
+		if byteRange:
+			start, end = byteRange
+		else:
+			start, end = 0, size - 1
+		length = end - start + 1
+		
+		try:
+			if getStaticFileCache().isCacheable(size):
+				contents = getStaticFileCache().get(path, mtime, size)
+				f = None
 			else:
-				contentType = self._getContentType(path)
-				if not contentType:
-					# Unsupported media type
-					self.request.sendError(415)
-					return
+				f = open(path, 'rb')
+		except:
+			self.request.sendError(404)
+			return
 
+		try:
+			if byteRange:
+				self.request.sendResponse(206)
+				self.request.sendHeader('Content-Range', 'bytes %s-%s/%s' % (start, end, size))
+			else:
 				self.request.sendResponse(200)
-				self.request.sendHeader('Content-Type', contentType)
-				if asFilename:
-					self.request.sendHeader('Content-Disposition', 'attachment; filename="%s"' % asFilename)
-				self.request.sendHeader('Content-Length', len(contents))
-				self.request.endHeaders()
-				self.request.write(contents)
+			self.request.sendHeader('Content-Type', contentType)
+			if asFilename:
+				self.request.sendHeader('Content-Disposition', 'attachment; filename="%s"' % asFilename)
+			self.request.sendHeader('Content-Length', length)
+			self.request.sendHeader('Accept-Ranges', 'bytes')
+			self.request.sendHeader('ETag', etag)
+			self.request.sendHeader('Last-Modified', lastModified)
+			self.request.endHeaders()
+			if f:
+				self.request.sendFile(f, start, length)
+			else:
+				self.request.write(contents[start:end+1])
 				self.request.flush()
+		finally:
+			if f:
+				f.close()
+
+	def _isNotModified(self, headers, etag, mtime):
+		"""
+		Evaluates the conditional GET headers against the current
+		file validators.
+		"""
+		ifNoneMatch = headers.get('If-None-Match')
+		if ifNoneMatch:
+			# If-None-Match takes precedence over If-Modified-Since
+			tags = [ x.strip() for x in ifNoneMatch.split(',') ]
+			return etag in tags or '*' in tags
+		ifModifiedSince = headers.get('If-Modified-Since')
+		if ifModifiedSince:
+			try:
+				since = email.utils.mktime_tz(email.utils.parsedate_tz(ifModifiedSince.split(';')[0]))
+			except:
+				return False
+			return mtime <= since
+		return False
+
+	def _parseRange(self, value, size):
+		"""
+		Parses a Range header value.
+		Only single byte ranges are supported.
+		
+		@rtype: tuple (int, int), None, or False
+		@returns: the (first byte, last byte) inclusive range to serve,
+		None if the range is syntactically invalid or cannot be handled
+		(the header is ignored and the whole content should be served),
+		False if the range is valid but not satisfiable.
+		"""
+		value = value.strip()
+		if not value.startswith('bytes=') or ',' in value or not '-' in value:
+			return None
+		first, last = value[6:].split('-', 1)
+		first, last = first.strip(), last.strip()
+		if not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+			return None
+		if not first:
+			# Suffix range: last N bytes
+			suffix = int(last)
+			if suffix == 0:
+				return False
+			first = max(0, size - suffix)
+			last = size - 1
+		else:
+			first = int(first)
+			if last:
+				if int(last) < first:
+					# e.g. bytes=5-2
+					return None
+				last = min(int(last), size - 1)
+			else:
+				last = size - 1
+		if first >= size:
+			return False
+		return (first, last)
 
 	def _getContentType(self, path):
 		"""
@@ -475,22 +774,19 @@ class WebApplication:
 		@param context: the context to apply to the template.
 		@type  context: dict
 		"""
-		try:
-			f = open(path)
-			contents = f.read()
-			f.close()
-		except:
-			self.request.sendError(404)
-			return
-
 		contentType = self._getContentType(path)
 		if not contentType:
 			# Unsupported media type
 			self.request.sendError(415)
 			return
+
+		try:
+			template = getTemplateCache().get(path)
+		except (IOError, OSError):
+			self.request.sendError(404)
+			return
 		
-		# Get the template and merge the context parameters		
-		template = airspeed.Template(contents)
+		# Merge the context parameters		
 		defaultContext = self._getDefaultTemplateContext()
 		if not context:
 			context = {}
@@ -556,6 +852,8 @@ class WebSocketApplication:
 	
 	This is a minimalist implementation of a WebSocket server, not
 	optimized at all, especially with regards to thread management.
+	wsSend() is thread-safe, however, so that you can push messages
+	from another thread than the one reading the connection.
 	"""
 
 	# If you want to authenticate your users, provide a realm
@@ -567,6 +865,8 @@ class WebSocketApplication:
 		self._debug = debug
 		self._authenticationRealm = authenticationRealm
 		self.username = None
+		# wsSend() may be called from other threads than the one handling the connection
+		self._sendLock = threading.Lock()
 
 	def __str__(self):
 		return "WebSocket application"
@@ -637,6 +937,8 @@ class WebSocketApplication:
 		
 		self.request.setCloseCallback(self.onWsClose)
 
+		self._stopEvent = threading.Event()
+
 		# Ready		
 		getLogger().info("WebSocket link connected from %s" % str(self._getClientAddress()))
 		try:
@@ -654,7 +956,6 @@ class WebSocketApplication:
 		h = self.request._getHandler()
 		sock = h.connection
 		
-		self._stopEvent = threading.Event()
 		self.buf = ''
 		
 		while not self._stopEvent.isSet():
@@ -819,8 +1120,12 @@ class WebSocketApplication:
 			header = struct.pack('>BBQ', b1, 127, payload_len)
 
 		buf = header + msg
-		self.request.write(buf)
-		self.request.flush()
+		self._sendLock.acquire()
+		try:
+			self.request.write(buf)
+			self.request.flush()
+		finally:
+			self._sendLock.release()
 
 	def wsClose(self):
 		"""
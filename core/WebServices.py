@@ -52,7 +52,7 @@ import zlib
 #: API versions: major.minor
 #: major += 1 if not backward compatible,
 #: minor += 1 if feature-enriched, backward compatible
-WS_VERSION = '1.8'
+WS_VERSION = '1.9'
 
 
 ################################################################################
@@ -377,6 +377,66 @@ def getJobLogFilename(jobId):
 	getLogger().info("<< getJobLogFilename: %s" % str(res))
 	return res
 
+def _getChunkSize(maxSize):
+	"""
+	Bounds a chunk size requested by a client to the server maximum.
+	"""
+	serverMaxSize = ConfigManager.instance().get('testerman.ws.max_chunk_size')
+	if not maxSize or maxSize <= 0:
+		return serverMaxSize
+	return min(int(maxSize), serverMaxSize)
+
+def getJobLogChunk(jobId, offset, maxSize = 0, useCompression = True):
+	"""
+	Gets a part of the current log for an existing job, from an offset,
+	so that a client can follow a log, or resume following it, without
+	getting it again.
+	
+	Unlike getJobLog(), the returned log is not wrapped into a XML prologue
+	and root element: this is the raw log file content. The chunk always
+	ends with a complete line, unless a single line is larger than the
+	chunk size.
+	
+	@since: 1.9
+
+	@type  jobId: integer
+	@param jobId: the job ID identifying the job whose log should be retrieved
+	@type  offset: integer (or float for offsets larger than 2^31)
+	@param offset: the position in the log to get the chunk from (0 for the beginning)
+	@type  maxSize: integer
+	@param maxSize: the maximum chunk size in bytes, before compression.
+	0, or a value larger than the server maximum chunk size, for the server maximum chunk size.
+	@type  useCompression: bool
+	@param useCompression: if set to True, compress the chunk using zlib before encoding it in base64
+	
+	@rtype: dict{'data': string, 'offset': integer, 'complete': bool}, or None
+	@returns: None if the job was not found, or
+	          the log chunk (utf-8, optionally gzip + base64 encoded if useCompression is set to True),
+	          the offset to get the next chunk from (integer, or float for large values),
+	          and whether the job is complete and its whole log has been returned
+	"""
+	getLogger().info(">> getJobLogChunk(%d, %s, %s, %s)" % (jobId, offset, maxSize, str(useCompression)))
+	res = None
+	try:
+		chunk = JobManager.instance().getJobLogChunk(jobId, long(offset), _getChunkSize(maxSize))
+		if chunk is not None:
+			(data, nextOffset, complete) = chunk
+			if useCompression:
+				data = base64.encodestring(zlib.compress(data))
+			else:
+				data = base64.encodestring(data)
+			res = { 'data': data, 'offset': _toXmlRpcNumber(nextOffset), 'complete': complete }
+	except Exception as e:
+		e =  Exception("Unable to complete getJobLogChunk operation: %s\n%s" % (str(e), Tools.getBacktrace()))
+		getLogger().info("<< getJobLogChunk(...): Fault:\n%s" % str(e))
+		raise(e)
+
+	if res is not None:
+		getLogger().info("<< getJobLogChunk: next offset %s, complete: %s" % (res['offset'], res['complete']))
+	else:
+		getLogger().info("<< getJobLogChunk: job not found")
+	return res
+
 def rescheduleJob(jobId, at):
 	"""
 	Reschedules a job to start at <at>.
@@ -508,6 +568,56 @@ def getFile(path, useCompression = False):
 		getLogger().info("<< getFile(%s): file not found" % (path))
 	return ret
 
+def getFileChunk(path, offset, maxSize = 0, useCompression = False):
+	"""
+	Retrieves a part of a file according to the path, from an offset,
+	so that large files can be retrieved in bounded memory.
+	The path is relative to the document root.
+	
+	@since: 1.9
+
+	@type  path: string
+	@param path: a path to a file
+	@type  offset: integer (or float for offsets larger than 2^31)
+	@param offset: the position in the file to get the chunk from
+	@type  maxSize: integer
+	@param maxSize: the maximum chunk size in bytes, before compression.
+	0, or a value larger than the server maximum chunk size, for the server maximum chunk size.
+	@type  useCompression: bool
+	@param useCompression: if True, the output is gziped before being mime64-encoded
+	
+	@rtype: dict{'data': string, 'offset': integer, 'eof': bool}, or None
+	@returns: None if the file was not found, or
+	          the chunk contents in base64 encoding, optionally compressed,
+	          the offset to get the next chunk from (integer, or float for large values),
+	          and whether the end of the file was reached
+	"""
+	getLogger().info(">> getFileChunk(%s, %s, %s, %s)" % (path, offset, maxSize, useCompression))
+	if not path.startswith('/'):
+		path = '/' + path
+
+	ret = None
+	try:
+		offset = long(offset)
+		maxSize = _getChunkSize(maxSize)
+		contents = FileSystemManager.instance().readChunk(path, offset, maxSize)
+		if contents is not None:
+			if useCompression:
+				data = base64.encodestring(zlib.compress(contents))
+			else:
+				data = base64.encodestring(contents)
+			ret = { 'data': data, 'offset': _toXmlRpcNumber(offset + len(contents)), 'eof': len(contents) < maxSize }
+	except Exception as e:
+		e =  Exception("Unable to perform operation: %s\n%s" % (str(e), Tools.getBacktrace()))
+		getLogger().info("<< getFileChunk(...): Fault:\n%s" % str(e))
+		ret = None
+	
+	if ret is not None:
+		getLogger().info("<< getFileChunk(%s): next offset %s" % (path, ret['offset']))
+	else:
+		getLogger().info("<< getFileChunk(%s): file not found" % (path))
+	return ret
+
 def putFile(content, path, useCompression = False, username = None):
 	"""
 	Writes a file to docroot/path
@@ -1015,6 +1125,144 @@ def importPackageFile(content, path, useCompression = False):
 	getLogger().info("<< importPackageFile(): %s" % str(res))
 	return res
 
+def getPackageManifest(path):
+	"""
+	Lists the files of a package with their content digests,
+	so that a client can export it file by file (using getFileChunk()),
+	or compare it with a package to import.
+	
+	@since: 1.9
+
+	@type  path: string
+	@param path: a docpath to a package root folder
+	
+	@rtype: list of dict{'name': string, 'type': 'dir' or 'file', 'size': integer, 'digest': string}, or None
+	@returns: None if the package was not found, or its files and folders, relative to the package root folder.
+	          size (integer, or float for large values) and digest (sha1, hex) are provided for files only.
+	"""
+	getLogger().info(">> getPackageManifest(%s)" % (path))
+	if not path.startswith('/'): path = '/' + path
+
+	ret = None
+	try:
+		ret = Package.getPackageManifest(path)
+		if ret is not None:
+			for e in ret:
+				if e.has_key('size'):
+					e['size'] = _toXmlRpcNumber(e['size'])
+	except Exception as e:
+		e =  Exception("Unable to perform operation: %s\n%s" % (str(e), Tools.getBacktrace()))
+		getLogger().info("<< getPackageManifest(...): Fault:\n%s" % str(e))
+		raise(e)
+
+	if ret is not None:
+		getLogger().info("<< getPackageManifest(%s): %d entries" % (path, len(ret)))
+	else:
+		getLogger().info("<< getPackageManifest(%s): package not found" % (path))
+	return ret
+
+def getPackageTransfers(path, manifest):
+	"""
+	Returns the files of a package to import that should be transferred
+	with importPackageFileChunk() before importing the package
+	with importPackageManifest(): only the files whose content is
+	not already in the destination package nor already transferred are returned.
+	
+	@since: 1.9
+
+	@type  path: string
+	@param path: a document-root path where the package should be imported. May exist.
+	@type  manifest: list of dict{'name': string, 'type': 'dir' or 'file', 'size': integer, 'digest': string}
+	@param manifest: the package files, as returned by getPackageManifest()
+
+	@rtype: list of dict{'name': string, 'digest': string, 'offset': integer}
+	@returns: the files to transfer (one per digest), with the offset
+	          to resume their transfer from (integer, or float for large values)
+	"""
+	getLogger().info(">> getPackageTransfers(%s)" % (path))
+	if not path.startswith('/'): path = '/' + path
+
+	ret = []
+	try:
+		ret = Package.getPackageTransfers(path, manifest)
+		for e in ret:
+			e['offset'] = _toXmlRpcNumber(e['offset'])
+	except Exception as e:
+		e =  Exception("Unable to perform operation: %s\n%s" % (str(e), Tools.getBacktrace()))
+		getLogger().info("<< getPackageTransfers(...): Fault:\n%s" % str(e))
+		raise(e)
+
+	getLogger().info("<< getPackageTransfers(%s): %d files to transfer" % (path, len(ret)))
+	return ret
+
+def importPackageFileChunk(digest, offset, content, useCompression = False):
+	"""
+	Transfers a part of a file to import with importPackageManifest().
+	
+	@since: 1.9
+
+	@type  digest: string
+	@param digest: the sha1 hex digest of the whole file, identifying it
+	@type  offset: integer (or float for offsets larger than 2^31)
+	@param offset: the position of this part in the file. 0 restarts the transfer.
+	@type  content: buffer string, encoded in mime64
+	@param content: the part of the file
+	@type  useCompression: bool
+	@param useCompression: if set to True, the content has been gziped before being mime64-encoded.
+
+	@rtype: integer
+	@returns: the offset of the next part (integer, or float for large values)
+	"""
+	getLogger().info(">> importPackageFileChunk(%s, %s, %s)" % (digest, offset, useCompression))
+
+	try:
+		content = base64.decodestring(content)
+		if useCompression:
+			content = zlib.decompress(content)
+		res = _toXmlRpcNumber(Package.stagePackageFileChunk(digest, long(offset), content))
+	except Exception as e:
+		e =  Exception("Unable to perform operation: %s\n%s" % (str(e), Tools.getBacktrace()))
+		getLogger().info("<< importPackageFileChunk(...): Fault:\n" + str(e))
+		raise(e)
+
+	getLogger().info("<< importPackageFileChunk(): %s" % str(res))
+	return res
+
+def importPackageManifest(path, manifest):
+	"""
+	Imports a package into the repository, once its changed files
+	have been transferred with importPackageFileChunk().
+	Only the files whose content changed are written.
+	
+	Unlike importPackageFile(), the destination package may exist:
+	it is updated.
+	
+	@since: 1.9
+
+	@type  path: string
+	@param path: a document-root path where the package should be imported. May exist.
+	@type  manifest: list of dict{'name': string, 'type': 'dir' or 'file', 'size': integer, 'digest': string}
+	@param manifest: the package files, as returned by getPackageManifest()
+
+	@throws Exception on error, for instance if a changed file was not transferred
+
+	@rtype: integer
+	@returns: the number of written files
+	"""
+	getLogger().info(">> importPackageManifest(%s)" % (path))
+	if not path.startswith('/'): path = '/' + path
+
+	res = 0
+	try:
+		res = Package.importPackageManifest(path, manifest)
+	except Exception as e:
+		e =  Exception("Unable to perform operation: %s\n%s" % (str(e), Tools.getBacktrace()))
+		getLogger().info("<< importPackageManifest(...): Fault:\n" + str(e))
+		raise(e)
+	
+	getLogger().info("<< importPackageManifest(): %s files written" % str(res))
+	return res
+
 def createPackage(path):
 	"""
 	Creates a new package tree somewhere in the docroot.
@@ -1315,35 +1563,120 @@ def getSystemInformation():
 
 	return ret
 
-def getCounter(path):
+def _toXmlRpcNumber(value):
 	"""
-	TODO.
+	XML-RPC integers are limited to 32 bits.
 	"""
-	return 0
+	if isinstance(value, (int, long)) and not (-2**31 <= value < 2**31):
+		return float(value)
+	return value
 
-def getCounters(paths):
+def _getCounters(paths, component):
 	"""
-	TODO.
+	Returns a dict of counter values indexed by their paths,
+	empty if the component is unknown or did not answer.
 	"""
-	return {}
+	if component == "ts":
+		cm = CounterManager.instance()
+		return dict([ (path, cm.get(path)) for path in paths ])
+	elif component == "tacs":
+		return ProbeManager.instance().getCounters(paths) or {}
+	else:
+		return {}
+
+def getCounter(path, component = "ts"):
+	"""
+	Returns the value of a counter or of one of its properties,
+	identified by its path (for instance server.ts.jobs.submitted,
+	server.ts.jobs.dispatch.latency._p99).
+	
+	If the counter is not a leaf counter, returns the sum of the values
+	of the leaf counters below it.
+	
+	@since: 1.9
+
+	@type  path: string
+	@param path: the counter path, with an optional ._property suffix
+	@type  component: string
+	@param component: the server component to retrieve the counter from.
+	ts = testerman server; tacs = connected TACS
 
-def getAllCounters():
+	@rtype: number, or None
+	@returns: the counter value, or None if the counter does not exist
 	"""
-	TODO
+	return _toXmlRpcNumber(_getCounters([ path ], component).get(path))
+
+def getCounters(paths, component = "ts"):
+	"""
+	Returns the values of several counters at once.
+	See getCounter().
+	
+	@since: 1.9
+
+	@type  paths: list of strings
+	@param paths: the counter paths, with optional ._property suffixes
+	@type  component: string
+	@param component: the server component to retrieve the counters from.
+	ts = testerman server; tacs = connected TACS
+
+	@rtype: dict[string] of numbers
+	@returns: the counter values, indexed by their paths (None if the counter does not exist)
 	"""
-	return {}
+	ret = _getCounters(paths, component)
+	return dict([ (k, _toXmlRpcNumber(v)) for (k, v) in ret.items() ])
+
+def getAllCounters(component = "ts"):
+	"""
+	Returns the values of all the leaf counters, with their properties
+	(such as path._max, path._rate, or histogram percentiles path._p99).
+	
+	@since: 1.9
+
+	@type  component: string
+	@param component: the server component to retrieve the counters from.
+	ts = testerman server; tacs = connected TACS
+
+	@rtype: dict[string] of numbers
+	@returns: the counter and property values, indexed by their paths
+	"""
+	if component == "ts":
+		ret = CounterManager.instance().getAllLeafPropertyValues()
+	elif component == "tacs":
+		ret = ProbeManager.instance().getCounters(None) or {}
+	else:
+		ret = {}
+	return dict([ (k, _toXmlRpcNumber(v)) for (k, v) in ret.items() ])
 
 def resetCounter(path):
 	"""
-	TODO
+	Resets a server counter and all the counters below it.
+	
+	@since: 1.9
+
+	@type  path: string
+	@param path: the counter path
+
+	@rtype: bool
+	@returns: True if the counter was found and reset, False otherwise
 	"""
-	return False
+	getLogger().info(">> resetCounter(%s)" % path)
+	ret = CounterManager.instance().reset(path)
+	getLogger().info("<< resetCounter: %s" % ret)
+	return ret
 
 def resetAllCounters():
 	"""
-	TODO
+	Resets all server counters.
+
+	@since: 1.9
+
+	@rtype: bool
+	@returns: True
 	"""
-	return False
+	getLogger().info(">> resetAllCounters()")
+	CounterManager.instance().resetAll()
+	getLogger().info("<< resetAllCounters")
+	return True
 
 def getVariables(component = "ts"):
 	"""
@@ -37,6 +37,10 @@ Modifications for Testerman:
   Convenient to inject placeholders values with \n replaced with
   <br /> when generating code, for instance.
 - added support for #[[literal content]]# (Velocity 1.7)
+- added Template.compile(), that precompiles the parsed template
+  into a tree of Python render functions (constant texts merged,
+  comments dropped, no per-node dispatch). Once called, merge()
+  and merge_to() use the compiled renderer.
 """
 
 import re, operator, os
@@ -85,6 +89,7 @@ class Template:
     def __init__(self, content):
         self.content = content
         self.root_element = None
+        self.render_function = None
 
     def merge(self, namespace, loader=None, xform=None):
         output = StringIO.StringIO()
@@ -95,10 +100,21 @@ class Template:
         if not self.root_element:
             self.root_element = TemplateBody(self.content)
 
+    def compile(self):
+        """Precompiles the template into a render function
+        render(stream, namespace, loader, xform) and returns it."""
+        self.ensure_compiled()
+        if self.render_function is None:
+            self.render_function = self.root_element.compile()
+        return self.render_function
+
     def merge_to(self, namespace, fileobj, loader=None, xform=None):
         if loader is None: loader = NullLoader()
         self.ensure_compiled()
-        self.root_element.evaluate(fileobj, namespace, loader, xform)
+        if self.render_function is not None:
+            self.render_function(fileobj, namespace, loader, xform)
+        else:
+            self.root_element.evaluate(fileobj, namespace, loader, xform)
 
 
 class TemplateError(Exception):
@@ -209,6 +225,10 @@ class _Element:
     def syntax_error(self, expected):
         return TemplateSyntaxError(self, expected)
 
+    def compile(self):
+        # Default: no specific compilation, the element evaluates itself
+        return self.evaluate
+
     def identity_match(self, pattern):
         m = pattern.match(self._full_text, self.end)
         if not m:
@@ -487,6 +507,19 @@ class Placeholder(_Element):
         else:
             stream.write(unicode(value))
 
+    def compile(self):
+        calculate = self.expression.calculate
+        if self.silent: default = ''
+        else: default = self.my_text()
+        def render(stream, namespace, loader, xform=None):
+            value = calculate(namespace, loader)
+            if value is None: value = default
+            if xform:
+                stream.write(xform(unicode(value)))
+            else:
+                stream.write(unicode(value))
+        return render
+
 
 class LiteralContent(_Element):
     START = re.compile(r'#\[\[(.*?)(\]\]#.*)', re.S + re.M)
@@ -512,6 +545,9 @@ class SimpleReference(_Element):
 class Null:
     def evaluate(self, stream, namespace, loader, xform=None): pass
 
+    def compile(self):
+        return None
+
 
 class Comment(_Element, Null):
     COMMENT = re.compile('#(?:#.*?(?:\n|$)|\*.*?\*#(?:[ \t]*\n)?)(.*)$', re.M + re.S)
@@ -621,6 +657,23 @@ class IfDirective(_Element):
                     return
             self.else_block.evaluate(stream, namespace, loader, xform)
 
+    def compile(self):
+        branches = [(self.condition.calculate, self.block.compile())]
+        branches += [(elseif.condition.calculate, elseif.block.compile()) for elseif in self.elseifs]
+        if isinstance(self.else_block, ElseBlock):
+            else_render = self.else_block.block.compile()
+        else:
+            else_render = None
+        def render(stream, namespace, loader, xform=None):
+            for condition, block_render in branches:
+                if condition(namespace, loader):
+                    if block_render is not None:
+                        block_render(stream, namespace, loader, xform)
+                    return
+            if else_render is not None:
+                else_render(stream, namespace, loader, xform)
+        return render
+
 
 class Assignment(_Element):
     START = re.compile(r'\s*\(\s*\$([a-z_][a-z0-9_]*)\s*=\s*(.*)$', re.S + re.I)
@@ -782,6 +835,27 @@ class ForeachDirective(_Element):
         except TypeError:
             raise
 
+    def compile(self):
+        calculate = self.value.calculate
+        loop_var_name = self.loop_var_name
+        block_render = self.block.compile()
+        def render(stream, namespace, loader, xform=None):
+            iterable = calculate(namespace, loader)
+            if iterable is None:
+                return
+            if hasattr(iterable, 'keys'): iterable = iterable.keys()
+            if not hasattr(iterable, '__getitem__'):
+                raise ValueError("value for $%s is not iterable in #foreach: %s" % (loop_var_name, iterable))
+            counter = 1
+            for item in iterable:
+                namespace = LocalNamespace(namespace)
+                namespace['velocityCount'] = counter
+                namespace[loop_var_name] = item
+                if block_render is not None:
+                    block_render(stream, namespace, loader, xform)
+                counter += 1
+        return render
+
 
 class TemplateBody(_Element):
     def parse(self):
@@ -793,6 +867,13 @@ class TemplateBody(_Element):
         namespace = LocalNamespace(namespace)
         self.block.evaluate(stream, namespace, loader, xform)
 
+    def compile(self):
+        block_render = self.block.compile()
+        def render(stream, namespace, loader, xform=None):
+            if block_render is not None:
+                block_render(stream, LocalNamespace(namespace), loader, xform)
+        return render
+
 
 class Block(_Element):
     def parse(self):
@@ -804,3 +885,34 @@ class Block(_Element):
     def evaluate(self, stream, namespace, loader, xform=None):
         for child in self.children:
             child.evaluate(stream, namespace, loader, xform)
+
+    def compile(self):
+        """Returns a render function, or None if the block renders nothing."""
+        renderers = []
+        texts = []
+        def flush_texts():
+            if texts:
+                text = ''.join(texts)
+                del texts[:]
+                renderers.append(lambda stream, namespace, loader, xform=None: stream.write(text))
+        for child in self.children:
+            if isinstance(child, Comment):
+                continue
+            if isinstance(child, (Text, FallthroughHashText)):
+                # Adjacent constant texts are written at once
+                texts.append(child.text)
+                continue
+            flush_texts()
+            child_render = child.compile()
+            if child_render is not None:
+                renderers.append(child_render)
+        flush_texts()
+        if not renderers:
+            return None
+        if len(renderers) == 1:
+            return renderers[0]
+        renderers = tuple(renderers)
+        def render(stream, namespace, loader, xform=None):
+            for child_render in renderers:
+                child_render(stream, namespace, loader, xform)
+        return render
@@ -27,11 +27,15 @@ import FileSystemBackend
 import FileSystemBackendManager
 
 import dulwich
+import dulwich.objects
 
+import cPickle as pickle
 import glob
 import logging
 import os
 import shutil
+import stat
+import threading
 import time
 
 ################################################################################
@@ -49,6 +53,199 @@ def fileExists(path):
 	except:
 		return False
 
+class RevisionHistoryIndex:
+	"""
+	Per-path history of the files of a GIT repository,
+	so that the history of a file can be retrieved without
+	walking through all the commits and their trees.
+
+	The commits from the head are indexed in chronological order,
+	and each commit is compared with the previous one: only the trees
+	that changed between them are traversed.
+	New commits are indexed incrementally, on demand, and the index
+	is saved in the repository control dir.
+	"""
+	VERSION = 1
+
+	def __init__(self, repo, filename):
+		self._repo = repo
+		self._filename = filename
+		self._mutex = threading.RLock()
+		self._reset()
+		self._load()
+
+	def _lock(self):
+		self._mutex.acquire()
+
+	def _unlock(self):
+		self._mutex.release()
+
+	def _reset(self):
+		#: the last indexed head
+		self._head = None
+		#: the indexed commits, in chronological order: list of (id, message, committer, commit_time, tree)
+		self._commits = []
+		#: the index of each commit in _commits, by commit id
+		self._commitIndexes = {}
+		#: the changes of each path: list of (commit index, blob sha, or None if deleted), by path
+		self._paths = {}
+
+	def _load(self):
+		try:
+			f = open(self._filename, 'rb')
+			try:
+				data = pickle.load(f)
+			finally:
+				f.close()
+			if data['version'] != self.VERSION:
+				return
+			self._head = data['head']
+			self._commits = data['commits']
+			self._paths = data['paths']
+			self._commitIndexes = dict([ (c[0], i) for (i, c) in enumerate(self._commits) ])
+			getLogger().info("Revision history index loaded, %d commits, %d paths" % (len(self._commits), len(self._paths)))
+		except IOError:
+			pass
+		except Exception as e:
+			getLogger().warning("Unable to load the revision history index %s, rebuilding it: %s" % (self._filename, str(e)))
+			self._reset()
+
+	def _save(self):
+		tmp = '%s.tmp' % self._filename
+		try:
+			f = open(tmp, 'wb')
+			try:
+				pickle.dump(dict(version = self.VERSION, head = self._head, commits = self._commits, paths = self._paths), f, pickle.HIGHEST_PROTOCOL)
+			finally:
+				f.close()
+			os.rename(tmp, self._filename)
+		except Exception as e:
+			getLogger().warning("Unable to save the revision history index %s: %s" % (self._filename, str(e)))
+
+	def update(self):
+		"""
+		Indexes the commits added since the last update, if any.
+		"""
+		head = self._repo.head()
+		self._lock()
+		try:
+			if head == self._head:
+				return
+
+			# Collect the commits that have not been indexed yet
+			newCommits = []
+			pending = [ head ]
+			seen = set()
+			while pending:
+				commitId = pending.pop()
+				if commitId in seen or commitId in self._commitIndexes:
+					continue
+				seen.add(commitId)
+				commit = self._repo[commitId]
+				newCommits.append(commit)
+				pending += commit.parents
+
+			if self._head and self._commits and not self._head in [ p for c in newCommits for p in c.parents ]:
+				# The history was rewritten: the last indexed head is not an ancestor of the current one anymore
+				getLogger().info("Revision history rewritten, rebuilding its index")
+				self._reset()
+				self.update()
+				return
+
+			newCommits.sort(key = lambda c: c.commit_time)
+			previousTree = self._commits and self._commits[-1][4] or None
+			for commit in newCommits:
+				index = len(self._commits)
+				changes = {}
+				self._diffTrees(previousTree, commit.tree, '', changes)
+				for (path, sha) in changes.items():
+					self._paths.setdefault(path, []).append((index, sha))
+				self._commits.append((commit.id, commit.message, commit.committer, commit.commit_time, commit.tree))
+				self._commitIndexes[commit.id] = index
+				previousTree = commit.tree
+			self._head = head
+			getLogger().debug("%d new commits indexed" % len(newCommits))
+			self._save()
+		finally:
+			self._unlock()
+
+	def _diffTrees(self, oldTreeId, newTreeId, prefix, changes):
+		"""
+		Fills changes with the new blob sha (or None if removed) of the files
+		that changed between two trees, indexed by their path.
+		"""
+		if oldTreeId == newTreeId:
+			return
+		old = {}
+		if oldTreeId:
+			for (mode, name, sha) in self._repo[oldTreeId].entries():
+				old[name] = (stat.S_ISDIR(mode), sha)
+		new = {}
+		if newTreeId:
+			for (mode, name, sha) in self._repo[newTreeId].entries():
+				new[name] = (stat.S_ISDIR(mode), sha)
+
+		for name in set(old.keys()) | set(new.keys()):
+			o = old.get(name, (False, None))
+			n = new.get(name, (False, None))
+			if o == n:
+				continue
+			path = prefix + name
+			# Subtrees
+			if o[0] or n[0]:
+				self._diffTrees(o[0] and o[1] or None, n[0] and n[1] or None, path + '/', changes)
+			# Files
+			oldBlob = not o[0] and o[1] or None
+			newBlob = not n[0] and n[1] or None
+			if oldBlob != newBlob:
+				changes[path] = newBlob
+
+	def getRevisions(self, path):
+		"""
+		@rtype: list of dict(message, committer, date, id, change)
+		@returns: the changes of a file, in chronological order.
+		id is the blob sha of the file; for a deleted file, it is
+		the sha of its last revision.
+		"""
+		self._lock()
+		try:
+			ret = []
+			lastSha = None
+			for (index, sha) in self._paths.get(path, []):
+				(commitId, message, committer, commitTime, tree) = self._commits[index]
+				if sha is None:
+					change = "deleted"
+				elif lastSha is None:
+					change = "added"
+				else:
+					change = "updated"
+				ret.append(dict(message = message, committer = committer, date = commitTime, id = sha or lastSha, change = change))
+				lastSha = sha
+			return ret
+		finally:
+			self._unlock()
+
+	def getBlobAt(self, path, commitId):
+		"""
+		@rtype: string, or None
+		@returns: the blob sha of a file as of a commit, or None if the file did not exist
+		in this commit or if the commit is not indexed.
+		"""
+		self._lock()
+		try:
+			index = self._commitIndexes.get(commitId)
+			if index is None:
+				return None
+			ret = None
+			for (i, sha) in self._paths.get(path, []):
+				if i > index:
+					break
+				ret = sha
+			return ret
+		finally:
+			self._unlock()
+
+
 class GitBackend(FileSystemBackend.FileSystemBackend):
 	"""
 	Properties:
@@ -88,6 +285,7 @@ class GitBackend(FileSystemBackend.FileSystemBackend):
 
 		self._repo = dulwich.repo.Repo(self['repository'])
 		self._defaultCommitter = self['default_committer']
+		self._revisionIndex = RevisionHistoryIndex(self._repo, os.path.join(self._repo.controldir(), 'testerman-revisions.idx'))
 			
 		return True
 	
@@ -127,13 +325,21 @@ class GitBackend(FileSystemBackend.FileSystemBackend):
 				getLogger().warning("Unable to read file %s: %s" % (filename, str(e)))
 				return None
 		else:
-			# We need to retrieve the file from the given revision
-			blob = self._repo.get_object(revision)
-			if not blob:
+			# We need to retrieve the file from the given revision,
+			# a blob sha (as returned by revisions()), or a commit id.
+			try:
+				obj = self._repo[revision]
+			except KeyError:
+				obj = None
+			if isinstance(obj, dulwich.objects.Commit):
+				self._revisionIndex.update()
+				sha = self._revisionIndex.getBlobAt(localpath, revision)
+				obj = sha and self._repo[sha] or None
+			if not obj:
 				getLogger().warning("Unable to read file %s (revision %s)" % (filename, revision))
 				return None
 			else:
-				return self._repo.get_object(revision).data
+				return obj.data
 		
 
 	def write(self, filename, content, baseRevision = None, reason = None, username = None):
@@ -403,63 +609,19 @@ class GitBackend(FileSystemBackend.FileSystemBackend):
 		
 		localname = filename
 		
-		ret = []
-		
 		# Only get history from the head, not from another branch yet.
-		
-		# Strategy: traverse our commits in chronological order.
-		# For each commit, check if the file is in the tree.
-		# Based on its pushed id, we will then be able to 
-		# see if the file was changed, unchanged, added, or removed, from
-		# one commit to another.
 		# There is no rename detection for now (could be done backward, based on the same sha).
-		commits = self._repo.revision_history(self._repo.head())
-		commits.reverse()
-		
-		lastchange = None
-		for c in commits:
-			# Check if the file was included in this commit
-			tree = self._repo.tree(c.tree)
-			in_this_commit = False
-			
-			# We have to traverse the tree, recursively if needed (if the localname contains directories)
-			# (here this is an iterative implementation)
-			elements = localname.split('/')
-			for i in range(len(elements)):
-				finalElement = (i == len(elements)-1)
-				for (mode, path, sha) in tree.entries():
-					if path == elements[i]:
-						# The element was in this commit
-						
-						if not finalElement:
-							tree = self._repo.tree(sha)
-							break
-						
-						# OK, final element, we have our file
-						in_this_commit = True
-
-						if lastchange:
-							if lastchange[1] == sha:
-								# no change
-								continue
-							else:
-								# file updated
-								lastchange = (dict(message = c.message, committer = c.committer, date = c.commit_time, id = sha, change = "updated"), sha)
-								ret.append(lastchange[0])
-						else:
-							# file added (or newborn)
-							lastchange = (dict(message = c.message, committer = c.committer, date = c.commit_time, id = sha, change = "added"), sha)
-							ret.append(lastchange[0])
-						break
-					
-			if not in_this_commit and lastchange:
-				# The file was seen at least once, and was deleted in this commit
-				lastchange = None
-				ret.append(dict(message = c.message, committer = c.committer, date = c.commit_time, id = sha, change = "deleted"))
-
-		return ret
+		self._revisionIndex.update()
+		return self._revisionIndex.getRevisions(localname)
 
 	
+	def watch(self, callback):
+		def onChange(path, recursive):
+			# Profiles are stored in a <script>.profiles dir, exposed as <script>/profiles
+			callback('/'.join([ e.endswith('.profiles') and '%s/profiles' % e[:-len('.profiles')] or e for e in path.split('/') ]), recursive)
+		self._watcher = FileSystemBackend.TreeWatcher(self['repository'], onChange, self._excludedPatterns)
+		return self._watcher.start()
+
 	def isdir(self, path):
 		path = self._realpath(path)
 		if not path: 
@@ -103,6 +103,21 @@ class LocalBackend(FileSystemBackend.FileSystemBackend):
 			getLogger().warning("Unable to read file %s: %s" % (filename, str(e)))
 			return None
 
+	def readChunk(self, filename, offset, size):
+		filename = self._realpath(filename)
+		if not filename: 
+			return None
+		
+		try:
+			f = open(filename)
+			f.seek(offset)
+			content = f.read(size)
+			f.close()
+			return content
+		except Exception as e:
+			getLogger().warning("Unable to read file %s: %s" % (filename, str(e)))
+			return None
+
 	def write(self, filename, content, baseRevision = None, reason = None, username = None):
 		"""
 		Makes sure that we can overwrite the file, if already exists:
@@ -266,6 +281,13 @@ class LocalBackend(FileSystemBackend.FileSystemBackend):
 		# Not yet implemented
 		return None
 	
+	def watch(self, callback):
+		def onChange(path, recursive):
+			# Profiles are stored in a <script>.profiles dir, exposed as <script>/profiles
+			callback('/'.join([ e.endswith('.profiles') and '%s/profiles' % e[:-len('.profiles')] or e for e in path.split('/') ]), recursive)
+		self._watcher = FileSystemBackend.TreeWatcher(self['basepath'], onChange, self._excludedPatterns)
+		return self._watcher.start()
+
 	def isdir(self, path):
 		path = self._realpath(path)
 		if not path: 
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Job log following by offset (getLogChunk),
+# on a job log in a local docroot.
+##
+
+import ConfigManager
+import EventManager
+import JobManager
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+TempDir = None
+
+class NotificationManager:
+	def dispatchNotification(self, notification):
+		pass
+
+def setUpModule():
+	global TempDir
+	TempDir = tempfile.mkdtemp()
+	os.makedirs(os.path.join(TempDir, 'archives'))
+	ConfigManager.instance().register("testerman.document_root", TempDir)
+	EventManager.TheManager = NotificationManager()
+
+def tearDownModule():
+	shutil.rmtree(TempDir)
+
+
+LOG_FILENAME = '/archives/job.log'
+
+class GetLogChunkTestSequence(unittest.TestCase):
+	def setUp(self):
+		self.filename = os.path.join(TempDir, LOG_FILENAME[1:])
+		if os.path.exists(self.filename):
+			os.remove(self.filename)
+		self.job = JobManager.Job('test')
+		self.job._logFilename = LOG_FILENAME
+		self.job.setState(JobManager.Job.STATE_RUNNING)
+
+	def append(self, content):
+		f = open(self.filename, 'ab')
+		f.write(content)
+		f.close()
+
+	def test_noLog(self):
+		# Not created yet
+		self.assertEqual(self.job.getLogChunk(0, 100), ('', 0, False))
+		self.job.setState(JobManager.Job.STATE_COMPLETE)
+		self.assertRaises(IOError, self.job.getLogChunk, 0, 100)
+		# Not any log for this job
+		self.job._logFilename = None
+		self.assertEqual(self.job.getLogChunk(0, 100), ('', 0, True))
+
+	def test_completeLines(self):
+		self.append('<a />\n<b />\n<c')
+		# The last line may be being written
+		self.assertEqual(self.job.getLogChunk(0, 100), ('<a />\n<b />\n', 12, False))
+		self.assertEqual(self.job.getLogChunk(12, 100), ('', 12, False))
+		self.append(' />\n')
+		self.assertEqual(self.job.getLogChunk(12, 100), ('<c />\n', 18, False))
+
+	def test_chunks(self):
+		self.append('<a />\n' * 5)
+		self.assertEqual(self.job.getLogChunk(0, 15), ('<a />\n<a />\n', 12, False))
+		self.assertEqual(self.job.getLogChunk(12, 15), ('<a />\n<a />\n', 24, False))
+		self.assertEqual(self.job.getLogChunk(24, 15), ('<a />\n', 30, False))
+
+	def test_longLine(self):
+		# A line larger than a chunk is split
+		self.append('<a>%s</a>\n' % ('x' * 20))
+		self.assertEqual(self.job.getLogChunk(0, 10), ('<a>xxxxxxx', 10, False))
+		self.assertEqual(self.job.getLogChunk(10, 10), ('xxxxxxxxxx', 20, False))
+		self.assertEqual(self.job.getLogChunk(20, 10), ('xxx</a>\n', 28, False))
+
+	def test_complete(self):
+		self.append('<a />\n<b />\n')
+		self.job.setState(JobManager.Job.STATE_COMPLETE)
+		# Complete once the whole log is read only
+		self.assertEqual(self.job.getLogChunk(0, 6), ('<a />\n', 6, False))
+		self.assertEqual(self.job.getLogChunk(6, 100), ('<b />\n', 12, True))
+		self.assertEqual(self.job.getLogChunk(12, 100), ('', 12, True))
+
+	def test_completeWithIncompleteLine(self):
+		self.append('<a />\n<b')
+		self.job.setState(JobManager.Job.STATE_ERROR)
+		# Not written anymore: returned as is
+		self.assertEqual(self.job.getLogChunk(0, 100), ('<a />\n<b', 8, True))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# File by file package importation tests
+# (manifest, transfers, staging, importation),
+# on a local docroot.
+##
+
+import ConfigManager
+import EventManager
+import FileSystemManager
+import Package
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+TempDir = None
+
+class NotificationManager:
+	def dispatchNotification(self, notification):
+		pass
+
+def setUpModule():
+	global TempDir
+	TempDir = tempfile.mkdtemp()
+	os.makedirs(os.path.join(TempDir, 'docroot', 'repository'))
+	os.makedirs(os.path.join(TempDir, 'var'))
+	cm = ConfigManager.instance()
+	cm.register("testerman.document_root", os.path.join(TempDir, 'docroot'))
+	cm.register("testerman.var_root", os.path.join(TempDir, 'var'))
+	# No metadata cache: the tests update the docroot directly
+	cm.register("testerman.fs.cache.max_entries", 0)
+	cm.register("ts.name", "test")
+	cm.set_transient("ts.server_root", os.path.dirname(os.path.abspath(__file__)))
+	FileSystemManager.initialize()
+	EventManager.TheManager = NotificationManager()
+
+def tearDownModule():
+	shutil.rmtree(TempDir)
+
+def docrootFilename(path):
+	return os.path.join(TempDir, 'docroot', path[1:])
+
+def writeFile(path, content):
+	filename = docrootFilename(path)
+	if not os.path.isdir(os.path.dirname(filename)):
+		os.makedirs(os.path.dirname(filename))
+	f = open(filename, 'wb')
+	f.write(content)
+	f.close()
+
+def readFile(path):
+	f = open(docrootFilename(path), 'rb')
+	try:
+		return f.read()
+	finally:
+		f.close()
+
+
+SOURCE = '/repository/source'
+DESTINATION = '/repository/destination'
+
+FILES = {
+	'package.xml': Package.DEFAULT_PACKAGE_DESCRIPTION,
+	'src/main.ats': 'print "main"\n',
+	# Same content: staged once
+	'src/copy.ats': 'print "main"\n',
+	'src/lib/data.py': ''.join([ chr(i % 251) for i in range(5000) ]),
+	'profiles/default.profile': '<profile />\n',
+}
+
+class ImportPackageManifestTestSequence(unittest.TestCase):
+	def setUp(self):
+		for path in [ SOURCE, DESTINATION ]:
+			if os.path.isdir(docrootFilename(path)):
+				shutil.rmtree(docrootFilename(path))
+		stagingDir = os.path.join(TempDir, 'var', 'package-staging')
+		if os.path.isdir(stagingDir):
+			shutil.rmtree(stagingDir)
+		for (name, content) in FILES.items():
+			writeFile('%s/%s' % (SOURCE, name), content)
+		self.manifest = Package.getPackageManifest(SOURCE)
+
+	def stage(self, transfers):
+		for transfer in transfers:
+			content = readFile('%s/%s' % (SOURCE, transfer['name']))
+			Package.stagePackageFileChunk(transfer['digest'], transfer['offset'], content[transfer['offset']:])
+
+	def importPackage(self):
+		self.stage(Package.getPackageTransfers(DESTINATION, self.manifest))
+		return Package.importPackageManifest(DESTINATION, self.manifest)
+
+	def assertImported(self):
+		for (name, content) in FILES.items():
+			self.assertEqual(readFile('%s/%s' % (DESTINATION, name)), content)
+
+	def test_manifest(self):
+		entries = dict([ (e['name'], e) for e in self.manifest ])
+		self.assertEqual(sorted(entries.keys()), sorted(FILES.keys() + [ 'src', 'src/lib', 'profiles' ]))
+		self.assertEqual(entries['src/lib']['type'], 'dir')
+		self.assertEqual(entries['src/lib/data.py']['size'], 5000)
+		self.assertEqual(entries['src/main.ats']['digest'], entries['src/copy.ats']['digest'])
+		self.assertEqual(Package.getPackageManifest('/repository/missing'), None)
+
+	def test_newPackage(self):
+		transfers = Package.getPackageTransfers(DESTINATION, self.manifest)
+		# One transfer per digest
+		self.assertEqual(len(transfers), len(FILES) - 1)
+		self.assertEqual([ x['offset'] for x in transfers ], [ 0 ] * len(transfers))
+		self.stage(transfers)
+		self.assertEqual(Package.importPackageManifest(DESTINATION, self.manifest), len(FILES))
+		self.assertImported()
+		# Imported files are unstaged
+		self.assertEqual(os.listdir(os.path.join(TempDir, 'var', 'package-staging')), [])
+
+	def test_unchangedFilesSkipped(self):
+		self.importPackage()
+		self.assertEqual(Package.getPackageTransfers(DESTINATION, self.manifest), [])
+		self.assertEqual(Package.importPackageManifest(DESTINATION, self.manifest), 0)
+
+	def test_changedFileOnly(self):
+		self.importPackage()
+		writeFile('%s/src/lib/data.py' % DESTINATION, 'changed')
+		transfers = Package.getPackageTransfers(DESTINATION, self.manifest)
+		self.assertEqual([ (x['name'], x['offset']) for x in transfers ], [ ('src/lib/data.py', 0) ])
+		self.stage(transfers)
+		self.assertEqual(Package.importPackageManifest(DESTINATION, self.manifest), 1)
+		self.assertImported()
+
+	def test_resume(self):
+		content = FILES['src/lib/data.py']
+		digest = [ e['digest'] for e in self.manifest if e['name'] == 'src/lib/data.py' ][0]
+		# Interrupted transfer
+		self.assertEqual(Package.stagePackageFileChunk(digest, 0, content[:2048]), 2048)
+		transfers = Package.getPackageTransfers(DESTINATION, self.manifest)
+		self.assertEqual([ x['offset'] for x in transfers if x['digest'] == digest ], [ 2048 ])
+		# Only a consistent offset can be resumed from
+		self.assertRaises(Exception, Package.stagePackageFileChunk, digest, 1024, content[1024:])
+		self.stage(transfers)
+		self.assertEqual(Package.importPackageManifest(DESTINATION, self.manifest), len(FILES))
+		self.assertImported()
+
+	def test_invalidStagedFile(self):
+		self.stage(Package.getPackageTransfers(DESTINATION, self.manifest))
+		digest = [ e['digest'] for e in self.manifest if e['name'] == 'src/lib/data.py' ][0]
+		Package.stagePackageFileChunk(digest, 0, 'x' * 5000)
+		# Checked before writing anything, and removed
+		self.assertRaises(Exception, Package.importPackageManifest, DESTINATION, self.manifest)
+		self.assertFalse(os.path.exists(docrootFilename(DESTINATION)))
+		self.assertFalse(os.path.exists(Package._getStagingFilename(digest)))
+		# Retried
+		transfers = Package.getPackageTransfers(DESTINATION, self.manifest)
+		self.assertEqual([ (x['digest'], x['offset']) for x in transfers ], [ (digest, 0) ])
+		self.stage(transfers)
+		self.assertEqual(Package.importPackageManifest(DESTINATION, self.manifest), len(FILES))
+		self.assertImported()
+
+	def test_invalidStagedFileTransfer(self):
+		self.stage(Package.getPackageTransfers(DESTINATION, self.manifest))
+		digest = [ e['digest'] for e in self.manifest if e['name'] == 'src/lib/data.py' ][0]
+		Package.stagePackageFileChunk(digest, 0, 'x' * 5000)
+		# Completely staged, but invalid: staged again
+		transfers = Package.getPackageTransfers(DESTINATION, self.manifest)
+		self.assertEqual([ (x['digest'], x['offset']) for x in transfers ], [ (digest, 0) ])
+		self.stage(transfers)
+		self.assertEqual(Package.importPackageManifest(DESTINATION, self.manifest), len(FILES))
+		self.assertImported()
+
+	def test_notImportable(self):
+		manifest = self.manifest + [ { 'name': '../outside.py', 'type': 'file', 'size': 1, 'digest': '0' * 40 } ]
+		self.assertEqual([ x for x in Package.getPackageTransfers(DESTINATION, manifest) if x['name'] == '../outside.py' ], [])
+		self.stage(Package.getPackageTransfers(DESTINATION, manifest))
+		self.assertEqual(Package.importPackageManifest(DESTINATION, manifest), len(FILES))
+		self.assertFalse(os.path.exists(docrootFilename('/repository/outside.py')))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Binary log event encoding tests.
+##
+
+import TestermanTCI
+
+import marshal
+import struct
+import unittest
+
+
+class Proxy:
+	"""
+	A template proxy-like object.
+	"""
+	def __init__(self, message):
+		self._message = message
+	def toMessage(self):
+		return self._message
+
+class Unencodable:
+	def __str__(self):
+		return 'unencodable'
+
+
+class LogEventEncodingTestSequence(unittest.TestCase):
+	def roundTrip(self, event):
+		return TestermanTCI.decodeLogEvent(TestermanTCI.encodeLogEvent(event))
+
+	def test_simpleTypes(self):
+		values = [ None, True, False, 0, -1, 2**63 - 1, -2**63, 2**100, -2**100, 1.5, -0.25, '', 'a\x00\xff', u'', u'\xe9€' ]
+		event = ('message', { 'class': 'event', 'timestamp': 1.5 }, ('v', [ ('value', v) for v in values ]))
+		decoded = self.roundTrip(event)
+		self.assertEqual(decoded, event)
+		# Strings and unicode strings, booleans and integers are kept apart
+		self.assertEqual([ type(v) for (name, v) in decoded[2][1] if not type(v) in (int, long) ], [ type(v) for v in values if not type(v) in (int, long) ])
+
+	def test_structures(self):
+		message = { 'rows': [ { 'id': 1, 'name': u'\xe9' }, { 'id': 2, 'name': None } ], 'choice': ('a', [ 1, ('b', {}) ]), 'empty': [] }
+		event = ('message', { 'class': 'event', 'tc': 'tc1' }, ('v', [ ('message', message) ]))
+		self.assertEqual(self.roundTrip(event), event)
+
+	def test_bodies(self):
+		for body in [ None, ('t', u'text <&>'), ('c', 'cdata') ]:
+			event = ('user', { 'class': 'user' }, body)
+			self.assertEqual(self.roundTrip(event), event)
+
+	def test_convertedValues(self):
+		event = ('message', {}, ('v', [ ('proxy', Proxy({ 'a': Proxy(1) })), ('object', Unencodable()), ('choice', (1, 2, 3)) ]))
+		self.assertEqual(self.roundTrip(event), ('message', {}, ('v', [ ('proxy', { 'a': 1 }), ('object', u'unencodable'), ('choice', (1, 2, 3)) ])))
+		self.assertEqual(TestermanTCI.logEventToXml(self.roundTrip(event)), TestermanTCI.logEventToXml(event))
+
+	def test_invalidData(self):
+		data = TestermanTCI.encodeLogEvent(('message', { 'class': 'event' }, ('v', [ ('value', [ 'a', 1 ]) ])))
+		invalid = [
+			'',
+			# Truncated, or followed by other data
+			data[:-1],
+			data + 'N',
+			# Not an event
+			TestermanTCI.encodeLogEvent(('message', { 'class': 'event' })),
+			TestermanTCI.encodeLogEvent(('message', 'class', None)),
+			# Unknown format version, or tag
+			data.replace(struct.pack('>q', TestermanTCI.LogEventFormatVersion), struct.pack('>q', 0), 1),
+			'c' + data[1:],
+			marshal.dumps((TestermanTCI.LogEventFormatVersion, 'message', {}, None), 2),
+			# Inconsistent lengths and counts
+			'(\xff\xff\xff\xff',
+			's\x00\x00\x01\x00abc',
+			'l\x00\x00\x00\x03 12',
+			'u\x00\x00\x00\x01\xff',
+			# Not a simple dict key
+			'{\x00\x00\x00\x01[\x00\x00\x00\x00N',
+			# Too deeply nested
+			'[\x00\x00\x00\x01' * (TestermanTCI.MaxLogEventDepth + 1) + 'N',
+		]
+		for data in invalid:
+			self.assertRaises(Exception, TestermanTCI.decodeLogEvent, data)
+
+
+if __name__ == "__main__":
+	unittest.main()
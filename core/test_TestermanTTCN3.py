@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# TestermanTTCN3 tests, executed in a minimal local TE
+# (local log file, no TACS).
+##
+
+import TestermanTCI
+
+import os
+import tempfile
+import unittest
+
+
+LogFilename = None
+
+def setUpModule():
+	global LogFilename, T
+	(fd, LogFilename) = tempfile.mkstemp(suffix = '.log')
+	os.close(fd)
+	TestermanTCI.initialize(ilServerAddress = None, logFilename = LogFilename)
+	import TestermanSA
+	import TestermanPA
+	import TestermanTTCN3 as T
+	TestermanSA.initialize(None)
+	TestermanPA.initialize()
+	T._initialize()
+
+def tearDownModule():
+	T._finalize()
+	os.remove(LogFilename)
+
+def readLog():
+	f = open(LogFilename)
+	try:
+		return f.read()
+	finally:
+		f.close()
+
+
+class ProcessPtcTestSequence(unittest.TestCase):
+	def test_logFromProcessPtc(self):
+		class LogBehaviour(T.Behaviour):
+			def body(self, message):
+				T.log(message)
+				T.setverdict("pass")
+
+		class TC_PROCESS_PTC_LOG(T.TestCase):
+			def body(self):
+				ptc = self.create(process = True)
+				ptc.start(LogBehaviour(), message = "logged from a PTC process")
+				ptc.done()
+
+		self.assertEqual(TC_PROCESS_PTC_LOG().execute(), "pass")
+		log = readLog()
+		self.assertTrue("logged from a PTC process" in log)
+		self.assertFalse("terminated unexpectedly" in log)
+
+	def test_logFromThreadPtc(self):
+		class LogBehaviour(T.Behaviour):
+			def body(self, message):
+				T.log(message)
+				T.setverdict("pass")
+
+		class TC_THREAD_PTC_LOG(T.TestCase):
+			def body(self):
+				ptc = self.create()
+				ptc.start(LogBehaviour(), message = "logged from a PTC thread")
+				ptc.done()
+
+		self.assertEqual(TC_THREAD_PTC_LOG().execute(), "pass")
+		self.assertTrue("logged from a PTC thread" in readLog())
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -391,6 +391,8 @@ class HttpResponseCodec(CodecManager.IncrementalCodec):
 		Incremental decoder version:
 		- detect missing bytes if a content-length is provided
 		- able to decode Transfer-Encoding: chunked
+		- only consumes the bytes of the decoded response, so that
+		  pipelined responses can be decoded from the same buffer
 		"""
 		ret = {}
 		lines = data.split('\r\n')
@@ -467,6 +469,14 @@ class HttpResponseCodec(CodecManager.IncrementalCodec):
 
 			except IndexError:
 				return self.needMoreData()
+
+			# remainingPayload is what follows the last chunk size line:
+			# the final empty line, possibly after some trailers
+			consumedBytes = len(data) - len(remainingPayload)
+			if remainingPayload.startswith('\r\n'):
+				consumedBytes += 2
+			elif '\r\n\r\n' in remainingPayload:
+				consumedBytes += remainingPayload.index('\r\n\r\n') + 4
 		
 		else:
 			# No chunk
@@ -481,12 +491,18 @@ class HttpResponseCodec(CodecManager.IncrementalCodec):
 				elif bl > cl:
 					# Truncate the body
 					ret['body'] = ret['body'][:cl]
+				consumedBytes = len(data) - bl + cl
 			else:
 				# No chunk, no content-length: maybe this is normal (204, 304 and 1xx) or we wait until the end of the connection if we can
-				if not complete and not (ret['status'] in [204, 304] or ret['status'] <= 199):
+				if ret['status'] in [204, 304] or ret['status'] <= 199:
+					consumedBytes = len(data) - len(ret['body'])
+					ret['body'] = ''
+				elif not complete:
 					return self.needMoreData()
+				else:
+					consumedBytes = len(data)
 		
-		return self.decoded(ret, self.getSummary(ret))
+		return self.decoded(ret, self.getSummary(ret), consumedBytes)
 
 	def getSummary(self, template):
 		"""
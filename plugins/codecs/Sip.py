@@ -766,10 +766,62 @@ def decodeHeaderBody(value, name):
 	decodedValue = decoder(value)
 	return decodedValue
 
-def decodeMessage(s):
+def splitHeaderValue(name, value):
+	"""
+	Splits a header line value into its encoded values
+	(multivalued headers may be comma-separated).
+	"""
+	if name in MultiValuedHeaders:
+		return filter(lambda x: x, map(lambda x: x.strip(), value.split(',')))
+	else:
+		return [ value ]
+
+def decodeHeader(name, values):
+	"""
+	Decodes the values of all the header lines for the header whose
+	internal name/identifier is name.
+	
+	Returns a tuple (fieldValue, rawValues).
+	"""
+	fieldValue = None
+	rawValues = []
+	for i in range(len(values)):
+		# Split multivalued headers into multiple headers, if needed.
+		encodedValues = splitHeaderValue(name, values[i])
+		decodedValues = map(lambda x: decodeHeaderBody(x, name), encodedValues)
+
+		if len(decodedValues) == 1:
+			value = decodedValues[0]
+		else:
+			value = decodedValues
+
+		if i == 0:
+			# First header line - if the header is supposed to be multivalued,
+			# creates it as a list, always.
+			if name in MultiValuedHeaders:
+				fieldValue = isinstance(value, list) and value or [ value ]
+			else:
+				fieldValue = value
+		else:
+			# Already exists. Already a list ? if not, turns it to a list
+			if not isinstance(fieldValue, list):
+				fieldValue = [ fieldValue ]
+			if isinstance(value, list):
+				fieldValue += value
+			else:
+				fieldValue.append(value)
+		# In any case, add the raw value as a list
+		rawValues += encodedValues
+	return (fieldValue, rawValues)
+
+def decodeMessage(s, log = None):
 	"""
 	s is a list of lines after the request/status line.
 	Also contains a body.
+	
+	Header lines are indexed in one pass over the message, then decoded.
+	A header that cannot be decoded is kept as its raw value, which is
+	reported to log(txt), if provided.
 	"""
 	ret = {}
 	s = s.split('\r\n')
@@ -781,46 +833,13 @@ def decodeMessage(s):
 
 	headers = {}
 	def addHeader(previousHeaderLine):
-		# Split multivalued headers into multiple headers, if needed.
-
 		s = previousHeaderLine.split(':', 1)
 		fieldName = s[0].strip()
 		encodedValue = s[1].strip()
 		name = fieldNameToName(fieldName)
-		if name in MultiValuedHeaders:
-			encodedValues = filter(lambda x: x, map(lambda x: x.strip(), encodedValue.split(',')))
-		else:
-			encodedValues = [ encodedValue ]
-
-		decodedValues = map(lambda x: decodeHeaderBody(x, name), encodedValues)
-
-		if len(decodedValues) == 1:
-			value = decodedValues[0]
-		else:
-			value = decodedValues
-
-		if name in headers:
-			# Already exists. Already a list ? if not, turns it to a list
-			v = headers[name]['fieldValue']
-			if not isinstance(v, list):
-				headers[name]['fieldValue'] = [v]
-			if isinstance(value, list):
-				for val in value:
-					headers[name]['fieldValue'].append(val)
-			else:
-				headers[name]['fieldValue'].append(value)
-			# In any case, add the raw value as a list
-			headers[name]['rawValues'] += encodedValues
-		else:
-			# First header line - if the header is supposed to be multivalued,
-			# creates it as a list, always.
-			if name in MultiValuedHeaders:
-				headers[name] = { 'fieldName': fieldName, 'fieldValue': isinstance(value, list) and value or [ value ] }
-			else:
-				headers[name] = { 'fieldName': fieldName, 'fieldValue': value }
-
-			# In any case, add the raw value as a list
-			headers[name]['rawValues'] = encodedValues
+		if not name in headers:
+			headers[name] = (fieldName, [])
+		headers[name][1].append(encodedValue)
 
 	i = 1
 	previousHeaderLine = None
@@ -848,6 +867,16 @@ def decodeMessage(s):
 		body = '\r\n'.join(s[i:])
 		ret['messageBody'] = body
 
+	for name, (fieldName, values) in headers.items():
+		try:
+			fieldValue, rawValues = decodeHeader(name, values)
+		except Exception as e:
+			if log:
+				log("Unable to decode header %s, using its raw value: %s" % (fieldName, str(e)))
+			rawValues = values
+			fieldValue = len(rawValues) == 1 and rawValues[0] or rawValues
+		headers[name] = { 'fieldName': fieldName, 'fieldValue': fieldValue, 'rawValues': rawValues }
+
 	ret['messageHeaders'] = headers
 	return ret
 
@@ -885,7 +914,7 @@ class SipCodec(CodecManager.Codec):
 		return (encodeMessage(template), 'SIP message')
 
 	def decode(self, data):
-		return (decodeMessage(data), 'SIP message')
+		return (decodeMessage(data, self.log), 'SIP message')
 
 if __name__ != '__main__':
 	CodecManager.registerCodecClass('sip', SipCodec)
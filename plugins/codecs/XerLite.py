@@ -36,24 +36,15 @@
 
 import CodecManager
 
-import StringIO
 import codecs
-import xml.dom.minidom
+import xml.parsers.expat
 
-# "overriden" Document.toxml and toprettyxml to optionaly write the prolog.
 
-def writexml(doc, prolog = True, encoding = None, indent = "", addindent = "", newl = ""):
-	writer = StringIO.StringIO()
-	if encoding is not None:
-		writer = codecs.lookup(encoding)[3](writer)
-	if prolog:
-		if encoding is None:
-			writer.write('<?xml version="1.0" ?>%s' % newl)
-		else:
-			writer.write('<?xml version="1.0" encoding="%s"?>%s' % (encoding, newl))
-	for node in doc.childNodes:
-		node.writexml(writer, indent, addindent, newl)
-	return writer.getvalue()
+def escape(data):
+	"""
+	Escapes a text value, the way minidom does.
+	"""
+	return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
 
 class XerLiteCodec(CodecManager.Codec):
 	"""
@@ -70,58 +61,139 @@ class XerLiteCodec(CodecManager.Codec):
 	"""
 	def encode(self, template):
 		(rootTag, value) = template
-		dom = xml.dom.minidom.getDOMImplementation().createDocument(None, rootTag, None)
-		root_element = dom.documentElement
-		self._encode(dom, root_element, value)
+		encoding = self.getProperty('encoding', 'utf-8')
+		out = []
+		if self.getProperty('write_prolog', True):
+			if encoding is None:
+				out.append('<?xml version="1.0" ?>')
+			else:
+				out.append('<?xml version="1.0" encoding="%s"?>' % encoding)
+			if not self.getProperty('canonical', False):
+				out.append('\n')
 		if not self.getProperty('canonical', False):
-			ret = writexml(dom, prolog = self.getProperty('write_prolog', True), encoding = self.getProperty('encoding', 'utf-8'), addindent = "\t", newl = "\n")
+			self._encode(out, rootTag, value, "", "\t", "\n")
 		else:
-			ret = writexml(dom, prolog = self.getProperty('write_prolog', True), encoding = self.getProperty('encoding', 'utf-8'))
+			self._encode(out, rootTag, value, "", "", "")
+		ret = u''.join(out)
+		if encoding is not None:
+			ret = codecs.lookup(encoding).encode(ret)[0]
 		return (ret, "XML data")
 	
-	def _encode(self, doc, element, value):
+	def _encode(self, out, tag, value, indent, addindent, newl):
 		"""
-		@type  doc: Document
-		@type  element: Element
+		Writes the element to out, as minidom would.
+		
+		@type  out: list of unicode
+		@type  tag: string
 		@type  value: basetring, or a list of (string, value)
 		"""
 		if isinstance(value, list):
 			# OK, children present. Ignoring value/cdata
-			for (tag, v) in value:
-				e = doc.createElement(tag)
-				self._encode(doc, e, v)
-				element.appendChild(e)
+			if value:
+				out.append("%s<%s>%s" % (indent, tag, newl))
+				for (t, v) in value:
+					self._encode(out, t, v, indent + addindent, addindent, newl)
+				out.append("%s</%s>%s" % (indent, tag, newl))
+			else:
+				out.append("%s<%s/>%s" % (indent, tag, newl))
 		else:
-			e = doc.createTextNode(unicode(value))
-			element.appendChild(e)
+			out.append("%s<%s>%s</%s>%s" % (indent, tag, escape(unicode(value)), tag, newl))
 			
 	def decode(self, data):
-		ret = None
-		dom = xml.dom.minidom.parseString(data)
-		element = dom.documentElement
-		ret = self._decode(element)
-		return (ret, "XML data")
-	
-	def _decode(self, element):
 		"""
-		Recursive decoding.
-		@type  element: Element
-		
-		@rtype: tuple (tag, list or unicode)
+		Streaming decoding: the Testerman structure is built from the
+		expat parser events, without building a DOM.
 		"""
-		tag = element.tagName
-		
-		# Now retrieve children, if any
-		children = []
-		for node in element.childNodes:
-			if node.nodeType == node.ELEMENT_NODE:
-				children.append(self._decode(node))
-			# We should return only if these nodes are the first one.. ?
-			elif node.nodeType == node.TEXT_NODE and node.nodeValue.strip():
-				return (tag, node.nodeValue.strip())
-			# Ignore other final node types (cdata, comments, ...)
-		
-		return (tag, children) 
+		decoder = _XerLiteDecoder()
+		return (decoder.decode(data), "XML data")
+
+class _XerLiteDecoder:
+	"""
+	Builds the decoded structure from expat events.
+	
+	The first non-blank text node of an element is its value,
+	otherwise its value is the list of its children elements.
+	As with minidom, adjacent character data belong to the same text node,
+	which is terminated by any other node (element, cdata section, comment,
+	processing instruction).
+	"""
+	def __init__(self):
+		# Stack of [ tag, children, value, text ]
+		# value is set to the first non-blank text,
+		# text is the list of the character data of the current text node, or None
+		self._stack = []
+		self._ret = None
+		self._cdata = False
+	
+	def decode(self, data):
+		parser = xml.parsers.expat.ParserCreate(namespace_separator = " ")
+		parser.namespace_prefixes = True
+		parser.buffer_text = True
+		parser.StartElementHandler = self._startElement
+		parser.EndElementHandler = self._endElement
+		parser.CharacterDataHandler = self._characterData
+		parser.StartCdataSectionHandler = self._startCdataSection
+		parser.EndCdataSectionHandler = self._endCdataSection
+		parser.CommentHandler = self._otherNode
+		parser.ProcessingInstructionHandler = self._otherNode
+		parser.Parse(data, True)
+		return self._ret
+	
+	def _endText(self):
+		if not self._stack:
+			return
+		element = self._stack[-1]
+		if element[3] is not None:
+			text = u''.join(element[3])
+			element[3] = None
+			if element[2] is None and text.strip():
+				element[2] = text.strip()
+	
+	def _startElement(self, name, attributes):
+		self._endText()
+		if ' ' in name:
+			# uri localname [prefix]
+			t = name.split(' ')
+			if len(t) == 3:
+				name = u'%s:%s' % (t[2], t[1])
+			else:
+				name = t[1]
+		self._stack.append([ name, [], None, None ])
+	
+	def _endElement(self, name):
+		self._endText()
+		(tag, children, value, text) = self._stack.pop()
+		if value is not None:
+			ret = (tag, value)
+		else:
+			ret = (tag, children)
+		if self._stack:
+			parent = self._stack[-1]
+			# Children after the parent value are ignored
+			if parent[2] is None:
+				parent[1].append(ret)
+		else:
+			self._ret = ret
+	
+	def _characterData(self, data):
+		# Ignore cdata sections (and data outside the root element)
+		if self._cdata or not self._stack:
+			return
+		element = self._stack[-1]
+		if element[3] is None:
+			element[3] = [ data ]
+		else:
+			element[3].append(data)
+	
+	def _startCdataSection(self):
+		self._endText()
+		self._cdata = True
+	
+	def _endCdataSection(self):
+		self._cdata = False
+	
+	def _otherNode(self, *args):
+		self._endText()
 
 CodecManager.registerCodecClass('xer.lite', XerLiteCodec)
 
@@ -19,7 +19,9 @@
 
 import CodecManager
 
+import codecs
 import libxml2
+import re
 
 
 class XmlCodec(CodecManager.Codec):
@@ -156,122 +158,251 @@ class XmlCodec(CodecManager.Codec):
 
 	def encode(self, template):
 		(tag, attr) = template
-		doc = libxml2.newDoc("1.0")
-		root = self._encode(doc, tag, attr.get('children'), attr.get('attributes', {}), attr.get('value', ''), attr.get('cdata', False), attr.get('ns'))
-		doc.setRootElement(root)
+		out = []
+		self._encode(out, tag, attr.get('children'), attr.get('attributes', {}), attr.get('value', ''), attr.get('cdata', False), attr.get('ns'), self.getProperty('prettyprint', False), 0)
 		encoding = self.getProperty('encoding', 'utf-8')
 		ret = ''
 		if self.getProperty('write_prolog', True):
 			ret = '<?xml version="1.0" encoding="%s"?>\n' % encoding
-		ret += root.serialize(encoding = encoding, format = (self.getProperty('prettyprint', False) and 1 or 0))
+		ret += transcode(''.join(out), encoding)
 		return (ret, "XML data")
 
-	def _encode(self, doc, tag, children, attributes, value, cdata, ns, nsMap = {}):
-		node = libxml2.newNode(tag)
+	def _encode(self, out, tag, children, attributes, value, cdata, ns, prettyprint, level):
+		"""
+		Writes the element to out (a list of utf-8 strings),
+		serialized the way libxml2 does.
+		"""
+		name = toUtf8(tag)
+		out.append('<')
 		if ns:
 			# create a prefix for the ns
-			if not ns in nsMap:
-				nsMap[ns] = 'ns%d' % (len(nsMap) + 1)
-			prefix = nsMap[ns]
-			node.setNs(node.newNs(ns, prefix))
+			if not ns in NamespacePrefixes:
+				NamespacePrefixes[ns] = 'ns%d' % (len(NamespacePrefixes) + 1)
+			prefix = NamespacePrefixes[ns]
+			name = '%s:%s' % (prefix, name)
+			out.append(name)
+			out.append(' xmlns:%s=%s' % (prefix, quote(toUtf8(ns))))
+		else:
+			out.append(name)
 		for k, v in attributes.items():
-			node.setProp(k, v)
+			out.append(' %s="%s"' % (toUtf8(k), escapeAttribute(toUtf8(v))))
+		out.append('>')
 		
 		if children:
+			if prettyprint:
+				out.append('\n')
 			for (tag, attr) in children:
-				node.addChild(self._encode(doc, tag, attr.get('children'), attr.get('attributes', {}), attr.get('value'), attr.get('cdata'), attr.get('ns'), nsMap))
-		else:
-			if cdata:
-				node.addChild(doc.newCDataBlock(value, len(value)))
-			else:
-				node.addChild(libxml2.newText(value))
-		return node
+				if prettyprint:
+					out.append(indent(level + 1))
+				self._encode(out, tag, attr.get('children'), attr.get('attributes', {}), attr.get('value'), attr.get('cdata'), attr.get('ns'), prettyprint, level + 1)
+				if prettyprint:
+					out.append('\n')
+			if prettyprint:
+				out.append(indent(level))
+		elif cdata:
+			writeCData(out, toUtf8(value))
+		elif value is not None:
+			out.append(escapeText(toUtf8(value)))
+		out.append('</%s>' % name)
 			
 	def decode(self, data):
+		"""
+		Streaming decoding: the elements are read with a libxml2 text reader,
+		that only keeps the current node in memory, and the Testerman
+		structures are built as the elements are closed.
+		"""
+		reader = libxml2.readerForMemory(data, len(data), None, None, 0)
+		# The stack of the currently opened elements
+		stack = []
+		# All the text read so far, to rebuild the content of mixed elements
+		texts = []
 		ret = None
-		doc = libxml2.parseDoc(data)
-		root = doc.getRootElement()
-		ret = self._decode(root)
-		doc.freeDoc()
+		while True:
+			status = reader.Read()
+			if status == 0:
+				break
+			if status < 0:
+				raise libxml2.parserError('xmlTextReaderRead() failed')
+			
+			nodeType = reader.NodeType()
+			if nodeType == READER_ELEMENT:
+				element = self._startElement(reader, stack and stack[-1] or None, len(texts))
+				if reader.IsEmptyElement():
+					ret = self._endElement(element, stack and stack[-1] or None, texts)
+				else:
+					stack.append(element)
+			elif nodeType == READER_END_ELEMENT:
+				element = stack.pop()
+				ret = self._endElement(element, stack and stack[-1] or None, texts)
+			elif nodeType in READER_TEXTS:
+				content = reader.Value()
+				texts.append(content)
+				if stack:
+					self._addText(stack[-1], nodeType, content)
+			elif nodeType == READER_ENTITY_REFERENCE:
+				# Not substituted: only part of the mixed elements content
+				texts.append(reader.CurrentNode().content)
+		reader.Close()
 		return (ret, "XML data")
 
-	def _decode(self, element):
+	def _startElement(self, reader, parent, contentIndex):
 		"""
-		libxml2 based.
+		Returns a new opened element state, updating its parent's state.
 		"""
-		tag = element.name
-		ns = element.ns()
-		if ns: ns = ns.content
-		else:
-			ns = None
+		element = _OpenedElement()
+		element.tag = reader.LocalName()
+		element.ns = reader.NamespaceUri()
+		element.contentIndex = contentIndex
 
 		attributes = {} # attributes are not namespaced...		
-		a = element.properties
-		while a:
-			attributes[a.name] = a.content
-			a = a.next
+		if reader.HasAttributes():
+			while reader.MoveToNextAttribute() == 1:
+				if not reader.IsNamespaceDecl():
+					attributes[reader.LocalName()] = reader.Value()
+			reader.MoveToElement()
+		element.attributes = attributes
+
+		if parent:
+			if parent.ignored or parent.isMixed:
+				# only the content of the mixed ancestor matters
+				element.ignored = True
+			elif parent.hasTextChild:
+				parent.isMixed = True
+			else:
+				parent.hasElementChild = True
+		return element
 
+	def _addText(self, element, nodeType, content):
 		# If the node has (non-strippable) text nodes and element nodes as children,
 		# for instance: "something <i>else</i>, etc"
 		# we consider the whole thing as its value.
-		
-		# If the node has only element nodes as children,
-		# the node won't have a value, but only children.
-		
-		children = []
-		hasElementChild = False
-		hasTextChild = False
-		isMixed = False
-		value = ''
-		cdata = False
-
-		node = element.children
-		while node:
-			if node.type == 'cdata':
-				if hasElementChild:
-					# element contains a mix of text and child elements: retrieves the element content only
-					isMixed = True
-					break
-				else:
-					hasTextChild = True
-					cdata = True
-					value = node.content
-
-			elif node.isText() and node.content.strip():
-				if hasElementChild:
-					# element contains a mix of text and child elements: retrieves the element content only
-					isMixed = True
-					break
-				else:
-					hasTextChild = True
-					value = node.content.strip()
-			elif node.type == 'element':
-				if hasTextChild:
-					isMixed = True
-					break
-				else:
-					# let's register the element in the children list
-					children.append(self._decode(node))
-					hasElementChild = True
-			
-			node = node.next
+		if element.ignored or element.isMixed:
+			return
+		if nodeType == READER_CDATA:
+			if element.hasElementChild:
+				# element contains a mix of text and child elements: retrieves the element content only
+				element.isMixed = True
+			else:
+				element.hasTextChild = True
+				element.cdata = True
+				element.value = content
+		elif nodeType == READER_TEXT and content.strip():
+			if element.hasElementChild:
+				element.isMixed = True
+			else:
+				element.hasTextChild = True
+				element.value = content.strip()
 
-		if isMixed:
-			d = { 'attributes': attributes, 'cdata': False, 'value': element.content }
-			if ns: d['ns'] = ns
-			return (tag, d)
+	def _endElement(self, element, parent, texts):
+		"""
+		Returns the decoded element, and adds it to its parent's children.
+		"""
+		if element.ignored:
+			return None
 
-		if hasElementChild:
+		if element.isMixed:
+			d = { 'attributes': element.attributes, 'cdata': False, 'value': ''.join(texts[element.contentIndex:]) }
+		elif element.hasElementChild:
 			# only element children
-			d = { 'attributes': attributes, 'children': children }
-			if ns: d['ns'] = ns
-			return (tag, d)
-
-		# no child, or a single text child
-		d = { 'attributes': attributes, 'cdata': cdata, 'value': value }
-		if ns: d['ns'] = ns
-		return (tag, d)
-	
+			d = { 'attributes': element.attributes, 'children': element.children }
+		else:
+			# no child, or a single text child
+			d = { 'attributes': element.attributes, 'cdata': element.cdata, 'value': element.value }
+		if element.ns: d['ns'] = element.ns
+		ret = (element.tag, d)
+
+		if parent and not parent.isMixed:
+			parent.children.append(ret)
+		return ret
+
+class _OpenedElement:
+	"""
+	The decoding state of an element being read.
+	"""
+	def __init__(self):
+		self.tag = None
+		self.ns = None
+		self.attributes = None
+		self.children = []
+		self.hasElementChild = False
+		self.hasTextChild = False
+		self.isMixed = False
+		self.value = ''
+		self.cdata = False
+		# Index of the first text of this element in the read texts
+		self.contentIndex = 0
+		# Set for the descendants of mixed elements
+		self.ignored = False
+
+
+# libxml2 text reader node types
+READER_ELEMENT = 1
+READER_TEXT = 3
+READER_CDATA = 4
+READER_ENTITY_REFERENCE = 5
+READER_END_ELEMENT = 15
+# Text nodes, including whitespaces, that are part of the element contents
+READER_TEXTS = [ READER_TEXT, READER_CDATA, 13, 14 ]
+
+# Namespace prefixes used when encoding, allocated once per namespace
+NamespacePrefixes = {}
+
+def toUtf8(s):
+	if isinstance(s, unicode):
+		return s.encode('utf-8')
+	return str(s)
+
+def escapeText(s):
+	return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;')
+
+def _charRef(m):
+	c = m.group(0).decode('utf-8')
+	if len(c) == 2:
+		# UTF-16 surrogate pair (narrow Python builds)
+		return '&#x%X;' % (0x10000 + ((ord(c[0]) - 0xd800) << 10) + (ord(c[1]) - 0xdc00))
+	return '&#x%X;' % ord(c)
+
+_NonAsciiRe = re.compile(r'[\xc0-\xff][\x80-\xbf]*')
+
+def escapeAttribute(s):
+	"""
+	Attribute values: non-ASCII characters are written as character references,
+	as the document has no declared encoding.
+	"""
+	s = s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+	s = s.replace('\n', '&#10;').replace('\r', '&#13;').replace('\t', '&#9;')
+	return _NonAsciiRe.sub(_charRef, s)
+
+def quote(s):
+	if '"' in s and not "'" in s:
+		return "'%s'" % s
+	return '"%s"' % s.replace('"', '&quot;')
+
+def writeCData(out, s):
+	if not s:
+		out.append('<![CDATA[]]>')
+		return
+	# ]]> cannot appear in a CDATA section: split it
+	start = 0
+	end = s.find(']]>')
+	while end >= 0:
+		out.append('<![CDATA[%s]]>' % s[start:end + 2])
+		start = end + 2
+		end = s.find(']]>', start)
+	out.append('<![CDATA[%s]]>' % s[start:])
+
+def indent(level):
+	return '  ' * min(level, 30)
+
+def transcode(s, encoding):
+	"""
+	Converts a utf-8 string to encoding, using character references
+	for the characters that cannot be represented.
+	"""
+	if codecs.lookup(encoding).name == 'utf-8':
+		return s
+	return s.decode('utf-8').encode(encoding, 'xmlcharrefreplace')
+
 
 CodecManager.registerCodecClass('xml', XmlCodec)
 
@@ -21,10 +21,14 @@
 ##
 
 
+import Inotify
 import ProbeImplementationManager
 
+import bisect
+import errno
 import os
 import re
+import select
 import threading
 
 class DirWatcherProbe(ProbeImplementationManager.ProbeImplementation):
@@ -64,11 +68,16 @@ When the file ``'/var/lock/testerman.lock'`` is removed, expect:
 
   ('removed', {'dir': '/var/lock', 'name': 'testerman.lock', 'mached_application': 'testerman'})
 
-On start watching, the probe checks for changes in the monitored dirss each second (by default). The interval
-between two checks can be configured via the ``interval`` startWatchingFiles field. The probe is aware of reset/recreated
-or new born dirs (when monitoring a dir that has not been created yet). Be aware that you may miss notifications
+On Linux, the probe is notified of entry creations, renames and deletions by the kernel (inotify), as they happen,
+and costs nothing while the monitored dirs do not change.
+
+On other platforms, the probe checks for changes in the monitored dirs each second (by default). The interval
+between two checks can be configured via the ``interval`` startWatchingDirs field (on Linux, it is only used
+to retry watching dirs that do not exist yet). Be aware that in this polling mode, you may miss notifications
 if some files are created/deleted faster than the interval allows to detect.
 
+In both modes, the probe is aware of reset/recreated or new born dirs (when monitoring a dir that has not been created yet).
+
 When you do not need to watch these dirs any more, send a stopWatchingDirs command. 
 
 The probe automatically stops watching dirs on unmap and when the current test case is over. 
@@ -87,7 +96,7 @@ Possible use cases for this probe:
 Availability
 ~~~~~~~~~~~~
 
-All platforms.
+All platforms. Event-driven watching (inotify) is used on Linux only.
 
 Dependencies
 ~~~~~~~~~~~~
@@ -177,7 +186,10 @@ The test system interface port bound to such a probe complies with the `DirWatch
 	def startWatching(self, dirs, interval, patterns):
 		self.stopWatching()
 		self._lock()
-		self._watchingThread = WatchingThread(self, dirs, interval, patterns)
+		if Inotify.isAvailable():
+			self._watchingThread = InotifyWatchingThread(self, dirs, interval, patterns)
+		else:
+			self._watchingThread = WatchingThread(self, dirs, interval, patterns)
 		self._watchingThread.start()
 		self._unlock()
 	
@@ -236,20 +248,122 @@ class WatchingThread(threading.Thread):
 		(added, removed) = _compareLists(current, ref)
 		
 		for (label, l) in [ ('added', added), ('removed', removed) ]:
-			for entryname in l:
-				for pattern in self._patterns:
-					m = pattern.match(entryname)
-					if m:
-						attr = { 'dir': directory, 'name': entryname }
-						for k, v in m.groupdict().items():
-							attr['matched_%s' % k] = v
-						event = (label, attr)
-						self._probe.triEnqueueMsg(event)			
-						# A name can be matched only once.
-						break
-					# else no match
+			self._notifyEntries(directory, label, l)
+
+	def _notifyEntries(self, directory, label, entrynames):
+		for entryname in entrynames:
+			for pattern in self._patterns:
+				m = pattern.match(entryname)
+				if m:
+					attr = { 'dir': directory, 'name': entryname }
+					for k, v in m.groupdict().items():
+						attr['matched_%s' % k] = v
+					event = (label, attr)
+					self._probe.triEnqueueMsg(event)			
+					# A name can be matched only once.
+					break
+				# else no match
+
+
+class InotifyWatchingThread(WatchingThread):
+	"""
+	Linux only.
+	Instead of polling the dirs, watches them with inotify.
+	"""
+	WATCH_MASK = Inotify.IN_CREATE | Inotify.IN_MOVED_TO | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | Inotify.IN_ONLYDIR
+
+	def __init__(self, probe, dirs, interval, patterns):
+		WatchingThread.__init__(self, probe, dirs, interval, patterns)
+		#: watched directories indexed by watch descriptor
+		self._watches = {}
+		#: directories we could not watch yet, retried every interval
+		self._unwatchedDirs = []
+		for directory in dirs:
+			if not directory in self._unwatchedDirs:
+				self._unwatchedDirs.append(directory)
+		self._inotify = Inotify.Inotify()
+		self._stopPipe = os.pipe()
+		for directory in self._unwatchedDirs[:]:
+			self._watchDir(directory, initial = True)
+
+	def run(self):
+		self._probe.getLogger().debug("Starting watching dirs %s with %s (inotify)" % (self._dirs, self._patterns))
+		try:
+			while True:
+				# No need to wake up until something changes, unless we have some directories to retry
+				timeout = self._unwatchedDirs and self._interval or None
+				try:
+					r, w, e = select.select([ self._inotify, self._stopPipe[0] ], [], [], timeout)
+				except select.error as e:
+					if e.args[0] == errno.EINTR:
+						continue
+					raise
+				if self._stopPipe[0] in r:
+					break
+				try:
+					if self._inotify in r:
+						self._processEvents(self._inotify.readEvents())
+					for directory in self._unwatchedDirs[:]:
+						self._watchDir(directory)
+				except Exception as e:
+					self._probe.getLogger().debug("Error while watching directories: %s" % str(e))
+		finally:
+			self._inotify.close()
+
+	def stop(self):
+		os.write(self._stopPipe[1], 'x')
+		self.join()
+		os.close(self._stopPipe[0])
+		os.close(self._stopPipe[1])
+		self._probe.getLogger().debug("Watching thread stopped")
+
+	def _watchDir(self, directory, initial = False):
+		try:
+			wd = self._inotify.addWatch(directory, self.WATCH_MASK)
+		except OSError as e:
+			if initial:
+				self._probe.getLogger().debug("Unable to watch directory %s (%s), retrying every %ss" % (directory, str(e), self._interval))
+			return
+		self._watches[wd] = directory
+		self._unwatchedDirs.remove(directory)
+		self._checkDir(directory)
+
+	def _unwatchDir(self, wd):
+		directory = self._watches.pop(wd, None)
+		if directory is None:
+			return
+		# Its last known entries are kept, to be compared with its content
+		# if it is recreated
+		self._probe.getLogger().debug("Directory %s removed, retrying to watch it every %ss" % (directory, self._interval))
+		self._inotify.removeWatch(wd)
+		self._unwatchedDirs.append(directory)
+
+	def _processEvents(self, events):
+		for (wd, mask, cookie, name) in events:
+			if mask & Inotify.IN_Q_OVERFLOW:
+				self._probe.getLogger().warning("Too many file system events, some of them were lost. Checking all watched directories")
+				for directory in self._watches.values():
+					self._checkDir(directory)
+				continue
+			if mask & (Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | Inotify.IN_IGNORED):
+				self._unwatchDir(wd)
+				continue
+			directory = self._watches.get(wd)
+			if directory is None:
+				continue
+			# _watchedDirs contains sorted lists of entries
+			entries = self._watchedDirs[directory]
+			if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+				i = bisect.bisect_left(entries, name)
+				if i == len(entries) or entries[i] != name:
+					entries.insert(i, name)
+					self._notifyEntries(directory, 'added', [ name ])
+			elif mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+				i = bisect.bisect_left(entries, name)
+				if i < len(entries) and entries[i] == name:
+					del entries[i]
+					self._notifyEntries(directory, 'removed', [ name ])
 
-		
 
 def _compareLists(current, ref):
 	"""
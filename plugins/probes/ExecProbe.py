@@ -21,128 +21,14 @@
 ##
 
 import ProbeImplementationManager
+import ProcessTree
 
+import collections
 import os
-import signal
+import Queue
 import subprocess
 import threading
 import sys
-import glob
-import re
-import struct
-
-##
-# Tools: get a whole process tree (as a flat list of pids)
-##
-
-def parseStatusFile_linux(filename):
-	pid_ = None
-	ppid_ = None
-	try:
-		f = open(filename)
-		lines = f.readlines()
-		f.close()
-		for line in lines:
-			if not pid_:
-				m = re.match(r'Pid:\s+(.*)', line)
-				if m:
-					pid_ = int(m.group(1))
-			elif not ppid_:
-				m = re.match(r'PPid:\s+(.*)', line)
-				if m:
-					ppid_ = int(m.group(1))
-			elif ppid_ and pid_:
-				break
-	except Exception as e:
-		pass
-	return (pid_, ppid_)
-
-def parseStatusFile_solaris(filename):
-	"""
-	according to /usr/include/sys/procfs.h
-	
-	typedef struct pstatus {
-        int     pr_flags;       /* flags (see below) */
-        int     pr_nlwp;        /* number of active lwps in the process */
-        pid_t   pr_pid;         /* process id */
-        pid_t   pr_ppid;        /* parent process id */
-	...
-	}
-	
-	int are 64 or 32 depending on the platform...
-	
-	This implementation only support 64 bit (for now).
-	"""
-	pid_ = None
-	ppid_ = None
-	try:
-		f = open(filename)
-		buf = f.read()
-		f.close()
-		
-		(_, _, pid_, ppid_) = struct.unpack('IIII', buf[:struct.calcsize('IIII')])
-	except:
-		pass
-	return (pid_, ppid_)
-
-def parseStatusFile(filename):
-	"""
-	Parse a /proc/<pid>/status file,
-	according to the current OS.
-	
-	@rtype: tuple of int 
-	@returns: pid, ppid (any of those may be None if not parsed)
-	
-	Supported:
-	- Linux 2.6.x
-	- Solaris
-	"""
-	if sys.platform in [ 'linux', 'linux2' ]:
-		return parseStatusFile_linux(filename)
-	elif sys.platform in [ 'sunos5' ]:
-		return parseStatusFile_solaris(filename)
-	else:
-		return (None, None)
-
-def getChildrenPids(pid):
-	"""
-	Retrieves all the children pids for a given pid, 
-	including the pid itself as the first element of the returned list of PIDs
-
-	Returns them as a list.
-	
-	WARNING: only Linux and Solaris-compatible for now,
-	as it relies on /proc/<pid>/status pseudo file.
-	
-	@type  pid: int
-	@param pid: the parent pid whose we should retrieve children
-	
-	@rtype: list of int
-	@returns: first the pid itself, then its children's pids
-	"""
-	pids = [] # a list of current (pid, ppid)
-	# Let's scan /proc/...
-	# No other way to do it ?
-	statusFilenames = glob.glob("/proc/[0-9]*/status")
-	for filename in statusFilenames:
-		try:
-			pid_, ppid_ = parseStatusFile(filename)
-			if pid_ and ppid_:
-				pids.append( (pid_, ppid_) )
-		except Exception as e:
-			pass
-	
-	# Now let's construct the tree for the looked up pid
-	ret = [ pid ]
-	ppids = [ pid ]
-	while ppids:
-		currentPpid = ppids.pop()
-		for (pid_, ppid_) in pids:
-			if ppid_ == currentPpid:
-				if pid_ not in ppids: ppids.append(pid_)
-				if pid_ not in ret: ret.append(pid_)
-	
-	return ret
 
 ##
 # The Exec Probe
@@ -160,6 +46,10 @@ Properties:
    :header: "Name","Type","Default value","Description"
 
    "``shell``","string","``None``","The shell to use when executing the command line. On Unixes, this is defaulted to ``/bin/sh``, on Windows, this is the shell as specified via the COMSPEC environment variable."
+   "``streaming``","boolean","``False``","If set, the command output is notified as it arrives, in ``OutputNotification`` messages, before the final ``ExecResponse``"
+   "``chunk_size``","integer","``4096``","Streaming mode: the maximum size of a notified output chunk, in bytes"
+   "``max_output_size``","integer","``10485760``","The maximum size of the output retained for the ``ExecResponse``, in bytes. Only the end of a larger output is kept. 0 means no limit."
+   "``cgroup``","string","``None``","POSIX only: an existing cgroup directory, writable by the probe, in which a sub-cgroup is created for each command execution. Cancelling a command then also kills the processes it started out of its process tree and process group."
 
 Overview
 --------
@@ -168,13 +58,24 @@ This probe implements a single shot command execution interface (the same as Pro
 commands.
 
 Basically you just specify a command to execute that will be executed within a shell, and you get a response
-once its execution is over. The response contains both an integer return code and the whole command output.
+once its execution is over. The response contains both an integer return code and the whole command output
+(stdout and stderr), or its last ``max_output_size`` bytes if it is larger.
+
+If the ``streaming`` property is set, you also get the output as it arrives, in ``OutputNotification`` messages
+indicating the stream (``stdout`` or ``stderr``) it was read from. Each notification contains complete lines,
+up to ``chunk_size`` bytes (a longer line is split in several chunks). An incomplete last line is notified
+after 200ms without new output. This enables to match intermediate output of long-running commands.
 
 If you consider the command execution is too long (no response received), you can cancel it at any time from the
 userland. Such a cancellation terminates all the subprocess tree with a SIGKILL signal on POSIX platforms,
 and a SIGTERM to the started process (not all its subtree) on Windows. Once cancelled, you should not expect
 a command response anymore.
 
+On POSIX platforms, each command is started in its own session, and its whole process group is killed on
+cancellation too. Processes that leave both the process tree and the process group (typically daemons) are only killed
+if the ``cgroup`` property is set: each command is then run in its own sub-cgroup, killed as a whole
+(atomically with cgroup v2 on Linux 5.14+), and removed once the command is over if it is empty.
+
 No interaction is possible during the command execution.
 
 Notes:
@@ -218,12 +119,19 @@ The test system interface port bound to such a probe complies with the ``ExecPor
     charstring output
   }
   
+  // streaming mode only
+  type record OutputNotification
+  {
+    charstring output,
+    charstring stream, // 'stderr' or 'stdout'
+  }
+  
   type charstring ErrorResponse;
   
   type port ExecPortType message
   {
     in  ExecCommand;
-    out ExecResponse, ErrorResponse;
+    out ExecResponse, OutputNotification, ErrorResponse;
   }
 	"""
 	def __init__(self):
@@ -231,6 +139,10 @@ The test system interface port bound to such a probe complies with the ``ExecPor
 		self._mutex = threading.RLock()
 		self._execThread = None
 		self.setDefaultProperty("shell", None)
+		self.setDefaultProperty("streaming", False)
+		self.setDefaultProperty("chunk_size", 4096)
+		self.setDefaultProperty("max_output_size", 10*1024*1024)
+		self.setDefaultProperty("cgroup", None)
 
 	# ProbeImplementation reimplementation
 
@@ -347,11 +259,29 @@ The test system interface port bound to such a probe complies with the ``ExecPor
 	
 
 
+def readPipe(pipe, stream, queue):
+	"""
+	Reads a pipe until EOF, queuing (stream, data) for each read,
+	then (stream, None).
+	"""
+	try:
+		while True:
+			data = os.read(pipe.fileno(), 65536)
+			if not data:
+				break
+			queue.put((stream, data))
+	except Exception:
+		pass
+	queue.put((stream, None))
+
 class ExecThread(threading.Thread):
 	"""
-	Executes a command through ssh in its own thread.
-	Created and started on command execution, once the login phase was OK.
+	Executes a command in its own thread.
+	Created and started on command execution.
 	"""
+	# In streaming mode, incomplete lines are notified after this delay without new output, in s
+	FLUSH_DELAY = 0.2
+
 	def __init__(self, probe, command):
 		threading.Thread.__init__(self)
 		self._probe = probe
@@ -360,19 +290,71 @@ class ExecThread(threading.Thread):
 		self._mutex = threading.RLock()
 		self._reportStatus = True
 		self._stoppedEvent = threading.Event()
+		self._streaming = probe['streaming']
+		self._chunkSize = probe['chunk_size']
+		self._maxOutputSize = probe['max_output_size']
+		# Output retained for the final response, bounded to max_output_size
+		self._output = collections.deque()
+		self._outputSize = 0
+		self._truncated = False
+		# Streaming mode: incomplete lines, per stream
+		self._buffers = { 'stdout': '', 'stderr': '' }
+		# POSIX only: the command is a session (and process group) leader,
+		# optionally in its own cgroup
+		self._posix = not sys.platform in [ 'win32', 'win64' ]
+		self._cgroup = None
+	
+	def _preexec(self):
+		"""
+		Called in the child process before executing the command.
+		"""
+		os.setsid()
+		if self._cgroup:
+			ProcessTree.joinCgroup(self._cgroup)
 	
 	def run(self):
 		self._probe.getLogger().debug("Starting command execution thread...")
 		output = None
 		status = None
 		try:
-			self._process = subprocess.Popen(self._command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True, executable=self._probe["shell"])
-			output, _ = self._process.communicate()
-			status = self._process.returncode
+			if self._posix and self._probe['cgroup']:
+				self._cgroup = os.path.join(self._probe['cgroup'], 'exec-%d-%d' % (os.getpid(), id(self)))
+				os.mkdir(self._cgroup)
+			# Without streaming, stderr is interleaved with stdout in a single pipe
+			self._process = subprocess.Popen(self._command, stdout=subprocess.PIPE, stderr=(self._streaming and subprocess.PIPE or subprocess.STDOUT), shell=True, executable=self._probe["shell"], preexec_fn=(self._posix and self._preexec or None))
+			# Bounded, so that a chatty command is blocked on write if we cannot follow it
+			queue = Queue.Queue(64)
+			readers = [ threading.Thread(target = readPipe, args = (self._process.stdout, 'stdout', queue)) ]
+			if self._streaming:
+				readers.append(threading.Thread(target = readPipe, args = (self._process.stderr, 'stderr', queue)))
+			for reader in readers:
+				reader.setDaemon(True)
+				reader.start()
+
+			running = len(readers)
+			while running:
+				try:
+					(stream, data) = queue.get(True, self.FLUSH_DELAY)
+				except Queue.Empty:
+					self._flush()
+					continue
+				if data is None:
+					running -= 1
+				else:
+					self._onOutput(stream, data)
+			self._flush()
+
+			status = self._process.wait()
+			output = ''.join(self._output)
+			if self._truncated:
+				self._probe.getLogger().info("Command output truncated to its last %s bytes" % self._maxOutputSize)
 		except Exception as e:
 			self._probe.triEnqueueMsg('Internal execution error: %s' % str(e))
 		
 		self._process = None
+		if self._cgroup:
+			# Still busy if the command left daemons behind
+			ProcessTree.removeCgroup(self._cgroup, timeout = (self.getReportStatus() and 0.0 or 1.0))
 
 		self._probe._onExecThreadTerminated()
 		if self.getReportStatus():
@@ -395,16 +377,11 @@ class ExecThread(threading.Thread):
 		if self._process:
 			self.setReportStatus(False)
 			pid = self._process.pid
-			pids = getChildrenPids(pid)
-			self._probe.getLogger().info("Killing process %s (%s) on user demand..." % (pid, pids))
-			s = signal.SIGKILL
-			if sys.platform in [ 'win32', 'win64' ]:
-				s = signal.SIGTERM
-			for p in pids:
-				try:
-					os.kill(p, s)
-				except Exception as e:
-					self._probe.getLogger().warning("Unable to kill process %s: %s" % (pid, str(e))) 
+			try:
+				pids = ProcessTree.killProcessTree(pid, processGroup = self._posix, cgroup = self._cgroup)
+				self._probe.getLogger().info("Killed process %s (%s) on user demand" % (pid, pids))
+			except Exception as e:
+				self._probe.getLogger().warning("Unable to kill process %s: %s" % (pid, str(e)))
 		# And we should wait for a notification indicating that the process
 		# has died...
 		# We wait at most 1s. Maybe the process was not killed
@@ -412,7 +389,49 @@ class ExecThread(threading.Thread):
 		# and this will lead to an error later in next command execution.
 		# So the user wil figure it out soon.
 		self._stoppedEvent.wait(1.0)
-		
+
+	def _onOutput(self, stream, data):
+		self._output.append(data)
+		self._outputSize += len(data)
+		if self._maxOutputSize:
+			# Only keep the end of the output
+			while self._outputSize > self._maxOutputSize:
+				excess = self._outputSize - self._maxOutputSize
+				first = self._output[0]
+				if len(first) <= excess:
+					self._output.popleft()
+					self._outputSize -= len(first)
+				else:
+					self._output[0] = first[excess:]
+					self._outputSize -= excess
+				self._truncated = True
+
+		if not self._streaming:
+			return
+		buf = self._buffers[stream] + data
+		# Notify complete lines, by chunks of at most chunk_size bytes
+		while len(buf) >= self._chunkSize:
+			end = buf.rfind('\n', 0, self._chunkSize) + 1 or self._chunkSize
+			self._notifyOutput(stream, buf[:end])
+			buf = buf[end:]
+		end = buf.rfind('\n') + 1
+		if end:
+			self._notifyOutput(stream, buf[:end])
+			buf = buf[end:]
+		self._buffers[stream] = buf
+
+	def _flush(self):
+		"""
+		Notifies incomplete lines, if any.
+		"""
+		for (stream, buf) in self._buffers.items():
+			if buf:
+				self._notifyOutput(stream, buf)
+				self._buffers[stream] = ''
+
+	def _notifyOutput(self, stream, output):
+		if self.getReportStatus():
+			self._probe.triEnqueueMsg({ 'stream': stream, 'output': output })
 
 
 ProbeImplementationManager.registerProbeImplementationClass("exec", ExecProbe)
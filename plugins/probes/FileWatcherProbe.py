@@ -23,12 +23,16 @@
 ##
 
 
+import Inotify
 import ProbeImplementationManager
 
+import errno
+import fnmatch
 import glob
 import os
 import os.path
 import re
+import select
 import threading
 
 class FileWatcherProbe(ProbeImplementationManager.ProbeImplementation):
@@ -54,10 +58,18 @@ as in ``r'resource (?P<name>.*) played'``. In this example, if a line matching t
 in one of the watched files, you will receive a notification containing the source file filename, the
 complete line that matched the pattern, and an additional ``matched_name`` string entry containing the matched group.
 
-On start watching, the probe checks for new lines in the monitored files each second (by default). The interval
-between two checks can be configured via the ``interval`` startWatchingFiles field. The probe is aware of reset/recreated
-or new born files (when monitoring a file that has not been created yet). In case of a file reset, you may miss some
-matching lines if new lines are created and the file is reset before the next file check, but this should not be a show-stopper
+On Linux, the probe is notified of file creations, modifications and deletions by the kernel (inotify):
+it only watches the directories containing the files to monitor, costs nothing while the files do not change,
+and reads new lines from the last known offset of a file as soon as they are written.
+Only complete lines are notified, unless the file is closed by its writer.
+The probe is aware of reset/recreated/rotated or new born files (when monitoring a file that has not been created yet),
+and of watched directories that are created or recreated after the watching started.
+
+On other platforms, or when a directory of the watched files contains wildcards, the probe checks for new lines
+in the monitored files each second (by default). The interval between two checks can be configured via the ``interval``
+startWatchingFiles field, which is also used to retry watching directories that do not exist yet on Linux.
+In this polling mode, in case of a file reset, you may miss some matching lines if new lines are created and
+the file is reset before the next file check, but this should not be a show-stopper
 considering the typical use cases for this probe.
 
 When you do not need to watch these files anymore, send a stopWatchingFiles command. 
@@ -84,7 +96,7 @@ Possible use cases for this probe:
 Known Bugs
 ~~~~~~~~~~
 
-This probe may not detect a file recreation on some file systems such as ext3,
+In polling mode, this probe may not detect a file recreation on some file systems such as ext3,
 in the following case:
 
 * the file is recreated/replaced with a larger file than the initial one,
@@ -96,7 +108,7 @@ reported, instead of reporting all the lines of the file.
 Availability
 ~~~~~~~~~~~~
 
-All platforms.
+All platforms. Event-driven watching (inotify) is used on Linux only.
 
 Dependencies
 ~~~~~~~~~~~~
@@ -169,20 +181,27 @@ The test system interface port bound to such a probe complies with the `FileWatc
 		if cmd == 'startWatchingFiles':
 			self._checkArgs(args, [ ('files', None), ('interval', 1.0), ('patterns', [ r'.*' ])] )
 			compiledPatterns = [ re.compile(x) for x in args['patterns']]
-			# Glob files here - glob.glob() blocks when called from the watching thread (?! - blocked in fnmatch.filter: import os,posixpath)
-			files = []
-			for arg in args['files']:
-				files += glob.glob(arg)
-			self.startWatching(files = files, interval = args['interval'], patterns = compiledPatterns)
+			self.startWatching(files = args['files'], interval = args['interval'], patterns = compiledPatterns)
 		elif cmd == 'stopWatchingFiles':
 			self.stopWatching()
 		else:
 			raise ProbeImplementationManager.ProbeException("Invalid message format (%s)" % cmd)
 	
 	def startWatching(self, files, interval, patterns):
+		"""
+		@type  files: list of strings
+		@param files: the files to watch, wildcards accepted
+		"""
 		self.stopWatching()
 		self._lock()
-		self._watchingThread = WatchingThread(self, files, interval, patterns)
+		# Threads are created here - glob.glob() blocks when called from the watching thread (?! - blocked in fnmatch.filter: import os,posixpath)
+		if Inotify.isAvailable() and not filter(glob.has_magic, [ os.path.dirname(f) for f in files ]):
+			self._watchingThread = InotifyWatchingThread(self, files, interval, patterns)
+		else:
+			globbedFiles = []
+			for f in files:
+				globbedFiles += glob.glob(f)
+			self._watchingThread = WatchingThread(self, globbedFiles, interval, patterns)
 		self._watchingThread.start()
 		self._unlock()
 	
@@ -309,7 +328,9 @@ class WatchingThread(threading.Thread):
 		# Technically, the file may have grown since we took the ref size
 		# We should lock the file until we complete our analysis and reading
 		# but the current implementation should be enough for typical probe usages
-		
+		self._notifyLines(filename, newlines)
+
+	def _notifyLines(self, filename, newlines):
 		for line in newlines:
 			for pattern in self._patterns:
 				m = pattern.match(line)
@@ -321,6 +342,261 @@ class WatchingThread(threading.Thread):
 					# A line can be matched only once.
 					break
 				# else no match
-		
+
+
+class InotifyWatchingThread(WatchingThread):
+	"""
+	Linux only.
+	Instead of polling the files, watches their directories with inotify,
+	and reads the modified files from the offset they were last read at.
+	
+	Each watched file is kept open, so that the lines written to it before
+	it was rotated (renamed) or deleted can still be read.
+	"""
+	WATCH_MASK = Inotify.IN_MODIFY | Inotify.IN_CLOSE_WRITE | Inotify.IN_CREATE | Inotify.IN_MOVED_TO | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | Inotify.IN_ONLYDIR
+
+	def __init__(self, probe, files, interval, patterns):
+		WatchingThread.__init__(self, probe, files, interval, patterns)
+		#: compiled file name patterns indexed by directory
+		self._nameMatchers = {}
+		for f in files:
+			directory, name = os.path.split(os.path.abspath(f))
+			self._nameMatchers.setdefault(directory, []).append((name.startswith('.'), re.compile(fnmatch.translate(name))))
+		#: bytes already read, indexed by filename
+		self._offsets = {}
+		#: open file objects, indexed by filename
+		self._openFiles = {}
+		#: watched directories indexed by watch descriptor
+		self._watches = {}
+		#: directories we could not watch yet, retried every interval
+		self._unwatchedDirs = self._nameMatchers.keys()
+		self._inotify = Inotify.Inotify()
+		self._stopPipe = os.pipe()
+		# First look at the files: only lines added from now on will be notified
+		for directory in self._unwatchedDirs[:]:
+			self._watchDir(directory, initial = True)
+
+	def run(self):
+		self._probe.getLogger().debug("Starting watching files %s with %s (inotify)" % (self._files, self._patterns))
+		try:
+			while True:
+				# No need to wake up until something changes, unless we have some directories to retry
+				timeout = self._unwatchedDirs and self._interval or None
+				try:
+					r, w, e = select.select([ self._inotify, self._stopPipe[0] ], [], [], timeout)
+				except select.error as e:
+					if e.args[0] == errno.EINTR:
+						continue
+					raise
+				if self._stopPipe[0] in r:
+					break
+				try:
+					if self._inotify in r:
+						self._processEvents(self._inotify.readEvents())
+					for directory in self._unwatchedDirs[:]:
+						self._watchDir(directory)
+				except Exception as e:
+					self._probe.getLogger().debug("Error while watching files: %s" % str(e))
+		finally:
+			self._inotify.close()
+			for filename in self._openFiles.keys():
+				self._forgetFile(filename)
+
+	def stop(self):
+		os.write(self._stopPipe[1], 'x')
+		self.join()
+		os.close(self._stopPipe[0])
+		os.close(self._stopPipe[1])
+		self._probe.getLogger().debug("Watching thread stopped")
+
+	def _matches(self, directory, name):
+		for (dotted, matcher) in self._nameMatchers.get(directory, []):
+			# Same as glob: hidden files are only matched explicitly
+			if matcher.match(name) and (dotted or not name.startswith('.')):
+				return True
+		return False
+
+	def _watchDir(self, directory, initial = False):
+		try:
+			wd = self._inotify.addWatch(directory, self.WATCH_MASK)
+		except OSError as e:
+			if initial:
+				self._probe.getLogger().debug("Unable to watch directory %s (%s), retrying every %ss" % (directory, str(e), self._interval))
+			return
+		self._watches[wd] = directory
+		self._unwatchedDirs.remove(directory)
+		# Files created before we started watching are registered at their current size,
+		# files created in a new (or recreated) directory are new born files.
+		for name in os.listdir(directory):
+			filename = os.path.join(directory, name)
+			if self._matches(directory, name) and os.path.isfile(filename):
+				if initial:
+					self._probe.getLogger().debug("New file %s registered for watching" % filename)
+					try:
+						self._offsets[filename] = os.fstat(self._openFile(filename).fileno()).st_size
+					except (IOError, OSError):
+						pass
+				else:
+					self._readFile(filename)
+
+	def _unwatchDir(self, wd):
+		directory = self._watches.pop(wd, None)
+		if directory is None:
+			return
+		self._probe.getLogger().debug("Directory %s removed, retrying to watch it every %ss" % (directory, self._interval))
+		self._inotify.removeWatch(wd)
+		for filename in self._offsets.keys() + self._openFiles.keys():
+			if os.path.dirname(filename) == directory:
+				self._drainFile(filename)
+		self._unwatchedDirs.append(directory)
+
+	def _rescan(self):
+		"""
+		Called when some events were lost: checks all the files in the watched directories.
+		"""
+		for directory in self._watches.values():
+			names = [ name for name in os.listdir(directory) if self._matches(directory, name) ]
+			filenames = [ os.path.join(directory, name) for name in names ]
+			for filename in self._offsets.keys() + self._openFiles.keys():
+				if os.path.dirname(filename) == directory and not filename in filenames:
+					self._drainFile(filename)
+			for filename in filenames:
+				if os.path.isfile(filename):
+					f = self._openFiles.get(filename)
+					if f and os.fstat(f.fileno()).st_ino != os.stat(filename).st_ino:
+						# Rotated, then recreated
+						self._drainFile(filename)
+					self._readFile(filename)
+
+	def _processEvents(self, events):
+		# Coalesce the events so that each modified file is read once.
+		# flush indexed by filename
+		changedFiles = {}
+		# (filename, offset) of the files renamed before we could open them, indexed by cookie
+		renamedFiles = {}
+		for (wd, mask, cookie, name) in events:
+			if mask & Inotify.IN_Q_OVERFLOW:
+				self._probe.getLogger().warning("Too many file system events, some of them were lost. Checking all watched files")
+				self._rescan()
+				continue
+			if mask & (Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | Inotify.IN_IGNORED):
+				self._unwatchDir(wd)
+				continue
+			directory = self._watches.get(wd)
+			if directory is None or mask & Inotify.IN_ISDIR:
+				continue
+			if mask & Inotify.IN_MOVED_TO and cookie in renamedFiles:
+				# Renamed in the same directory, whatever its new name
+				(filename, offset) = renamedFiles.pop(cookie)
+				self._drainRenamedFile(filename, offset, os.path.join(directory, name))
+			if not self._matches(directory, name):
+				continue
+			filename = os.path.join(directory, name)
+			if mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+				# Rotated or deleted: read what was written to it until then.
+				# If recreated, the whole file will be considered.
+				changedFiles.pop(filename, None)
+				if mask & Inotify.IN_MOVED_FROM and not filename in self._openFiles:
+					renamedFiles[cookie] = (filename, self._offsets.get(filename, 0))
+				self._drainFile(filename)
+				continue
+			if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+				self._probe.getLogger().debug("New file %s created" % filename)
+				# Possibly replacing a file we were following
+				if changedFiles.pop(filename, None) is not None or filename in self._openFiles:
+					self._drainFile(filename)
+				self._offsets[filename] = 0
+			changedFiles[filename] = changedFiles.get(filename, False) or bool(mask & Inotify.IN_CLOSE_WRITE)
+
+		for filename, flush in changedFiles.items():
+			try:
+				self._readFile(filename, flush)
+			except Exception as e:
+				self._probe.getLogger().debug("Unable to watch file %s: %s" % (filename, str(e)))
+
+	def _openFile(self, filename):
+		"""
+		Returns the open file object for filename, opening it if needed.
+		"""
+		f = self._openFiles.get(filename)
+		if f is None:
+			f = open(filename, 'rb')
+			self._openFiles[filename] = f
+		return f
+
+	def _forgetFile(self, filename):
+		self._offsets.pop(filename, None)
+		f = self._openFiles.pop(filename, None)
+		if f:
+			f.close()
+
+	def _drainFile(self, filename):
+		"""
+		Reads and notifies the remaining lines of a rotated or deleted file,
+		through its open file object if any, then stops following it.
+		"""
+		f = self._openFiles.get(filename)
+		try:
+			if f:
+				self._readFile(filename, flush = True, f = f)
+		except Exception as e:
+			self._probe.getLogger().debug("Unable to read rotated file %s: %s" % (filename, str(e)))
+		self._forgetFile(filename)
+
+	def _drainRenamedFile(self, filename, offset, newFilename):
+		"""
+		Reads and notifies the remaining lines of a file renamed before
+		we could open it, from its new name.
+		"""
+		try:
+			f = open(newFilename, 'rb')
+		except IOError:
+			return
+		try:
+			self._offsets[filename] = offset
+			self._readFile(filename, flush = True, f = f)
+		finally:
+			f.close()
+			self._offsets.pop(filename, None)
+
+	def _readFile(self, filename, flush = False, f = None):
+		"""
+		Reads and notifies the lines added to filename since we last read it.
+
+		@type  flush: bool
+		@param flush: if False, an incomplete last line is kept
+		for the next read, if True, it is notified too.
+		@type  f: file object
+		@param f: the file to read, if no longer named filename
+		"""
+		# New files are read from their start
+		offset = self._offsets.get(filename, 0)
+		if f is None:
+			try:
+				f = self._openFile(filename)
+			except IOError:
+				# Already removed
+				self._forgetFile(filename)
+				return
+		if os.fstat(f.fileno()).st_size < offset:
+			self._probe.getLogger().debug("File %s was reset (content replaced)" % filename)
+			offset = 0
+		f.seek(offset)
+		data = f.read()
+
+		if flush:
+			end = len(data)
+		else:
+			end = data.rfind('\n') + 1
+		self._offsets[filename] = offset + end
+		if not end:
+			return
+		self._probe.getLogger().debug("File %s changed, %d new bytes starting at %d" % (filename, end, offset))
+		lines = data[:end].split('\n')
+		newlines = [ line + '\n' for line in lines[:-1] ]
+		if lines[-1]:
+			newlines.append(lines[-1])
+		self._notifyLines(filename, newlines)
+
 
 ProbeImplementationManager.registerProbeImplementationClass("watcher.file", FileWatcherProbe)
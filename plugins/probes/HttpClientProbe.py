@@ -44,8 +44,10 @@ Properties:
    "``port``","integer","``80``","The HTTP server's port."
    "``version``","string","``HTTP/1.0``","The HTTP version to use in requests."
    "``protocol``","string","``http``","The HTTP variant:``http`` or ``https``. For now, only ``http`` is supported."
-   "``maintain_connection``","boolean","``False``","If set to True and HTTP version is 1.1, the probe keeps the tcp connection opened once a response has been received, until the server closes it."
+   "``maintain_connection``","boolean","``False``","If set to True and HTTP version is 1.1, the probe keeps the tcp connection opened once a response has been received, until the server closes it, and reuses it for the next requests."
    "``connection_timeout``","float","``5.0``","The connection timeout, in s, when trying to connect to a remote party."
+   "``max_connections``","integer","``1``","The maximum number of simultaneous connections to the server. Additional requests are queued until a connection is available, or pipelined if enabled."
+   "``pipelining``","boolean","``False``","If set to True, HTTP version is 1.1 and ``maintain_connection`` is True, requests are sent without waiting for the responses to the previous ones on a connection (HTTP/1.1 pipelining), when all the connections are busy and no new one can be opened."
 
 Overview
 --------
@@ -56,6 +58,28 @@ It can be used to connect to an HTTP server, send and receive requests at low-le
 However, it is able to maintain the TCP connection between requests (set ``maintain_connection`` to ``True``) and 
 manageq a connection timeout to automatically fails the probe after a given delay (see the ``connection_timeout`` property).
 
+Connection Pool
+~~~~~~~~~~~~~~~
+
+The probe manages a pool of up to ``max_connections`` connections to the server,
+whose responses are all read by a single thread.
+Each request is sent on an idle connection of the pool, or on a new
+connection if the pool is not full.
+When all connections are busy, the request is pipelined on the least loaded
+connection if ``pipelining`` is enabled, or queued until a connection
+becomes idle.
+
+When ``maintain_connection`` is set, the connections are kept opened
+once their responses have been received (unless the server closes them, or
+requests it with a ``Connection: close`` header), including from a testcase
+to another, until the probe is unmapped.
+A request sent on a reused connection that the server had just closed is sent
+again, once, on another connection.
+
+The responses are enqueued in the order of the requests on a connection;
+when several connections are used, they may be received in a different order
+than the requests.
+
 For HTTPS connectivity, you should consider using :doc:`ProbeTcp` with :doc:`HTTP codecs <CodecHttp>` as default codecs instead.
 
 Availability
@@ -108,8 +132,13 @@ The test system interface port bound to such a probe complies with the ``HttpCli
 	def __init__(self):
 		ProbeImplementationManager.ProbeImplementation.__init__(self)
 		self._mutex = threading.RLock()
-		self._httpThread = None
-		self._httpConnection = None
+		self._ioThread = None
+		# The connection pool (list of HttpConnection)
+		self._connections = []
+		# Number of connections being opened, not in the pool yet
+		self._connecting = 0
+		# Requests waiting for an available connection (list of HttpRequest)
+		self._queuedRequests = []
 		# Default test adapter parameters
 		self.setDefaultProperty('maintain_connection', False)
 		self.setDefaultProperty('version', 'HTTP/1.0')
@@ -119,6 +148,8 @@ The test system interface port bound to such a probe complies with the ``HttpCli
 		self.setDefaultProperty('port', 80)
 		self.setDefaultProperty('local_ip', '')
 		self.setDefaultProperty('connection_timeout', 5.0)
+		self.setDefaultProperty('max_connections', 1)
+		self.setDefaultProperty('pipelining', False)
 
 	# LocalProbe reimplementation)
 	def onTriMap(self):
@@ -129,11 +160,11 @@ The test system interface port bound to such a probe complies with the ``HttpCli
 		self.reset()
 	
 	def onTriExecuteTestCase(self):
-		# No static connections
+		# No static connections - maintained connections are reused
 		pass
 
 	def onTriSAReset(self):
-		# No static connections
+		# No static connections - maintained connections are reused
 		pass
 	
 	def onTriSend(self, message, sutAddress):
@@ -145,18 +176,10 @@ The test system interface port bound to such a probe complies with the ``HttpCli
 				message['version'] = self['version']
 			try:
 				(encodedMessage, summary) = CodecManager.encode('http.request', message)
-			except Exception as e:
+			except Exception:
 				raise ProbeImplementationManager.ProbeException('Invalid request message format: cannot encode HTTP request:\n%s' % ProbeImplementationManager.getBacktrace())
 			
-			# Connect if needed
-			if not self.isConnected():
-				self.connect()
-
-			# Send our payload
-			self._httpConnection.send(encodedMessage)
-			self.logSentPayload(summary, encodedMessage, "%s:%s" % self._httpConnection.getpeername())
-			# Now wait for a response asynchronously
-			self.waitResponse()
+			self._sendRequest(HttpRequest(encodedMessage, summary))
 		except Exception as e:
 			raise ProbeImplementationManager.ProbeException('Unable to send HTTP request: %s' % str(e))
 				
@@ -168,9 +191,18 @@ The test system interface port bound to such a probe complies with the ``HttpCli
 	def _unlock(self):
 		self._mutex.release()
 	
+	def _getServerAddress(self):
+		return "%s:%s" % (self['host'], self['port'])
+
+	def _isPersistent(self):
+		return self['maintain_connection'] and self['version'] == 'HTTP/1.1'
+	
 	def connect(self):
 		"""
-		Tcp-connect to the host. Returns when we are ready to send something.
+		Tcp-connect to the host, adding a new connection to the pool.
+		Returns when we are ready to send something.
+		
+		@rtype: HttpConnection
 		"""
 		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
 		sock.bind((self['local_ip'], 0))
@@ -178,84 +210,284 @@ The test system interface port bound to such a probe complies with the ``HttpCli
 		# Blocking or not ?
 		sock.settimeout(float(self['connection_timeout']))
 		sock.connect((self['host'], self['port']))
-		self._httpConnection = sock
+		connection = HttpConnection(sock)
+		self._lock()
+		self._connections.append(connection)
+		if not self._ioThread:
+			self._ioThread = IoThread(self)
+			self._ioThread.start()
+		self._unlock()
+		self._ioThread.wakeup()
+		return connection
 	
 	def isConnected(self):
-		if self._httpConnection:
+		if self._connections:
 			return True
 		else:
 			return False
 	
 	def disconnect(self):
-		if self._httpConnection:
-			try:
-				self._httpConnection.close()
-			except:
-				pass
-		self._httpConnection = None
+		self._lock()
+		connections = self._connections
+		self._connections = []
+		self._queuedRequests = []
+		self._unlock()
+		for connection in connections:
+			connection.close()
 	
 	def reset(self):
-		if self._httpThread:
-			self._httpThread.stop()
+		self._lock()
+		thread = self._ioThread
+		self._ioThread = None
+		self._unlock()
+		if thread:
+			thread.stop()
 		self.disconnect()
-		self._httpThread = None
 	
-	def waitResponse(self):
+	def _sendRequest(self, request):
+		"""
+		Sends a request on an idle connection of the pool, or on a new
+		connection if the pool is not full, or pipelines it on the least loaded
+		connection, if enabled.
+		Otherwise, queues it until a connection is available.
+		"""
+		self._lock()
+		try:
+			connection = self._getIdleConnection()
+			if not connection and self._canConnect():
+				self._connecting += 1
+				self._unlock()
+				try:
+					connection = self.connect()
+				finally:
+					self._lock()
+					self._connecting -= 1
+			if not connection and self._canPipeline():
+				for c in self._connections:
+					if c.isUsable() and (not connection or len(c.pendingRequests) < len(connection.pendingRequests)):
+						connection = c
+			if connection:
+				self._sendOnConnection(connection, request)
+			else:
+				self.getLogger().debug('No connection available, queuing request')
+				self._queuedRequests.append(request)
+		finally:
+			self._unlock()
+
+	def _getIdleConnection(self):
+		for c in self._connections:
+			if c.isIdle():
+				return c
+		return None
+
+	def _canConnect(self):
+		return len(self._connections) + self._connecting < self['max_connections']
+	
+	def _canPipeline(self):
+		if self['pipelining'] and self._isPersistent():
+			for c in self._connections:
+				if c.isUsable():
+					return True
+		return False
+
+	def _sendOnConnection(self, connection, request):
+		"""
+		To call with the lock held.
+		"""
+		connection.pendingRequests.append(request)
+		try:
+			connection.socket.sendall(request.payload)
+		except Exception:
+			self._closeConnection(connection)
+			raise
+		self.logSentPayload(request.summary, request.payload, connection.peerName)
+
+	def _closeConnection(self, connection):
 		"""
-		Creates a thread, wait for the response.
+		To call with the lock held.
 		"""
-		self._httpThread = ResponseThread(self, self._httpConnection)
-		self._httpThread.start()
+		if connection in self._connections:
+			self._connections.remove(connection)
+		connection.close()
 
-class ResponseThread(threading.Thread):
-	def __init__(self, probe, socket):
+	def _sendQueuedRequests(self):
+		"""
+		Sends the queued requests on the available connections.
+		Called from the IO thread.
+		"""
+		while True:
+			self._lock()
+			if not self._queuedRequests or not (self._getIdleConnection() or self._canConnect() or self._canPipeline()):
+				self._unlock()
+				break
+			request = self._queuedRequests.pop(0)
+			self._unlock()
+			try:
+				self._sendRequest(request)
+			except Exception as e:
+				self.getLogger().error('Unable to send queued HTTP request: %s' % str(e))
+
+	def onData(self, connection, data):
+		"""
+		Decodes the responses received on a connection.
+		Called from the IO thread. data is empty on disconnection.
+		"""
+		disconnected = (data == '')
+		self._lock()
+		try:
+			if not connection in self._connections:
+				return
+			buf = connection.buffer + data
+			# Loop on pipelined responses
+			while buf:
+				# Tolerate empty lines between responses
+				buf = buf.lstrip('\r\n')
+				if not buf:
+					break
+				try:
+					(status, consumedSize, decodedMessage, summary) = CodecManager.incrementalDecode('http.response', buf, complete = disconnected)
+				except Exception:
+					status = CodecManager.IncrementalCodec.DECODING_ERROR
+				if status == CodecManager.IncrementalCodec.DECODING_NEED_MORE_DATA:
+					self.getLogger().info('Waiting for additional data...')
+					break
+				elif status == CodecManager.IncrementalCodec.DECODING_OK:
+					if consumedSize == 0:
+						consumedSize = len(buf)
+					fromAddr = self._getServerAddress()
+					self.logReceivedPayload(summary, buf[:consumedSize], fromAddr)
+					self.triEnqueueMsg(decodedMessage, fromAddr)
+					buf = buf[consumedSize:]
+					# Interim (1xx) responses do not answer the request
+					if decodedMessage['status'] >= 200 and connection.pendingRequests:
+						connection.pendingRequests.pop(0)
+					if not self._isPersistent() or decodedMessage['headers'].get('connection', '').lower() == 'close' or decodedMessage['version'] == 'HTTP/1.0':
+						connection.closing = True
+				else:
+					self.getLogger().error('Error while waiting for http response: unable to decode response: decoding error')
+					disconnected = True
+					buf = ''
+					break
+			connection.buffer = buf
+
+			if disconnected:
+				self._closeConnection(connection)
+				pendingRequests = connection.pendingRequests
+				connection.pendingRequests = []
+				if pendingRequests:
+					if connection.reused and not connection.buffer and not pendingRequests[0].retried:
+						# The server closed a kept-alive connection we had just reused:
+						# send the requests again
+						self.getLogger().info('Connection closed by the server, sending %d request(s) again' % len(pendingRequests))
+						for request in pendingRequests:
+							request.retried = True
+						self._queuedRequests = pendingRequests + self._queuedRequests
+					else:
+						self.getLogger().error('Error while waiting for http response: connection lost, %d request(s) not answered' % len(pendingRequests))
+			elif connection.closing and not connection.pendingRequests:
+				self._closeConnection(connection)
+			elif connection.isIdle():
+				connection.reused = True
+		finally:
+			self._unlock()
+		self._sendQueuedRequests()
+
+	def getConnections(self):
+		self._lock()
+		ret = self._connections[:]
+		self._unlock()
+		return ret
+
+
+class HttpRequest:
+	def __init__(self, payload, summary):
+		self.payload = payload
+		self.summary = summary
+		self.retried = False
+
+
+class HttpConnection:
+	"""
+	A connection of the pool,
+	with its requests waiting for a response.
+	"""
+	def __init__(self, sock):
+		self.socket = sock
+		self.peerName = "%s:%s" % sock.getpeername()
+		self.buffer = ''
+		# The requests sent on this connection and not answered yet, in order
+		self.pendingRequests = []
+		# Set when the connection should be closed once all the responses are received
+		self.closing = False
+		# Set when a request is (or will be) sent on an already used connection
+		self.reused = False
+	
+	def isUsable(self):
+		return not self.closing
+	
+	def isIdle(self):
+		return not self.closing and not self.pendingRequests
+
+	def close(self):
+		try:
+			self.socket.close()
+		except:
+			pass
+
+
+class IoThread(threading.Thread):
+	"""
+	Reads the responses on all the connections of the pool.
+	"""
+	def __init__(self, probe):
 		threading.Thread.__init__(self)
+		self.setDaemon(True)
 		self._probe = probe
-		self._socket = socket
 		self._stopEvent = threading.Event()
+		# Used to wake up the select() when the pool is updated
+		self._wakeupSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self._wakeupSocket.bind(('127.0.0.1', 0))
+		self._wakeupSocket.setblocking(0)
+		self._wakeupAddress = self._wakeupSocket.getsockname()
+	
+	def wakeup(self):
+		try:
+			self._wakeupSocket.sendto('x', self._wakeupAddress)
+		except:
+			pass
 	
 	def run(self):
-		buf = ''
 		while not self._stopEvent.isSet():
+			connections = dict([ (c.socket, c) for c in self._probe.getConnections() ])
 			try:
-				r, w, e = select.select([self._socket], [], [], 0.1)
-				if self._socket in r:
-					read = self._socket.recv(1024*1024)
-					buf += read
-					
-					decodedMessage = None
-
-					self._probe.getLogger().debug('data received (bytes %d), decoding attempt...' % len(buf))
-					# If we are not disconnected, notify that the codec can still expect more data (complete = False)
-					(status, _, decodedMessage, summary) = CodecManager.incrementalDecode('http.response', buf, complete = (not read))
-
-					if status == CodecManager.IncrementalCodec.DECODING_NEED_MORE_DATA:
-						if not read:
-							# We are disconnected.
-							raise Exception('Unable to decode response: additional data required, but connection lost')
-						else:
-							# Just wait
-							self._probe.getLogger().info('Waiting for additional data...')
-					elif status == CodecManager.IncrementalCodec.DECODING_ERROR:
-						raise Exception('Unable to decode response: decoding error')
-					else:
-						# DECODING_OK
-						fromAddr = "%s:%s" % (self._probe['host'], self._probe['port'])
-						self._probe.getLogger().debug('message decoded, enqueuing...')
-						self._probe.logReceivedPayload(summary, buf, fromAddr)
-						self._probe.triEnqueueMsg(decodedMessage, fromAddr)
-						self._stopEvent.set()
-			except Exception as e:
-				self._probe.getLogger().error('Error while waiting for http response: %s' % str(e))
-				self._stopEvent.set()
-		if not self._probe['maintain_connection']:
-			# Well, actually this should depends on the HTTP protocol version...
-			self._probe.disconnect()
+				r, w, e = select.select(connections.keys() + [ self._wakeupSocket ], [], [], 1.0)
+			except (select.error, socket.error):
+				# A connection may have been closed in the meantime
+				continue
+			for s in r:
+				if s is self._wakeupSocket:
+					try:
+						while True:
+							self._wakeupSocket.recv(1024)
+					except socket.error:
+						pass
+					continue
+				try:
+					data = s.recv(1024*1024)
+				except Exception as e:
+					self._probe.getLogger().warning('Error while reading http response: %s' % str(e))
+					data = ''
+				try:
+					self._probe.onData(connections[s], data)
+				except Exception as e:
+					self._probe.getLogger().error('Error while waiting for http response: %s' % str(e))
+		self._wakeupSocket.close()
 	
 	def stop(self):
 		self._stopEvent.set()
-		self.join()
+		self.wakeup()
+		if threading.currentThread() is not self:
+			self.join()
 					
 					
 ProbeImplementationManager.registerProbeImplementationClass('http.client', HttpClientProbe)
-		
@@ -23,10 +23,12 @@
 ##
 
 import ProbeImplementationManager
+import SqlProbe
 
 import MySQLdb as dbapi
+import MySQLdb.cursors
 
-class MySqlProbe(ProbeImplementationManager.ProbeImplementation):
+class MySqlProbe(SqlProbe.SqlProbe):
 	"""
 Identification and Properties
 -----------------------------
@@ -43,6 +45,10 @@ Properties:
    "``db``","string","(empty)","The database to use"
    "``user``","string","(empty)","The user to use to connect to the database ``db`` above"
    "``password``","string","(empty)","The password to use, if required to connect to the database ``db`` above for user ``user``"
+   "``maintain_connection``","boolean","``True``","If set to True, the connection to the database is opened on the first query, then reused until the probe is unmapped. Otherwise, a connection is opened for each query."
+   "``health_check_interval``","float","``30.0``","When a maintained connection has been idle for more than this interval, in s, it is checked (and reopened if needed) before executing a query. ``0`` disables the check."
+   "``statement_cache_size``","integer","``20``","The number of cursors kept opened for the last executed statements, enabling the driver to reuse their prepared statements. ``0`` disables the cache."
+   "``fetch_size``","integer","``0``","If not ``0``, the result sets are streamed as ``resultChunk`` messages of at most this number of rows instead of a single ``result`` message."
 
 Overview
 --------
@@ -69,6 +75,26 @@ create a ticket).
 
 These structures and mechanisms are common to all ``sql.*`` probe types.
 
+Connections, Statements and Result Streaming
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+By default, the connection to the database is opened on the first query and
+maintained until the probe is unmapped, including from a testcase to another.
+When it has been idle for more than ``health_check_interval``, or after a connection-related
+error, it is checked before executing the next query and transparently reopened if needed.
+
+The cursors of the last executed statements are cached, so that executing
+the same statement again, typically a parametrized one, lets the driver
+reuse its prepared statement if it supports it.
+Instead of a plain SQL string, you may send a ``SqlParametrizedQuery`` record
+whose ``parameters`` are bound by the driver, using its own parameter style.
+
+When ``fetch_size`` (or the ``fetchSize`` field of a parametrized query) is set,
+the rows of a SELECT are fetched and delivered in ``resultChunk`` messages of at most
+``fetchSize`` rows, the last one being flagged with ``last`` set to ``true``,
+so that large result sets are never held entirely by the probe.
+If an error occurs while streaming, an ``error`` message follows the chunks already sent.
+
 The supported MySQL versions depend on the underlying MySQL DB libs you are using, and are
 independent from the probe.
 
@@ -99,12 +125,26 @@ The test system interface port bound to such a probe complies with the ``SqlPort
 
 ::
 
-  type charstring SqlRequest;
+  type charstring SqlQuery;
+  
+  type record SqlParametrizedQuery
+  {
+    charstring query,
+    any parameters optional, // a list or a dict, according to the driver parameter style
+    integer fetchSize optional, // default: fetch_size
+  }
+  
+  type union SqlRequest
+  {
+    SqlQuery query, // sent as is, i.e. not as a choice
+    SqlParametrizedQuery parametrizedQuery // sent as is, i.e. not as a choice
+  }
   
   type union Result
   {
     charstring error,
-    record of SqlResult result
+    record of SqlResult result,
+    SqlResultChunk resultChunk
   }
   
   type record SqlResult
@@ -112,62 +152,36 @@ The test system interface port bound to such a probe complies with the ``SqlPort
     any <field name>* // according to your request 
   }
   
+  type record SqlResultChunk
+  {
+    record of SqlResult rows, // at most fetchSize rows
+    boolean last
+  }
+  
   type port SqlPortType message
   {
     in SqlRequest,
-    out SqlResult
+    out Result
   }
 	"""
+	dbapi = dbapi
+
 	def __init__(self):
-		ProbeImplementationManager.ProbeImplementation.__init__(self)
+		SqlProbe.SqlProbe.__init__(self)
 		self.setDefaultProperty('host', 'localhost')
 		self.setDefaultProperty('port', 3306)
 		self.setDefaultProperty('password', '')
 		self.setDefaultProperty('db', '')
 		self.setDefaultProperty('user', '')
 	
-	def onTriMap(self):
-		pass
-	
-	def onTriUnmap(self):
-		pass
-	
-	def onTriSAReset(self):
-		pass
-	
-	def onTriExecuteTestCase(self):
-		pass
-	
-	def onTriSend(self, message, sutAddress):
-		self._executeQuery(message)
-	
-	def _executeQuery(self, query):
-		try:
-			conn = dbapi.connect(user = self['user'], passwd = self['password'], db = self['database'], host = self['host']) # '%s:%s' % (self['host'], self['port']))
-			cursor = conn.cursor()
-			self.logSentPayload(query.split(' ')[0].upper(), query)
-			try:
-				cursor.execute(query)
-				conn.commit()
-			except Exception as e:
-				conn.rollback()
-				cursor.close()
-				conn.close()
-				raise e
-
-			res = []
-			if cursor.description: # equivalent to "the previous execution() provided a set ?"
-				columnNames = map(lambda x: x[0], cursor.description)
-				for row in cursor.fetchall():
-					res.append(dict(zip(columnNames, row)))
-
-			self.triEnqueueMsg(('result', res))
-			cursor.close()
-			conn.close()
-		except Exception as e:
-			self.getLogger().warning("Exception while handling a query: %s" % str(e))
-			self.triEnqueueMsg(('error', str(e)))
-		
+	def _connect(self):
+		return dbapi.connect(user = self['user'], passwd = self['password'], db = self['db'], host = self['host'], port = int(self['port']))
+
+	def _getCursor(self, conn, streaming):
+		if streaming:
+			# Server-side cursor: rows are not retrieved on execute
+			return conn.cursor(MySQLdb.cursors.SSCursor)
+		return conn.cursor()
 		
 
 ProbeImplementationManager.registerProbeImplementationClass('sql.mysql', MySqlProbe)
@@ -27,19 +27,11 @@
 ##
 
 import ProbeImplementationManager
+import SqlProbe
 
 import cx_Oracle as dbapi
 
-import traceback
-import StringIO
-def getBacktrace():
-	backtrace = StringIO.StringIO()
-	traceback.print_exc(None, backtrace)
-	ret = backtrace.getvalue()
-	backtrace.close()
-	return ret
-
-class OracleProbe(ProbeImplementationManager.ProbeImplementation):
+class OracleProbe(SqlProbe.SqlProbe):
 	"""
 = Identification and Properties =
 
@@ -55,6 +47,10 @@ Properties:
    "``sid``","string","(empty)","The Oracle System ID corresponding to your instance"
    "``user``","string","(empty)","The user to use to connect to the database ``db`` above"
    "``password``","string","(empty)","The password to use, if required to connect to the database ``db`` above for user ``user``"
+   "``maintain_connection``","boolean","``True``","If set to True, the connection to the database is opened on the first query, then reused until the probe is unmapped. Otherwise, a connection is opened for each query."
+   "``health_check_interval``","float","``30.0``","When a maintained connection has been idle for more than this interval, in s, it is checked (and reopened if needed) before executing a query. ``0`` disables the check."
+   "``statement_cache_size``","integer","``20``","The number of cursors kept opened for the last executed statements, enabling the driver to reuse their prepared statements. ``0`` disables the cache."
+   "``fetch_size``","integer","``0``","If not ``0``, the result sets are streamed as ``resultChunk`` messages of at most this number of rows instead of a single ``result`` message."
 
 Overview
 --------
@@ -81,6 +77,26 @@ create a ticket).
 
 These structures and mechanisms are common to all ``sql.*`` probe types.
 
+Connections, Statements and Result Streaming
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+By default, the connection to the database is opened on the first query and
+maintained until the probe is unmapped, including from a testcase to another.
+When it has been idle for more than ``health_check_interval``, or after a connection-related
+error, it is checked before executing the next query and transparently reopened if needed.
+
+The cursors of the last executed statements are cached, so that executing
+the same statement again, typically a parametrized one, lets the driver
+reuse its prepared statement if it supports it.
+Instead of a plain SQL string, you may send a ``SqlParametrizedQuery`` record
+whose ``parameters`` are bound by the driver, using its own parameter style.
+
+When ``fetch_size`` (or the ``fetchSize`` field of a parametrized query) is set,
+the rows of a SELECT are fetched and delivered in ``resultChunk`` messages of at most
+``fetchSize`` rows, the last one being flagged with ``last`` set to ``true``,
+so that large result sets are never held entirely by the probe.
+If an error occurs while streaming, an ``error`` message follows the chunks already sent.
+
 The supported Oracle versions depend on the underlying Oracle libs you are using, and are
 independent from the probe.
 
@@ -127,12 +143,26 @@ The test system interface port bound to such a probe complies with the ``SqlPort
 
 ::
 
-  type charstring SqlRequest;
-
+  type charstring SqlQuery;
+  
+  type record SqlParametrizedQuery
+  {
+    charstring query,
+    any parameters optional, // a list or a dict, according to the driver parameter style
+    integer fetchSize optional, // default: fetch_size
+  }
+  
+  type union SqlRequest
+  {
+    SqlQuery query, // sent as is, i.e. not as a choice
+    SqlParametrizedQuery parametrizedQuery // sent as is, i.e. not as a choice
+  }
+  
   type union Result
   {
     charstring error,
-    record of SqlResult result
+    record of SqlResult result,
+    SqlResultChunk resultChunk
   }
   
   type record SqlResult
@@ -140,64 +170,47 @@ The test system interface port bound to such a probe complies with the ``SqlPort
     any <field name>* // according to your request 
   }
   
+  type record SqlResultChunk
+  {
+    record of SqlResult rows, // at most fetchSize rows
+    boolean last
+  }
+  
   type port SqlPortType message
   {
     in SqlRequest,
-    out SqlResult
+    out Result
   }
 """
+	dbapi = dbapi
+	pingQuery = 'SELECT 1 FROM DUAL'
+
 	def __init__(self):
-		ProbeImplementationManager.ProbeImplementation.__init__(self)
+		SqlProbe.SqlProbe.__init__(self)
 		self.setDefaultProperty('host', 'localhost')
 		self.setDefaultProperty('port', 1521)
 		self.setDefaultProperty('password', '')
 		self.setDefaultProperty('user', '')
 		self.setDefaultProperty('sid', '')
-	def onTriMap(self):
-		pass
-	
-	def onTriUnmap(self):
-		pass
-	
-	def onTriSAReset(self):
-		pass
-	
-	def onTriExecuteTestCase(self):
-		pass
-	
-	def onTriSend(self, message, sutAddress):
-		self._executeQuery(message)
-	
-	def _executeQuery(self, query):
-		self.getLogger().debug("Executing query:\n%s" % repr(query))
-		try:
-			dsn = dbapi.makedsn(str(self['host']), self['port'], str(self['sid']))
-			conn = dbapi.connect(str(self['user']), str(self['password']), dsn)
-			cursor = conn.cursor()
-			self.logSentPayload(query.split(' ')[0].upper(), query)
-			try:
-				cursor.execute(str(query))
-				conn.commit()
-			except Exception as e:
-				self.getLogger().warning("Exception while executing query: %s" % getBacktrace())
-				conn.rollback()
-				cursor.close()
-				conn.close()
-				raise e
-
-			res = []
-			if cursor.description: # equivalent to "the previous execution() provided a set ?"
-				columnNames = map(lambda x: x[0], cursor.description)
-				for row in cursor.fetchall():
-					res.append(dict(zip(columnNames, row)))
-
-			self.triEnqueueMsg(('result', res))
-			cursor.close()
-			conn.close()
-		except Exception as e:
-			self.getLogger().warning("Exception while handling a query: %s" % getBacktrace())
-			self.triEnqueueMsg(('error', str(e)))
-		
+
+	def _connect(self):
+		dsn = dbapi.makedsn(str(self['host']), self['port'], str(self['sid']))
+		conn = dbapi.connect(str(self['user']), str(self['password']), dsn)
+		# Let the driver cache the prepared statements, too
+		if hasattr(conn, 'stmtcachesize'):
+			conn.stmtcachesize = max(self['statement_cache_size'], conn.stmtcachesize)
+		return conn
+
+	def _getCursor(self, conn, streaming):
+		cursor = conn.cursor()
+		if streaming:
+			# Rows are retrieved by round trips of this size
+			cursor.arraysize = max(self['fetch_size'], cursor.arraysize)
+		return cursor
+
+	def _executeQuery(self, query, parameters = None, fetchSize = 0):
+		# cx_Oracle does not support unicode statements
+		SqlProbe.SqlProbe._executeQuery(self, str(query), parameters, fetchSize)
 		
 
 ProbeImplementationManager.registerProbeImplementationClass('sql.oracle', OracleProbe)
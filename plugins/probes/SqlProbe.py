@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2009 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Common implementation of the sql.* probes, based on Python DB API 2.0:
+# - persistent, health-checked connection per probe mapping,
+# - cursor caching per statement, so that drivers supporting it can reuse
+#   their prepared statements,
+# - result sets streamed in chunks of bounded size.
+#
+# Not a probe by itself: the sql.* probes subclass it.
+##
+
+import ProbeImplementationManager
+
+import threading
+import time
+
+
+class SqlProbe(ProbeImplementationManager.ProbeImplementation):
+	"""
+	Base class for the sql.* probes.
+
+	Subclasses must set dbapi to their DB API module and implement _connect(),
+	and may reimplement _ping() and _getCursor().
+	"""
+	# The DB API module
+	dbapi = None
+	# Statement used to check a connection when the driver has no ping()
+	pingQuery = 'SELECT 1'
+
+	def __init__(self):
+		ProbeImplementationManager.ProbeImplementation.__init__(self)
+		self._mutex = threading.RLock()
+		self._connection = None
+		# Last time the connection was known to be working
+		self._lastUsed = 0
+		# Set when the connection should be checked before being used again
+		self._suspect = False
+		# Cached cursors, dict[(query, streaming)] = cursor, and their LRU order
+		self._cursors = {}
+		self._cursorKeys = []
+		self.setDefaultProperty('maintain_connection', True)
+		self.setDefaultProperty('health_check_interval', 30.0)
+		self.setDefaultProperty('statement_cache_size', 20)
+		self.setDefaultProperty('fetch_size', 0)
+
+	def onTriMap(self):
+		pass
+
+	def onTriUnmap(self):
+		self._disconnect()
+
+	def onTriSAReset(self):
+		# The connection is reused from a testcase to another
+		pass
+
+	def onTriExecuteTestCase(self):
+		pass
+
+	def onTriSend(self, message, sutAddress):
+		parameters = None
+		fetchSize = self['fetch_size']
+		if isinstance(message, dict):
+			query = message['query']
+			parameters = message.get('parameters', None)
+			fetchSize = message.get('fetchSize', fetchSize)
+		else:
+			query = message
+		self._executeQuery(query, parameters, fetchSize)
+
+	def _lock(self):
+		self._mutex.acquire()
+
+	def _unlock(self):
+		self._mutex.release()
+
+	# To implement in subclasses
+
+	def _connect(self):
+		"""
+		@rtype: DB API connection
+		@returns: a new connection to the database
+		"""
+		# Default implementation: can't do anything, raise an error
+		raise Exception("_connect() not implemented for this probe")
+
+	def _ping(self, conn):
+		"""
+		Raises an exception if the connection is not usable anymore.
+		"""
+		if hasattr(conn, 'ping'):
+			conn.ping()
+		else:
+			cursor = conn.cursor()
+			try:
+				cursor.execute(self.pingQuery)
+				cursor.fetchall()
+			finally:
+				cursor.close()
+
+	def _getCursor(self, conn, streaming):
+		"""
+		@type  streaming: bool
+		@param streaming: if True, the cursor will be fetched by chunks,
+		and should not retrieve the whole result set on execute.
+		"""
+		return conn.cursor()
+
+	# Connection and cursors management
+
+	def _getConnection(self):
+		"""
+		Returns the current connection, checking it if it has been idle
+		for too long or if an error occured on it, or a new one.
+		"""
+		if self._connection:
+			interval = self['health_check_interval']
+			if self._suspect or (interval and time.time() - self._lastUsed > interval):
+				try:
+					self._ping(self._connection)
+				except Exception as e:
+					self.getLogger().info("Connection lost (%s), reconnecting..." % str(e))
+					self._disconnect()
+				self._suspect = False
+		if not self._connection:
+			self._connection = self._connect()
+		return self._connection
+
+	def _disconnect(self):
+		self._lock()
+		conn = self._connection
+		self._connection = None
+		for cursor in self._cursors.values():
+			try:
+				cursor.close()
+			except:
+				pass
+		self._cursors = {}
+		self._cursorKeys = []
+		self._unlock()
+		if conn:
+			try:
+				conn.close()
+			except:
+				pass
+
+	def _getCachedCursor(self, conn, query, streaming):
+		"""
+		Returns a cursor that may have already executed this query.
+		"""
+		key = (query, streaming)
+		cursor = self._cursors.get(key)
+		if cursor:
+			self._cursorKeys.remove(key)
+			self._cursorKeys.append(key)
+			return cursor
+		cursor = self._getCursor(conn, streaming)
+		if self['statement_cache_size'] > 0:
+			self._cursors[key] = cursor
+			self._cursorKeys.append(key)
+			while len(self._cursorKeys) > self['statement_cache_size']:
+				self._closeCachedCursor(self._cursorKeys[0])
+		return cursor
+
+	def _closeCachedCursor(self, key):
+		cursor = self._cursors.pop(key, None)
+		if key in self._cursorKeys:
+			self._cursorKeys.remove(key)
+		if cursor:
+			try:
+				cursor.close()
+			except:
+				pass
+
+	def _executeQuery(self, query, parameters = None, fetchSize = 0):
+		self.getLogger().debug("Executing query:\n%s" % repr(query))
+		streaming = fetchSize > 0
+		self._lock()
+		try:
+			conn = self._getConnection()
+			cursor = self._getCachedCursor(conn, query, streaming)
+			self.logSentPayload(query.split(' ')[0].upper(), query)
+			try:
+				if parameters is None:
+					cursor.execute(query)
+				else:
+					cursor.execute(query, parameters)
+
+				if not cursor.description: # equivalent to "the previous execution() provided a set ?"
+					self.triEnqueueMsg(('result', []))
+				elif streaming:
+					columnNames = map(lambda x: x[0], cursor.description)
+					# Fetch one chunk ahead to flag the last one
+					rows = cursor.fetchmany(fetchSize)
+					while True:
+						nextRows = rows and cursor.fetchmany(fetchSize) or []
+						self.triEnqueueMsg(('resultChunk', { 'rows': [ dict(zip(columnNames, row)) for row in rows ], 'last': not nextRows }))
+						if not nextRows:
+							break
+						rows = nextRows
+				else:
+					columnNames = map(lambda x: x[0], cursor.description)
+					self.triEnqueueMsg(('result', [ dict(zip(columnNames, row)) for row in cursor.fetchall() ]))
+				conn.commit()
+			except Exception as e:
+				self._closeCachedCursor((query, streaming))
+				try:
+					conn.rollback()
+				except:
+					pass
+				if isinstance(e, (self.dbapi.OperationalError, self.dbapi.InterfaceError)):
+					self._suspect = True
+				raise
+			self._lastUsed = time.time()
+		except Exception as e:
+			self.getLogger().warning("Exception while handling a query: %s" % ProbeImplementationManager.getBacktrace())
+			self.triEnqueueMsg(('error', str(e)))
+		self._unlock()
+
+		if not self['maintain_connection']:
+			self._disconnect()
@@ -32,8 +32,10 @@ import DefaultPayloads
 import wave
 
 import cStringIO as StringIO
+import heapq
 import select
 import socket
+import struct
 import threading
 import time
 
@@ -43,47 +45,75 @@ import rtp.packets
 import rtp.rtcp
 
 
-class LoopablePayload:
+def gcd(a, b):
+	while b:
+		a, b = b, a % b
+	return a
+
+class PayloadRing:
 	"""
-	Encapsulates a (string) payload as a cycling buffer,
-	provides a getNextPacket() fonction to get
-	the next packetSize repeated payload.
-	
-	Uses reset() to reset the stream if needed.
-	
-	Can be called indefinitly.
+	A payload pre-sliced into a ring of ready-to-send RTP packets
+	(header + payload slice), so that only the sequence number, timestamp
+	and SSRC have to be patched in place before sending each of them.
 	
+	The packets are only patched and sent from the RtpScheduler thread,
+	so that a ring can be shared by several streams.
 	"""
-	def __init__(self, payload, packetSize):
-		self._offset = 0
-		self._packetSize = packetSize
+	# Maximum size of a looping ring, in bytes
+	MAX_SIZE = 1 << 20
 
-		# The internal payload contains at least packetSize,
-		# so that we don't have to manage N loops before
-		# completing a packet
-		self._payload = (packetSize / len(payload) + 1) * payload
-		self._len = len(self._payload)
-	
-	def getNextPacket(self):
-		# payload is at least packetSize.
-		# we start at current offset, loop if needed.
-		
-		# the internal payload has been cycled to garantee
-		# that we'll need to loop at most once to complete
-		# our target packet size
-		start = self._offset
-		end = self._offset + self._packetSize
-		if end > self._len: 
-			end = end % self._len
-			data = self._payload[start:] + self._payload[:end]
-			self._offset = end
+	def __init__(self, payload, packetSize, payloadType, loop = True):
+		"""
+		@type  loop: bool
+		@param loop: if True, the payload is cycled indefinitely, a packet
+		possibly overlapping the end and the beginning of the payload.
+		Otherwise, the last packet is padded with '\\x00'.
+		"""
+		length = len(payload)
+		if loop:
+			# Covers a whole number of payload cycles so that the ring
+			# loops exactly like the payload, when reasonable.
+			# Otherwise, the last incomplete packet of the ring is dropped.
+			cycles = packetSize / gcd(length, packetSize)
+			if cycles * length > self.MAX_SIZE:
+				cycles = max(self.MAX_SIZE / length, packetSize / length + 1)
+			data = cycles * payload
+			data = data[:len(data) - len(data) % packetSize]
 		else:
-			data = self._payload[start:end]
-			self._offset = end
-		return data
+			data = payload + ((packetSize - length % packetSize) % packetSize) * '\x00'
 		
-	def reset(self):
-		self._offset = 0
+		header = struct.pack('!BBHII', 0x80, payloadType & 0x7f, 0, 0, 0)
+		self._packets = [ bytearray(header + data[i:i+packetSize]) for i in range(0, len(data), packetSize) ]
+
+	def __len__(self):
+		return len(self._packets)
+	
+	def __getitem__(self, index):
+		return self._packets[index]
+
+
+# Rings for the default payloads, shared by all the streams.
+# dict[(payload, packet size, payload type)] = PayloadRing
+DefaultPayloadRings = {}
+DefaultPayloadRingsMutex = threading.RLock()
+MAX_DEFAULT_PAYLOAD_RINGS = 32
+
+def getDefaultPayloadRing(payload, packetSize, payloadType):
+	"""
+	Returns a (shared) looping ring for a default payload.
+	"""
+	key = (payload, packetSize, payloadType)
+	DefaultPayloadRingsMutex.acquire()
+	try:
+		ring = DefaultPayloadRings.get(key)
+		if not ring:
+			if len(DefaultPayloadRings) >= MAX_DEFAULT_PAYLOAD_RINGS:
+				DefaultPayloadRings.clear()
+			ring = PayloadRing(payload, packetSize, payloadType)
+			DefaultPayloadRings[key] = ring
+	finally:
+		DefaultPayloadRingsMutex.release()
+	return ring
 
 def getWavData(payload):
 	"""
@@ -149,7 +179,8 @@ Properties:
    "``payload_type``","integer","``8``","The default payload type to use in sent RTP packets, if not provided explicitly when starting sending a stream"
    "``frame_size``","integer","``20``","The default frame size to use when sending RTP packets, if not provided explicitly when starting sending a stream"
    "``packet_size``","integer","``160``","The default packet size to use when sending RTP packets, if not provided explicitly when starting sending a stream"
-   "``sample_rate``","integer","``8000``","The default sample rate to use in sent RTP packets, if not provided explicitly when starting sending a stream"
+   "``sample_rate``","integer","``8000``","The default sample rate to use in sent RTP packets, if not provided explicitly when starting sending a stream, and to compute the jitter of received streams, if not provided explicitly when starting listening"
+   "``rtcp_interval``","float","``0.0``","The default interval between two RTCP receiver reports, in s, sent for a received stream if not provided explicitly when starting listening. ``0`` means no RTCP reports."
 
 The default payload type/frame size/packet size/sample rate values are chosen
 to enable a default stream in G.711 a-law (PCMA) / 20.
@@ -210,10 +241,47 @@ If you prefer start sending a silent sound, you should set the argument ``defaul
 
 You may, of course, inject another payload as a default sound.
 
+Scheduling
+~~~~~~~~~~
+
+All the RTP probes running in an agent share a single scheduler thread,
+which sends each packet at an absolute deadline computed from the stream
+sampling clock (stream start + n * frame size), and serves the incoming
+streams from the same loop.
+Scheduling delays thus never accumulate, and hundreds of streams can be
+sent from a single agent without creating a thread for each of them.
+
+A packet sent more than 2ms after its deadline is counted as late.
+When the scheduler falls behind by more than 200ms (overloaded host, ...),
+the missed packets are skipped rather than sent in a burst:
+the timestamps of the next packets still follow the sampling clock.
+
+These late-send statistics are logged when the stream is stopped, and can be
+retrieved at any time with the ``getSendingRtpStatistics`` command (for the
+current stream, or the last stopped one).
+
+Receive Statistics
+~~~~~~~~~~~~~~~~~~
+
+While listening, the probe computes the statistics of the received stream
+on each packet, as described in RFC 3550: expected and lost packets (from
+the extended sequence numbers), interarrival jitter, plus the number of
+duplicated and reordered packets, and the received bitrate.
+The statistics are reset each time a ``startedReceivingRtp`` notification is
+raised for a new SSRC or source.
+
+They are logged when the probe stops listening, and can be retrieved at any time
+with the ``getReceivingRtpStatistics`` command (for the current stream, or the
+last received one).
+
+Optionally, when a ``rtcpInterval`` is set, the probe also sends these
+statistics as RTCP receiver reports (RR + SDES CNAME) to the stream source,
+on its RTP port + 1, from the listening port + 1.
+
 Notes:
 
 * A probe can send/receive at most one stream in a way (i.e. can send, receive, or send+receive).
-* No RTCP support for now
+* RTCP support is limited to sending receiver reports, without sender report processing (LSR and DLSR are always 0)
 * No RFC2833 support for now (excepted by playing a wav file with RFC2833 payload, but this is not integrated enough to be usable)
 
 Availability
@@ -263,6 +331,9 @@ The test system interface port bound to such a probe complies with the ``RtpPort
     integer onPort optional, // default: listening_port
     charstring onIp optional, // default: listening_ip
     integer timeout optional, // timeout to detect interrupted incoming stream, in s
+    integer sampleRate optional, // default: sample_rate (8000 (Hz)), used to compute the jitter
+    float rtcpInterval optional, // default: rtcp_interval (0.0, i.e. no RTCP receiver reports), in s
+    integer ssrc optional, // default: ssrc (1000), used in RTCP receiver reports
   }
   
   type record StopListeningCommand
@@ -291,19 +362,54 @@ The test system interface port bound to such a probe complies with the ``RtpPort
     charstring format optional, // choice in wav, raw ; default: wav
   }
   
+  type record GetSendingStatisticsCommand
+  {
+  }
+  
+  type record SendingStatisticsNotification
+  {
+    integer sentPackets,
+    integer latePackets, // sent more than 2ms after their deadline
+    integer skippedPackets, // not sent, the scheduler lagging behind too much
+    float meanLateness, // in ms
+    float maxLateness, // in ms
+  }
+  
+  type record GetReceivingStatisticsCommand
+  {
+  }
+  
+  type record ReceivingStatisticsNotification
+  {
+    charstring fromIp,
+    integer fromPort,
+    integer ssrc,
+    integer receivedPackets, // not including duplicates
+    integer expectedPackets,
+    integer lostPackets, // expected - received
+    integer duplicatePackets,
+    integer reorderedPackets,
+    float jitter, // in ms
+    float bitrate, // in bit/s
+  }
+  
   type union Command
   {
     StartSendingCommand startSendingRtp,
     StopSendingCommand stopSendingRtp,
     StartListeningCommand startListeningRtp,
     StopListeningCommand stopListeningRtp,
-    PlayCommand play
+    PlayCommand play,
+    GetSendingStatisticsCommand getSendingRtpStatistics,
+    GetReceivingStatisticsCommand getReceivingRtpStatistics
   }
   
   type union Notification
   {
     StartedReceivingNotification startedReceivingRtp,
-    StoppedReceivingNotification stoppedReceivingRtp
+    StoppedReceivingNotification stoppedReceivingRtp,
+    SendingStatisticsNotification sendingRtpStatistics,
+    ReceivingStatisticsNotification receivingRtpStatistics
   }
   
   type port message RtpPortType
@@ -315,17 +421,16 @@ The test system interface port bound to such a probe complies with the ``RtpPort
 	def __init__(self):
 		ProbeImplementationManager.ProbeImplementation.__init__(self)
 		self._mutex = threading.RLock()
-		self._stopEvent = threading.Event()
-		self._listeningThread = None
-		self._sendingThread = None
+		self._listeningStream = None
+		self._sendingStream = None
+		# The statistics of the last sent stream
+		self._sendingStatistics = None
+		# The statistics of the last received stream
+		self._receivingStatistics = None
 		
 		# A pool of sockets in used, indexed by the local (ip, port)
 		self._sockets = {}
 		
-		# A StringIO that contains the data to packetize and inject onto the network.
-		self._dataToStream = None
-		self._dataToStreamLoopCount = 0
-		
 		# Some default properties
 		self.setDefaultProperty('local_port', 0)
 		self.setDefaultProperty('local_ip', '')
@@ -337,6 +442,7 @@ The test system interface port bound to such a probe complies with the ``RtpPort
 		self.setDefaultProperty('listening_ip', '')
 		self.setDefaultProperty('ssrc', 1000)
 		self.setDefaultProperty('stream_timeout', 0.5) # 500ms
+		self.setDefaultProperty('rtcp_interval', 0.0) # no RTCP receiver reports
 		
 	def _lock(self):
 		self._mutex.acquire()
@@ -346,16 +452,16 @@ The test system interface port bound to such a probe complies with the ``RtpPort
 	
 	def _isSending(self):
 		self._lock()
-		thread = self._sendingThread
+		stream = self._sendingStream
 		self._unlock()
-		if thread: return True
+		if stream: return True
 		return False
 	
 	def _isListening(self):
 		self._lock()
-		thread = self._listeningThread
+		stream = self._listeningStream
 		self._unlock()
-		if thread: return True
+		if stream: return True
 		return False
 
 	def onTriMap(self):
@@ -420,13 +526,17 @@ The test system interface port bound to such a probe complies with the ``RtpPort
 		
 		elif cmd == 'startListeningRtp':
 			self._checkArgs(args, [ ('onPort', self['listening_port']), ('onIp', self['listening_ip']),
-				('timeout', self['stream_timeout'])])
+				('timeout', self['stream_timeout']), ('sampleRate', self['sample_rate']),
+				('rtcpInterval', self['rtcp_interval']), ('ssrc', self['ssrc']) ])
 			
 			onPort = args['onPort']
 			onIp = args['onIp']
 			timeout = args['timeout']
+			sampleRate = args['sampleRate']
+			rtcpInterval = args['rtcpInterval']
+			ssrc = args['ssrc']
 			
-			self.startListeningRtp((onIp, onPort), timeout)
+			self.startListeningRtp((onIp, onPort), timeout, sampleRate, rtcpInterval, ssrc)
 			
 		elif cmd == 'stopSendingRtp':
 			self.stopSendingRtp()
@@ -438,11 +548,21 @@ The test system interface port bound to such a probe complies with the ``RtpPort
 			self._checkArgs(args, [ ('payload', None), ('loopCount', 1), ('format', 'wav') ])
 			payload = args['payload']
 			loopCount = args['loopCount']
-			type_ = args['type']
+			format = args['format']
 
-			data = loadPayload(payload, type_)
+			data = loadPayload(payload, format)
 			self.playPayload(data, loopCount)
 
+		elif cmd == 'getSendingRtpStatistics':
+			self.triEnqueueMsg(('sendingRtpStatistics', self.getSendingStatistics()))
+
+		elif cmd == 'getReceivingRtpStatistics':
+			statistics = self.getReceivingStatistics()
+			if statistics:
+				self.triEnqueueMsg(('receivingRtpStatistics', statistics))
+			else:
+				self.getLogger().warning("No RTP stream received yet, no receiving statistics to provide")
+
 	def _reset(self):
 		self.stopSendingRtp()
 		self.stopListeningRtp()		
@@ -525,24 +645,31 @@ The test system interface port bound to such a probe complies with the ``RtpPort
 		# Stop our stream if needed
 		self.stopSendingRtp()
 		self._lock()
-		self._defaultPayload = LoopablePayload(defaultPayload, packetSize)
 		try:
 			sock = self._getLocalSocket(fromAddr)
-			self._sendingThread = SendingThread(self, sock, toAddr, payloadType, frameSize, packetSize, sampleRate, ssrc)
-			self._sendingThread.start()
+			self._sendingStream = SendingStream(self, sock, toAddr, payloadType, frameSize, packetSize, sampleRate, ssrc, defaultPayload)
+			getScheduler().addSendingStream(self._sendingStream)
 		except Exception as e:
 			self.getLogger().error("Unable to start sending RTP: %s" % str(e))
 		self._unlock()
 
-	def startListeningRtp(self, fromAddr, timeout):
+	def startListeningRtp(self, fromAddr, timeout, sampleRate = 8000, rtcpInterval = 0.0, ssrc = 1000):
 		self.getLogger().info("Starting listening RTP on %s, stream timeout %4.4fs..." % (fromAddr, timeout))
 		# Stop listening if needed
 		self.stopListeningRtp()
 		self._lock()
 		try:
 			sock = self._getLocalSocket(fromAddr)
-			self._listeningThread = ListeningThread(self, sock, timeout)
-			self._listeningThread.start()
+			rtcpSocket = None
+			if rtcpInterval > 0:
+				# RTCP on the next port, as usual
+				ip, port = sock.getsockname()
+				try:
+					rtcpSocket = self._getLocalSocket((ip, port + 1))
+				except Exception as e:
+					self.getLogger().warning("Unable to send RTCP receiver reports: %s" % str(e))
+			self._listeningStream = ListeningStream(self, sock, timeout, sampleRate, rtcpSocket, rtcpInterval, ssrc)
+			getScheduler().addListeningStream(self._listeningStream)
 		except Exception as e:
 			self.getLogger().error("Unable to start listening RTP: %s" % str(e))
 		self._unlock()
@@ -551,248 +678,710 @@ The test system interface port bound to such a probe complies with the ``RtpPort
 		"""
 		Plays a payload within an outgoing stream, loopCount times.
 		"""
+		self._lock()
+		stream = self._sendingStream
+		self._unlock()
 		# If not currently playing RTP, ignore the request.
-		if not self._isSending():
+		if not stream or not data:
 			return # nothing to do.
 		
 		self.getLogger().info("Playing new data %s times, data len is %s" % (loopCount, len(data)))
 
 		# Now inject the data within the outgoing stream
-		self._resetDataToStream()
-		self._setDataToStream(data, loopCount)
-	
-	def getNextPacket(self, packetSize):
+		stream.play(data, loopCount)
+
+	def stopSendingRtp(self):
+		self._lock()
+		stream = self._sendingStream
+		self._sendingStream = None
+		self._unlock()
+		if stream:
+			self.getLogger().info("Stopping sending RTP...")
+			getScheduler().removeSendingStream(stream)
+			self._conditionallyCloseSocket(stream.getSocket())
+			statistics = stream.getStatistics()
+			self._lock()
+			self._sendingStatistics = statistics
+			self._unlock()
+			self.getLogger().info("Sending RTP stopped: %(sentPackets)s packets sent, %(latePackets)s late, %(skippedPackets)s skipped, lateness mean %(meanLateness)4.3fms, max %(maxLateness)4.3fms" % statistics)
+
+	def stopListeningRtp(self):
+		self._lock()
+		stream = self._listeningStream
+		self._listeningStream = None
+		self._unlock()
+		if stream:
+			self.getLogger().info("Stopping listening RTP...")
+			getScheduler().removeListeningStream(stream)
+			self._conditionallyCloseSocket(stream.getSocket())
+			if stream.getRtcpSocket():
+				self._conditionallyCloseSocket(stream.getRtcpSocket())
+			statistics = stream.getStatistics()
+			if statistics:
+				self._lock()
+				self._receivingStatistics = statistics
+				self._unlock()
+				self.getLogger().info("Listening RTP stopped: %(receivedPackets)s packets received, %(lostPackets)s lost, %(duplicatePackets)s duplicated, %(reorderedPackets)s reordered, jitter %(jitter)4.3fms" % statistics)
+			else:
+				self.getLogger().info("Listening RTP stopped.")
+
+	def getSendingStatistics(self):
 		"""
-		Returns the payload of the next RTP packet,
-		which is packetSize in length.
+		Returns the late-send statistics of the current stream,
+		or of the last stopped stream if none.
 		
-		Gets the payload either from a default resource stream
-		depending on the payload type,
-		or use the current resource/data to stream if available.
+		@rtype: dict
+		@returns: sentPackets, latePackets, skippedPackets (integers),
+		meanLateness, maxLateness (floats, in ms)
+		"""
+		self._lock()
+		stream = self._sendingStream
+		statistics = self._sendingStatistics
+		self._unlock()
+		if stream:
+			return stream.getStatistics()
+		elif statistics:
+			return statistics
+		return { 'sentPackets': 0, 'latePackets': 0, 'skippedPackets': 0, 'meanLateness': 0.0, 'maxLateness': 0.0 }
+
+	def getReceivingStatistics(self):
+		"""
+		Returns the receive statistics of the current incoming stream,
+		or of the last received stream if none.
 		
-		Also prepares the source data for the next iteration.
+		@rtype: dict, or None
+		@returns: see ReceptionStatistics.getStatistics(), plus fromIp and fromPort.
+		None if no stream was received.
+		"""
+		self._lock()
+		stream = self._listeningStream
+		statistics = self._receivingStatistics
+		self._unlock()
+		if stream:
+			return stream.getStatistics() or statistics
+		return statistics
+
+
+TWO_TO_THE_16TH = 1<<16
+TWO_TO_THE_32ND = 1<<32
+
+################################################################################
+# Shared RTP scheduler
+################################################################################
+
+class RtpScheduler(threading.Thread):
+	"""
+	A single thread that drives all the RTP streams of all the RTP probes
+	running in the agent.
+	
+	Outgoing packets are sent at absolute deadlines computed from
+	their stream sampling clock (stream start + n * frame size), so that
+	the scheduling jitter never accumulates into a drift.
+	All the packets due in the same tick are sent in a batch.
+	
+	Incoming streams are served by the same loop, which waits for their
+	sockets to be readable until the next sending deadline.
+	"""
+	# Packets due within this delay are sent in the current tick, in s
+	TICK = 0.0005
+	# Packets sent later than this after their deadline are counted as late, in s
+	LATE_THRESHOLD = 0.002
+	# When lagging behind more than this, skip packets instead of sending a burst, in s
+	MAX_LATENESS = 0.2
+	# Interval between two checks for interrupted incoming streams, in s
+	LISTENING_CHECK_INTERVAL = 0.01
+
+	def __init__(self):
+		threading.Thread.__init__(self)
+		self.setDaemon(True)
+		self._mutex = threading.RLock()
+		# Heap of (deadline, counter, SendingStream)
+		self._sendingStreams = []
+		self._counter = 0
+		# dict[socket] = ListeningStream
+		self._listeningStreams = {}
+		# Used to wake up the loop when the streams are updated
+		self._wakeupSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self._wakeupSocket.bind(('127.0.0.1', 0))
+		self._wakeupSocket.setblocking(0)
+		self._wakeupAddress = self._wakeupSocket.getsockname()
+	
+	def _lock(self):
+		self._mutex.acquire()
+	
+	def _unlock(self):
+		self._mutex.release()
+	
+	def _wakeup(self):
+		try:
+			self._wakeupSocket.sendto('x', self._wakeupAddress)
+		except:
+			pass
+	
+	def _schedule(self, stream):
+		"""
+		Pushes the next deadline of a sending stream.
+		To call with the lock held.
 		"""
+		self._counter += 1
+		heapq.heappush(self._sendingStreams, (stream.getNextDeadline(), self._counter, stream))
+	
+	def addSendingStream(self, stream):
+		self._lock()
+		stream.activate()
+		self._schedule(stream)
+		self._unlock()
+		self._wakeup()
+	
+	def removeSendingStream(self, stream):
+		"""
+		Once returned, the stream won't send any other packet.
+		"""
+		stream.deactivate()
 		self._lock()
-		if self._dataToStream:
-			# File/payload to play, provided by the user
+		self._sendingStreams = [ x for x in self._sendingStreams if x[2] is not stream ]
+		heapq.heapify(self._sendingStreams)
+		self._unlock()
+
+	def addListeningStream(self, stream):
+		self._lock()
+		stream.activate()
+		self._listeningStreams[stream.getSocket()] = stream
+		self._unlock()
+		self._wakeup()
+	
+	def removeListeningStream(self, stream):
+		"""
+		Once returned, the stream won't be notified of any other packet.
+		"""
+		stream.deactivate()
+		self._lock()
+		if self._listeningStreams.get(stream.getSocket()) is stream:
+			del self._listeningStreams[stream.getSocket()]
+		self._unlock()
+		self._wakeup()
+	
+	def run(self):
+		nextListeningCheck = 0
+		while True:
 			try:
-				data = self._dataToStream.read(packetSize)
-				if len(data) < packetSize:
-					self._dataToStreamLoopCount -= 1
-					if self._dataToStreamLoopCount <= 0:
-						self.getLogger().info("Data stream played. Now back to the default payload.")
-						# TODO: send a notification to tell the userland the source has been played
-						self._resetDataToStream()
-					else:
-						# Reset the stream for next loop
-						self.getLogger().info("Resetting stream, remaining count %d" % self._dataToStreamLoopCount)
-						self._dataToStream.seek(0)
-					# We should "padd" our data with something to reach packetSize
-					data += (packetSize - len(data)) * '\x00'
+				# Sends the packets due in this tick
+				self._lock()
+				due = []
+				limit = time.time() + self.TICK
+				while self._sendingStreams and self._sendingStreams[0][0] <= limit:
+					due.append(heapq.heappop(self._sendingStreams)[2])
 				self._unlock()
-			except Exception as e:
+
+				for stream in due:
+					stream.sendPacket()
+
+				self._lock()
+				for stream in due:
+					if stream.isActive():
+						self._schedule(stream)
+				if self._sendingStreams:
+					timeout = max(0, self._sendingStreams[0][0] - time.time())
+				else:
+					timeout = None
+				listeningStreams = self._listeningStreams.copy()
 				self._unlock()
-				self.getLogger().warning("Unable to read next packet from source data to stream: %s" % str(e))	
-				data = self._defaultPayload.getNextPacket()
-		else:
-			self._unlock()
-			# No user provided stream to play - using default values
-			data = self._defaultPayload.getNextPacket()
+
+				# Incoming streams
+				if listeningStreams:
+					now = time.time()
+					if now >= nextListeningCheck:
+						for stream in listeningStreams.values():
+							stream.checkTimeout(now)
+						nextListeningCheck = now + self.LISTENING_CHECK_INTERVAL
+					if timeout is None or timeout > nextListeningCheck - now:
+						timeout = max(0, nextListeningCheck - now)
+
+				try:
+					r, w, e = select.select(listeningStreams.keys() + [ self._wakeupSocket ], [], [], timeout)
+				except (select.error, socket.error):
+					# A listening socket may have been closed in the meantime
+					continue
+				for sock in r:
+					if sock is self._wakeupSocket:
+						try:
+							while True:
+								self._wakeupSocket.recv(1024)
+						except socket.error:
+							pass
+					else:
+						listeningStreams[sock].onReadable()
+			except Exception as e:
+				ProbeImplementationManager.getLogger().error("Exception in RTP scheduler: %s" % str(e))
+
+
+TheScheduler = None
+TheSchedulerMutex = threading.RLock()
+
+def getScheduler():
+	"""
+	Returns the RTP scheduler shared by all the probes,
+	starting it on first use.
+	"""
+	global TheScheduler
+	TheSchedulerMutex.acquire()
+	try:
+		if not TheScheduler:
+			TheScheduler = RtpScheduler()
+			TheScheduler.start()
+	finally:
+		TheSchedulerMutex.release()
+	return TheScheduler
+
+
+class SendingStream:
+	"""
+	An outgoing RTP stream, driven by the RtpScheduler.
+	
+	The n-th packet of the stream is due at start + n * frame size,
+	and carries the timestamp n * samples per packet.
+	
+	Its packets are taken from the ring of the payload being played,
+	if any, or from the ring of the default payload.
+	"""
+	def __init__(self, probe, fromSocket, toAddr, payloadType, frameSize, packetSize, sampleRate, ssrc, defaultPayload):
+		self._mutex = threading.RLock()
+		self._probe = probe
+		self._socket = fromSocket
+		self._toAddr = toAddr
+		self._payloadType = payloadType
+		self._packetSize = packetSize
+		self._ssrc = ssrc
+		# interval between 2 packets, in s (float)
+		self._interval = frameSize / 1000.0
+		self._samplesPerPacket = frameSize * sampleRate / 1000
+		# NB: for RFC2833, samplesPerPacket 160 should be used.
+		
+		self._defaultRing = getDefaultPayloadRing(defaultPayload, packetSize, payloadType)
+		self._defaultIndex = 0
+		# The payload being played, if any
+		self._playRing = None
+		self._playIndex = 0
+		self._playLoopCount = 0
+
+		self._active = False
+		self._start = None
+		# Index of the next packet on the sampling clock
+		self._index = 0
+		# We always (re)start our stream with a seq number = 0, and a timestamp ts to 0 too
+		# (According to RFC1889, should be a unique ID instead)
+		self._seq = 0
 		
-		return data
+		# Late-send statistics
+		self._sentPackets = 0
+		self._latePackets = 0
+		self._skippedPackets = 0
+		self._maxLateness = 0.0
+		self._totalLateness = 0.0
+
+	def _lock(self):
+		self._mutex.acquire()
+	
+	def _unlock(self):
+		self._mutex.release()
+	
+	def getSocket(self):
+		return self._socket
+	
+	def activate(self):
+		self._lock()
+		self._active = True
+		self._start = time.time()
+		self._unlock()
+		self._probe.getLogger().info("Now sending RTP, %4.4fs between packets, %s samples per packet" % (self._interval, self._samplesPerPacket))
+	
+	def deactivate(self):
+		# Waits for a possible packet being sent
+		self._lock()
+		self._active = False
+		self._unlock()
+	
+	def isActive(self):
+		return self._active
 
-	def _setDataToStream(self, data, count):
+	def play(self, data, loopCount):
 		"""
-		Sets some source data to stream asap.
+		Plays a payload loopCount times, then goes back to the default payload.
 		"""
+		ring = PayloadRing(data, self._packetSize, self._payloadType, loop = False)
 		self._lock()
-		try:
-			self._dataToStream = StringIO.StringIO(data)
-			self._dataToStreamLoopCount = count
-		except Exception as e:
-			self.getLogger().warning("Exception while setting data to stream: %s" % str(e))
+		self._playRing = ring
+		self._playIndex = 0
+		self._playLoopCount = loopCount
 		self._unlock()
+	
+	def _getNextPacket(self):
+		"""
+		Returns the next packet from the played payload or the default one,
+		to patch before sending.
+		"""
+		ring = self._playRing
+		if ring:
+			packet = ring[self._playIndex]
+			self._playIndex += 1
+			if self._playIndex == len(ring):
+				self._playIndex = 0
+				self._playLoopCount -= 1
+				if self._playLoopCount <= 0:
+					self._probe.getLogger().info("Data stream played. Now back to the default payload.")
+					# TODO: send a notification to tell the userland the source has been played
+					self._playRing = None
+				else:
+					self._probe.getLogger().info("Resetting stream, remaining count %d" % self._playLoopCount)
+		else:
+			packet = self._defaultRing[self._defaultIndex]
+			self._defaultIndex = (self._defaultIndex + 1) % len(self._defaultRing)
+		return packet
 
-	def _resetDataToStream(self):
+	def getNextDeadline(self):
+		return self._start + self._index * self._interval
+	
+	def sendPacket(self):
 		"""
-		Reset the data to stream.
+		Sends the packet due now, if any.
 		"""
 		self._lock()
 		try:
-			if self._dataToStream:
-				self._dataToStream.close()
-			self._dataToStream = None
-			self._dataToStreamLoopCount = 0
+			if self._active:
+				self._sendPacket()
 		except Exception as e:
-			self.getLogger().warning("Exception while resetting data to stream: %s" % str(e))
+			self._probe.getLogger().warning("Exception while sending RTP: %s " % str(e))
+			self._index += 1
 		self._unlock()
+
+	def _sendPacket(self):
+		lateness = time.time() - self.getNextDeadline()
+		if lateness > RtpScheduler.MAX_LATENESS:
+			# We won't catch up: skip the packets we missed
+			# (keeping the timestamps on the sampling clock)
+			missed = int(lateness / self._interval)
+			self._index += missed
+			self._skippedPackets += missed
+			lateness -= missed * self._interval
+
+		packet = self._getNextPacket()
+		# The timestamp actually counts the samples.
+		ts = (self._index * self._samplesPerPacket) % TWO_TO_THE_32ND
+		struct.pack_into('!HII', packet, 2, self._seq, ts, self._ssrc)
+
+		# Log outgoing payloads only on first packet, with a packet as an example.
+		if not self._sentPackets:
+			self._probe.logSentPayload("Sending RTP...", str(packet), "%s:%s" % self._toAddr)
+
+		try:
+			self._socket.sendto(packet, 0, self._toAddr)
+		except Exception as e:
+			self._probe.getLogger().warning("Exception while sending a RTP packet: %s" % str(e))
+		
+		self._sentPackets += 1
+		self._totalLateness += lateness
+		if lateness > RtpScheduler.LATE_THRESHOLD:
+			self._latePackets += 1
+		if lateness > self._maxLateness:
+			self._maxLateness = lateness
+		# the sequence number is linearly incremented by one.
+		self._seq = (self._seq + 1) % TWO_TO_THE_16TH
+		self._index += 1
 	
-	def stopSendingRtp(self):
+	def getStatistics(self):
+		"""
+		Returns the late-send statistics of the stream,
+		durations in ms.
+		
+		@rtype: dict
+		"""
 		self._lock()
-		thread = self._sendingThread
-		self._sendingThread = None
+		ret = { 'sentPackets': self._sentPackets, 'latePackets': self._latePackets,
+			'skippedPackets': self._skippedPackets,
+			'maxLateness': self._maxLateness * 1000.0,
+			'meanLateness': self._sentPackets and (self._totalLateness * 1000.0 / self._sentPackets) or 0.0 }
 		self._unlock()
-		if thread:
-			thread.stop()
+		return ret
 
-	def stopListeningRtp(self):
-		self._lock()
-		thread = self._listeningThread
-		self._listeningThread = None
-		self._unlock()
-		if thread:
-			thread.stop()
 
+RTP_SEQ_MOD = 1<<16
+# Sequence number validation, as suggested by RFC 3550 A.1
+MAX_DROPOUT = 3000
+MAX_MISORDER = 100
 
-TWO_TO_THE_48TH = 2<<48
-TWO_TO_THE_32ND = 2<<32
+class ReceptionStatistics:
+	"""
+	Receive statistics of an incoming RTP stream,
+	updated incrementally on each packet, as described in RFC 3550
+	(sequence number validation (A.1), expected and lost packets (A.3),
+	interarrival jitter (A.8)).
+	
+	Duplicates are detected within a window of the last received packets,
+	and are not counted as received packets.
+	"""
+	# Duplicate detection window, in packets
+	WINDOW = 1024
+
+	def __init__(self, ssrc, sampleRate, seq, now):
+		self._ssrc = ssrc
+		self._sampleRate = sampleRate
+		self._baseSeq = seq
+		self._maxSeq = seq
+		self._cycles = 0
+		self._badSeq = RTP_SEQ_MOD + 1
+		self._window = [ -1 ] * self.WINDOW
+
+		self._received = 0
+		self._duplicates = 0
+		self._reordered = 0
+		self._bytes = 0
+		self._firstArrival = now
+		self._lastArrival = now
+		# Jitter, in timestamp units
+		self._transit = None
+		self._jitter = 0.0
+		
+		# Counters at the previous receiver report
+		self._expectedPrior = 0
+		self._receivedPrior = 0
 
-class SendingThread(threading.Thread):
-	def __init__(self, probe, *args):
+	def update(self, seq, ts, size, now):
 		"""
-		Paramerers:
-		fromSocket, toAddr,
-		payloadType,
-		frameSize,
-		packetSize,
-		sampleRase,
-		ssrc
+		Accounts an incoming packet.
 		"""
-		threading.Thread.__init__(self)
-		self._probe = probe
-		self._args = args
-		self._stopEvent = threading.Event()
-	
-	def stop(self):
-		self._probe.getLogger().info("Stopping sending thread...")
-		self._stopEvent.set()
-		self.join()
-		self._probe.getLogger().info("Sending thread stopped.")
+		udelta = (seq - self._maxSeq) % RTP_SEQ_MOD
+		reordered = False
+		if udelta < MAX_DROPOUT:
+			# In order, with permissible gap
+			if seq < self._maxSeq:
+				# Sequence number wrapped
+				self._cycles += RTP_SEQ_MOD
+			self._maxSeq = seq
+			extendedSeq = self._cycles + seq
+		elif udelta <= RTP_SEQ_MOD - MAX_MISORDER:
+			# The sequence number made a very large jump
+			if seq != self._badSeq:
+				self._badSeq = (seq + 1) % RTP_SEQ_MOD
+				return
+			# Two sequential packets: assume that the other side
+			# restarted without telling us, just resync
+			self.__init__(self._ssrc, self._sampleRate, seq, now)
+			extendedSeq = seq
+		else:
+			# Duplicate or reordered packet
+			extendedSeq = self._cycles + seq
+			if seq > self._maxSeq:
+				# Belongs to the previous cycle
+				extendedSeq -= RTP_SEQ_MOD
+			reordered = True
+
+		i = extendedSeq % self.WINDOW
+		if self._window[i] == extendedSeq:
+			self._duplicates += 1
+			return
+		self._window[i] = extendedSeq
+		if reordered:
+			self._reordered += 1
+
+		self._received += 1
+		self._bytes += size
+		self._lastArrival = now
+
+		# Interarrival jitter
+		transit = int(now * self._sampleRate) - ts
+		if self._transit is not None:
+			d = abs(transit - self._transit)
+			if d > TWO_TO_THE_32ND / 2:
+				# Timestamp wrapped
+				d = abs(d - TWO_TO_THE_32ND)
+			self._jitter += (d - self._jitter) / 16.0
+		self._transit = transit
+
+	def getExpected(self):
+		return self._cycles + self._maxSeq - self._baseSeq + 1
+
+	def getStatistics(self):
+		"""
+		@rtype: dict
+		@returns: ssrc, receivedPackets, expectedPackets, lostPackets,
+		duplicatePackets, reorderedPackets (integers),
+		jitter (float, in ms), bitrate (float, in bit/s)
+		"""
+		expected = self.getExpected()
+		duration = self._lastArrival - self._firstArrival
+		if duration > 0:
+			bitrate = self._bytes * 8 / duration
+		else:
+			bitrate = 0.0
+		return { 'ssrc': self._ssrc, 'receivedPackets': self._received,
+			'expectedPackets': expected, 'lostPackets': expected - self._received,
+			'duplicatePackets': self._duplicates, 'reorderedPackets': self._reordered,
+			'jitter': self._jitter * 1000.0 / self._sampleRate, 'bitrate': bitrate }
 	
-	def run(self):
+	def getReportBlock(self):
 		"""
-		RTP sending loop.
+		Returns a RTCP reception report block for the stream,
+		as expected by rtp.rtcp, and resets the interval counters.
 		"""
-		fromSocket, toAddr, payloadType, frameSize, packetSize, sampleRate, ssrc = self._args
+		expected = self.getExpected()
+		expectedInterval = expected - self._expectedPrior
+		lostInterval = expectedInterval - (self._received - self._receivedPrior)
+		self._expectedPrior = expected
+		self._receivedPrior = self._received
+		if expectedInterval > 0 and lostInterval > 0:
+			fraclost = float(lostInterval) / expectedInterval
+		else:
+			fraclost = 0.0
+		# No sender report support: lsr and dlsr are 0
+		return { 'ssrc': self._ssrc, 'fraclost': fraclost,
+			'packlost': max(min(expected - self._received, 0x7fffff), -0x800000),
+			'highest': (self._cycles + self._maxSeq) % TWO_TO_THE_32ND,
+			'jitter': int(self._jitter), 'lsr': 0, 'dlsr': 0 }
+
+
+class ListeningStream:
+	"""
+	An incoming RTP stream, served by the RtpScheduler.
+	"""
+	def __init__(self, probe, fromSocket, timeout, sampleRate, rtcpSocket = None, rtcpInterval = 0.0, ssrc = 0):
+		self._mutex = threading.RLock()
+		self._probe = probe
+		self._socket = fromSocket
+		self._timeout = timeout
+		self._sampleRate = sampleRate
+		self._active = False
 		
-		# Some fixed values computation
-		# interval between 2 packets, in s (float)
-		interval = frameSize / 1000.0
-		# We always (re)start our stream with a seq number = 0, and a timestamp ts to 0 too
-		# (According to RFC1889, should be a unique ID instead)
-		seq = 0
-		ts = 0
-		samplesPerPacket = frameSize * sampleRate / 1000
-		# NB: for RFC2833, samplesPerPacket 160 should be used.
-		self._probe.getLogger().info("Now sending RTP, %4.4fs between packets, %s samples per packet" % (interval, samplesPerPacket))
+		self._lastPt = None
+		self._lastSourceIp = None
+		self._lastSourcePort = None
+		self._lastTime = None # Last time(stamp) we received a packet
+		self._lastSsrc = None
+		
+		# The statistics of the current (or last) incoming stream
+		self._statistics = None
+		
+		# RTCP receiver reports, if enabled
+		self._rtcpSocket = rtcpSocket
+		self._rtcpInterval = rtcpInterval
+		self._ssrc = ssrc
+		self._nextReport = None
 
-		while not self._stopEvent.isSet():
-			try:
-				# Let's build a RTP packet
-				# The payload is a packetsize-bytes extract from the current played resource.
-				data = self._probe.getNextPacket(packetSize)
-				packet = rtp.packets.RTPPacket(ssrc, seq, ts, data, payloadType)
-
-				packetBytes = packet.netbytes()
-
-				# Log outgoing payloads only on first packet, with a packet as an example.
-				if not seq:
-					self._probe.logSentPayload("Sending RTP...", packetBytes, "%s:%s" % toAddr)
-				
-				# the sequence number is linearly incremented by one.
-				# Cycled on 2^48, at least according to Shtoom implementation.
-				seq += 1
-				if seq > TWO_TO_THE_48TH:
-					seq -= TWO_TO_THE_48TH
-				# The timestamp actually counts the samples.
-				ts += samplesPerPacket
-				if ts > TWO_TO_THE_32ND:
-					ts -= TWO_TO_THE_32ND
+	def _lock(self):
+		self._mutex.acquire()
+	
+	def _unlock(self):
+		self._mutex.release()
 
-				try:
-					fromSocket.sendto(packetBytes, 0, toAddr)
-				except Exception as e:
-					self._probe.getLogger().warning("Exception while sending a RTP packet: %s" % str(e))
-			except Exception as e:
-				self._probe.getLogger().warning("Exception while sending RTP: %s " % str(e))
-			# Wait our interval (should be an asynchronous tick, normally...)
-			time.sleep(interval)
+	def getSocket(self):
+		return self._socket
 
-		self._probe._conditionallyCloseSocket(fromSocket)
-		self._probe._resetDataToStream()
+	def getRtcpSocket(self):
+		return self._rtcpSocket
+
+	def activate(self):
+		self._lock()
+		self._active = True
+		self._unlock()
+	
+	def deactivate(self):
+		# Waits for a possible packet being handled
+		self._lock()
+		self._active = False
+		self._unlock()
 
+	def getStatistics(self):
+		"""
+		@rtype: dict, or None
+		@returns: the statistics of the current or last received stream,
+		None if no stream was received.
+		"""
+		self._lock()
+		ret = None
+		if self._statistics:
+			ret = self._statistics.getStatistics()
+			ret['fromIp'] = self._lastSourceIp
+			ret['fromPort'] = self._lastSourcePort
+		self._unlock()
+		return ret
 
-class ListeningThread(threading.Thread):
-	def __init__(self, probe, *args):
-		threading.Thread.__init__(self)
-		self._probe = probe
-		self._args = args
-		self._stopEvent = threading.Event()
+	def checkTimeout(self, now):
+		"""
+		Detects an interrupted stream,
+		sends the RTCP receiver reports.
+		"""
+		self._lock()
+		try:
+			if self._active and (self._lastTime) and ((now - self._lastTime) > self._timeout):
+				self._probe.triEnqueueMsg(('stoppedReceivingRtp', { 'reason': 'interrupted' }))
+				self._lastTime = None
+			if self._active and self._lastTime and self._rtcpSocket and now >= self._nextReport:
+				self._sendReceiverReport()
+				self._nextReport = now + self._rtcpInterval
+		except Exception as e:
+			self._probe.getLogger().error("Exception while listening RTP: %s" % str(e))
+		self._unlock()
 	
-	def stop(self):
-		self._probe.getLogger().info("Stopping listening thread...")
-		self._stopEvent.set()
-		self.join()
-		self._probe.getLogger().info("Listening thread stopped.")
+	def _sendReceiverReport(self):
+		compound = rtp.rtcp.RTCPCompound()
+		compound.addPacket(rtp.rtcp.RTCPPacket('RR', contents = [ self._ssrc, [ self._statistics.getReportBlock() ] ]))
+		cname = 'testerman@%s' % self._rtcpSocket.getsockname()[0]
+		compound.addPacket(rtp.rtcp.RTCPPacket('SDES', contents = [ (self._ssrc, [ ('CNAME', cname) ]) ]))
+		try:
+			self._rtcpSocket.sendto(compound.encode(), 0, (self._lastSourceIp, self._lastSourcePort + 1))
+		except Exception as e:
+			self._probe.getLogger().warning("Exception while sending a RTCP packet: %s" % str(e))
 	
-	def run(self):
+	def onReadable(self):
 		"""
-		Starts listening RTP.
+		Handles all the packets pending on the socket.
 		"""
-		fromSocket, timeout = self._args
-
-		lastPt = None
-		lastSourceIp = None
-		lastSourcePort = None
-		lastTime = None # Last time(stamp) we received a packet
-		lastSsrc = None
-		while not self._stopEvent.isSet():
-			try:
-				# Stream interrupted on timeout ?
-				if (lastTime) and ((time.time() - lastTime) > timeout):
-					self._probe.triEnqueueMsg(('stoppedReceivingRtp', { 'reason': 'interrupted' }))
-					lastTime = None
-
-				r, w, e = select.select([fromSocket], [], [], 0.01)
-				if not fromSocket in r:
-					continue
-				
-				# Something to read. Get it, decode it.
-				(data, src) = fromSocket.recvfrom(10000)
+		self._lock()
+		try:
+			while self._active:
 				try:
-					packet = rtp.packets.parse_rtppacket(data)
-				except:
-					self._probe.getLogger().info("Invalid RTP packet received")
-					continue
-
-				pt = packet.header.pt
-				ssrc = packet.header.ssrc
-				if not lastTime: # i.e. this is our first packet for the stream
-					# Log incoming payloads only on first packet, with a packet as an example.
-					self._probe.logReceivedPayload("Receiving RTP...", data, "%s:%s" % src)
-					self._probe.triEnqueueMsg(('startedReceivingRtp', {'payloadType': pt, 'ssrc': ssrc, 'fromIp': src[0],
-						'fromPort': src[1]}), "%s:%s" % src)
-					lastTime = time.time()
-				else:
-					# Stream continued. Check for possible changes in properties
-					# TODO: use a bitmap of updated properties
-					if (pt, src[0], src[1], ssrc) != (lastPt, lastSourceIp, lastSourcePort, lastSsrc):
-						# PT or emitter updated: raise a stop then a start event.
-						self._probe.triEnqueueMsg(('stoppedReceivingRtp', {'reason': 'updated'}), "%s:%s" % src)
-						self._probe.logReceivedPayload("Receiving RTP...", data, "%s:%s" % src)
-						self._probe.triEnqueueMsg(('startedReceivingRtp', {'payloadType': pt, 'ssrc': ssrc, 'fromIp': lastSourceIp,
-							'fromPort': lastSourcePort}), "%s:%s" % src)
-
-				# Update stream properties with the current values
-				lastPt = pt
-				lastSourceIp, lastSourcePort = src
-				lastSsrc = ssrc
-				lastTime = time.time()
-			
-			except Exception as e:
-				self._probe.getLogger().error("Exception while listening RTP: %s" % str(e))
+					(data, src) = self._socket.recvfrom(10000)
+				except socket.error:
+					break
+				self._onPacket(data, src)
+		except Exception as e:
+			self._probe.getLogger().error("Exception while listening RTP: %s" % str(e))
+		self._unlock()
 
-		self._probe._conditionallyCloseSocket(fromSocket)
+	def _onPacket(self, data, src):
+		# Only the fixed header is decoded
+		if len(data) < 12 or (ord(data[0]) >> 6) != 2:
+			self._probe.getLogger().info("Invalid RTP packet received")
+			return
+		pt, seq, ts, ssrc = struct.unpack('!xBHII', data[:12])
+		pt &= 0x7f
+		now = time.time()
+
+		if not self._lastTime: # i.e. this is our first packet for the stream
+			# Log incoming payloads only on first packet, with a packet as an example.
+			self._probe.logReceivedPayload("Receiving RTP...", data, "%s:%s" % src)
+			self._probe.triEnqueueMsg(('startedReceivingRtp', {'payloadType': pt, 'ssrc': ssrc, 'fromIp': src[0],
+				'fromPort': src[1]}), "%s:%s" % src)
+			self._statistics = ReceptionStatistics(ssrc, self._sampleRate, seq, now)
+			self._nextReport = now + self._rtcpInterval
+		else:
+			# Stream continued. Check for possible changes in properties
+			# TODO: use a bitmap of updated properties
+			if (pt, src[0], src[1], ssrc) != (self._lastPt, self._lastSourceIp, self._lastSourcePort, self._lastSsrc):
+				# PT or emitter updated: raise a stop then a start event.
+				self._probe.triEnqueueMsg(('stoppedReceivingRtp', {'reason': 'updated'}), "%s:%s" % src)
+				self._probe.logReceivedPayload("Receiving RTP...", data, "%s:%s" % src)
+				self._probe.triEnqueueMsg(('startedReceivingRtp', {'payloadType': pt, 'ssrc': ssrc, 'fromIp': self._lastSourceIp,
+					'fromPort': self._lastSourcePort}), "%s:%s" % src)
+				if ssrc != self._lastSsrc or src != (self._lastSourceIp, self._lastSourcePort):
+					self._statistics = ReceptionStatistics(ssrc, self._sampleRate, seq, now)
+
+		self._statistics.update(seq, ts, len(data), now)
+
+		# Update stream properties with the current values
+		self._lastPt = pt
+		self._lastSourceIp, self._lastSourcePort = src
+		self._lastSsrc = ssrc
+		self._lastTime = now
 
 	
 ProbeImplementationManager.registerProbeImplementationClass('rtp', RtpProbe)
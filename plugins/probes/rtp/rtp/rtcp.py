@@ -166,7 +166,20 @@ class RTCPPacket:
         self._contents = [ssrc,blocks]
 
     def encode_RR(self):
-        return ''
+        ssrc, blocks = self._contents
+        packet = struct.pack('!BBHI', len(blocks)|128, self._ptcode, 0, ssrc)
+        for block in blocks:
+            packet = packet + self._encodeRRSRReportBlock(block)
+        packet = self._patchLengthHeader(packet)
+        return packet
+
+    def _encodeRRSRReportBlock(self, c):
+        # Same dict format as returned by _decodeRRSRReportBlocks.
+        # The cumulative number of packets lost is a signed 24-bit value.
+        fraclost = min(int(c['fraclost'] * 256), 255)
+        lost = (fraclost << 24) | (c['packlost'] & 0x00FFFFFF)
+        return struct.pack('!IIIIII', c['ssrc'], lost, c['highest'],
+                           c['jitter'], c['lsr'], c['dlsr'])
 
     def _decodeRRSRReportBlocks(self):
         blocks = []
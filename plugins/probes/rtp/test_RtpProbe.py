@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# RtpProbe reception statistics tests.
+#
+# Requires the core directory in the PYTHONPATH.
+##
+
+import RtpProbe
+
+import unittest
+
+
+SAMPLE_RATE = 8000
+
+class ReceptionStatisticsTestSequence(unittest.TestCase):
+	def receive(self, seqs):
+		"""
+		Creates the statistics on the first packet, as the listening
+		stream does, then accounts all the packets.
+		Packets are regularly spaced, 1s apart.
+		"""
+		stats = RtpProbe.ReceptionStatistics(0x1234, SAMPLE_RATE, seqs[0], 0.0)
+		for (i, seq) in enumerate(seqs):
+			stats.update(seq, i * SAMPLE_RATE, 160, float(i))
+		return stats
+
+	def assertCounters(self, stats, received, expected, duplicates = 0, reordered = 0):
+		s = stats.getStatistics()
+		self.assertEqual(s['receivedPackets'], received)
+		self.assertEqual(s['expectedPackets'], expected)
+		self.assertEqual(s['lostPackets'], expected - received)
+		self.assertEqual(s['duplicatePackets'], duplicates)
+		self.assertEqual(s['reorderedPackets'], reordered)
+
+	def test_inOrder(self):
+		stats = self.receive(range(10))
+		self.assertCounters(stats, 10, 10)
+		self.assertEqual(stats.getStatistics()['jitter'], 0.0)
+
+	def test_loss(self):
+		stats = self.receive([ 0, 1, 3, 4, 7 ])
+		self.assertCounters(stats, 5, 8)
+		block = stats.getReportBlock()
+		self.assertEqual(block['packlost'], 3)
+		self.assertEqual(block['fraclost'], 3 / 8.0)
+		self.assertEqual(block['highest'], 7)
+		# Interval counters are reset on each report block
+		self.assertEqual(stats.getReportBlock()['fraclost'], 0.0)
+
+	def test_seqWrap(self):
+		stats = self.receive([ 65533, 65534, 65535, 0, 1, 2 ])
+		self.assertCounters(stats, 6, 6)
+		self.assertEqual(stats.getReportBlock()['highest'], 65536 + 2)
+
+	def test_seqWrapWithLoss(self):
+		stats = self.receive([ 65534, 65535, 1, 2 ])
+		self.assertCounters(stats, 4, 5)
+
+	def test_duplicates(self):
+		stats = self.receive([ 0, 1, 1, 2, 1, 3 ])
+		self.assertCounters(stats, 4, 4, duplicates = 2)
+
+	def test_reordering(self):
+		stats = self.receive([ 0, 2, 1, 3, 5, 4 ])
+		self.assertCounters(stats, 6, 6, reordered = 2)
+
+	def test_reorderingAcrossWrap(self):
+		stats = self.receive([ 65534, 0, 65535, 1 ])
+		self.assertCounters(stats, 4, 4, reordered = 1)
+
+	def test_duplicateAcrossWrap(self):
+		stats = self.receive([ 65534, 65535, 0, 65535, 1 ])
+		self.assertCounters(stats, 4, 4, duplicates = 1)
+
+	def test_largeJumpIgnored(self):
+		# A single packet far away from the expected sequence number is discarded
+		stats = self.receive([ 100, 101, 40000, 102 ])
+		self.assertCounters(stats, 3, 3)
+
+	def test_resync(self):
+		# Two sequential packets after a large jump: the source restarted
+		stats = self.receive([ 100, 101, 40000, 40001, 40002 ])
+		self.assertCounters(stats, 2, 2)
+		self.assertEqual(stats.getReportBlock()['highest'], 40002)
+
+	def test_jitter(self):
+		stats = RtpProbe.ReceptionStatistics(0x1234, SAMPLE_RATE, 0, 0.0)
+		stats.update(0, 0, 160, 0.0)
+		stats.update(1, SAMPLE_RATE, 160, 1.0)
+		# 1/64s late, i.e. 125 timestamp units: jitter = 125/16 units
+		stats.update(2, 2 * SAMPLE_RATE, 160, 2 + 1 / 64.0)
+		self.assertEqual(stats.getStatistics()['jitter'], 125 / 16.0 * 1000.0 / SAMPLE_RATE)
+		self.assertEqual(stats.getReportBlock()['jitter'], 7)
+
+
+if __name__ == "__main__":
+	unittest.main()
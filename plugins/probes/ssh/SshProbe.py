@@ -27,6 +27,9 @@ import threading
 import os.path
 import fcntl
 import base64
+import random
+import re
+import time
 
 import hmac
 try:
@@ -66,6 +69,8 @@ Properties:
    "``working_dir``","string","(none)","the diretory to go to before executing the command line. By default, the working dir is the login directory (usually the home dir)."
    "``strict_host``","boolean","``True``","if set to False, the probe removes the target host from $HOME/.ssh/known_hosts to avoid failing when connecting to an updated host. Otherwise, the connection fails if the SSH key changed."
    "``max_line_length``","integer","``150``","the max number of characters before splitting a line over multiple lines with a \\-based continuation. Currently the splitting algorithm is pretty dumb and may split your command line in the middle of a quoted argument, possibly changing its actual value. Increasing this size may be a workaround in such cases."
+   "``persistent_session``","boolean","``True``","if set to True, the SSH session is kept open once a command is complete, and reused for the next commands, including in the next testcases. Otherwise, a new session is opened (with a full SSH handshake and authentication) for each command."
+   "``health_check_interval``","float","``30.0``","persistent session only: if the session has been idle for more than this number of seconds, it is checked (with a round trip to the remote shell) before being reused, and re-opened if needed. 0 means never check."
 
 Overview
 --------
@@ -76,7 +81,7 @@ Basically you just specify a command to execute that will be executed within a s
 once its execution is over. The response contains both an integer return code and the whole command output.
 
 If you consider the command execution is too long (no response received), you can cancel it at any time from the
-userland. Such a cancellation terminates all the subprocess tree with a SIGKILL signal. Once cancelled,
+userland. Such a cancellation interrupts the command (see below). Once cancelled,
 you should not expect a command response anymore.
 
 No interaction is possible during the command execution.
@@ -89,6 +94,18 @@ execution was either complete (i.e. you received a ``ExecResponse`` message) or
 If you need to execute multiple commands in parallel, you should use multiple probes - consider that each one is as if you 
 had one open ssh terminal connection to your SUT.
 
+By default (``persistent_session``), this terminal connection is actually kept open: the SSH login sequence is only
+performed for the first command, and the following commands, including the ones sent in other testcases,
+are executed in the same remote shell, as long as the ``host``, ``username`` and ``password`` do not change.
+Each command is executed in its own subshell, so that its working directory or environment changes
+do not leak to the next ones, and its output and exit status are delimited by a unique shell prompt.
+If the remote shell is not sh-compatible (csh, etc), commands are executed directly in the session shell,
+and their exit status is retrieved with an additional round trip.
+A session that has been idle for more than ``health_check_interval`` seconds is checked before being reused.
+
+When a command is cancelled, it is interrupted (as with a Ctrl+C). If the remote shell does not come back
+within one second, the session is closed.
+
 Notes:
 
 * When starting daemons from this probe, make sure that your daemon correctly closes standard output, 
@@ -150,6 +167,10 @@ The test system interface port bound to such a probe complies with the ``ExecPor
 		self.setDefaultProperty('working_dir', None)
 		self.setDefaultProperty('strict_host', True)
 		self.setDefaultProperty('max_line_length', 150)
+		self.setDefaultProperty('persistent_session', True)
+		self.setDefaultProperty('health_check_interval', 30.0)
+		# The current SSH session, if any
+		self._session = None
 
 		self._known_hosts = None
 		try:
@@ -162,6 +183,9 @@ The test system interface port bound to such a probe complies with the ``ExecPor
 	def onTriUnmap(self):
 		self.getLogger().debug("onTriUnmap()")
 		self.cancelCommand()
+		# The persistent session is reused in the next testcases
+		if not self['persistent_session']:
+			self._closeSession()
 
 	def onTriMap(self):
 		self.getLogger().debug("onTriMap()")
@@ -247,6 +271,87 @@ The test system interface port bound to such a probe complies with the ``ExecPor
 				self.getLogger().error('Error while cancelling the pending SSH thread: %s' % str(e))
 		# Nothing to do if no pending thread.
 
+	def _removeKnownHost(self, host):
+		"""
+		Removes host from the known_hosts file.
+		"""
+		try:
+			f = open(self._known_hosts)
+			lines = f.readlines()
+			f.close()
+			adjustedlines = []
+			for l in lines:
+				# SSH >= 4.0 versions used hashed host names
+				# format: |1|<salt>|<hash>= <keytype> <...>
+				# <hash> is a HMAC-SHA1 in Base64 of ( unbase64(<salt>), <hostname> )
+				if l.startswith('|1|'):
+					try:
+						_, _, salt, hashedhostname = l.split(' ')[0].split('|')
+						h = hmac.new(base64.decodestring(salt), host, SHA1)
+						computedhash = base64.encodestring(h.digest()).strip()
+						if not (hashedhostname == computedhash):
+							# Keep the entry
+							adjustedlines.append(l)
+						else:
+							# Discard the entry, this is our hostname
+							pass
+					except Exception as e:
+						# In case of an error, let's keep the entry
+						adjustedlines.append(l)
+					
+				# SSH < 4.0 uses plain text host names
+				elif not l.startswith(host + ' '):
+					adjustedlines.append(l)
+			
+			# Should be file locked. But apparently on Solaris flock() does not work
+			# as expected, so possible race conditions if running this probe under Solaris.
+			f = open(self._known_hosts, 'w')
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+			f.write(''.join(adjustedlines))
+			f.close()
+		except Exception as e:
+			# Just proceed. It may still work.
+			try:
+				f.close()
+			except:
+				pass
+
+	def _getSession(self, username, host, password, timeout):
+		"""
+		Returns the current session if it can be reused, or a new one.
+		"""
+		session = self._session
+		if session:
+			interval = self['health_check_interval']
+			if session.key != (host, username, password):
+				self.getLogger().info("Session parameters changed, opening a new session...")
+				self._closeSession()
+			elif (interval and time.time() - session.lastUsed > interval) and not session.check(timeout):
+				self.getLogger().info("Session lost, opening a new session...")
+				self._closeSession()
+			elif not session.isalive():
+				self._closeSession()
+			else:
+				return session
+
+		# Remove possible known host
+		if not self['strict_host'] and self._known_hosts:
+			self._removeKnownHost(host)
+
+		# Make sure no askpass will be displayed
+		if os.environ.has_key('DISPLAY'):
+			del os.environ['DISPLAY']
+		self._session = SshSession(host, username, password, timeout)
+		return self._session
+
+	def _closeSession(self):
+		self._lock()
+		session = self._session
+		self._session = None
+		self._unlock()
+		if session:
+			session.close()
+
 	def executeCommand(self, command, username, host, password, timeout, workingdir):
 		"""
 		Executes a command.
@@ -257,72 +362,19 @@ The test system interface port bound to such a probe complies with the ``ExecPor
 			sshThread = self._sshThread
 			if sshThread:
 				raise Exception("Another command is currently being executed. Please cancel it first.")
-	
-			# Remove possible known host
-			if not self['strict_host'] and self._known_hosts:
-				try:
-					f = open(self._known_hosts)
-					lines = f.readlines()
-					f.close()
-					adjustedlines = []
-					for l in lines:
-						# SSH >= 4.0 versions used hashed host names
-						# format: |1|<salt>|<hash>= <keytype> <...>
-						# <hash> is a HMAC-SHA1 in Base64 of ( unbase64(<salt>), <hostname> )
-						if l.startswith('|1|'):
-							try:
-								_, _, salt, hashedhostname = l.split(' ')[0].split('|')
-								h = hmac.new(base64.decodestring(salt), host, SHA1)
-								computedhash = base64.encodestring(h.digest()).strip()
-								if not (hashedhostname == computedhash):
-									# Keep the entry
-									adjustedlines.append(l)
-								else:
-									# Discard the entry, this is our hostname
-									pass
-							except Exception as e:
-								# In case of an error, let's keep the entry
-								adjustedlines.append(l)
-							
-						# SSH < 4.0 uses plain text host names
-						elif not l.startswith(host + ' '):
-							adjustedlines.append(l)
-					
-					# Should be file locked. But apparently on Solaris flock() does not work
-					# as expected, so possible race conditions if running this probe under Solaris.
-					f = open(self._known_hosts, 'w')
-					fcntl.flock(f.fileno(), fcntl.LOCK_EX)
-					f.write(''.join(adjustedlines))
-					f.close()
-				except Exception as e:
-					# Just proceed. It may still work.
-					try:
-						f.close()
-					except:
-						pass
-
-			# Make sure no askpass will be displayed
-			if os.environ.has_key('DISPLAY'):
-				del os.environ['DISPLAY']
-			ssh = pexpect.pxssh.pxssh()
-
-			if not ssh.login(host, username, password, login_timeout = timeout):
-				raise Exception("Unable to login: incorrect password, unreachable host, timeout during negotiation")
 
+			session = self._getSession(username, host, password, timeout)
 			# OK, we're logged in.
 			# Move to working dir, if any
-			if workingdir:
-				ssh.sendline('cd "%s"' % workingdir)
-				ssh.prompt()
-				ssh.sendline('echo $?')
-				ssh.prompt()
-				# 'before' contains: line 0: echo $? , line 1: the echo output
-				status = int(ssh.before.split('\n')[1].strip())
-				if status:
-					raise Exception('Unable to change to working dir "%s"' % workingdir)
-				
+			try:
+				session.changeDir(workingdir, timeout)
+			except Exception as e:
+				if not session.check(timeout):
+					self._closeSession()
+				raise e
+
 			# Now start our dedicated thread.
-			self._sshThread = SshThread(self, ssh, command)
+			self._sshThread = SshThread(self, session, command)
 		except Exception as e:
 			self._unlock()
 			raise e
@@ -330,10 +382,12 @@ The test system interface port bound to such a probe complies with the ``ExecPor
 		self._unlock()
 		self._sshThread.start()
 
-	def onSshThreadTerminated(self, status, output):
+	def onSshThreadTerminated(self, status, output, reusable):
 		self._lock()
 		self._sshThread = None
 		self._unlock()
+		if not reusable or not self['persistent_session']:
+			self._closeSession()
 
 		if status is not None:
 			# We stopped on command completion
@@ -343,22 +397,182 @@ The test system interface port bound to such a probe complies with the ``ExecPor
 		# Otherwise, we stopped on cancel - nothing to raise.
 
 
+class SshSession:
+	"""
+	A remote shell, logged in through ssh, that may execute several commands.
+
+	If the remote shell supports it, the shell prompt is set to a unique string
+	containing the last command exit status, and the terminal echo is disabled.
+	This way, a command output is delimited by the next prompt, and its status
+	is retrieved without another round trip.
+	Otherwise, the status is retrieved with an additional echo $?.
+	"""
+	def __init__(self, host, username, password, timeout):
+		self.key = (host, username, password)
+		self.workingdir = None
+		self.lastUsed = time.time()
+		self._ssh = pexpect.pxssh.pxssh()
+		try:
+			if not self._ssh.login(host, username, password, login_timeout = timeout):
+				raise Exception()
+		except Exception as e:
+			raise Exception("Unable to login: incorrect password, unreachable host, timeout during negotiation (%s)" % str(e))
+		# Only useful for the password prompt: otherwise costs 50ms per sent chunk
+		self._ssh.delaybeforesend = 0
+		self._framed = self._setFramingPrompt(timeout)
+
+	def _setFramingPrompt(self, timeout):
+		marker = 'TESTERMAN-%08x' % random.randint(0, 0xffffffff)
+		# The prompt as sent is not matched when echoed: $? is not expanded yet
+		self._prompt = re.compile(r'\[%s:(\d+)\] ' % marker)
+		self._ssh.sendline("PS2=''; PS1='[%s:$?] '" % marker)
+		if self._ssh.expect([ self._prompt, self._ssh.PROMPT, pexpect.pxssh.TIMEOUT ], timeout = timeout) != 0:
+			# Not a sh-compatible shell
+			return False
+		self._ssh.sendline("stty -echo")
+		return self._ssh.expect([ self._prompt, pexpect.pxssh.TIMEOUT ], timeout = timeout) == 0
+
+	def _drain(self):
+		"""
+		Discards any pending output, written after the last prompt
+		(background processes, etc).
+		"""
+		try:
+			self._ssh.expect([ pexpect.pxssh.TIMEOUT ], timeout = 0)
+		except pexpect.pxssh.EOF:
+			pass
+		self._ssh.buffer = ''
+
+	def _execute(self, line, timeout):
+		"""
+		Executes a line in the current shell.
+
+		@rtype: int
+		@returns: its exit status
+		"""
+		self._drain()
+		self._ssh.sendline(line)
+		if self._framed:
+			if self._ssh.expect([ self._prompt, pexpect.pxssh.TIMEOUT ], timeout = timeout) != 0:
+				raise Exception("Timeout while executing %s" % line)
+			return int(self._ssh.match.group(1))
+		if not self._ssh.prompt(timeout):
+			raise Exception("Timeout while executing %s" % line)
+		return self._getLastStatus()
+
+	def _getLastStatus(self):
+		self._ssh.sendline('echo $?')
+		self._ssh.prompt()
+		# 'before' contains: line 0: echo $? , line 1: the echo output
+		return int(self._ssh.before.split('\n')[1].strip())
+
+	def isalive(self):
+		return self._ssh.isalive()
+
+	def check(self, timeout):
+		"""
+		Checks that the remote shell still answers.
+		"""
+		try:
+			self._execute('', timeout)
+			return True
+		except Exception:
+			return False
+
+	def changeDir(self, workingdir, timeout):
+		"""
+		Moves to workingdir, or to the login (home) directory if None.
+		"""
+		if workingdir == self.workingdir:
+			return
+		if workingdir:
+			line = 'cd "%s"' % workingdir
+		else:
+			line = 'cd'
+		if self._execute(line, timeout):
+			raise Exception('Unable to change to working dir "%s"' % workingdir)
+		self.workingdir = workingdir
+
+	def sendCommand(self, lines):
+		"""
+		Starts executing a command, possibly split over several lines.
+		"""
+		self._drain()
+		if self._framed:
+			# In a subshell, so that the command cannot alter the session
+			self._ssh.send('( ' + '\n'.join(lines) + '\n)\n')
+		else:
+			self._ssh.sendline('\n'.join(lines))
+		self._lines = len(lines)
+
+	def waitCommand(self, timeout):
+		"""
+		Waits for the command completion.
+
+		@rtype: tuple (int, string), or None
+		@returns: (status, output), or None if the command is not complete yet
+		"""
+		if self._framed:
+			if self._ssh.expect([ self._prompt, pexpect.pxssh.TIMEOUT ], timeout = timeout) != 0:
+				return None
+			self.lastUsed = time.time()
+			return (int(self._ssh.match.group(1)), self._ssh.before)
+
+		if not self._ssh.prompt(timeout):
+			return None
+		# We got a completion - skip the command line (that could be multiline) that have been
+		# echoed.
+		output = '\n'.join(self._ssh.before.split('\n')[self._lines:])
+		status = self._getLastStatus()
+		self.lastUsed = time.time()
+		return (status, output)
+
+	def interrupt(self, timeout):
+		"""
+		Interrupts the current command.
+
+		@rtype: bool
+		@returns: True if the shell is ready for another command.
+		"""
+		try:
+			self._ssh.sendintr()
+			if self._framed:
+				return self._ssh.expect([ self._prompt, pexpect.pxssh.TIMEOUT ], timeout = timeout) == 0
+			return self._ssh.prompt(timeout)
+		except Exception:
+			return False
+
+	def close(self):
+		try:
+			if self._ssh.isalive():
+				self._ssh.sendline('exit')
+				self._ssh.expect([ pexpect.pxssh.EOF, pexpect.pxssh.TIMEOUT ], timeout = 1.0)
+		except Exception:
+			pass
+		# Kill the ssh session, if still active for wathever reason
+		try:
+			self._ssh.terminate(force = True)
+		except:
+			pass
+
+
 class SshThread(threading.Thread):
 	"""
 	Executes a command through ssh in its own thread.
 	Created and started on command execution, once the login phase was OK.
 	"""
-	def __init__(self, probe, ssh, command):
+	def __init__(self, probe, session, command):
 		threading.Thread.__init__(self)
 		self._probe = probe
 		self._command = command
-		self._ssh = ssh
+		self._session = session
 		self._stopEvent = threading.Event()
 	
 	def run(self):
 		self._probe.getLogger().debug("Starting command execution thread...")
 		output = None
 		status = None
+		reusable = False
 		try:
 			# Split the command on multiple "technical" lines - the pseudo terminal may limit the max line length
 			size = self._probe['max_line_length']
@@ -372,30 +586,22 @@ class SshThread(threading.Thread):
 			
 			actualCommandLine = '\\\n'.join(splitcmd)
 			self._probe.logSentPayload("SSH Command line", actualCommandLine, "%s@%s" % (self._probe['username'], self._probe['host']))
-			self._ssh.sendline(actualCommandLine)
+			self._session.sendCommand(actualCommandLine.split('\n'))
 
 			# Wait for a command completion
 			while not self._stopEvent.isSet():
-				if self._ssh.prompt(0.1):
-					# We got a completion - skip the command line (that could be multiline) that have been
-					# echoed.
-					output = '\n'.join(self._ssh.before.split('\n')[len(splitcmd):])
-					self._ssh.sendline('echo $?')
-					self._ssh.prompt()
-					# 'before' contains: line 0: echo $? , line 1: the echo output
-					status = int(self._ssh.before.split('\n')[1].strip())
-					self._ssh.logout()
+				result = self._session.waitCommand(0.1)
+				if result:
+					status, output = result
+					reusable = True
 					break
+			else:
+				# Cancelled
+				reusable = self._session.interrupt(1.0)
 		except Exception as e:
 			self._probe.triEnqueueMsg('Internal SSH error: %s' % str(e))
 			
-		# Kill the ssh session, if still active for wathever reason
-		try:
-			self._ssh.terminate()
-		except:
-			pass
-		self._probe.onSshThreadTerminated(status, output)
-			
+		self._probe.onSshThreadTerminated(status, output, reusable)
 
 	def stop(self):
 		self._stopEvent.set()
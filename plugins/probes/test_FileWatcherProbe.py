@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# FileWatcherProbe inotify watching tests.
+#
+# The file operations of a test are done before the watching thread reads
+# the resulting events, so that they are processed as a single batch.
+#
+# Requires the core directory in the PYTHONPATH.
+##
+
+import FileWatcherProbe
+import Inotify
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+
+class Probe:
+	"""
+	Collects the notified lines.
+	"""
+	def __init__(self):
+		self.lines = []
+	def getLogger(self): return logging.getLogger('FileWatcherProbe')
+	def triEnqueueMsg(self, message, sutAddress = None): self.lines.append(message['line'])
+
+class InotifyRotationTestSequence(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.filename = os.path.join(self.directory, 'a.log')
+		self.probe = Probe()
+		self.thread = None
+
+	def tearDown(self):
+		if self.thread:
+			# Not started: released without stop()
+			for filename in self.thread._openFiles.keys():
+				self.thread._forgetFile(filename)
+			self.thread._inotify.close()
+			os.close(self.thread._stopPipe[0])
+			os.close(self.thread._stopPipe[1])
+		shutil.rmtree(self.directory)
+
+	def watch(self):
+		self.thread = FileWatcherProbe.InotifyWatchingThread(self.probe, [ os.path.join(self.directory, '*.log') ], 1.0, [ re.compile('.*') ])
+
+	def append(self, content, filename = None):
+		f = open(filename or self.filename, 'ab')
+		f.write(content)
+		f.close()
+
+	def processEvents(self):
+		"""
+		Processes the pending events as a single batch,
+		returning the lines notified since the previous call.
+		"""
+		self.thread._processEvents(self.thread._inotify.readEvents())
+		lines = self.probe.lines
+		self.probe.lines = []
+		return lines
+
+	def test_newFileRotatedInSingleBatch(self):
+		if not Inotify.isAvailable():
+			return
+		self.watch()
+		self.append('l1\nl2')
+		self.append('-end\n')
+		os.rename(self.filename, self.filename + '.1')
+		self.assertEqual(self.processEvents(), [ 'l1', 'l2-end' ])
+
+	def test_followedFileRotatedInSingleBatch(self):
+		if not Inotify.isAvailable():
+			return
+		self.append('before\n')
+		self.watch()
+		# Kept open like a logger's: an incomplete last line is only notified on close
+		f = open(self.filename, 'ab', 0)
+		f.write('l1\nl2')
+		self.assertEqual(self.processEvents(), [ 'l1' ])
+		f.write('-end\n')
+		os.rename(self.filename, self.filename + '.1')
+		f.close()
+		self.append('new\n')
+		self.assertEqual(self.processEvents(), [ 'l2-end', 'new' ])
+		self.append('next\n')
+		self.assertEqual(self.processEvents(), [ 'next' ])
+
+	def test_followedFileDeleted(self):
+		if not Inotify.isAvailable():
+			return
+		self.append('before\n')
+		self.watch()
+		self.append('last')
+		os.remove(self.filename)
+		self.assertEqual(self.processEvents(), [ 'last' ])
+
+	def test_followedFileReplaced(self):
+		if not Inotify.isAvailable():
+			return
+		self.append('before\n')
+		self.watch()
+		self.append('last\n')
+		replacement = os.path.join(self.directory, 'a.tmp')
+		self.append('new\n', replacement)
+		os.rename(replacement, self.filename)
+		self.assertEqual(self.processEvents(), [ 'last', 'new' ])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# SqlProbe tests, against an in-memory sqlite3 database.
+#
+# Requires the core directory in the PYTHONPATH.
+##
+
+import SqlProbe
+
+import logging
+import sqlite3
+import unittest
+
+
+class Adapter:
+	"""
+	Collects the messages enqueued by the probe.
+	"""
+	def __init__(self):
+		self.messages = []
+	def logSentPayload(self, label, payload, sutAddress = None): pass
+	def logReceivedPayload(self, label, payload, sutAddress = None): pass
+	def getLogger(self): return logging.getLogger('SqlProbe')
+	def getProperty(self, name, defaultValue): return defaultValue
+	def triEnqueueMsg(self, message, sutAddress = None): self.messages.append(message)
+
+class SqliteProbe(SqlProbe.SqlProbe):
+	dbapi = sqlite3
+	def _connect(self):
+		return sqlite3.connect(':memory:')
+
+
+class ChunkingTestSequence(unittest.TestCase):
+	def setUp(self):
+		self.adapter = Adapter()
+		self.probe = SqliteProbe()
+		self.probe._setAdapter(self.adapter)
+		self.probe.onTriMap()
+
+	def tearDown(self):
+		self.probe.onTriUnmap()
+
+	def query(self, rowCount, fetchSize):
+		conn = self.probe._getConnection()
+		conn.execute('CREATE TABLE IF NOT EXISTS t (id INTEGER)')
+		conn.execute('DELETE FROM t')
+		conn.executemany('INSERT INTO t VALUES (?)', [ (i,) for i in range(rowCount) ])
+		self.adapter.messages = []
+		self.probe.onTriSend({ 'query': 'SELECT id FROM t ORDER BY id', 'fetchSize': fetchSize }, None)
+		return self.adapter.messages
+
+	def assertChunks(self, messages, sizes):
+		self.assertEqual([ x[0] for x in messages ], [ 'resultChunk' ] * len(sizes))
+		self.assertEqual([ len(x[1]['rows']) for x in messages ], sizes)
+		self.assertEqual([ x[1]['last'] for x in messages ], [ False ] * (len(sizes) - 1) + [ True ])
+		ids = []
+		for x in messages:
+			ids += [ row['id'] for row in x[1]['rows'] ]
+		self.assertEqual(ids, range(sum(sizes)))
+
+	def test_lastChunkPartial(self):
+		self.assertChunks(self.query(7, 3), [ 3, 3, 1 ])
+
+	def test_lastChunkFull(self):
+		# No trailing empty chunk
+		self.assertChunks(self.query(6, 3), [ 3, 3 ])
+
+	def test_singleChunk(self):
+		self.assertChunks(self.query(2, 3), [ 2 ])
+		self.assertChunks(self.query(3, 3), [ 3 ])
+
+	def test_emptyResultSet(self):
+		self.assertChunks(self.query(0, 3), [ 0 ])
+
+	def test_unchunked(self):
+		messages = self.query(7, 0)
+		self.assertEqual(messages, [ ('result', [ { 'id': i } for i in range(7) ]) ])
+
+	def test_cachedCursor(self):
+		# The same query re-executed on a cached cursor starts from the first row again
+		self.assertChunks(self.query(7, 3), [ 3, 3, 1 ])
+		self.assertChunks(self.query(4, 3), [ 3, 1 ])
+
+
+if __name__ == "__main__":
+	unittest.main()
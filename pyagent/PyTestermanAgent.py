@@ -761,7 +761,7 @@ def scanPlugins(paths, label):
 			sys.path.append(path)
 		try:
 			for m in os.listdir(path):
-				if m.startswith('__init__') or not (os.path.isdir(path + '/' + m) or m.endswith('.py')) or m.startswith('.'):
+				if m.startswith('__init__') or m.startswith('test_') or not (os.path.isdir(path + '/' + m) or m.endswith('.py')) or m.startswith('.'):
 					continue
 				if m.endswith('.py'):
 					m = m[:-3]
@@ -27,12 +27,19 @@ import VisualLogView
 import EventMonitor
 import Actions
 import PluginManager
+import Plugin
 
-import gc
+import array
 import base64
-import urlparse
+import bisect
+import collections
+import gc
 import os
 import os.path
+import struct
+import tempfile
+import urlparse
+import xml.parsers.expat as expat
 
 ###############################################################################
 # Log file loader
@@ -62,13 +69,59 @@ def loadLog(url):
 		log("Loading from server: remote file %s..." % url.path())
 		content = getProxy().getFile(unicode(url.path()))
 
-	# If this is not a well formed xml file but a "log" file (i.e. a list of xml elements only)
-	# add some basic xml headers and a root element.
+	return wrapLog(content)
+
+def wrapLog(content):
+	"""
+	If this is not a well formed xml file but a "log" file (i.e. a list of xml elements only)
+	add some basic xml headers and a root element.
+	"""
 	if content and not content.startswith('<?xml'):
 		content = '<?xml version="1.0" encoding="utf-8" ?>\n<ats>\n%s</ats>' % content
 	
 	return content
 
+def spoolLog(content):
+	"""
+	Stores a log content into a temporary file.
+
+	@type  content: utf-8 string
+	@param content: the log contents
+
+	@rtype: file object
+	@returns: the temporary file, deleted once closed
+	"""
+	if isinstance(content, unicode):
+		content = content.encode('utf-8')
+	f = tempfile.TemporaryFile()
+	f.write(content)
+	f.seek(0)
+	return f
+
+def openLog(url):
+	"""
+	Opens a log file from an url, without loading it in memory
+	if it is a local file.
+
+	Unlike loadLog(), the log is not wrapped into a XML document.
+
+	@type  url: QUrl
+	@param url: the url locating the log file (testerman://, file://)
+
+	@rtype: file object (binary mode)
+	@returns: the log file, a temporary copy of the remote log file, or None if not found
+	"""
+	log("Opening log from '%s'" % unicode(url.toString()))
+
+	if url.scheme() == "file": # local file
+		return open(unicode(url.toLocalFile()), 'rb')
+
+	# remote file
+	content = getProxy().getFile(unicode(url.path()))
+	if content is None:
+		return None
+	return spoolLog(content)
+
 def trim(docstring):
 	"""
 	docstring trimmer - from PEP 257 sample code
@@ -181,7 +234,7 @@ def xmlToDomElement(xmlLog):
 	"""
 	Constructs a DOM element based on a xml string, and returns it.
 	
-	@type  xmlLog: unicode
+	@type  xmlLog: unicode, or QByteArray (utf-8)
 	@param xmlLog: a log event as a xml string
 	
 	@rtype: QDomElement
@@ -195,6 +248,206 @@ def xmlToDomElement(xmlLog):
 		log("WARNING: Unable to parse XML event: %s" % str(errormessage))
 		return None
 
+def getDomAttributes(domElement):
+	"""
+	@rtype: dict[unicode] = unicode
+	@returns: the attributes of a DOM element
+	"""
+	ret = {}
+	attributes = domElement.attributes()
+	for i in range(attributes.count()):
+		attribute = attributes.item(i).toAttr()
+		ret[unicode(attribute.name())] = unicode(attribute.value())
+	return ret
+
+def getEventDisplayClass(tag, attributes):
+	"""
+	Returns the class a log event is displayed with in the textual log view,
+	i.e. its class attribute, unless this is an event the view discards.
+
+	Computed when indexing the events, so that the textual log view
+	can be filtered without parsing them.
+
+	@type  tag: unicode
+	@type  attributes: dict[unicode] = unicode
+
+	@rtype: unicode
+	"""
+	if tag == "testcase-created":
+		return u"discarded"
+	elif tag == "verdict-updated" and attributes.get('verdict') != "fail":
+		return u"discarded"
+	return attributes.get('class', u'')
+
+class EventIndexList:
+	"""
+	An ordered list of event indexes, as stored by the log models.
+
+	The indexes of a testcase are mostly consecutive: they
+	are stored as runs of consecutive indexes, so that the list
+	size does not depend on the number of events.
+	"""
+	def __init__(self):
+		# The first index of each run
+		self._starts = array.array('l')
+		# The position in the list of the first index of each run
+		self._positions = array.array('l')
+		self._count = 0
+
+	def append(self, index):
+		if not self._starts or self._starts[-1] + self._count - self._positions[-1] != index:
+			self._starts.append(index)
+			self._positions.append(self._count)
+		self._count += 1
+
+	def copy(self):
+		ret = EventIndexList()
+		ret._starts = array.array('l', self._starts)
+		ret._positions = array.array('l', self._positions)
+		ret._count = self._count
+		return ret
+
+	def __len__(self):
+		return self._count
+
+	def __getitem__(self, position):
+		if position < 0:
+			position += self._count
+		if position < 0 or position >= self._count:
+			raise IndexError("event index list position out of range")
+		run = bisect.bisect_right(self._positions, position) - 1
+		return self._starts[run] + position - self._positions[run]
+
+	def __iter__(self):
+		runs = len(self._starts)
+		for run in xrange(runs):
+			if run + 1 < runs:
+				length = self._positions[run + 1] - self._positions[run]
+			else:
+				length = self._count - self._positions[run]
+			start = self._starts[run]
+			for index in xrange(start, start + length):
+				yield index
+
+class LogEventList:
+	"""
+	A read-only list of log events, as QDomElements,
+	parsed only when accessed.
+
+	Returned by the getDomElements() functions: can be iterated,
+	indexed and sliced as the list of QDomElements it replaces.
+	"""
+	def __init__(self, logModel, indexes):
+		self._logModel = logModel
+		self._indexes = indexes
+
+	def getLogModel(self):
+		return self._logModel
+
+	def getIndexes(self):
+		"""
+		@rtype: EventIndexList
+		@returns: the indexes of the events in the log model
+		"""
+		return self._indexes
+
+	def __len__(self):
+		return len(self._indexes)
+
+	def __getitem__(self, position):
+		if isinstance(position, slice):
+			return [ self[i] for i in xrange(*position.indices(len(self))) ]
+		return self._logModel.getEvent(self._indexes[position])
+
+	def __iter__(self):
+		for index in self._indexes:
+			yield self._logModel.getEvent(index)
+
+class LogEventIndex:
+	"""
+	The locations of the log events in their source files,
+	in feeding order.
+
+	The locations are stored as fixed size records in a temporary file.
+	Only the event tags and display classes are kept in memory,
+	as small integer codes, so that the events can be selected and
+	filtered without reading them.
+	"""
+	# source, offset, length
+	Record = struct.Struct('<HQI')
+	# Number of records to buffer before writing them to the file
+	FlushThreshold = 4096
+
+	def __init__(self):
+		self._file = tempfile.TemporaryFile()
+		self._pendingRecords = []
+		self._flushedRecords = 0
+		self._tags = array.array('H')
+		self._classes = array.array('H')
+		# Code tables for tags and classes: list[code] = name, dict[name] = code
+		self._names = []
+		self._codes = {}
+
+	def close(self):
+		self._file.close()
+
+	def __len__(self):
+		return len(self._tags)
+
+	def _getCode(self, name):
+		code = self._codes.get(name)
+		if code is None:
+			code = len(self._names)
+			self._names.append(name)
+			self._codes[name] = code
+		return code
+
+	def findCode(self, name):
+		"""
+		@rtype: int, or None
+		@returns: the code of a tag or class, or None if no event uses it
+		"""
+		return self._codes.get(name)
+
+	def append(self, source, offset, length, tag, class_):
+		"""
+		@rtype: int
+		@returns: the index of the new event
+		"""
+		self._pendingRecords.append(self.Record.pack(source, offset, length))
+		self._tags.append(self._getCode(tag))
+		self._classes.append(self._getCode(class_))
+		if len(self._pendingRecords) >= self.FlushThreshold:
+			self._file.seek(0, 2)
+			self._file.write(''.join(self._pendingRecords))
+			self._flushedRecords += len(self._pendingRecords)
+			self._pendingRecords = []
+		return len(self._tags) - 1
+
+	def getLocation(self, index):
+		"""
+		@rtype: tuple (int, int, int)
+		@returns: the source, offset and length of an event
+		"""
+		if index >= self._flushedRecords:
+			record = self._pendingRecords[index - self._flushedRecords]
+		else:
+			self._file.seek(index * self.Record.size)
+			record = self._file.read(self.Record.size)
+		return self.Record.unpack(record)
+
+	def getTag(self, index):
+		return self._names[self._tags[index]]
+
+	def getTagCodes(self):
+		return self._tags
+
+	def getClass(self, index):
+		return self._names[self._classes[index]]
+
+	def getClassCodes(self):
+		return self._classes
+
 class TestCaseLogModel:
 	"""
 	Stores the events associated to a testcase.
@@ -202,8 +455,9 @@ class TestCaseLogModel:
 	testcase properties, too.
 	"""
 	def __init__(self, id_, role, atsLogModel):
-		self._domElements = []
+		self._indexes = EventIndexList()
 		self._atsLogModel = atsLogModel
+		self._logModel = atsLogModel.getLogModel()
 		# Set by the main log model
 		self._verdict = None
 		self._description = None
@@ -212,27 +466,29 @@ class TestCaseLogModel:
 		if not role: role = "testcase"
 		self._role = role
 	
-	def _append(self, domElement):
+	def _append(self, index, tag, attributes):
 		"""
 		Local model feeder, storage only.
 		"""
-		tag = domElement.tagName()
 		if tag == "testcase-started":
-			self._title = unicode(domElement.text()).strip()
+			self._title = unicode(self._logModel.getEvent(index).text()).strip()
 		elif tag == "testcase-stopped":
-			self._description = trim(unicode(domElement.text()))
-			self._verdict = unicode(domElement.attribute('verdict'))
+			self._description = trim(unicode(self._logModel.getEvent(index).text()))
+			self._verdict = attributes.get('verdict', u'')
 		
-		self._domElements.append(domElement)
+		self._indexes.append(index)
 		
 	##
 	# Public functions usable in log reporters, plugins
 	##	
 	def getDomElements(self, tagName = None):
-		if tagName:
-			return filter(lambda x: x.tagName() == QString(tagName), self._domElements)
-		else:
-			return self._domElements
+		return self._logModel.getEvents(self._indexes, tagName)
+
+	def getEventIndexes(self):
+		return self._indexes
+
+	def getLogModel(self):
+		return self._logModel
 	
 	def isComplete(self):
 		return self._verdict is not None
@@ -269,38 +525,41 @@ class TestCaseLogModel:
 		The generated image is NOT cached.
 		"""
 		s = VisualLogView.TestCaseScene()
-		for e in self._domElements:
+		for e in self.getDomElements():
 			s.onEvent(e)
 		return s.toBase64Image(format)
 
 class AtsLogModel:
-	def __init__(self, id_):
-		# Local DOM elements (ATS control part)
-		self._domElements = []
+	def __init__(self, id_, logModel):
+		# Local event indexes (ATS control part)
+		self._indexes = EventIndexList()
+		self._logModel = logModel
 
 		# Set by the main log model
 		self._result = None
 		self._id = id_
 		self._testCases = [] # list of TestCaseLogModel
 	
-	def _append(self, domElement):
+	def _append(self, index, tag, attributes):
 		"""
 		Local model feeder, storage only.
 		"""
-		tag = domElement.tagName()
 		if tag == "ats-stopped":
-			self._result = int(domElement.attribute('result'))
+			self._result = int(attributes.get('result'))
 		
-		self._domElements.append(domElement)
+		self._indexes.append(index)
 	
 	##
 	# Public functions usable in log reporters, plugins
 	##	
 	def getDomElements(self, tagName = None):
-		if tagName:
-			return filter(lambda x: x.tagName() == QString(tagName), self._domElements)
-		else:
-			return self._domElements
+		return self._logModel.getEvents(self._indexes, tagName)
+
+	def getEventIndexes(self):
+		return self._indexes
+
+	def getLogModel(self):
+		return self._logModel
 	
 	def isComplete(self):
 		return self._result is not None
@@ -319,8 +578,14 @@ class LogModel(QObject):
 	This represents a complete Testerman log as an internal model
 	suitable for ATS/testcase iteration and so on.
 	
-	It is fed log event by log event, either as XML string or
+	It is fed either with complete log files, scanned with a
+	streaming parser, or log event by log event, either as XML string or
 	as a single QDomElement.
+
+	The events are not kept in memory: the model only indexes
+	their locations in the log files (or in temporary copies of them),
+	and parses them back as QDomElements when they are accessed
+	(getEvent(), getDomElements()).
 	
 	This model interprets the fed event and emits several signals
 	enabling basic statistics and model visualisation during feeding.
@@ -332,9 +597,15 @@ class LogModel(QObject):
 	testCaseStopped(QString verdict, QDomElement)
 	actionRequested(QString label, float timeout)
 
-	Low level signal:
-	testermanEvent(QDomElement element)
+	Low level signals:
+	testermanEventIndexed(int index)
+	testermanEvent(QDomElement element) (only parsed if connected)
 	"""
+	# Number of parsed events kept in cache
+	EventCacheSize = 500
+	# Read size when scanning a log file
+	ScanChunkSize = 65536
+
 	def __init__(self):
 		QObject.__init__(self)
 		self._atses = []
@@ -347,9 +618,143 @@ class LogModel(QObject):
 		self._currentAts = None
 		self._currentTestCase = None
 
+		self._index = LogEventIndex()
+		# The files the events are read from, indexed by source id
+		self._sources = []
+		# The source id of the temporary file the fed events are appended to
+		self._liveSource = None
+		# Parsed events: dict[index] = QDomElement, and their insertion order
+		self._cache = {}
+		self._cacheOrder = collections.deque()
+
 	def clear(self):
 		self._atses = []
 		self._containsIncludes = False
+		self._currentAts = None
+		self._currentTestCase = None
+		for f in self._sources:
+			f.close()
+		self._sources = []
+		self._liveSource = None
+		self._index.close()
+		self._index = LogEventIndex()
+		self._cache = {}
+		self._cacheOrder = collections.deque()
+
+	##
+	# Event access
+	##
+	def getEventCount(self):
+		return len(self._index)
+
+	def getEvent(self, index):
+		"""
+		Returns a log event, parsing it if needed.
+
+		@type  index: int
+		@param index: the event index, in feeding order
+
+		@rtype: QDomElement
+		@returns: the event, or a null element if it cannot be parsed
+		"""
+		element = self._cache.get(index)
+		if element is None:
+			(source, offset, length) = self._index.getLocation(index)
+			f = self._sources[source]
+			f.seek(offset)
+			element = xmlToDomElement(QByteArray(f.read(length)))
+			if element is None:
+				element = QtXml.QDomElement()
+			self._cacheEvent(index, element)
+		return element
+
+	def getEventTag(self, index):
+		return self._index.getTag(index)
+
+	def getEventClass(self, index):
+		"""
+		@rtype: unicode
+		@returns: the class the event is displayed with (see getEventDisplayClass())
+		"""
+		return self._index.getClass(index)
+
+	def getEventClassCodes(self):
+		"""
+		@rtype: array of int
+		@returns: the display class codes of all events, indexed by event index
+		"""
+		return self._index.getClassCodes()
+
+	def findCode(self, name):
+		"""
+		@rtype: int, or None
+		@returns: the code of an event tag or display class, or None if unused
+		"""
+		return self._index.findCode(name)
+
+	def getEvents(self, indexes, tagName = None):
+		"""
+		@type  indexes: EventIndexList
+		@param indexes: event indexes
+		@type  tagName: string, or None
+		@param tagName: if set, only the events with this tag are selected
+
+		@rtype: LogEventList
+		@returns: the (lazily parsed) events
+		"""
+		if tagName:
+			selected = EventIndexList()
+			code = self._index.findCode(unicode(tagName))
+			if code is not None:
+				tags = self._index.getTagCodes()
+				for index in indexes:
+					if tags[index] == code:
+						selected.append(index)
+			indexes = selected
+		return LogEventList(self, indexes)
+
+	def _cacheEvent(self, index, element):
+		self._cache[index] = element
+		self._cacheOrder.append(index)
+		if len(self._cacheOrder) > self.EventCacheSize:
+			del self._cache[self._cacheOrder.popleft()]
+
+	##
+	# Model feeding
+	##
+	def feedFile(self, f, progress = None):
+		"""
+		Feeds the model with a complete log file,
+		scanned with a streaming parser.
+
+		The model takes the ownership of the file object: it keeps it
+		open to read the events on demand, until it is cleared.
+
+		@type  f: file object, opened in binary mode
+		@param f: the log file, either a well formed XML document or a list of XML elements
+		@type  progress: callable(int read, int size), or None
+		@param progress: called regularly while scanning the file. If it returns False,
+		the scan is interrupted.
+
+		@rtype: bool
+		@returns: True if the whole file was scanned, False if it was interrupted
+		or in case of a parsing error
+		"""
+		source = len(self._sources)
+		self._sources.append(f)
+		return self._scan(source, f, progress)
+
+	def feedLog(self, content, progress = None):
+		"""
+		Convenience function.
+
+		Feeds the model with a complete log file content,
+		stored in a temporary file.
+
+		@type  content: string (utf-8)
+		@param content: the log file content
+		"""
+		return self.feedFile(spoolLog(content), progress)
 
 	def feedXmlEvent(self, xmlLog):
 		"""
@@ -361,7 +766,12 @@ class LogModel(QObject):
 		@type  xmlLog: unicode
 		@param xmlLog: a log event as a xml string
 		"""
-		self.feedEvent(xmlToDomElement(xmlLog))
+		element = xmlToDomElement(xmlLog)
+		if element is None:
+			return
+		if isinstance(xmlLog, unicode):
+			xmlLog = xmlLog.encode('utf-8')
+		self._appendEvent(str(xmlLog), element)
 
 	def feedEvent(self, domElement):
 		"""
@@ -380,23 +790,133 @@ class LogModel(QObject):
 		"""
 		if not domElement:
 			return
+		xml = QString()
+		domElement.save(QTextStream(xml), 0)
+		self._appendEvent(unicode(xml).encode('utf-8'), domElement)
+
+	def _appendEvent(self, data, domElement):
+		"""
+		Stores an event in the live source, then processes it.
+		"""
+		if self._liveSource is None:
+			self._liveSource = len(self._sources)
+			self._sources.append(tempfile.TemporaryFile())
+		f = self._sources[self._liveSource]
+		f.seek(0, 2)
+		offset = f.tell()
+		f.write(data)
+		tag = unicode(domElement.tagName())
+		attributes = getDomAttributes(domElement)
+		index = self._index.append(self._liveSource, offset, len(data), tag, getEventDisplayClass(tag, attributes))
+		self._cacheEvent(index, domElement)
+		self._processEvent(index, tag, attributes)
+
+	def _scan(self, source, f, progress = None):
+		"""
+		Indexes and processes the events of a log file.
+
+		Only the event start tags are reported by the parser:
+		an event is located from its start tag to the next one
+		(or to the end of the root element).
+		"""
+		f.seek(0, 2)
+		size = f.tell()
+		f.seek(0)
+		data = f.read(self.ScanChunkSize)
+		# Raw logs are a list of elements: scan them within a root element,
+		# as loadLog() would wrap them.
+		if data.startswith('<?xml'):
+			prefix = ''
+		else:
+			prefix = '<ats>'
+
+		parser = expat.ParserCreate()
+		# The event being scanned, as (offset, tag, attributes), is only processed
+		# once we know where it ends.
+		state = { 'depth': 0, 'pending': None }
+
+		def processPending(end):
+			if state['pending']:
+				(offset, tag, attributes) = state['pending']
+				state['pending'] = None
+				index = self._index.append(source, offset, end - offset, tag, getEventDisplayClass(tag, attributes))
+				self._processEvent(index, tag, attributes)
+
+		def onStartElement(tag, attributes):
+			if state['depth'] == 1:
+				offset = parser.CurrentByteIndex - len(prefix)
+				processPending(offset)
+				state['pending'] = (offset, tag, attributes)
+			state['depth'] += 1
+
+		def onEndElement(tag):
+			state['depth'] -= 1
+			if state['depth'] == 0:
+				processPending(parser.CurrentByteIndex - len(prefix))
+
+		parser.StartElementHandler = onStartElement
+		parser.EndElementHandler = onEndElement
+
+		read = 0
+		try:
+			parser.Parse(prefix)
+			while data:
+				read += len(data)
+				parser.Parse(data)
+				if progress and progress(read, size) is False:
+					log("Log scanning interrupted")
+					return False
+				# The events read while processing the scanned ones move the file position
+				f.seek(read)
+				data = f.read(self.ScanChunkSize)
+		except expat.ExpatError as e:
+			log("Parsing error: %s" % str(e))
+			return False
 
-		tag = domElement.tagName()
+		try:
+			if prefix:
+				parser.Parse('</ats>', True)
+			else:
+				parser.Parse('', True)
+		except expat.ExpatError as e:
+			# Incomplete log (running job): the last event ends with the file
+			log("Incomplete log: %s" % str(e))
+			processPending(size)
+		return True
+
+	def _emitEvent(self, index):
+		self.emit(SIGNAL('testermanEventIndexed(int)'), index)
+		# Only parse the event if someone is interested in it
+		if self.receivers(SIGNAL('testermanEvent(QDomElement)')):
+			self.emit(SIGNAL('testermanEvent(QDomElement)'), self.getEvent(index))
+
+	def _processEvent(self, index, tag, attributes):
+		"""
+		Emits signals according to an indexed event,
+		then stores it in the appropriate internal
+		model structures.
 
+		@type  index: int
+		@param index: the event index
+		@type  tag: unicode
+		@param tag: the event tag
+		@type  attributes: dict[unicode] = unicode
+		@param attributes: the event attributes
+		"""
 		if tag == "ats-started":
-			atsLogModel = AtsLogModel(domElement.attribute('id'))
-			atsLogModel._append(domElement)
+			atsLogModel = AtsLogModel(QString(attributes.get('id', u'')), self)
+			atsLogModel._append(index, tag, attributes)
 			self._atses.append(atsLogModel)
 			self._currentAts = atsLogModel
 			self.emit(SIGNAL("atsStarted"), atsLogModel)
-			self.emit(SIGNAL('testermanEvent(QDomElement)'), domElement)
+			self._emitEvent(index)
 
 		elif tag == "ats-stopped":
-			self.emit(SIGNAL('testermanEvent(QDomElement)'), domElement)
+			self._emitEvent(index)
 			if not self._currentAts:
 				log("ATS stopped event received, but missed the started event. Discarding.")
 			else:
-				self._currentAts._append(domElement)
+				self._currentAts._append(index, tag, attributes)
 				self.emit(SIGNAL("atsStopped"), self._currentAts)
 				self._currentAts = None
 				self._currentTestCase = None
@@ -405,38 +925,38 @@ class LogModel(QObject):
 			if not self._currentAts:
 				log("TestCase started event received, but missed the started ATS event. Discarding.")
 			else:
-				testCaseLogModel = TestCaseLogModel(domElement.attribute('id'), domElement.attribute('role'), self._currentAts)
-				testCaseLogModel._append(domElement)
+				testCaseLogModel = TestCaseLogModel(QString(attributes.get('id', u'')), attributes.get('role'), self._currentAts)
+				testCaseLogModel._append(index, tag, attributes)
 				self._currentAts._testCases.append(testCaseLogModel)
 				self._currentTestCase = testCaseLogModel
 				self.emit(SIGNAL("testCaseStarted"), testCaseLogModel)
-			self.emit(SIGNAL('testermanEvent(QDomElement)'), domElement)
+			self._emitEvent(index)
 
 		elif tag == "testcase-stopped":
-			self.emit(SIGNAL('testermanEvent(QDomElement)'), domElement)
+			self._emitEvent(index)
 			if not self._currentTestCase:
 				log("TestCase stopped event received, but missed the started event. Discarding.")
 			else:
-				self._currentTestCase._append(domElement)
+				self._currentTestCase._append(index, tag, attributes)
 				self.emit(SIGNAL("testCaseStopped"), self._currentTestCase)
 				self._currentTestCase = None
 
 		elif tag == "action-requested":
-			self.emit(SIGNAL('testermanEvent(QDomElement)'), domElement)
-			timeout = float(domElement.attribute('timeout'))
-			message = domElement.firstChildElement('message').text()
+			self._emitEvent(index)
+			timeout = float(attributes.get('timeout'))
+			message = self.getEvent(index).firstChildElement('message').text()
 			self.emit(SIGNAL("actionRequested(QString, float)"), QString(message), timeout)
 			if self._currentTestCase:
-				self._currentTestCase._append(domElement)
+				self._currentTestCase._append(index, tag, attributes)
 
 		elif tag == "action-cleared":
-			self.emit(SIGNAL('testermanEvent(QDomElement)'), domElement)
+			self._emitEvent(index)
 			self.emit(SIGNAL("actionCleared()"))
 			if self._currentTestCase:
-				self._currentTestCase._append(domElement)
+				self._currentTestCase._append(index, tag, attributes)
 		
 		elif tag == "include":
-			url = QUrl(domElement.attribute('url'))
+			url = QUrl(attributes.get('url', u''))
 			self._containsIncludes = True
 			self._processInclude(url)
 			# Don't forward an include 'event'
@@ -444,37 +964,30 @@ class LogModel(QObject):
 		else:
 			# Store the event into the internal data structure
 			if self._currentTestCase:
-				self._currentTestCase._append(domElement)
+				self._currentTestCase._append(index, tag, attributes)
 			elif self._currentAts:
-				self._currentAts._append(domElement)
-			self.emit(SIGNAL('testermanEvent(QDomElement)'), domElement)
+				self._currentAts._append(index, tag, attributes)
+			self._emitEvent(index)
 
 	def _processInclude(self, url):
 		"""
-		Loads an included file identified by the provided url,
+		Opens an included file identified by the provided url,
 		and feeds it to itself.
 		
 		@type  url: QUrl
 		@param url: the url locating the file to load containing the included logs.
 		"""
-		xmlLog = loadLog(url)
-		if not xmlLog:
+		try:
+			f = openLog(url)
+		except Exception as e:
+			f = None
+		if not f:
 			log("Warning: unable to get included logs")
 			return
 	
-		log("Parsing included logs...")
-		xmlDoc = QtXml.QDomDocument()
-		(res, errormessage, errorline, errorcol) = xmlDoc.setContent(xmlLog, 0)
-		log("Included Logs parsed, DOM constructed")
-
-		element =  xmlDoc.documentElement().firstChildElement()
-		count = 0
-		while not element.isNull():
-			self.feedEvent(element)
-			count += 1
-			if not (count % 50):
-				QApplication.instance().processEvents()
-			element = element.nextSiblingElement()
+		log("Scanning included logs...")
+		self.feedFile(f, lambda read, size: QApplication.instance().processEvents())
+		log("Included logs scanned")
 
 	def getAtses(self):
 		"""
@@ -612,9 +1125,16 @@ class WRawLogView(QWidget):
 	xml-well-formed, adding requiring missing root element and XML prologue.
 	(this is done in the (re)loading function, i.e. updateFromSource).
 	The "Save as" option is then enabled.
+
+	Large logs are not displayed, but can still be saved.
 	"""
+	# Larger raw logs are not loaded into the text edit
+	MaxDisplayedSize = 8 * 1024 * 1024
+
 	def __init__(self, parent = None):
 		QWidget.__init__(self, parent)
+		# The log file to save, if not the displayed text
+		self._logFile = None
 		self.__createWidgets()
 		
 	def __createWidgets(self):
@@ -672,7 +1192,13 @@ class WRawLogView(QWidget):
 		directory = os.path.dirname(filename)
 		settings.setValue('lastVisitedDirectory', QVariant(directory))
 		try:
-			rawLogs = self.textEdit.toPlainText()
+			if self._logFile:
+				self._logFile.seek(0)
+				rawLogs = wrapLog(self._logFile.read())
+				if mode != LogSaver.MODE_RAW:
+					rawLogs = rawLogs.decode('utf-8')
+			else:
+				rawLogs = self.textEdit.toPlainText()
 			logSaver = LogSaver(QApplication.instance().client(), mode)
 			logSaver.saveAs(filename, rawLogs)
 			QMessageBox.information(self, getClientName(), "Execution log saved successfully.", QMessageBox.Ok)
@@ -682,12 +1208,31 @@ class WRawLogView(QWidget):
 			return False
 
 	def clearLog(self):
+		self._logFile = None
 		self.textEdit.clear()
 
 	def setLog(self, txt):
+		self._logFile = None
 		self.textEdit.setPlainText(txt)
 		self.saveAsButton.setEnabled(True)
 
+	def setLogFile(self, f):
+		"""
+		Displays a raw log from a file, unless it is too large.
+
+		@type  f: file object, opened in binary mode
+		@param f: the log file. Must remain open while the raw log may be saved.
+		"""
+		self._logFile = f
+		f.seek(0, 2)
+		size = f.tell()
+		if size > self.MaxDisplayedSize:
+			self.textEdit.setHtml('<i>This log is too large to be displayed here (%d bytes), but it can be saved</i>' % size)
+		else:
+			f.seek(0)
+			self.textEdit.setPlainText(wrapLog(f.read()).decode('utf-8', 'replace'))
+		self.saveAsButton.setEnabled(True)
+
 ###############################################################################
 # Complete Log Viewer
 ###############################################################################
@@ -721,6 +1266,9 @@ class WLogViewer(QWidget):
 	
 	An additional "delete logs" button is activated only for completed job or in offline mode.
 	"""
+	# Visual views with more events would take too long to render
+	VisualLogViewMaxEvents = 10000
+
 	def __init__(self, standalone = False, parent = None):
 		QWidget.__init__(self, parent, Qt.Window)
 
@@ -860,9 +1408,11 @@ class WLogViewer(QWidget):
 		self.connect(self._logModel, SIGNAL("atsStopped"), self.testCaseView.onAtsStopped)
 		self.connect(self._logModel, SIGNAL("atsStarted"), self.testCaseView.onAtsStarted)
 		# The test case view forwards real-time events to the views corresponding to the currently selected item, if any
-		self.connect(self._logModel, SIGNAL("testermanEvent(QDomElement)"), self.testCaseView.onEvent)
+		self.connect(self._logModel, SIGNAL("testermanEventIndexed(int)"), self.testCaseView.onEventIndexed)
 		for view in self.reportViews:
-			self.connect(self._logModel, SIGNAL("testermanEvent(QDomElement)"), view.onEvent)
+			# Events are only parsed for the report views that need them
+			if view.__class__.onEvent.im_func is not Plugin.WReportView.onEvent.im_func:
+				self.connect(self._logModel, SIGNAL("testermanEvent(QDomElement)"), view.onEvent)
 
 		# Summary connection on main log model
 		self.connect(self._logModel, SIGNAL("testCaseStopped"), self.summary.onTestCaseStopped)
@@ -883,7 +1433,7 @@ class WLogViewer(QWidget):
 
 		self.connect(self.testCaseView, SIGNAL("currentItemChanged(QTreeWidgetItem*, QTreeWidgetItem*)"), self.onTestCaseItemChanged)
 		# The Test Case view also "forwards" domElement in case of an event arriving while the item corresponding to the updated TestCase is selected
-		self.connect(self.testCaseView, SIGNAL("testermanEvent(QDomElement)"), self.textualLogView.onEvent)
+		self.connect(self.testCaseView, SIGNAL("testermanEventIndexed(int)"), self.textualLogView.onEventIndexed)
 		self.connect(self.testCaseView, SIGNAL("testermanEvent(QDomElement)"), self.visualLogView.onEvent)
 
 		self.connect(self.trackingCheckBox, SIGNAL('stateChanged(int)'), self.setTracking)
@@ -1050,6 +1600,10 @@ class WLogViewer(QWidget):
 		log("Updating logs from source...")
 
 		self.summary.clear()
+		# The views must not access the events being cleared anymore
+		self.textualLogView.clearLog()
+		self.visualLogView.clearLog()
+		self.rawView.clearLog()
 		self._logModel.clear()
 		state = None
 		logfile = ""
@@ -1060,6 +1614,8 @@ class WLogViewer(QWidget):
 				logfile = getProxy().getJobLog(self.jobId)
 			except Exception as e:
 				logfile = None
+			if logfile is not None:
+				logfile = spoolLog(logfile)
 			
 			try:
 				jobInfo = getProxy().getJobInfo(self.jobId)
@@ -1085,7 +1641,7 @@ class WLogViewer(QWidget):
 
 		else:
 			try:
-				logfile = loadLog(self._url)
+				logfile = openLog(self._url)
 				state = 'n/a'
 			except Exception as e:
 				QMessageBox.information(self, getClientName(), "Unable to load this log file.")
@@ -1117,89 +1673,76 @@ class WLogViewer(QWidget):
 			if not self.trackingActivated:
 				transient = WTransientWindow("Log Viewer", self)
 				transient.showTextLabel("Preparing views...")
-#			log("DEBUG: Preparing...")
+			elements = newItem.getElements()
 			self.textualLogView.clearLog()
-#			log("DEBUG: text cleared")
-			self.textualLogView.displayPartialLog(newItem.getElements())
-#			log("DEBUG: text prepared")
+			# Only the displayed rows are parsed
+			self.textualLogView.displayPartialLog(elements)
 			self.visualLogView.clearLog()
-#			log("DEBUG: visual cleared")
-			self.visualLogView.displayPartialLog(newItem.getElements())
-#			log("DEBUG: visual prepared")
+			if len(elements) > self.VisualLogViewMaxEvents:
+				log("Too many events to render, only rendering the first %d events in the visual view" % self.VisualLogViewMaxEvents)
+				elements = elements[:self.VisualLogViewMaxEvents]
+			self.visualLogView.displayPartialLog(elements)
 			if not self.trackingActivated:
 				transient.hide()
 				transient.setParent(None)
-#			log("DEBUG: Selected OK")
 
-	def setLog(self, xmlLog):
+	def setLog(self, logFile):
 		log("Loading log...")
 		start = time.time()
-		ret = self.setLog_Dom(xmlLog)
+		ret = self.setLog_Indexed(logFile)
 		log("Loading duration: %s" % (time.time() - start))
 		return ret
 
-	def setLog_Dom(self, xmlLog):
+	def setLog_Indexed(self, logFile):
 		"""
-		Takes an XML log content, parses it,
-		creates DOM nodes and forwards them to analysers, to
-		simulate a real-time log event feeding for them.
+		Takes a log file, scans it to index its events,
+		and forwards them to analysers, to simulate a real-time log event
+		feeding for them.
 	
-		@type  xmlLog: string (utf-8)
-		@param xmlLog: the log content to parse, well formed XML string
+		The events are only parsed when needed, i.e. when displayed
+		or accessed by a report view.
+	
+		@type  logFile: file object (binary mode), or None
+		@param logFile: the log file to scan, either a well formed XML document
+		or a list of XML elements. Owned by the log model once scanned.
 		"""
 		transient = WTransientWindow("Log Viewer", self)
-		transient.showTextLabel("Parsing logs...")
-
-		log("Parsing logs...")
-		xmlDoc = QtXml.QDomDocument()
-		(res, errormessage, errorline, errorcol) = xmlDoc.setContent(xmlLog, 0)
-		log("Logs parsed, DOM constructed")
+		transient.showTextLabel("Clearing views...")
+		log("Clearing views...")
+		previousSelectedItemIndex = None
+		# UI Context preservation: if a TestCase was selected, we'll have to select it after the update.
+		# FIXME: need a correct support now that the test case view is a tree
+		if self.testCaseView.currentItem():
+			previousSelectedItemIndex = self.testCaseView.currentItem().getIndexPath()
+		self.testCaseView.clearLog()
+		self.rawView.clearLog()
+		for view in self.reportViews:
+			view.clearLog()
 		transient.hide()
 
-		previousSelectedItemIndex = None
-		if res:
-			transient.showTextLabel("Clearing views...")
-			log("Clearing views...")
-			# UI Context preservation: if a TestCase was selected, we'll have to select it after the update.
-			# FIXME: need a correct support now that the test case view is a tree
-			if self.testCaseView.currentItem():
-				previousSelectedItemIndex = self.testCaseView.currentItem().getIndexPath()
-#				print ("DEBUG: saved UI context: %s" % previousSelectedItemIndex)
-			self.testCaseView.clearLog()
-			self.rawView.clearLog()
-			for view in self.reportViews:
-				view.clearLog()
-
-			transient.hide()
+		if logFile:
 			log("Analyzing events...")
-			root = xmlDoc.documentElement()
-			# Additional progress bar
-			nbChildren = root.childNodes().count()
-			progress = QProgressDialog("Analyzing log file...", "Cancel", 0, nbChildren, self)
+			progress = QProgressDialog("Analyzing log file...", "Cancel", 0, 100, self)
 			progress.setWindowTitle("Log Viewer")
 
-			element = root.firstChildElement()
-			count = 0
-			onePercent = max(1, nbChildren / 100)
-			while not element.isNull() and not progress.wasCanceled():
-				self._logModel.feedEvent(element)
-				count += 1
-				if not ((count - 1) % onePercent):
-					progress.setValue(count)
-					QApplication.instance().processEvents()
-				element = element.nextSiblingElement()
+			def onProgress(read, size):
+				if size:
+					progress.setValue(read * 100 / size)
+				QApplication.instance().processEvents()
+				return not progress.wasCanceled()
+
+			self._logModel.feedFile(logFile, onProgress)
+			log("%d events indexed" % self._logModel.getEventCount())
 
 			# Enable to drop the self -> progress reference, and thus free the QProgressDialog.
 			progress.setParent(None)
-		else:
-			log("Parsing error: " + str(errormessage) + 'at line ' + str(errorline) + ' col ' + str(errorcol))
 
 		transient.showTextLabel("Preparing views...")
 		log("Preparing views...")
 		self.testCaseView.displayLog()
 		# This should switch to a "onEvent" raw view feeding
-		if self.useRawView:
-			self.rawView.setLog(xmlLog)
+		if self.useRawView and logFile:
+			self.rawView.setLogFile(logFile)
 		for view in self.reportViews:
 			view.displayLog()
 		transient.hide()
@@ -1208,7 +1751,6 @@ class WLogViewer(QWidget):
 
 		# UI Context restoration
 		if previousSelectedItemIndex is not None:
-#			print ("DEBUG: restoring UI context from: %s" % previousSelectedItemIndex)
 			self.testCaseView.setCurrentItemAtIndexPath(previousSelectedItemIndex)
 
 	def closeEvent(self, event):
@@ -1245,20 +1787,21 @@ class WLogViewer(QWidget):
 
 
 ###############################################################################
-# Textual Log View: item and treewidget
+# Textual Log View: entry, model and view
 ###############################################################################
 
-class TextualLogItem(QTreeWidgetItem):
+class TextualLogEntry:
 	"""
 	An entry in the Textual log viewer is in fact an entry in a table (time, label).
 	The whole entry is formatted according to the item itself (start, stop, succes, etc)
 	and is clickable, triggering different actions according to the item (show message {mis}matching, ...)
+
+	Entries are created by the textual log model for the displayed rows only.
 	"""
-	def __init__(self, parent, domElement):
+	def __init__(self, domElement):
 		"""
-		xmlLogLineDoc is an Testerman2 xml log line already parsed into a QDomElement.
+		domElement is an Testerman2 xml log line already parsed into a QDomElement.
 		"""
-		QTreeWidgetItem.__init__(self, parent)
 		self.columns = [ 'time', 'class', 'message' ]
 		self._domElement = domElement
 
@@ -1274,6 +1817,10 @@ class TextualLogItem(QTreeWidgetItem):
 		self._binary = False
 		#: element name/tag, QString
 		self._element = None
+		#: message style: bold, italic, color (Qt.GlobalColor, or None)
+		self._bold = False
+		self._italic = False
+		self._color = None
 	
 	def isBinary(self):
 		return self._binary
@@ -1281,6 +1828,18 @@ class TextualLogItem(QTreeWidgetItem):
 	def getAssociatedData(self):
 		return self._associatedData
 
+	def getText(self, column):
+		return [ self._timestamp, self._class, self._message ][column]
+
+	def isBold(self):
+		return self._bold
+
+	def isItalic(self):
+		return self._italic
+
+	def getColor(self):
+		return self._color
+
 	def _setAssociatedData(self, data, binary = False):
 		if binary:
 			self._associatedData = QByteArray(base64.decodestring(data))
@@ -1295,6 +1854,12 @@ class TextualLogItem(QTreeWidgetItem):
 		i.e. everything needed for data() role equivalents,
 		and associated action in case of an item selection/activation.
 		"""
+		if self._domElement.isNull():
+			self._timestamp = QString()
+			self._class = QString()
+			self._message = QString("Unparsable log element")
+			return
+
 		self._timestamp = QString(formatTimestamp(float(self._domElement.attribute("timestamp"))))
 		self._class = self._domElement.attribute("class")
 		self._element = self._domElement.tagName()
@@ -1304,9 +1869,7 @@ class TextualLogItem(QTreeWidgetItem):
 			self._message = self._domElement.text()
 
 		elif self._element == "user":
-			f = self.font(2)
-			f.setItalic(1)
-			self.setFont(2, f)
+			self._italic = True
 			msg = self._domElement
 			if self._domElement.attribute("encoding") == "base64":
 				self._setAssociatedData(msg.text(), binary = True)
@@ -1364,18 +1927,18 @@ class TextualLogItem(QTreeWidgetItem):
 			self._message = "PTC %s stopped, local verdict is %s" % (self._domElement.attribute('id'), verdict)
 			# According to the verdict, display different colors.
 			if verdict == "pass":
-				self.setForeground(2, QBrush(QColor(Qt.blue)))
+				self._color = Qt.blue
 			elif verdict == "fail":
-				self.setForeground(2, QBrush(QColor(Qt.red)))
+				self._color = Qt.red
 			else:
-				self.setForeground(2, QBrush(QColor(Qt.darkRed)))
+				self._color = Qt.darkRed
 
 		# Template matching events
 		elif self._element == "template-match":
 			self._message = "Template match on port %s.%s" % (self._domElement.attribute('tc'), self._domElement.attribute('port'))
 			message = self._domElement.firstChildElement('message')
 			template = self._domElement.firstChildElement('template')
-			self.setForeground(2, QBrush(QColor(Qt.green)))
+			self._color = Qt.green
 		elif self._element == "template-mismatch":
 			if self._domElement.attribute('path'):
 				self._message = "Template mismatch on port %s.%s (unsatisfied template path: %s)" % (self._domElement.attribute('tc'), self._domElement.attribute('port'), self._domElement.attribute('path'))
@@ -1383,16 +1946,16 @@ class TextualLogItem(QTreeWidgetItem):
 				self._message = "Template mismatch on port %s.%s" % (self._domElement.attribute('tc'), self._domElement.attribute('port'))
 			message = self._domElement.firstChildElement('message')
 			template = self._domElement.firstChildElement('template')
-			self.setForeground(2, QBrush(QColor(Qt.red)))
+			self._color = Qt.red
 		elif self._element == "timeout-branch":
 			self._message = "Timeout match for Timer %s" % (self._domElement.attribute('id'))
-			self.setForeground(2, QBrush(QColor(Qt.green)))
+			self._color = Qt.green
 		elif self._element == "killed-branch":
 			self._message = "Killed match for TC %s" % (self._domElement.attribute('id'))
-			self.setForeground(2, QBrush(QColor(Qt.green)))
+			self._color = Qt.green
 		elif self._element == "done-branch":
 			self._message = "Done match for TC %s" % (self._domElement.attribute('id'))
-			self.setForeground(2, QBrush(QColor(Qt.green)))
+			self._color = Qt.green
 
 		# TestCase events
 		elif self._element == "testcase-created":
@@ -1403,36 +1966,30 @@ class TextualLogItem(QTreeWidgetItem):
 			verdict = self._domElement.attribute('verdict')
 			if verdict == "fail":
 				self._message = "TC local verdict updated to %s on %s" % (self._domElement.attribute('verdict'), self._domElement.attribute('tc'))
-				self.setForeground(2, QBrush(QColor(Qt.red)))
+				self._color = Qt.red
 			else:
 				# Discarded in this viewer for now.
 				self._class = "discarded"
 				self._message = "TC local verdict updated to %s on %s" % (self._domElement.attribute('verdict'), self._domElement.attribute('tc'))
 		elif self._element == "testcase-started":
 			self._message = "TestCase %s (%s) started" % (self._domElement.attribute('id'), self._domElement.text())
-			f = self.font(2)
-			f.setBold(True)
-			self.setFont(2, f)
+			self._bold = True
 		elif self._element == "testcase-stopped":
 			verdict = self._domElement.attribute('verdict')
 			self._message = "TestCase %s stopped, final verdict is %s" % (self._domElement.attribute('id'), verdict)
-			f = self.font(2)
-			f.setBold(True)
-			self.setFont(2, f)
+			self._bold = True
 			# According to the verdict, display different colors.
 			if verdict == "pass":
-				self.setForeground(2, QBrush(QColor(Qt.blue)))
+				self._color = Qt.blue
 			elif verdict == "fail":
-				self.setForeground(2, QBrush(QColor(Qt.red)))
+				self._color = Qt.red
 			else:
-				self.setForeground(2, QBrush(QColor(Qt.darkRed)))
+				self._color = Qt.darkRed
 
 		# ATS events
 		elif self._element == "ats-started":
 			self._message = "ATS started"
-			f = self.font(2)
-			f.setBold(True)
-			self.setFont(2, f)
+			self._bold = True
 		elif self._element == "ats-stopped":
 			result = int(self._domElement.attribute('result'))
 			message = self._domElement.text()
@@ -1440,13 +1997,11 @@ class TextualLogItem(QTreeWidgetItem):
 				self._message = "ATS stopped, result %s" % result
 			else:
 				self._message = "ATS stopped, result %s\n%s" % (result, message)
-			f = self.font(2)
-			f.setBold(True)
-			self.setFont(2, f)
+			self._bold = True
 			if result == 0:
-				self.setForeground(2, QBrush(QColor(Qt.blue)))
+				self._color = Qt.blue
 			else:
-				self.setForeground(2, QBrush(QColor(Qt.darkRed)))
+				self._color = Qt.darkRed
 
 		# Actions
 		elif self._element == "action-requested":
@@ -1458,41 +2013,178 @@ class TextualLogItem(QTreeWidgetItem):
 		else:
 			self._message = "Unhandled log element: %s" % self._element
 
-		self.setText(0, self._timestamp)
-		self.setText(1, self._class)
-		self.setText(2, self._message)
-		self.setTextAlignment(0, Qt.AlignTop)
-		self.setTextAlignment(1, Qt.AlignTop)
-		self.setTextAlignment(2, Qt.AlignTop)
-
-	def onSelected(self):
+	def onSelected(self, view):
 		if self._element == "message-sent":
-			self.treeWidget().emit(SIGNAL("messageSelected(QDomElement)"), self._domElement.firstChildElement('message'))
+			view.emit(SIGNAL("messageSelected(QDomElement)"), self._domElement.firstChildElement('message'))
 		elif self._element == "template-match":
-			self.treeWidget().emit(SIGNAL("templateMatchSelected(QDomElement, QDomElement)"), self._domElement.firstChildElement('message'), self._domElement.firstChildElement('template'))
+			view.emit(SIGNAL("templateMatchSelected(QDomElement, QDomElement)"), self._domElement.firstChildElement('message'), self._domElement.firstChildElement('template'))
 		elif self._element == "template-mismatch":
-			self.treeWidget().emit(SIGNAL("templateMisMatchSelected(QDomElement, QDomElement)"), self._domElement.firstChildElement('message'), self._domElement.firstChildElement('template'))
+			view.emit(SIGNAL("templateMisMatchSelected(QDomElement, QDomElement)"), self._domElement.firstChildElement('message'), self._domElement.firstChildElement('template'))
 
-	def applyFilter(self, hiddenLogClasses = []):
+class TextualLogModel(QAbstractTableModel):
+	"""
+	A virtual table over a selection of events of a log model.
+
+	The rows are the indexes of the events that are not filtered out:
+	the events are only parsed and formatted when a view requests
+	the data of their rows, i.e. when they are displayed.
+	"""
+	# Number of formatted entries kept in cache
+	EntryCacheSize = 500
+
+	def __init__(self, parent = None):
+		QAbstractTableModel.__init__(self, parent)
+		self._columns = [ 'Time', 'Class', 'Message' ]
+		self._logModel = None
+		# All the events, including the filtered out ones, as an EventIndexList
+		self._indexes = EventIndexList()
+		# The event index for each row
+		self._rows = array.array('l')
+		self._hiddenLogClasses = []
+		# dict[event index] = TextualLogEntry, and their insertion order
+		self._entries = {}
+		self._entryOrder = collections.deque()
+
+	def rowCount(self, parent = QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(self._rows)
+
+	def columnCount(self, parent = QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(self._columns)
+
+	def headerData(self, section, orientation, role = Qt.DisplayRole):
+		if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+			return QVariant(self._columns[section])
+		return QVariant()
+
+	def data(self, index, role = Qt.DisplayRole):
+		if not index.isValid():
+			return QVariant()
+		column = index.column()
+		if role == Qt.DisplayRole:
+			entry = self.getEntry(index.row())
+			if entry:
+				return QVariant(entry.getText(column))
+		elif role == Qt.TextAlignmentRole:
+			return QVariant(int(Qt.AlignTop))
+		elif role == Qt.FontRole and column == 2:
+			entry = self.getEntry(index.row())
+			if entry and (entry.isBold() or entry.isItalic()):
+				font = QFont()
+				font.setBold(entry.isBold())
+				font.setItalic(entry.isItalic())
+				return QVariant(font)
+		elif role == Qt.ForegroundRole and column == 2:
+			entry = self.getEntry(index.row())
+			if entry and entry.getColor() is not None:
+				return QVariant(QBrush(QColor(entry.getColor())))
+		return QVariant()
+
+	def getEventIndex(self, row):
+		return self._rows[row]
+
+	def findRow(self, eventIndex):
 		"""
-		If current class is in the hidden classes, we hide it, otherwise we
-		make the item reappears.
+		@rtype: int
+		@returns: the row displaying an event, or -1 if not displayed
 		"""
-		if self._class in hiddenLogClasses:
-			self.setHidden(1)
-		else:
-			self.setHidden(0)
+		row = bisect.bisect_left(self._rows, eventIndex)
+		if row < len(self._rows) and self._rows[row] == eventIndex:
+			return row
+		return -1
+
+	def getEntry(self, row):
+		"""
+		@rtype: TextualLogEntry
+		@returns: the parsed entry for a row, or None if out of range
+		"""
+		if row < 0 or row >= len(self._rows):
+			return None
+		eventIndex = self._rows[row]
+		entry = self._entries.get(eventIndex)
+		if entry is None:
+			entry = TextualLogEntry(self._logModel.getEvent(eventIndex))
+			entry.parse()
+			self._entries[eventIndex] = entry
+			self._entryOrder.append(eventIndex)
+			if len(self._entryOrder) > self.EntryCacheSize:
+				del self._entries[self._entryOrder.popleft()]
+		return entry
 
-class WTextualLogView(QTreeWidget):
+	def clear(self):
+		self._logModel = None
+		self._indexes = EventIndexList()
+		self._rows = array.array('l')
+		self._entries = {}
+		self._entryOrder = collections.deque()
+		self.reset()
+
+	def setEvents(self, events):
+		"""
+		@type  events: LogEventList
+		@param events: the events to display (filtered)
+		"""
+		self._logModel = events.getLogModel()
+		self._indexes = events.getIndexes().copy()
+		self._entries = {}
+		self._entryOrder = collections.deque()
+		self._filter()
+		self.reset()
+
+	def appendEvent(self, eventIndex):
+		"""
+		@rtype: bool
+		@returns: True if the event was appended as a new row, False if filtered out
+		"""
+		if not self._logModel:
+			return False
+		self._indexes.append(eventIndex)
+		if self._logModel.getEventClass(eventIndex) in self._hiddenLogClasses:
+			return False
+		row = len(self._rows)
+		self.beginInsertRows(QModelIndex(), row, row)
+		self._rows.append(eventIndex)
+		self.endInsertRows()
+		return True
+
+	def setHiddenLogClasses(self, hiddenLogClasses):
+		self._hiddenLogClasses = list(hiddenLogClasses)
+		self._filter()
+		self.reset()
+
+	def _filter(self):
+		"""
+		Selects the rows to display according to the hidden classes,
+		without parsing the events.
+		"""
+		if not self._logModel:
+			self._rows = array.array('l')
+			return
+		hiddenCodes = set()
+		for logClass in self._hiddenLogClasses:
+			code = self._logModel.findCode(unicode(logClass))
+			if code is not None:
+				hiddenCodes.add(code)
+		classes = self._logModel.getEventClassCodes()
+		self._rows = array.array('l', [ i for i in self._indexes if not classes[i] in hiddenCodes ])
+
+class WTextualLogView(QTreeView):
 	"""
 	A log viewer that can be updated regularly (append mode)
 	that displays the logs as rich text, with filters.
+
+	Based on a TextualLogModel: only the visible rows are parsed and formatted.
 	"""
 	def __init__(self, parent = None):
-		QTreeWidget.__init__(self, parent)
+		QTreeView.__init__(self, parent)
 		self.currentHiddenLogClasses = [ "internal", "discarded" ]
 		settings = QSettings()
 		self.trackingActivated = False
+		self._model = TextualLogModel(self)
+		self._model.setHiddenLogClasses(self.currentHiddenLogClasses)
 		self.__createWidgets()
 		self.__createActions()
 
@@ -1500,19 +2192,16 @@ class WTextualLogView(QTreeWidget):
 		self.trackingActivated = tracking
 
 	def __createWidgets(self):
-		self.root = self.invisibleRootItem()
+		self.setModel(self._model)
 		self.setRootIsDecorated(False)
-		self.labels = [ 'Time', 'Class', 'Message' ]
-		labels = QStringList()
-		for l in self.labels:
-			labels.append(l)
-		self.setHeaderLabels(labels)
+		# Enables the view to only lay out the visible rows
+		self.setUniformRowHeights(True)
 		fm = QFontMetrics(self.font())
 		self.setColumnWidth(0, fm.width("000000000 00:00:00.000")) # "time" sizing made dependent on font
 		self.setContextMenuPolicy(Qt.CustomContextMenu)
 		self.connect(self, SIGNAL("customContextMenuRequested(const QPoint&)"), self.onPopupMenu)
-		self.connect(self, SIGNAL("itemActivated(QTreeWidgetItem*, int)"), self.onItemActivated)
-		self.connect(self, SIGNAL("currentItemChanged(QTreeWidgetItem*, QTreeWidgetItem*)"), self.onCurrentItemChanged)
+		self.connect(self, SIGNAL("activated(const QModelIndex&)"), self.onItemActivated)
+		self.connect(self.selectionModel(), SIGNAL("currentRowChanged(const QModelIndex&, const QModelIndex&)"), self.onCurrentRowChanged)
 
 	def __createActions(self):
 		# logClass togglers
@@ -1546,81 +2235,72 @@ class WTextualLogView(QTreeWidget):
 			self.currentHiddenLogClasses.remove(logClass)
 		self.applyFilter(self.currentHiddenLogClasses)
 
-	def onItemActivated(self, item, col):
+	def onItemActivated(self, index):
 		"""
 		Displays the text into a text view.
 		"""
-		data = item.getAssociatedData()
+		entry = self._model.getEntry(index.row())
+		if not entry:
+			return
+		data = entry.getAssociatedData()
 		if data:
 			# We have an associated value
-			dialog = WValueDialog(title = "Value details", data = data, binary = item.isBinary(), parent = self)
+			dialog = WValueDialog(title = "Value details", data = data, binary = entry.isBinary(), parent = self)
 			dialog.exec_()
 		else:
 			# No associated value, just display the log line completely
-			text = item.text(2)
+			text = entry.getText(2)
 			dialog = WTextEditDialog(text, "Log line details", 1, self)
 			dialog.exec_()
 
-	def onCurrentItemChanged(self, newItem, previousItem):
+	def onCurrentRowChanged(self, current, previous):
 		"""
 		May display additional info related to the current log item.
-		Delegates to the item the ability to emit a signal.
+		Delegates to the entry the ability to emit a signal.
 		"""
-		if newItem:
-			newItem.onSelected()
+		if current.isValid():
+			entry = self._model.getEntry(current.row())
+			if entry:
+				entry.onSelected(self)
 
 	def clearLog(self):
-		self.clear()
+		self._model.clear()
 
-	def displayPartialLog(self, domElements):
+	def displayPartialLog(self, events):
 		"""
-		Feeds a list of dom elements that corresponds to
+		Displays a list of events that corresponds to
 		a portion of a log file.
 		
-		@type  domElements: list of QDomElement
-		"""
-#		log("DEBUG: starting display...")
-		item = None
-		for domElement in domElements:
-			item = TextualLogItem(None, domElement)
-			self.root.addChild(item)
-			item.parse()
-#		log("DEBUG: applying filter display...")
-		self.applyFilter(self.currentHiddenLogClasses)
-#		log("DEBUG: filter applied display...")
-
-		if self.trackingActivated and item:
-			self.scrollToItem(item)
-#		log("DEBUG: ok, displayed...")
-
-	def onEvent(self, domElement):
-		"""
-		Realtime feeding.
+		@type  events: LogEventList
 		"""
-		self.append(domElement)
+		self._model.setEvents(events)
+		if self.trackingActivated:
+			self.scrollToBottom()
 
-	def append(self, domElement):
+	def onEventIndexed(self, eventIndex):
 		"""
-		Appends a new Testerman log event already formatted as a QDomElement
-		to the view.
+		Realtime feeding.
 		"""
-		item = TextualLogItem(None, domElement)
-		self.root.addChild(item)
-		item.parse()
-		item.applyFilter(self.currentHiddenLogClasses)
-		if self.trackingActivated:
-			self.scrollToItem(item)
+		if self._model.appendEvent(eventIndex) and self.trackingActivated:
+			self.scrollToBottom()
 
 	def applyFilter(self, hiddenLogClasses = []):
 		"""
 		Hide/Unhide items according to the filter
 		"""
-		for i in range(0, self.root.childCount()):
-			self.root.child(i).applyFilter(hiddenLogClasses)
+		current = self.currentIndex()
+		eventIndex = None
+		if current.isValid():
+			eventIndex = self._model.getEventIndex(current.row())
+		self._model.setHiddenLogClasses(hiddenLogClasses)
 		# Make sure the selected line remains visible, if any was selected
-		item = self.currentItem()
-		if item:
-			self.scrollToItem(item)
+		if eventIndex is not None:
+			row = self._model.findRow(eventIndex)
+			if row >= 0:
+				index = self._model.index(row, 0)
+				self.setCurrentIndex(index)
+				self.scrollTo(index)
+
 
 	
 ###############################################################################
@@ -1712,7 +2392,7 @@ class WTestCaseView(QTreeWidget):
 	"""
 	This widget lists the TestCases, colorizing them according to their status.
 
-	Acts as a domElement dispatcher that dispatches a read domElement
+	Acts as an event dispatcher that dispatches a read event
 	to the associated test case. 
 	Each test case is directly represented by a TestCaseView Item that
 	stores the domElements for the test case.
@@ -1780,16 +2460,18 @@ class WTestCaseView(QTreeWidget):
 		self.__currentItem = None
 #		self._mapping[testCaseLogModel].setComplete()
 		
-	def onEvent(self, domElement):
+	def onEventIndexed(self, index):
 		if self.trackingActivated:
 			# switch to the current node for which we fed an event
 			if self.__currentItem:
 				self.setCurrentItem(self.__currentItem)
 		
 		# If we are currently watching a tree item (i.e. an item is selected),
-		# forward the event to the view to display it.
+		# forward the event to the views to display it.
 		if self.currentItem() and not self.currentItem()._model.isComplete():
-			self.emit(SIGNAL("testermanEvent(QDomElement)"), domElement)
+			self.emit(SIGNAL("testermanEventIndexed(int)"), index)
+			if self.receivers(SIGNAL("testermanEvent(QDomElement)")):
+				self.emit(SIGNAL("testermanEvent(QDomElement)"), self.currentItem()._model.getLogModel().getEvent(index))
 
 	def setCurrentItemAtIndexPath(self, indexPath):
 		"""
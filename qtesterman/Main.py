@@ -19,7 +19,6 @@
 ##
 
 from PyQt4.Qt import *
-from PyQt4 import QtXml
 
 import sys
 import os
@@ -1308,11 +1307,9 @@ def exportLog(logFilename, shouldConnect, defaultUrl, defaultUsername, pluginNam
 	for k, v in pluginParameters.items():
 		plugin._setProperty(k, v)
 	
-	# Load the XML file and turns it into a LogModel object suitable for the plugin
+	# Open the XML file, turned into a LogModel object suitable for the plugin once connected
 	try:
-		f = open(logFilename, 'r')
-		xmlLog = f.read()
-		f.close()
+		logFile = open(logFilename, 'rb')
 	except Exception as e:
 		log("Unable to load log file: %s" % unicode(e))
 		return 1
@@ -1332,21 +1329,9 @@ def exportLog(logFilename, shouldConnect, defaultUrl, defaultUsername, pluginNam
 	
 	logModel = LogViewer.LogModel()	
 
-	if not xmlLog.startswith("<?"):
-		# This is not a full XML file but a xml-element based raw logs
-		# from Testerman client
-		xmlLog = u'<?xml version="1.0" encoding="utf-8"?><ats>' + xmlLog + '</ats>'
-	xmlDoc = QtXml.QDomDocument()
-	(res, errormessage, errorline, errorcol) = xmlDoc.setContent(xmlLog, 0)
-	if res:
-		log("Logs parsed, DOM constructed")
-		root = xmlDoc.documentElement()
-		element = root.firstChildElement()
-		while not element.isNull():
-			logModel.feedEvent(element)
-			element = element.nextSiblingElement()
-	else:
-		log("Parsing error: " + str(errormessage) + ' at line ' + str(errorline) + ' col ' + str(errorcol))
+	# Raw logs (xml-element based, from Testerman client) are supported, too.
+	# The events are indexed, and only parsed when the plugin accesses them.
+	if not logModel.feedFile(logFile):
 		return 1
 
 	log("Log model constructed")